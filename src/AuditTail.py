@@ -0,0 +1,193 @@
+"""The recent end of each guild's audit log, shared by every cog that asks who did something.
+
+Logging asks who banned somebody, MediaLog asks who deleted a picture, and each used to read
+the audit log itself, once per event. A raid that bans fifty accounts cost fifty reads of the
+same endpoint, each returning mostly the same entries, and all of them counted against the one
+rate limit the bot has for it. Now the newest entries of each action type are kept here per
+guild, and a lookup is answered from them when it can be:
+
+- an entry already held that fits is the answer, with no read at all
+- otherwise the log is read, and everybody asking about the same guild and action while that
+  read is out waits for the same one
+- with the moderation intent and View Audit Log, Discord also pushes every new entry as it is
+  written (`on_audit_log_entry_create`). Once that has been running longer than the lookup
+  window, a miss means there is nothing to find, so nothing is read at all; the lookup only
+  waits a moment in case the entry is still on its way. Each shard has its own session, and
+  one that loses it is blind to what was written until the next one starts, so how long the
+  feed has been running is kept per shard and a guild is judged by its own.
+
+Everything here is best effort, as it was before: a member deleting their own message writes
+no entry, and Discord folds repeated actions into one entry, so an answer is never presented
+as certain.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import discord
+
+WINDOW = 20                 # seconds an entry can lag its event and still be the cause
+READ_LIMIT = 25             # entries per read
+TAIL_MAX = 100              # entries kept per guild and action
+MAX_TAILS = 5000            # guild and action pairs held, least recently used dropped first
+# How long a lookup waits for a pushed entry that hasn't arrived yet. The gateway usually
+# delivers it alongside the event it explains, in either order.
+FEED_GRACE = 1.0
+
+# (guild_id, action) -> entries, newest first
+_tails: "OrderedDict[tuple, list]" = OrderedDict()
+_inflight: dict[tuple, asyncio.Task] = {}
+_started: dict[tuple, float] = {}
+_arrivals: dict[tuple, asyncio.Event] = {}
+# shard id -> when its current session began pushing entries
+_feed_since: dict[int, float] = {}
+_counts = {"reads": 0, "joined": 0, "hits": 0, "pushed": 0, "trusted_misses": 0}
+
+
+def started(bot, shard_id: Optional[int] = None):
+    """Called when a session starts: for one shard from on_shard_ready, or for all of them
+    from on_ready. Pushed entries can be trusted for misses only after this, and only if the
+    bot asked for the intent that carries them."""
+    if not bot.intents.moderation:
+        _feed_since.clear()
+        return
+    now = time.monotonic()
+    if shard_id is not None:
+        _feed_since[shard_id] = now
+        return
+    # Unsharded, every guild is on shard 0.
+    shards = list(bot.shards) if isinstance(bot, discord.AutoShardedClient) else [0]
+    _feed_since.clear()
+    _feed_since.update(dict.fromkeys(shards, now))
+
+
+def feed(entry: discord.AuditLogEntry):
+    """An entry pushed by the gateway."""
+    key = (entry.guild.id, entry.action)
+    _merge(key, [entry])
+    _counts["pushed"] += 1
+    arrived = _arrivals.pop(key, None)
+    if arrived is not None:
+        arrived.set()
+
+
+def _can_read(guild) -> bool:
+    return (guild is not None and guild.me is not None
+            and guild.me.guild_permissions.view_audit_log)
+
+
+def _pushed(guild, window: float) -> bool:
+    if not _feed_since:
+        return False
+    since = _feed_since.get(guild.shard_id)
+    return since is not None and time.monotonic() - since > window
+
+
+def _merge(key: tuple, entries: list):
+    held = {e.id: e for e in _tails.get(key, ())}
+    # A read returns entries already held too. The newer copy wins, since Discord updates an
+    # entry in place when it folds another action into it.
+    held.update((e.id, e) for e in entries)
+    _tails[key] = sorted(held.values(), key=lambda e: e.id, reverse=True)[:TAIL_MAX]
+    _tails.move_to_end(key)
+    while len(_tails) > MAX_TAILS:
+        _tails.popitem(last=False)
+
+
+def _recent(key: tuple, window: float) -> list:
+    cutoff = discord.utils.utcnow().timestamp() - window
+    return [e for e in _tails.get(key, ()) if e.created_at.timestamp() >= cutoff]
+
+
+async def _read(guild, action, limit: int):
+    """Read the log, sharing the read with anyone else asking about the same guild and action.
+
+    Only a read that hasn't begun, or began after this was asked, is shared, since one already
+    out may have left before the entry being looked for was written. Whoever arrives while a
+    read is out waits for it and then shares the next one, so a burst costs two reads rather
+    than one per event."""
+    key = (guild.id, action)
+    asked = time.monotonic()
+    while True:
+        task = _inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(_fetch(guild, action, limit))
+            _inflight[key] = task
+            task.add_done_callback(lambda t, k=key: _finished(k, t))
+            break
+        # Not begun yet, or begun since: either way it will see whatever was written by now.
+        if _started.get(key, asked) >= asked:
+            _counts["joined"] += 1
+            break
+        await asyncio.wait([task])
+    await asyncio.shield(task)
+
+
+def _finished(key: tuple, task: asyncio.Task):
+    if _inflight.get(key) is task:
+        del _inflight[key]
+        _started.pop(key, None)
+
+
+async def _fetch(guild, action, limit: int):
+    _started[(guild.id, action)] = time.monotonic()
+    _counts["reads"] += 1
+    try:
+        entries = [e async for e in guild.audit_logs(limit=limit, action=action)]
+    except (discord.Forbidden, discord.HTTPException):
+        return
+    _merge((guild.id, action), entries)
+
+
+async def recent(guild, action, window: float = WINDOW, limit: int = READ_LIMIT) -> list:
+    """Every entry of `action` from the last `window` seconds, newest first. Reads the log
+    unless pushed entries already cover the window."""
+    if not _can_read(guild):
+        return []
+    if not _pushed(guild, window):
+        await _read(guild, action, limit)
+    return _recent((guild.id, action), window)
+
+
+async def find(guild, action, match: Optional[Callable] = None,
+               window: float = WINDOW) -> Optional[discord.AuditLogEntry]:
+    """The newest entry of `action` from the last `window` seconds that `match` accepts."""
+    if not _can_read(guild):
+        return None
+    key = (guild.id, action)
+    match = match or (lambda e: True)
+    hit = next(filter(match, _recent(key, window)), None)
+    if hit is not None:
+        _counts["hits"] += 1
+        return hit
+    if _pushed(guild, window):
+        deadline = time.monotonic() + FEED_GRACE
+        while (left := deadline - time.monotonic()) > 0:
+            arrived = _arrivals.get(key)
+            if arrived is None:
+                arrived = _arrivals[key] = asyncio.Event()
+            try:
+                await asyncio.wait_for(arrived.wait(), left)
+            except asyncio.TimeoutError:
+                break
+            hit = next(filter(match, _recent(key, window)), None)
+            if hit is not None:
+                return hit
+        _counts["trusted_misses"] += 1
+        return None
+    await _read(guild, action, READ_LIMIT)
+    return next(filter(match, _recent(key, window)), None)
+
+
+def prune():
+    """Drop tails with nothing left inside the window. Run by the bot's maintenance loop."""
+    for key in [k for k in _tails if not _recent(k, WINDOW)]:
+        del _tails[key]
+
+
+def stats() -> dict:
+    now = time.monotonic()
+    return {**_counts, "tails": len(_tails), "feeds": len(_feed_since),
+            "pushed_live": sum(now - since > WINDOW for since in _feed_since.values())}
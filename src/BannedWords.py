@@ -0,0 +1,134 @@
+"""Banned word lists, compiled into a trie that finds any of their words in one pass.
+
+AutoMod used to join a list into one big alternation, `(?:word1|word2|...)`, which the regex
+engine tries an alternative at a time at every position of the message. That is fine for a
+dozen words and falls over for a thousand: every character costs one attempt per word, so the
+dashboard had to stop lists at 100. Here the words are laid out as a trie first, and the trie is
+written out as the pattern, so `spam` and `spammer` and `scam` share `s`, then `spam` and
+`spammer` share `pam`. At each position the engine follows one branch per character, however
+many words there are. The cost is set by the length of the message and the longest word, not by
+the size of the list.
+
+It is still one compiled `re` pattern rather than an Aho-Corasick automaton walked in Python:
+stepping through a message a character at a time in the interpreter is slower than the regex
+engine doing the same in C, for every list size the dashboard allows.
+
+Disguises are caught too. Each letter in the trie also matches the digits and symbols people
+write in its place (`sp4m`, `$pam`), and letters from other alphabets that look the same (a
+Cyrillic `а` in `spаm`) are swapped for the plain letter before the search, where there are
+any. The match reported is what was actually written. Matching stays whole
+word: a word must not have a letter or digit on either side of it, so `ass` never matches
+`class` or `cla$$`.
+
+Compiled lists are shared by every guild with the same words, since servers copy their lists
+from the same few places, and the least recently used is dropped once there are CACHE_SIZE.
+That is as many as GuildConfig keeps settings for: AutoMod asks again for every fresh copy of a
+guild's settings, each TTL, so a smaller cache would compile a long list over and over, on the
+event loop, in the message path, once there were more lists in use than it held.
+"""
+
+import os
+import re
+from collections import OrderedDict
+from typing import Optional
+
+# Distinct lists kept compiled: one per guild GuildConfig holds at most, read from the same
+# setting rather than imported, so this module needs nothing but `re`.
+CACHE_SIZE = int(os.environ.get("GUILDCONFIG_MAX_ENTRIES") or 10_000)
+
+# What each letter may be written as, besides itself, in digits and symbols. Kept to the ones
+# people read as the letter at a glance; anything looser starts matching ordinary words. These
+# are small classes in the pattern, so `sp4m` matches `spam` while the text stays as written.
+LEET = {
+    "a": "4@", "b": "8", "c": "(", "e": "3", "g": "96", "i": "1!|", "l": "1|",
+    "o": "0", "s": "5$", "t": "7+", "z": "2",
+}
+# Letters from other alphabets, and accented ones, that look like a plain letter. These are
+# folded in the text instead: one letter for another, so the length and the whole word edges
+# stay exactly where they were, and a pattern made of a class per lookalike would be slow to
+# compile (every class holding a character past Latin-1 is a table of its own).
+HOMOGLYPHS = {
+    "a": "аαáàâäãåą", "c": "сçć", "e": "еёéèêëę", "h": "һ", "i": "іíìîïı", "j": "ј",
+    "k": "кκ", "l": "ӏł", "m": "м", "n": "ñńη", "o": "оοöóòôõøő", "p": "рρ", "s": "ѕšś",
+    "t": "т", "u": "υüúùûű", "x": "хχ", "y": "уýÿ", "z": "žźż",
+}
+_PLAIN = {alike: letter for letter, alikes in HOMOGLYPHS.items() for alike in alikes}
+_FOLD = str.maketrans(_PLAIN)
+_LOOKALIKE = re.compile("[" + re.escape("".join(_PLAIN)) + "]")
+def _swap(m: re.Match) -> str:
+    return _PLAIN[m.group()]
+
+
+_CLASS = {letter: "[" + re.escape(letter + alike) + "]" for letter, alike in LEET.items()}
+
+
+class Matcher:
+    """One compiled list. `find` gives the first banned word in a text, as it was written."""
+
+    __slots__ = ("pattern", "words")
+
+    def __init__(self, words: tuple):
+        self.words = words
+        self.pattern = re.compile(rf"(?<!\w){_pattern(_trie(words))}(?!\w)")
+
+    def find(self, text: str) -> Optional[str]:
+        """The first word of the list in `text`, which should be lowercased with zero width
+        characters taken out, as MessageScan's text is."""
+        # Only the lookalikes actually there are swapped, and plain ASCII, most of what
+        # anybody types, has none to look for.
+        plain = text if text.isascii() else _LOOKALIKE.sub(_swap, text)
+        hit = self.pattern.search(plain)
+        return text[hit.start():hit.end()] if hit else None
+
+
+_cache: "OrderedDict[tuple, Matcher]" = OrderedDict()
+_counts = {"compiled": 0, "shared": 0, "evicted": 0}
+
+
+def clean(words) -> tuple:
+    """A list as it is matched: stripped, lowercased, deduplicated and in order."""
+    return tuple(sorted({w.strip().lower() for w in words if w and w.strip()}))
+
+
+def matcher(words) -> Optional[Matcher]:
+    """The compiled list, or None for an empty one."""
+    key = clean(words)
+    if not key:
+        return None
+    if key in _cache:
+        _cache.move_to_end(key)
+        _counts["shared"] += 1
+        return _cache[key]
+    made = _cache[key] = Matcher(key)
+    _counts["compiled"] += 1
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+        _counts["evicted"] += 1
+    return made
+
+
+def _trie(words: tuple) -> dict:
+    root: dict = {}
+    for word in words:
+        node = root
+        for ch in word.translate(_FOLD):
+            node = node.setdefault(ch, {})
+        node[""] = {}                   # a word ends here
+    return root
+
+
+def _pattern(node: dict) -> str:
+    """The trie below `node` as a regex. A word ending partway down makes the rest optional,
+    so `spam` and `spammer` come out as `spam(?:mer)?`, each letter with its stand-ins."""
+    branches = [(_CLASS.get(ch) or re.escape(ch)) + _pattern(node[ch])
+                for ch in sorted(k for k in node if k)]
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if "" in node:
+        return f"(?:{body})?"
+    return body
+
+
+def stats() -> dict:
+    return {**_counts, "held": len(_cache)}
@@ -19,21 +19,32 @@ rule that looks switched on and quietly does nothing.
 Warnings and timeouts are recorded through the Moderation cog, so an automod action lands in
 the same numbered case history as one a moderator took by hand. Somebody looking up a member
 sees the whole picture rather than half of it.
+
+Every rule above watches one person, and a raid is many people each saying something once. So
+there is a raid check as well: the same message, give or take the mentions and punctuation a
+raid varies its copies by, from several accounts in one channel within a short window, or a
+burst of joins. It deletes the copies and locks every channel through the Moderation cog's
+lock, which a moderator lifts with one command once they have had a look. What it remembers
+is a fixed ring per channel, so a raid at full pelt costs it no more than a quiet afternoon.
 """
 
 import asyncio
 import datetime
-import re
 import time
-from collections import deque
+from collections import OrderedDict, deque
+from dataclasses import dataclass
 from typing import Optional
 
 import discord
 from discord import app_commands
-from discord.ext import commands, tasks
+from discord.ext import commands
 
+import BannedWords
 import GuildConfig
+import MessageScan
+import Recent
 from Brand import MINT
+from MessageScan import Scan
 
 # (key, icon, label). Mirrored in the dashboard's store.AUTOMOD_RULES; a test asserts the two
 # agree, since a typo means a rule the dashboard can switch on and the bot never runs.
@@ -83,27 +94,33 @@ DEFAULT_TIMEOUT_MINUTES = 10
 # the case says why. Raise it if you would rather it never got in the way.
 DEFAULT_MAX_REMOVALS = 5
 REMOVAL_WINDOW = 3600
-MAX_WORDS = 100
+# Banned words per list. BannedWords matches in time set by the message rather than the list,
+# so this is about what a moderator can sensibly keep track of; mirrored in the dashboard.
+MAX_WORDS = 2000
 MAX_WORD_LENGTH = 40
 MAX_DOMAINS = 50
 
 # How much history the flood and repeat rules keep per person, and how long a notice stays up.
+# A person is remembered for HISTORY_TTL after they last spoke, forgotten within HISTORY_TICK
+# of that, and the look back grows past HISTORY when a rule's count asks for more.
 HISTORY = 12
+MAX_HISTORY = 30            # the most either rule can count to on the dashboard
 HISTORY_TTL = 120
+HISTORY_TICK = 10
 NOTICE_SECONDS = 6
-PRUNE_MINUTES = 10
-WORD_CACHE_SIZE = 64      # distinct banned word lists kept compiled
-
 
-INVITE = re.compile(
-    r"(?:discord(?:app)?\.com/invite|discord\.gg|discord\.me|dsc\.gg|invite\.gg)/[\w-]+",
-    re.IGNORECASE)
-URL = re.compile(r"https?://([^\s/?#]+)", re.IGNORECASE)
-CUSTOM_EMOJI = re.compile(r"<a?:\w+:\d+>")
-UNICODE_EMOJI = re.compile(
-    "[\U0001F300-\U0001FAFF\U00002600-\U000027BF\U0001F1E6-\U0001F1FF]")
-# Zero width characters, which are how a filter gets walked straight past.
-INVISIBLE = re.compile(r"[​-‏⁠﻿­]")
+# The raid check. Off until a server turns it on, like everything else here. `accounts` is
+# how many different accounts sending the same thing within `seconds` counts as a raid, and
+# `joins`, if set, is the same for people arriving.
+RAID_DEFAULTS = {"on": False, "accounts": 5, "seconds": 30, "joins": 0, "lockdown": True}
+RAID_LABEL = "Raid"
+RAID_INDEX = 64             # messages kept per channel, oldest overwritten first
+MAX_RAID_ACCOUNTS = 25
+MAX_RAID_SECONDS = 120      # no longer than HISTORY_TTL, which is when a quiet channel is forgotten
+MAX_RAID_JOINS = 50         # joins kept per server, and the most `joins` can be set to
+# After a raid is spotted, further copies of it anywhere in the server are deleted without
+# another lockdown, notice or mod log post, for this long.
+RAID_COOLDOWN = 600
 
 
 def _settings(cfg: dict, key: str) -> dict:
@@ -112,8 +129,102 @@ def _settings(cfg: dict, key: str) -> dict:
     return {**DEFAULTS[key], **stored}
 
 
-def _normalise(text: str) -> str:
-    return INVISIBLE.sub("", text or "").lower()
+@dataclass(frozen=True)
+class Rule:
+    """One switched-on rule with its settings already read: numbers parsed, the banned word
+    list compiled and the allowed domains cleaned."""
+    key: str
+    action: str
+    limit: int = 0                      # mentions, emoji, newlines
+    count: int = 0                      # spam, duplicates
+    seconds: float = 0.0                # spam
+    percent: int = 0                    # caps
+    min_length: int = 0                 # caps
+    words: Optional[BannedWords.Matcher] = None
+    allow: frozenset = frozenset()
+
+
+@dataclass(frozen=True)
+class Plan:
+    """A guild's automod settings, compiled for the message path.
+
+    Every message used to merge each rule's stored settings over its defaults, parse the
+    numbers, and rebuild the exemption and allowed-domain sets, all to arrive at the same
+    answer as the message before. This is that answer, worked out once per copy of the
+    settings (GuildConfig.derived rebuilds it when the document changes) and shared by every
+    message until then. Frozen, since one plan serves every message in the guild at once.
+    """
+    enabled: bool = False
+    rules: tuple = ()                   # only the rules switched on, in RULES order
+    exempt_channels: frozenset = frozenset()
+    exempt_roles: frozenset = frozenset()
+    exempt_staff: bool = True
+    notify: bool = True
+    timeout_minutes: int = DEFAULT_TIMEOUT_MINUTES
+    max_removals: int = DEFAULT_MAX_REMOVALS
+    # Messages per person the flood and repeat rules look back over. Nothing is recorded
+    # when no rule reads it.
+    history: int = 0
+    raid: Optional[Rule] = None         # None when the raid check is off
+
+
+def _raid_settings(cfg: dict) -> dict:
+    return {**RAID_DEFAULTS, **((cfg.get("automod") or {}).get("raid") or {})}
+
+
+def _raid(cfg: dict) -> Optional[Rule]:
+    """The raid check as a Rule: `count` accounts within `seconds`, or `limit` joins in that
+    time (0 for none), and an action of "lockdown", or "delete" for a server that would
+    rather only be told."""
+    s = _raid_settings(cfg)
+    accounts = int(s.get("accounts") or 0)
+    if not s.get("on") or accounts < 2:
+        return None
+    return Rule(key="raid", action="lockdown" if s.get("lockdown", True) else "delete",
+                count=min(accounts, MAX_RAID_ACCOUNTS),
+                limit=min(int(s.get("joins") or 0), MAX_RAID_JOINS),
+                seconds=float(min(int(s.get("seconds") or 0) or 30, MAX_RAID_SECONDS)))
+
+
+# What the raid check hands back for one more copy of a raid already dealt with.
+RAID_COPY = Rule(key="raid", action="delete")
+
+
+def _rule(cfg: dict, key: str) -> Rule:
+    s = _settings(cfg, key)
+    action = s.get("action") if s.get("action") in ACTIONS else "delete"
+    return Rule(
+        key=key, action=action,
+        limit=int(s.get("limit", 0)),
+        count=int(s.get("count", 0)),
+        seconds=float(s.get("seconds", 0)),
+        percent=int(s.get("percent", 0)),
+        min_length=int(s.get("min_length", 0)),
+        words=(BannedWords.matcher((s.get("list") or [])[:MAX_WORDS]) if key == "words"
+               else None),
+        allow=frozenset(d.strip().lower().removeprefix("www.")
+                        for d in (s.get("allow") or []) if d.strip()))
+
+
+def compile_plan(cfg: dict) -> Plan:
+    """The guild's settings as a Plan. Passed to GuildConfig.derived, never called per message."""
+    automod = cfg.get("automod") or {}
+    if not automod.get("enabled"):
+        return Plan()
+    rules = tuple(_rule(cfg, key) for key in RULE_KEYS if _settings(cfg, key).get("on"))
+    # A words rule with an empty list can never match, so it isn't run.
+    rules = tuple(r for r in rules if r.key != "words" or r.words is not None)
+    return Plan(
+        enabled=True, rules=rules,
+        exempt_channels=frozenset(automod.get("exempt_channels") or ()),
+        exempt_roles=frozenset(automod.get("exempt_roles") or ()),
+        exempt_staff=bool(automod.get("exempt_staff", True)),
+        notify=bool(automod.get("notify", True)),
+        timeout_minutes=int(automod.get("timeout_minutes") or DEFAULT_TIMEOUT_MINUTES),
+        max_removals=int(automod.get("max_removals") or DEFAULT_MAX_REMOVALS),
+        history=max((min(max(HISTORY, r.count), MAX_HISTORY) for r in rules
+                     if r.key in ("spam", "duplicates")), default=0),
+        raid=_raid(cfg))
 
 
 class AutoMod(commands.Cog, name="AutoMod"):
@@ -121,121 +232,135 @@ class AutoMod(commands.Cog, name="AutoMod"):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        # (guild_id, user_id) -> deque of (when, normalised content)
-        self._recent: dict[tuple, deque] = {}
-        # The banned word list compiled once per distinct list rather than per message.
-        self._word_cache: dict[tuple, re.Pattern] = {}
+        # (guild_id, user_id) -> when they last spoke, and hashes of what they said
+        self._recent: dict[tuple, Recent.History] = {}
+        self._forget = Recent.TimingWheel(HISTORY_TTL, HISTORY_TICK)
         # guild_id -> when each automatic kick or ban happened, for the hourly brake.
         self._removals: dict[int, deque] = {}
+        # (guild_id, channel_id) -> the channel's recent messages, for the raid check, and
+        # guild_id -> when people joined. Forgotten like _recent, on wheels of their own.
+        self._channels: dict[tuple, Recent.Echoes] = {}
+        self._forget_channels = Recent.TimingWheel(HISTORY_TTL, HISTORY_TICK)
+        self._joins: dict[int, Recent.History] = {}
+        self._forget_joins = Recent.TimingWheel(HISTORY_TTL, HISTORY_TICK)
+        # guild_id -> (until, shapes of its messages) for a raid already dealt with. Only the
+        # latest RAID_INDEX shapes are kept: a raid that goes on changing its text would
+        # otherwise add one for every change, and every change pushes the cooldown back.
+        self._raids: dict[int, tuple] = {}
 
     automod = app_commands.Group(
         name="automod", description="Rules that act on messages by themselves",
         guild_only=True, default_permissions=discord.Permissions(manage_guild=True))
 
-    async def cog_load(self):
-        self.prune.start()
-
-    async def cog_unload(self):
-        self.prune.cancel()
-
-    @tasks.loop(minutes=PRUNE_MINUTES)
-    async def prune(self):
-        """Drop history for people who stopped talking, so the dict can't grow forever."""
-        cutoff = time.monotonic() - HISTORY_TTL
-        for key in [k for k, v in self._recent.items() if not v or v[-1][0] < cutoff]:
-            self._recent.pop(key, None)
-
     # ── the rules ────────────────────────────────────────────────────
-    def _words_pattern(self, words: list) -> Optional[re.Pattern]:
-        clean = tuple(sorted({w.strip().lower() for w in words if w and w.strip()}))
-        if not clean:
-            return None
-        if clean not in self._word_cache:
-            # Whole words only. Substring matching is how a filter for "ass" starts eating
-            # "class" and "passive", and nobody forgives that twice.
-            joined = "|".join(re.escape(w) for w in clean)
-            if len(self._word_cache) >= WORD_CACHE_SIZE:
-                self._word_cache.clear()   # cheap ceiling; these rebuild in microseconds
-            self._word_cache[clean] = re.compile(rf"(?<!\w)(?:{joined})(?!\w)")
-        return self._word_cache[clean]
-
-    def _check_words(self, message, s):
-        pattern = self._words_pattern(s.get("list") or [])
-        if pattern is None:
-            return None
-        hit = pattern.search(_normalise(message.content))
-        return f"used a banned word ({hit.group(0)})" if hit else None
+    # Each reads the message's Scan rather than its content, so the text is gone over once
+    # however many rules are on.
+    @staticmethod
+    def _check_words(message, r: Rule, scan: Scan):
+        hit = scan.banned(r.words)
+        return f"used a banned word ({hit})" if hit else None
 
     @staticmethod
-    def _check_invites(message, s):
-        return "posted a Discord invite" if INVITE.search(message.content or "") else None
+    def _check_invites(message, r: Rule, scan: Scan):
+        return "posted a Discord invite" if scan.invites else None
 
     @staticmethod
-    def _check_links(message, s):
-        allow = {d.strip().lower().removeprefix("www.")
-                 for d in (s.get("allow") or []) if d.strip()}
-        for match in URL.finditer(message.content or ""):
-            domain = match.group(1).lower().removeprefix("www.")
+    def _check_links(message, r: Rule, scan: Scan):
+        for domain in scan.domains:
             # Subdomains of an allowed domain are allowed too, so one entry covers a site.
-            if any(domain == a or domain.endswith("." + a) for a in allow):
+            if domain in r.allow or any(domain.endswith("." + a) for a in r.allow):
                 continue
             return f"posted a link ({domain})"
         return None
 
     @staticmethod
-    def _check_mentions(message, s):
+    def _check_mentions(message, r: Rule, scan: Scan):
         total = len(set(message.mentions)) + len(set(message.role_mentions))
-        limit = int(s.get("limit", 5))
-        return (f"mentioned {total} people or roles at once" if total > limit else None)
+        return (f"mentioned {total} people or roles at once" if total > r.limit else None)
 
     @staticmethod
-    def _check_caps(message, s):
-        content = message.content or ""
-        letters = [c for c in content if c.isalpha()]
-        if len(letters) < int(s.get("min_length", 12)):
+    def _check_caps(message, r: Rule, scan: Scan):
+        if not scan.capitals or scan.letters < r.min_length:
             return None
-        shouted = sum(1 for c in letters if c.isupper()) / len(letters) * 100
-        limit = int(s.get("percent", 70))
-        return f"wrote {shouted:.0f}% in capitals" if shouted >= limit else None
+        shouted = scan.caps_percent
+        return f"wrote {shouted:.0f}% in capitals" if shouted >= r.percent else None
+
+    @staticmethod
+    def _check_emoji(message, r: Rule, scan: Scan):
+        count = scan.emoji
+        return f"used {count} emoji in one message" if count > r.limit else None
 
     @staticmethod
-    def _check_emoji(message, s):
-        count = (len(CUSTOM_EMOJI.findall(message.content or ""))
-                 + len(UNICODE_EMOJI.findall(message.content or "")))
-        limit = int(s.get("limit", 8))
-        return f"used {count} emoji in one message" if count > limit else None
+    def _check_newlines(message, r: Rule, scan: Scan):
+        lines = scan.lines
+        return f"posted {lines} lines in one message" if lines > r.limit + 1 else None
 
     @staticmethod
-    def _check_newlines(message, s):
-        lines = (message.content or "").count("\n")
-        limit = int(s.get("limit", 15))
-        return f"posted {lines + 1} lines in one message" if lines > limit else None
-
-    def _check_spam(self, message, s, history):
-        window = float(s.get("seconds", 5))
-        count = int(s.get("count", 6))
-        cutoff = time.monotonic() - window
-        recent = sum(1 for when, _ in history if when >= cutoff)
-        return (f"sent {recent} messages in {window:.0f} seconds"
-                if recent >= count else None)
-
-    def _check_duplicates(self, message, s, history):
-        content = _normalise(message.content)
-        if not content:
+    def _check_spam(message, r: Rule, scan: Scan, history: Recent.History):
+        # The times are in order, so `count` inside the window is the same as the
+        # count-th latest being inside it.
+        if history.nth_latest(r.count) < time.monotonic() - r.seconds:
+            return None
+        return f"sent {r.count} messages in {r.seconds:.0f} seconds"
+
+    @staticmethod
+    def _check_duplicates(message, r: Rule, scan: Scan, history: Recent.History):
+        same = history.count(scan.digest)
+        return f"posted the same message {same} times" if same >= r.count else None
+
+    def _check_raid(self, message, r: Rule, scan: Scan) -> Optional[tuple]:
+        """(rule, reason) when this message makes a raid, or is another copy of one."""
+        shape = scan.shape
+        if not shape:
+            return None
+        now = time.monotonic()
+        gid = message.guild.id
+        seen = self._note(self._channels, self._forget_channels,
+                          (gid, message.channel.id), lambda: Recent.Echoes(RAID_INDEX), now)
+        seen.add(now, shape, message.author.id, message.id)
+
+        raid = self._raid_under_way(gid, now)
+        if raid is not None and shape in raid[1]:
+            raid[1].move_to_end(shape)      # still being sent, so the last to be dropped
+            return RAID_COPY, "kept up a raid"
+        # The C count first, which for anything but a raid is the end of it.
+        if seen.count(shape) < r.count:
+            return None
+        senders = seen.senders(shape, now - r.seconds)
+        if len(senders) < r.count:
+            return None
+        # Marked now rather than once it has been dealt with: the lockdown takes a while, and
+        # every copy arriving meanwhile would otherwise start a lockdown of its own.
+        self._mark_raid(gid, now, shape)
+        return r, (f"{len(senders)} accounts posted the same message in #{message.channel} "
+                   f"within {r.seconds:.0f} seconds")
+
+    def _raid_under_way(self, guild_id: int, now: float) -> Optional[tuple]:
+        raid = self._raids.get(guild_id)
+        if raid is not None and raid[0] < now:
+            del self._raids[guild_id]
             return None
-        count = int(s.get("count", 3))
-        same = sum(1 for _, text in history if text == content)
-        return f"posted the same message {same} times" if same >= count else None
+        return raid
+
+    def _mark_raid(self, guild_id: int, now: float, shape: int = 0):
+        """Start (or extend) a raid's quiet period, adding `shape` to the copies it deletes."""
+        shapes = self._raids[guild_id][1] if guild_id in self._raids else OrderedDict()
+        self._raids[guild_id] = (now + RAID_COOLDOWN, shapes)
+        if shape:
+            shapes[shape] = None
+            shapes.move_to_end(shape)
+            while len(shapes) > RAID_INDEX:
+                shapes.popitem(last=False)
 
     # ── exemptions ───────────────────────────────────────────────────
-    def _exempt(self, message, automod) -> bool:
+    @staticmethod
+    def _exempt(message, plan: Plan) -> bool:
         member = message.author
-        if message.channel.id in set(automod.get("exempt_channels") or []):
+        if message.channel.id in plan.exempt_channels:
             return True
-        exempt_roles = set(automod.get("exempt_roles") or [])
-        if exempt_roles and any(r.id in exempt_roles for r in member.roles):
+        if plan.exempt_roles and any(r.id in plan.exempt_roles for r in member.roles):
             return True
-        if automod.get("exempt_staff", True):
+        if plan.exempt_staff:
             perms = message.channel.permissions_for(member)
             if perms.manage_messages or perms.manage_guild or perms.administrator:
                 return True
@@ -257,31 +382,69 @@ class AutoMod(commands.Cog, name="AutoMod"):
             return
 
         cfg = await GuildConfig.get(self.bot, message.guild.id)
-        automod = cfg.get("automod") or {}
-        if not automod.get("enabled"):
-            return
-        if self._exempt(message, automod):
-            return
+        plan = GuildConfig.derived(message.guild.id, cfg, compile_plan)
+        found = self._judge(message, plan)
+        if found is not None:
+            rule, reason = found
+            await self._act(message, rule, reason, plan)
+
+    def _judge(self, message, plan: Plan) -> Optional[tuple]:
+        """(rule, reason) for the first rule the message breaks, or None. Everything from the
+        settings onwards that doesn't need to wait on Discord."""
+        if not (plan.rules or plan.raid) or self._exempt(message, plan):
+            return None
+
+        scan = MessageScan.scan(message)
+        history = None
+        if plan.history:
+            # Recorded before the checks, because the flood and repeat rules count this
+            # message too, and after the exemptions, so staff chatter isn't kept at all.
+            history = self._remember(message, plan.history, scan)
+        # Ahead of the rules, so a raid is seen whole even where each copy also breaks one.
+        if plan.raid is not None:
+            found = self._check_raid(message, plan.raid, scan)
+            if found is not None:
+                return found
+
+        for r in plan.rules:
+            if r.key == "spam":
+                reason = self._check_spam(message, r, scan, history)
+            elif r.key == "duplicates":
+                reason = self._check_duplicates(message, r, scan, history)
+            else:
+                reason = getattr(self, f"_check_{r.key}")(message, r, scan)
+            if reason:
+                return r, reason    # one rule per message, so nobody gets three punishments
+        return None
 
-        # History is recorded before the checks, because the flood and repeat rules count this
-        # message too, and after the exemptions, so staff chatter isn't kept at all.
+    def _remember(self, message, size: int, scan: Scan) -> Recent.History:
+        now = time.monotonic()
         key = (message.guild.id, message.author.id)
-        history = self._recent.setdefault(key, deque(maxlen=HISTORY))
-        history.append((time.monotonic(), _normalise(message.content)))
+        history = self._note(self._recent, self._forget, key, lambda: Recent.History(size), now)
+        # A guild whose rules now look further back starts its people afresh.
+        if history.size != size:
+            fresh = self._recent[key] = Recent.History(size)
+            fresh.due, history = history.due, fresh     # same slot on the wheel
+        history.add(now, scan.digest)
+        return history
 
-        for rule in RULE_KEYS:
-            s = _settings(cfg, rule)
-            if not s.get("on"):
+    @staticmethod
+    def _note(held: dict, wheel: Recent.TimingWheel, key, make, now: float):
+        """`held[key]`, made if need be and kept for another HISTORY_TTL, after letting go of
+        whatever in `held` has gone quiet for that long."""
+        for gone in wheel.expired(now):
+            record = held.get(gone)
+            if record is None:
                 continue
-            if rule == "spam":
-                reason = self._check_spam(message, s, history)
-            elif rule == "duplicates":
-                reason = self._check_duplicates(message, s, history)
+            if wheel.passed(record.due, now):
+                del held[gone]
             else:
-                reason = getattr(self, f"_check_{rule}")(message, s)
-            if reason:
-                await self._act(message, rule, reason, s.get("action", "delete"), automod)
-                return          # one rule per message, so nobody gets three punishments at once
+                wheel.keep(gone, record.due)
+        record = held.get(key)
+        if record is None:
+            record = held[key] = make()
+        record.due = wheel.touch(key, record.due, now)
+        return record
 
     # ── acting on it ─────────────────────────────────────────────────
     def _removal_allowed(self, guild_id: int, limit: int) -> bool:
@@ -295,9 +458,12 @@ class AutoMod(commands.Cog, name="AutoMod"):
         seen.append(now)
         return True
 
-    async def _act(self, message, rule: str, reason: str, action: str, automod: dict):
+    async def _act(self, message, rule: Rule, reason: str, plan: Plan):
+        if rule.key == "raid":
+            return await self._repel(message, rule, reason, plan)
         guild, member = message.guild, message.author
-        label = next(lbl for key, _, lbl in RULES if key == rule)
+        label = next(lbl for key, _, lbl in RULES if key == rule.key)
+        action = rule.action
 
         try:
             await message.delete()
@@ -309,8 +475,7 @@ class AutoMod(commands.Cog, name="AutoMod"):
         except discord.HTTPException as e:
             print(f"[AutoMod] delete failed in {guild.id}: {e}")
 
-        minutes = int(automod.get("timeout_minutes") or DEFAULT_TIMEOUT_MINUTES)
-        limit = int(automod.get("max_removals") or DEFAULT_MAX_REMOVALS)
+        minutes, limit = plan.timeout_minutes, plan.max_removals
         note = ""
 
         # A kick or a ban that can't go ahead becomes a timeout rather than nothing at all,
@@ -326,7 +491,7 @@ class AutoMod(commands.Cog, name="AutoMod"):
             note = (f" I couldn't {action} them, so this was a "
                     f"{'timeout' if outcome == 'timeout' else 'warning'} instead.")
 
-        if automod.get("notify", True):
+        if plan.notify:
             await self._notify(message, member, label, outcome, minutes)
 
         if outcome != "delete":
@@ -419,6 +584,105 @@ class AutoMod(commands.Cog, name="AutoMod"):
         except Exception as e:
             print(f"[AutoMod] couldn't record the case in {guild.id}: {e}")
 
+    # ── raids ────────────────────────────────────────────────────────
+    async def _repel(self, message, rule: Rule, reason: str, plan: Plan):
+        """Delete every copy of the raid in the channel and lock the server down, or for one
+        more copy of a raid already dealt with, just delete it."""
+        guild, channel = message.guild, message.channel
+        if rule is RAID_COPY:
+            try:
+                await message.delete()
+            except discord.HTTPException:
+                pass                    # gone already, or no Manage Messages; said once below
+            return
+
+        # Read before anything waits on Discord, while the ring still holds all of them.
+        seen = self._channels[(guild.id, channel.id)]
+        ids = [i for sent in seen.senders(MessageScan.scan(message).shape,
+                                          time.monotonic() - rule.seconds).values()
+               for i in sent]
+        try:
+            await channel.delete_messages([discord.Object(id=i) for i in ids],
+                                          reason=f"AutoMod: {RAID_LABEL}")
+        except discord.Forbidden:
+            print(f"[AutoMod] no Manage Messages in {guild.id}")
+        except discord.HTTPException as e:
+            print(f"[AutoMod] raid delete failed in {guild.id}: {e}")
+
+        locked = await self._respond_to_raid(guild, reason, rule.action == "lockdown")
+        if plan.notify:
+            text = f"🚨 That looked like a raid, so {len(ids)} copies of it were removed."
+            if locked:
+                text += " Every channel is locked while the moderators take a look."
+            try:
+                # Left up while the server is locked, since that is when people want to know.
+                await channel.send(text, delete_after=None if locked else NOTICE_SECONDS,
+                                   allowed_mentions=discord.AllowedMentions.none())
+            except discord.HTTPException:
+                pass
+
+    async def _respond_to_raid(self, guild, reason: str, lockdown: bool) -> list:
+        """Lock the server down if asked, and post the raid to the mod log either way. Returns
+        the channels it locked."""
+        locked = await self._lock_down(guild, reason) if lockdown else []
+        print(f"[AutoMod] raid in {guild.id}: {reason}; locked {len(locked)} channels")
+        mod = self.bot.get_cog("Moderation")
+        if mod is None:
+            return locked
+        extra = (f"Locked {len(locked)} channels. `/automod lift` unlocks them." if locked
+                 else None)
+        try:
+            await mod._post_case(guild, None, "lockdown", None, guild.me,
+                                 f"AutoMod: {reason}", extra=extra)
+        except Exception as e:
+            print(f"[AutoMod] couldn't post the raid in {guild.id}: {e}")
+        return locked
+
+    async def _lock_down(self, guild, reason: str) -> list:
+        """Lock every channel @everyone can send in, through Moderation's own lock, and keep
+        which ones and what their @everyone overwrite was, so lifting it puts back exactly
+        that and leaves alone a channel that was shut anyway."""
+        mod = self.bot.get_cog("Moderation")
+        if mod is None:
+            return []
+        if not guild.me.guild_permissions.manage_channels:
+            print(f"[AutoMod] no Manage Channels for a raid lockdown in {guild.id}")
+            return []
+        everyone = guild.default_role
+        locked = []
+        for channel in guild.text_channels:
+            if not channel.permissions_for(everyone).send_messages:
+                continue
+            was = channel.overwrites_for(everyone).send_messages
+            if await mod._set_lock(channel, True, f"AutoMod: {reason}", guild.me) is None:
+                locked.append({"id": channel.id, "was": was})
+        if locked:
+            cfg = await GuildConfig.get(self.bot, guild.id)
+            held = (cfg.get("raid_lockdown") or {}).get("channels") or []
+            # A channel already held keeps what it was before the first lockdown.
+            known = {c["id"] for c in held}
+            await GuildConfig.update(self.bot, guild.id, {"raid_lockdown": {
+                "channels": held + [c for c in locked if c["id"] not in known],
+                "reason": reason}})
+        return [c["id"] for c in locked]
+
+    async def _count_join(self, member, cfg: dict):
+        """Keep the join for the raid check, and treat a burst of them as a raid. Read from
+        the same Plan as the messages, so both follow automod's own on and off switch."""
+        r = GuildConfig.derived(member.guild.id, cfg, compile_plan).raid
+        if r is None or r.limit < 2:
+            return
+        joins, seconds = r.limit, r.seconds
+        guild, now = member.guild, time.monotonic()
+        log = self._note(self._joins, self._forget_joins, guild.id,
+                         lambda: Recent.History(MAX_RAID_JOINS), now)
+        log.add(now, member.id)         # the id where a message's hash would go
+        if log.nth_latest(joins) < now - seconds or self._raid_under_way(guild.id, now):
+            return
+        self._mark_raid(guild.id, now)
+        await self._respond_to_raid(guild, f"{joins} accounts joined within {seconds:.0f} seconds",
+                                    r.action == "lockdown")
+
     # ── the age gate ─────────────────────────────────────────────────
     # Not a message rule: it acts on arrival, before anybody has said anything. Raids are
     # nearly always accounts made minutes earlier, so an age floor turns most of one away
@@ -434,6 +698,8 @@ class AutoMod(commands.Cog, name="AutoMod"):
             return False
 
         cfg = await GuildConfig.get(self.bot, member.guild.id)
+        # Every join counts towards a burst, the ones about to be turned away included.
+        await self._count_join(member, cfg)
         gate = ((cfg.get("automod") or {}).get("minage") or {})
         days = int(gate.get("days") or 0)
         if not gate.get("on") or days <= 0:
@@ -521,6 +787,83 @@ class AutoMod(commands.Cog, name="AutoMod"):
                                   f"actually happen until you grant it."),
             ephemeral=True)
 
+    @automod.command(name="raid",
+                     description="Lock the server when many accounts post the same thing")
+    @app_commands.describe(
+        accounts=f"How many accounts, 2 to {MAX_RAID_ACCOUNTS}. Zero switches it off.",
+        seconds=f"Within this many seconds, 5 to {MAX_RAID_SECONDS}. Default 30.",
+        joins=f"Also a raid: this many joins within those seconds, 2 to {MAX_RAID_JOINS}. "
+              f"Zero leaves joins alone.",
+        lockdown="Lock every channel when one starts. Off only deletes and tells the mod log.")
+    @app_commands.checks.has_permissions(manage_guild=True)
+    @app_commands.default_permissions(manage_guild=True)
+    @app_commands.guild_only()
+    async def raid(self, interaction: discord.Interaction, accounts: int,
+                   seconds: int = 30, joins: int = 0, lockdown: bool = True):
+        if accounts and not 2 <= accounts <= MAX_RAID_ACCOUNTS:
+            await interaction.response.send_message(
+                f"Pick between 2 and {MAX_RAID_ACCOUNTS} accounts. Zero switches it off.",
+                ephemeral=True)
+            return
+        if not 5 <= seconds <= MAX_RAID_SECONDS or (joins and not 2 <= joins <= MAX_RAID_JOINS):
+            await interaction.response.send_message(
+                f"Seconds go from 5 to {MAX_RAID_SECONDS}, and joins from 2 to "
+                f"{MAX_RAID_JOINS} or zero.", ephemeral=True)
+            return
+
+        await GuildConfig.update(self.bot, interaction.guild.id, {
+            "automod.raid": {"on": accounts > 0, "accounts": accounts or 5,
+                             "seconds": seconds, "joins": joins, "lockdown": lockdown}})
+        if not accounts:
+            await interaction.response.send_message("Off. Nothing is watched for raids.",
+                                                    ephemeral=True)
+            return
+
+        what = f"**{accounts} accounts** posting the same thing within **{seconds} seconds**"
+        if joins:
+            what += f", or **{joins} joins** in that time,"
+        then = ("locks every channel until you run `/automod lift`" if lockdown
+                else "deletes the copies and tells the mod log")
+        allowed = interaction.guild.me.guild_permissions.manage_channels
+        await interaction.response.send_message(
+            f"{what[0].upper()}{what[1:]} counts as a raid, which {then}. Automod has to be on."
+            + ("" if allowed or not lockdown else
+               "\n\n⚠️ I don't have **Manage Channels** here, so I can't lock anything until "
+               "you grant it."),
+            ephemeral=True)
+
+    @automod.command(name="lift", description="Unlock the channels a raid lockdown locked")
+    @app_commands.checks.has_permissions(manage_guild=True)
+    @app_commands.default_permissions(manage_guild=True)
+    @app_commands.guild_only()
+    async def lift(self, interaction: discord.Interaction):
+        guild = interaction.guild
+        cfg = await GuildConfig.get(self.bot, guild.id)
+        held = (cfg.get("raid_lockdown") or {}).get("channels") or []
+        mod = self.bot.get_cog("Moderation")
+        if not held or mod is None:
+            await interaction.response.send_message("Nothing is locked down.", ephemeral=True)
+            return
+
+        # One permission edit per channel, which on a big server outlasts an interaction.
+        await interaction.response.defer(ephemeral=True)
+        opened, stuck = 0, []
+        for was in held:
+            channel = guild.get_channel(was["id"])
+            if channel is None:
+                continue                # deleted since
+            problem = await mod._set_lock(channel, False, "raid lockdown lifted",
+                                          interaction.user, unlock_to=was["was"])
+            if problem:
+                stuck.append(f"{channel.mention}: {problem}")
+            else:
+                opened += 1
+        await GuildConfig.update(self.bot, guild.id, unset={"raid_lockdown": ""})
+        self._raids.pop(guild.id, None)
+        await interaction.followup.send(
+            f"Unlocked {opened} channel{'' if opened == 1 else 's'}."
+            + ("\n" + "\n".join(stuck) if stuck else ""), ephemeral=True)
+
     @automod.command(name="on", description="Switch automod on")
     @app_commands.checks.has_permissions(manage_guild=True)
     async def on(self, interaction: discord.Interaction):
@@ -631,6 +974,16 @@ class AutoMod(commands.Cog, name="AutoMod"):
             exempt.append(", ".join(roles))
         if channels:
             exempt.append(", ".join(channels))
+        raid = _raid_settings(cfg)
+        if raid.get("on"):
+            line = (f"{raid['accounts']} accounts posting the same thing within "
+                    f"{raid['seconds']} seconds"
+                    + (f", or {raid['joins']} joins" if raid.get("joins") else "")
+                    + (", then lock every channel" if raid.get("lockdown", True) else ""))
+            if (cfg.get("raid_lockdown") or {}).get("channels"):
+                line += "\n**Locked down now.** `/automod lift` unlocks it."
+            embed.add_field(name="🚨 Raids", value=line, inline=False)
+
         embed.add_field(name="Never touched",
                         value="\n".join(f"· {e}" for e in exempt) or "*nobody*", inline=False)
         embed.set_footer(text="Warnings and timeouts appear in the moderation log as cases.")
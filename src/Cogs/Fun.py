@@ -15,7 +15,6 @@ Two decisions run through the file:
   changes every time you ask is not a joke anybody laughs at twice.
 """
 
-import asyncio
 import datetime
 import hashlib
 import random
@@ -26,6 +25,7 @@ from discord import app_commands
 from discord.ext import commands
 
 import Database
+import Mongo
 # The sentinel Invites writes for a join through the vanity url, imported rather than
 # repeated. Two copies of a magic string is how one of them quietly stops matching, and the
 # only symptom here would be a card showing `vanity` as though it were an invite code.
@@ -219,17 +219,13 @@ class Fun(commands.Cog, name="Fun"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
-    async def _run(self, fn, *args, **kwargs):
-        # pymongo is synchronous, and blocking the loop on a fun command is still blocking it.
-        return await asyncio.to_thread(lambda: fn(*args, **kwargs))
-
     @property
     def _db(self):
         return Database.get_bot_database(self.bot.MongoClient)
 
     async def cog_load(self):
         try:
-            await self._run(self._ensure_indexes)
+            await Mongo.run(self._ensure_indexes)
         except Exception as e:
             print(f"[Fun] index setup failed: {e}")
 
@@ -358,7 +354,7 @@ class Fun(commands.Cog, name="Fun"):
         guild_id = interaction.guild.id
         notes = []
 
-        rated = await self._run(self._db["ratings"].find_one,
+        rated = await Mongo.run(self._db["ratings"].find_one,
                                 {"guild_id": guild_id, "user_id": member.id})
         if rated and isinstance(rated.get("rating"), int):
             notes.append(f"⭐ Rated this server **{rated['rating']}/10**")
@@ -371,7 +367,7 @@ class Fun(commands.Cog, name="Fun"):
                          f", {stamp(wed['since'], 'R')}")
 
         # Membership spells: how they got here, and whether this is their first time.
-        spells = await self._run(
+        spells = await Mongo.run_for("memberships",
             lambda: list(self._db["memberships"]
                          .find({"guild_id": guild_id, "user_id": member.id})
                          .sort("joined_at", -1).limit(20)))
@@ -386,7 +382,7 @@ class Fun(commands.Cog, name="Fun"):
         # Warnings are nobody else's business. Shown only to somebody who could already look
         # them up with /warnings, which is the same bar the moderation commands use.
         if interaction.user.guild_permissions.moderate_members:
-            cases = await self._run(
+            cases = await Mongo.run(
                 self._db["mod_cases"].count_documents,
                 {"guild_id": guild_id, "user_id": member.id})
             if cases:
@@ -497,7 +493,7 @@ class Fun(commands.Cog, name="Fun"):
         """Joins, leaves and the week's best invite, off the records this bot already keeps."""
         now = datetime.datetime.now(datetime.timezone.utc)
         week = now - datetime.timedelta(days=7)
-        spells = await self._run(
+        spells = await Mongo.run_for("memberships",
             lambda: list(self._db["memberships"].find({"guild_id": guild.id})
                          .sort("joined_at", -1).limit(20000)))
         if not spells:
@@ -521,7 +517,7 @@ class Fun(commands.Cog, name="Fun"):
             lines.append(f"Best invite this week: `{'the vanity url' if code == VANITY else code}`"
                          f" with **{n}**")
 
-        rated = await self._run(
+        rated = await Mongo.run_for("ratings",
             lambda: list(self._db["ratings"].find({"guild_id": guild.id}).limit(20000)))
         scores = [r["rating"] for r in rated if isinstance(r.get("rating"), int)]
         if scores:
@@ -672,7 +668,7 @@ class Fun(commands.Cog, name="Fun"):
         await interaction.response.send_message(content=member.mention, embed=embed, view=view)
         posted = await interaction.original_response()
         try:
-            await self._run(self._db["rps_games"].insert_one, {
+            await Mongo.run(self._db["rps_games"].insert_one, {
                 "_id": posted.id,
                 "guild_id": interaction.guild.id,
                 "players": [interaction.user.id, member.id],
@@ -716,7 +712,7 @@ class Fun(commands.Cog, name="Fun"):
 
     async def _play_duel(self, interaction: discord.Interaction, throw: str):
         try:
-            game = await self._run(self._db["rps_games"].find_one,
+            game = await Mongo.run(self._db["rps_games"].find_one,
                                    {"_id": interaction.message.id})
         except Exception as e:
             print(f"[Fun] game lookup failed: {e}")
@@ -738,7 +734,7 @@ class Fun(commands.Cog, name="Fun"):
             return
 
         try:
-            game = await self._run(
+            game = await Mongo.run(
                 self._db["rps_games"].find_one_and_update,
                 {"_id": interaction.message.id, f"picks.{me}": {"$exists": False}},
                 {"$set": {f"picks.{me}": throw}}, return_document=True)
@@ -771,7 +767,7 @@ class Fun(commands.Cog, name="Fun"):
                         f"<@{two}> {THROWS[second]} **{second.title()}**")
         await interaction.response.edit_message(content=None, embed=embed, view=None)
         try:
-            await self._run(self._db["rps_games"].delete_one, {"_id": interaction.message.id})
+            await Mongo.run(self._db["rps_games"].delete_one, {"_id": interaction.message.id})
         except Exception as e:
             print(f"[Fun] couldn't clear the finished game: {e}")
 
@@ -794,7 +790,7 @@ class Fun(commands.Cog, name="Fun"):
         await interaction.response.send_message(embed=embed, view=view)
         posted = await interaction.original_response()
         try:
-            await self._run(self._db["wyr_polls"].insert_one, {
+            await Mongo.run(self._db["wyr_polls"].insert_one, {
                 "_id": posted.id,
                 "guild_id": interaction.guild.id,
                 "a": [], "b": [],
@@ -810,7 +806,7 @@ class Fun(commands.Cog, name="Fun"):
         try:
             # One update: out of whichever side they were on, into the one they picked. Two
             # separate operations would let a double click land them in both.
-            poll = await self._run(
+            poll = await Mongo.run(
                 self._db["wyr_polls"].find_one_and_update,
                 {"_id": interaction.message.id},
                 {"$pull": {other: interaction.user.id},
@@ -836,7 +832,7 @@ class Fun(commands.Cog, name="Fun"):
 
     # ── marriage ─────────────────────────────────────────────────────
     async def _marriage(self, guild_id: int, user_id: int):
-        return await self._run(self._db["marriages"].find_one,
+        return await Mongo.run(self._db["marriages"].find_one,
                                {"guild_id": guild_id, "partners": user_id})
 
     @app_commands.command(name="marry", description="Propose to somebody. They have to agree.")
@@ -913,7 +909,7 @@ class Fun(commands.Cog, name="Fun"):
 
         now = datetime.datetime.now(datetime.timezone.utc)
         try:
-            await self._run(self._db["marriages"].insert_one, {
+            await Mongo.run(self._db["marriages"].insert_one, {
                 "guild_id": interaction.guild.id,
                 # Sorted so a pair reads the same however it was asked.
                 "partners": sorted((proposer_id, target_id)),
@@ -949,7 +945,7 @@ class Fun(commands.Cog, name="Fun"):
 
         other = next((p for p in wed["partners"] if p != interaction.user.id), None)
         try:
-            await self._run(self._db["marriages"].delete_one, {"_id": wed["_id"]})
+            await Mongo.run(self._db["marriages"].delete_one, {"_id": wed["_id"]})
         except Exception as e:
             print(f"[Fun] couldn't record the divorce: {e}")
             await interaction.response.send_message(
@@ -1,23 +1,67 @@
 import asyncio
 import discord
+import os
 import re
+import time
+from collections import OrderedDict
 from discord import app_commands
 from discord.ext import commands
+from typing import Optional
 
+import Database
+import GuildConfig
+import ImageHash
+import Mongo
+import WriteBehind
 from Brand import MINT
 
+# Image similarity, on top of the filename rules. Filenames cost a spammer nothing to change,
+# the picture does, so with Pillow installed every image posted is hashed (see ImageHash) and
+# compared with the same guild's recent ones. A message is removed when all its images are the
+# same picture, or when one of them is the REPOST_LIMIT+1th copy inside REPOST_WINDOW.
+HASH_WORKERS = int(os.environ.get("IMAGESPAM_HASH_WORKERS") or 1)
+HASH_MAX_BYTES = 8 * 1024 * 1024    # larger images aren't fetched just to be hashed
+HASH_QUEUE = 32                     # messages waiting on the workers; past this, not hashed
+HAMMING = 6                         # bits of 64 two hashes may differ by and still match
+REPOST_LIMIT = 3                    # earlier copies tolerated inside the window
+REPOST_WINDOW = 10 * 60
+MAX_INDEXES = 1000                  # guilds with a hash index, least recently posting dropped
+
+# Each server's own settings, under "imagespam" in its settings document. A server that has
+# never touched them gets the filter, as every server always has.
+DEFAULTS = {"enabled": True, "similarity": True}
+# What it did, per server, in a collection of its own: counting in the settings document would
+# throw away the shared settings cache on every message caught.
+COUNTERS = ("hits", "deleted", "false_positives")
+# Messages already marked "not spam", kept in the same document so a second press, by another
+# moderator or after a restart, counts nothing. The latest MARKS_KEPT per server.
+MARKS_KEPT = 1000
+NOT_SPAM_ID = re.compile(r"^imagespam:fp:(\d+)$")
+IMAGE_EXT = re.compile(r'\.(png|jpe?g|webp|gif)$', re.IGNORECASE)
+# Matches: 1.png, 2.jpg, 123.png — purely numeric filenames
+NUMERIC_NAME = re.compile(r'^\d+\.(png|jpe?g|webp|gif)$', re.IGNORECASE)
+# The number a name starts with, for the sequence rule
+NUMERIC_PREFIX = re.compile(r'^(\d+)\.')
+
+
+def settings(cfg: dict) -> dict:
+    return {**DEFAULTS, **(cfg.get("imagespam") or {})}
+
 class ImageSpamFilter(commands.Cog):
-    """Auto-deletes messages with 2+ attachments following a spam naming pattern"""
+    """Auto-deletes messages with 2+ attachments following a spam naming pattern, and
+    pictures posted over and over whatever they are called"""
     
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.enabled = True
         self.min_attachments = 2
-        self.image_ext = re.compile(r'\.(png|jpe?g|webp|gif)$', re.IGNORECASE)
-        # Matches: 1.png, 2.jpg, 123.png — purely numeric filenames
-        self.numeric_pattern = re.compile(r'^\d+\.(png|jpe?g|webp|gif)$', re.IGNORECASE)
-        # Matches: image.png, photo.jpg, img.webp — generic single-word filenames
-        self.generic_pattern = re.compile(r'^\w+\.(png|jpe?g|webp|gif)$', re.IGNORECASE)
+        self.similarity = ImageHash.available()
+        self._hasher = ImageHash.pool(HASH_WORKERS) if self.similarity else None
+        self._hashing = 0
+        self._indexes: "OrderedDict[int, ImageHash.HashIndex]" = OrderedDict()
+
+    @property
+    def _stats(self):
+        return Database.get_bot_database(self.bot.MongoClient)["imagespam_stats"]
 
     def is_spam_batch(self, attachments: list[discord.Attachment]) -> bool:
         filenames = [att.filename.lower() for att in attachments]
@@ -27,41 +71,149 @@ class ImageSpamFilter(commands.Cog):
             return True
 
         # Rule 2: All are purely numeric names (1.png, 2.png, 3.png...)
-        if all(self.numeric_pattern.match(f) for f in filenames):
+        if all(map(NUMERIC_NAME.match, filenames)):
             return True
 
         # Rule 3: All are sequential numeric (1.png, 2.png, 3.png — no gaps > 1)
-        numeric = sorted([
-            int(re.match(r'^(\d+)\.', f).group(1))
-            for f in filenames
-            if re.match(r'^(\d+)\.', f)
-        ])
-        if len(numeric) == len(filenames):
-            gaps = [numeric[i+1] - numeric[i] for i in range(len(numeric)-1)]
-            if all(g <= 1 for g in gaps):
-                return True
-
-        return False
+        numeric = []
+        for f in filenames:
+            match = NUMERIC_PREFIX.match(f)
+            if match is None:
+                return False
+            numeric.append(int(match.group(1)))
+        numeric.sort()
+        return all(b - a <= 1 for a, b in zip(numeric, numeric[1:]))
+
+    async def _count(self, guild_id: int, counter: str):
+        try:
+            await WriteBehind.update(self._stats, {"_id": guild_id}, {"$inc": {counter: 1}},
+                                     upsert=True)
+        except Exception as e:
+            print(f"[ImageSpam] couldn't count {counter}: {e}")
+
+    async def _mark_not_spam(self, guild_id: int, message_id: int) -> bool:
+        """Count a "not spam" press, once per message however often, or by however many
+        moderators, it is pressed. Whether this press was the one that counted."""
+        # The server's document is made by the hit that removed the message, which may still
+        # be queued.
+        await WriteBehind.flush(self._stats)
+        result = await Mongo.run(
+            self._stats.update_one,
+            {"_id": guild_id, "marked": {"$ne": message_id}},
+            {"$inc": {"false_positives": 1},
+             "$push": {"marked": {"$each": [message_id], "$slice": -MARKS_KEPT}}})
+        return result.modified_count == 1
+
+    @staticmethod
+    def _not_spam(message_id: int) -> discord.ui.View:
+        view = discord.ui.View(timeout=None)
+        view.add_item(discord.ui.Button(label="Not spam", style=discord.ButtonStyle.grey,
+                                        custom_id=f"imagespam:fp:{message_id}"))
+        return view
+
+    def cog_unload(self):
+        if self._hasher is not None:
+            self._hasher.shutdown(wait=False, cancel_futures=True)
+
+    def _index(self, guild_id: int) -> ImageHash.HashIndex:
+        index = self._indexes.get(guild_id)
+        if index is None:
+            index = self._indexes[guild_id] = ImageHash.HashIndex()
+            while len(self._indexes) > MAX_INDEXES:
+                self._indexes.popitem(last=False)
+        self._indexes.move_to_end(guild_id)
+        return index
+
+    async def _image_bytes(self, message: discord.Message, images: list) -> list:
+        """Each image's bytes, or None. From MediaLog when it holds them, which it does
+        wherever it is switched on, so nothing is downloaded twice. Elsewhere only a batch is
+        fetched here: downloading every picture every server posts just to hash it would
+        cost more than the filter is worth."""
+        held = None
+        medialog = self.bot.get_cog("MediaLog")
+        if medialog is not None:
+            try:
+                held = await asyncio.wait_for(medialog.files_of(message), timeout=15)
+            except Exception as e:
+                print(f"[ImageSpam] media log lookup skipped: {e}")
+        if held is not None:
+            return [held.get(att.id) for att in images]
+        if len(images) < self.min_attachments:
+            return [None] * len(images)
+        out = []
+        for att in images:
+            if not att.size or att.size > HASH_MAX_BYTES:
+                out.append(None)
+                continue
+            try:
+                out.append(await att.read())
+            except discord.HTTPException:
+                out.append(None)
+        return out
+
+    async def looks_reposted(self, message: discord.Message, images: list) -> str:
+        """Why these images are spam by what they show, or "" if they aren't."""
+        if self._hashing >= HASH_QUEUE:
+            return ""           # a flood of uploads; the filename rules still apply
+        self._hashing += 1
+        try:
+            blobs = await self._image_bytes(message, images)
+            if not any(blobs):
+                return ""
+            hashes = await ImageHash.run(self._hasher, [b or b"" for b in blobs])
+        except Exception as e:
+            print(f"[ImageSpam] hashing failed: {e}")
+            return ""
+        finally:
+            self._hashing -= 1
+        got = [h for h in hashes if h is not None]
+        if not got:
+            return ""
+
+        # Rule 4: every image in the batch is the same picture, whatever each is called
+        if (len(images) >= self.min_attachments and len(got) == len(images)
+                and all(ImageHash.near(h, got[0], HAMMING) for h in got[1:])):
+            for h in got:
+                self._index(message.guild.id).add(h, message.id)
+            return f"the same picture {len(got)} times"
+
+        # Rule 5: a picture this guild has seen too often in the last few minutes
+        index = self._index(message.guild.id)
+        since = time.monotonic() - REPOST_WINDOW
+        seen = set()
+        for h in got:
+            seen |= index.matches(h, HAMMING, since)
+        for h in got:
+            index.add(h, message.id)
+        if len(seen) >= REPOST_LIMIT:
+            return f"posted {len(seen) + 1} times in {REPOST_WINDOW // 60} minutes"
+        return ""
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
-        if not self.enabled:
-            return
-        
         if message.guild is None or message.author.bot or not message.attachments:
             return
         
         # Only consider image attachments
         images = [att for att in message.attachments
-                  if self.image_ext.search(att.filename)]
-        
-        if len(images) < self.min_attachments:
+                  if IMAGE_EXT.search(att.filename)]
+        if not images:
             return
-        if len(images) != len(message.attachments):
+
+        cfg = await GuildConfig.get(self.bot, message.guild.id)
+        conf = settings(cfg)
+        if not conf["enabled"]:
             return
 
-        if not self.is_spam_batch(images):
+        reason = ""
+        if (len(images) >= self.min_attachments and len(images) == len(message.attachments)
+                and self.is_spam_batch(images)):
+            reason = "spam filenames"
+        elif self.similarity and conf["similarity"]:
+            reason = await self.looks_reposted(message, images)
+        if not reason:
             return
+        await self._count(message.guild.id, "hits")
 
         # Discord kills an attachment's CDN URL the instant its message is deleted, and cog
         # listeners run concurrently with no ordering guarantee — so the media log has to be
@@ -75,13 +227,30 @@ class ImageSpamFilter(commands.Cog):
 
         try:
             await message.delete()
+            await self._count(message.guild.id, "deleted")
 
-            await message.channel.send(
-                f"{message.author.mention} Message removed, please don't spam.",
-                delete_after=20
-            )
-
+            # Moderators can say it got this one wrong, which is what false_positives counts.
+            # The button goes on the server's mod log, where it stays for as long as anybody
+            # needs to look. Without one it stays on the notice, and the notice stays up with it:
+            # the twenty seconds the notice is otherwise left for is nobody's time to review.
             filenames_str = ", ".join(att.filename for att in images)
+            modlog = message.guild.get_channel(cfg.get("modlog_channel") or 0)
+            notice = f"{message.author.mention} Message removed, please don't spam."
+            if modlog is None:
+                await message.channel.send(notice, view=self._not_spam(message.id))
+            else:
+                await message.channel.send(notice, delete_after=20)
+                embed = discord.Embed(title="Image spam removed", color=MINT,
+                                      timestamp=discord.utils.utcnow())
+                embed.add_field(name="User", value=f"{message.author}\n`{message.author.id}`")
+                embed.add_field(name="Channel", value=message.channel.mention)
+                embed.add_field(name="Why", value=reason, inline=False)
+                embed.add_field(name="Attachments", value=filenames_str[:1024], inline=False)
+                try:
+                    await modlog.send(embed=embed, view=self._not_spam(message.id))
+                except discord.HTTPException as e:
+                    print(f"[ImageSpam] couldn't post to the mod log in {message.guild.id}: {e}")
+
             print(f"[ImageSpam] Deleted spam from {message.author} in {message.guild.name} ({message.jump_url})")
             
             await self.bot.send_log(
@@ -91,6 +260,7 @@ class ImageSpamFilter(commands.Cog):
                     "Guild": message.guild.name,
                     "Channel": message.channel.mention,
                     "Attachments": filenames_str,
+                    "Why": reason,
                     "Message Content": message.content[:200] if message.content else "(no text)"
                 },
                 color=MINT
@@ -101,30 +271,79 @@ class ImageSpamFilter(commands.Cog):
         except Exception as e:
             print(f"[ImageSpam] Error: {e}")
     
+    @commands.Cog.listener()
+    async def on_interaction(self, interaction: discord.Interaction):
+        if interaction.type != discord.InteractionType.component or interaction.guild is None:
+            return
+        match = NOT_SPAM_ID.match((interaction.data or {}).get("custom_id", ""))
+        if match is None:
+            return
+        if not interaction.user.guild_permissions.manage_messages:
+            await interaction.response.send_message(
+                "Only people who can manage messages can mark this.", ephemeral=True)
+            return
+        message_id = int(match.group(1))
+        try:
+            await self._mark_not_spam(interaction.guild.id, message_id)
+        except Exception as e:
+            print(f"[ImageSpam] couldn't count a false positive: {e}")
+        # Its picture shouldn't count against the next person who posts it.
+        index = self._indexes.get(interaction.guild.id)
+        if index is not None:
+            index.forget(message_id)
+        await interaction.response.edit_message(
+            content="Removed by mistake, sorry. Noted, and it won't count against a repost.",
+            view=None)
+
     @app_commands.command(
         name="toggleimagespam",
-        description="Enable / disable the image spam filter"
+        description="Enable / disable the image spam filter in this server"
     )
+    @app_commands.describe(similarity="Also compare what pictures show, not only their names")
     @app_commands.default_permissions(manage_guild=True)
     @app_commands.checks.has_permissions(manage_guild=True)
-    async def toggleimagespam(self, interaction: discord.Interaction):
-        self.enabled = not self.enabled
-        status = "**enabled**" if self.enabled else "**disabled**"
+    @app_commands.guild_only()
+    async def toggleimagespam(self, interaction: discord.Interaction,
+                              similarity: Optional[bool] = None):
+        conf = settings(await GuildConfig.get(self.bot, interaction.guild.id))
+        if similarity is None:
+            conf["enabled"] = not conf["enabled"]
+        else:
+            conf["enabled"], conf["similarity"] = True, similarity
+        await GuildConfig.update(self.bot, interaction.guild.id, {"imagespam": conf})
+        status = "**enabled**" if conf["enabled"] else "**disabled**"
         await interaction.response.send_message(
-            f"Image spam filter is now {status}.",
+            f"Image spam filter is now {status} in this server."
+            + (self._similarity_note(conf) if conf["enabled"] else ""),
             ephemeral=True
         )
-    
+
+    def _similarity_note(self, conf: dict) -> str:
+        if not conf["similarity"]:
+            return " It goes by filenames only."
+        if not self.similarity:
+            return " It goes by filenames only: comparing pictures isn't available on this bot."
+        return " It compares what pictures show as well as their names."
+
     @app_commands.command(
         name="imagespamstatus",
-        description="Check if the image spam filter is currently active"
+        description="Check if the image spam filter is active here, and what it has caught"
     )
     @app_commands.default_permissions(manage_guild=True)
     @app_commands.checks.has_permissions(manage_guild=True)
+    @app_commands.guild_only()
     async def imagespamstatus(self, interaction: discord.Interaction):
-        status = "active" if self.enabled else "disabled"
+        conf = settings(await GuildConfig.get(self.bot, interaction.guild.id))
+        # Counts are written in batches, so anything still queued goes out first.
+        await WriteBehind.flush(self._stats)
+        doc = await Mongo.run_for(self._stats, self._stats.find_one,
+                                  {"_id": interaction.guild.id}) or {}
+        hits, deleted, wrong = (doc.get(k, 0) for k in COUNTERS)
+        status = "active" if conf["enabled"] else "disabled"
         await interaction.response.send_message(
-            f"Image spam filter is currently **{status}**.",
+            f"Image spam filter is currently **{status}** here."
+            + (self._similarity_note(conf) if conf["enabled"] else "")
+            + f"\nCaught {hits:,} • deleted {deleted:,} • marked not spam {wrong:,}",
             ephemeral=True
         )
 
@@ -82,14 +82,27 @@ class Invites(commands.Cog, name="Invites"):
                 self.authors[guild.id][VANITY] = None
         return True
 
-    @commands.Cog.listener()
-    async def on_ready(self):
+    async def _snapshot_all(self, guilds: list, where: str):
         # Every guild at once rather than in sequence: a bot in a few hundred servers would
         # otherwise spend minutes unable to attribute anything.
-        await asyncio.gather(*(self._snapshot(g) for g in self.bot.guilds),
-                             return_exceptions=True)
-        known = sum(1 for g in self.bot.guilds if g.id in self.uses)
-        print(f"[Invites] tracking invites in {known}/{len(self.bot.guilds)} servers")
+        await asyncio.gather(*(self._snapshot(g) for g in guilds), return_exceptions=True)
+        known = sum(1 for g in guilds if g.id in self.uses)
+        print(f"[Invites] tracking invites in {known}/{len(guilds)} servers{where}")
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # A sharded bot has already done this shard by shard, below.
+        if not isinstance(self.bot, discord.AutoShardedClient):
+            await self._snapshot_all(self.bot.guilds, "")
+
+    @commands.Cog.listener()
+    async def on_shard_ready(self, shard_id: int):
+        """Per shard when the bot is sharded. A shard whose session is lost reconnects on its
+        own, and only it is ready again; joins on its servers went unseen in between, so its
+        counts are stale while every other shard's are fine. At startup this runs once for
+        each shard as it comes up, which adds up to what on_ready does for one shard."""
+        await self._snapshot_all([g for g in self.bot.guilds if g.shard_id == shard_id],
+                                 f" on shard {shard_id}")
 
     @commands.Cog.listener()
     async def on_guild_join(self, guild: discord.Guild):
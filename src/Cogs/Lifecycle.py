@@ -14,7 +14,6 @@ that happens would be its own kind of bug. The guild is written down as departed
 bot is added back within the grace period the note is torn up and nothing was lost.
 """
 
-import asyncio
 import datetime
 import os
 from typing import Optional
@@ -23,6 +22,7 @@ import discord
 from discord.ext import commands, tasks
 
 import Database
+import Mongo
 from Brand import MINT
 
 # How long a departed server's data is kept before it is deleted. Long enough to cover an
@@ -43,10 +43,12 @@ BY_GUILD_ID = [
     "marriages",      # who /marry paired up, which means nothing outside this server
     "wyr_polls",      # votes on would-you-rather questions
     "rps_games",      # a game in progress, meaningless once the message is gone
-    "reminders",      # set in a server, and they name a channel in it
+    "reminders",      # only until Reminders has moved any left over onto the scheduler
+    "jobs",           # scheduled jobs: reminders set in a server name a channel in it. The
+                      # midday passes are per timezone and carry no guild_id, so they stay.
 ]
-# These two key on the guild id itself rather than a guild_id field.
-BY_ID = ["config_dirty"]
+# These key on the guild id itself rather than a guild_id field.
+BY_ID = ["config_dirty", "imagespam_stats"]
 COUNTER_PREFIX = "case:"
 
 COLOR = MINT
@@ -58,9 +60,6 @@ class Lifecycle(commands.Cog, name="Lifecycle"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
-    async def _run(self, fn, *args, **kwargs):
-        return await asyncio.to_thread(lambda: fn(*args, **kwargs))
-
     @property
     def _db(self):
         return Database.get_bot_database(self.bot.MongoClient)
@@ -71,7 +70,7 @@ class Lifecycle(commands.Cog, name="Lifecycle"):
 
     async def cog_load(self):
         try:
-            await self._run(
+            await Mongo.run(
                 self.departed.create_index, [("at", 1)], name="departed_at")
         except Exception as e:
             print(f"[Lifecycle] index setup failed: {e}")
@@ -86,7 +85,7 @@ class Lifecycle(commands.Cog, name="Lifecycle"):
         # Added back within the grace period, so the data was never deleted and the note that
         # said to delete it is now wrong.
         try:
-            await self._run(self.departed.delete_one, {"_id": guild.id})
+            await Mongo.run(self.departed.delete_one, {"_id": guild.id})
         except Exception as e:
             print(f"[Lifecycle] couldn't clear the departure note for {guild.id}: {e}")
 
@@ -175,7 +174,7 @@ class Lifecycle(commands.Cog, name="Lifecycle"):
     async def on_guild_remove(self, guild: discord.Guild):
         when = datetime.datetime.now(datetime.timezone.utc)
         try:
-            await self._run(
+            await Mongo.run(
                 self.departed.update_one,
                 {"_id": guild.id},
                 {"$set": {"at": when, "name": guild.name}},
@@ -209,9 +208,9 @@ class Lifecycle(commands.Cog, name="Lifecycle"):
                 print(f"[Lifecycle] couldn't clear the case counter for {guild_id}: {e}")
             return removed
 
-        removed = await self._run(wipe)
+        removed = await Mongo.run(wipe)
         try:
-            await self._run(self.departed.delete_one, {"_id": guild_id})
+            await Mongo.run(self.departed.delete_one, {"_id": guild_id})
         except Exception as e:
             print(f"[Lifecycle] couldn't clear the departure note for {guild_id}: {e}")
 
@@ -227,7 +226,7 @@ class Lifecycle(commands.Cog, name="Lifecycle"):
         cutoff = (datetime.datetime.now(datetime.timezone.utc)
                   - datetime.timedelta(days=GRACE_DAYS))
         try:
-            due = await self._run(lambda: list(
+            due = await Mongo.run_for("departed_guilds", lambda: list(
                 self.departed.find({"at": {"$lte": cutoff}}).limit(50)))
         except Exception as e:
             print(f"[Lifecycle] couldn't look for expired guilds: {e}")
@@ -239,7 +238,7 @@ class Lifecycle(commands.Cog, name="Lifecycle"):
             # deleting a live server's settings would be the worst possible outcome.
             if self.bot.get_guild(guild_id) is not None:
                 print(f"[Lifecycle] {guild_id} is back, cancelling its deletion")
-                await self._run(self.departed.delete_one, {"_id": guild_id})
+                await Mongo.run(self.departed.delete_one, {"_id": guild_id})
                 continue
             await self.forget(guild_id)
 
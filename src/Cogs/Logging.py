@@ -15,7 +15,6 @@ switched on, a deleted message carrying an image is left to MediaLog so it is re
 with the picture, rather than twice.
 """
 
-import asyncio
 import datetime
 from typing import Optional
 
@@ -23,8 +22,10 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 
+import AuditTail
 import Database
 import GuildConfig
+import Mongo
 from Brand import MINT
 
 REMINDER_DAYS = 30          # how far back /logging status looks for survey reminders
@@ -144,19 +145,9 @@ class Logging(commands.Cog, name="Logging"):
 
     async def _actor(self, guild: discord.Guild, action, target_id=None):
         """Who did it, from the audit log. None when we can't see it or can't be sure."""
-        if not guild.me.guild_permissions.view_audit_log:
-            return None
-        try:
-            async for entry in guild.audit_logs(limit=6, action=action):
-                age = (discord.utils.utcnow() - entry.created_at).total_seconds()
-                if age > AUDIT_WINDOW:
-                    continue
-                if target_id is not None and getattr(entry.target, "id", None) != target_id:
-                    continue
-                return entry
-        except (discord.Forbidden, discord.HTTPException):
-            return None
-        return None
+        return await AuditTail.find(
+            guild, action, window=AUDIT_WINDOW,
+            match=lambda e: target_id is None or getattr(e.target, "id", None) == target_id)
 
     def _own_action(self, cfg: dict, entry) -> bool:
         """Whether the moderation log has already recorded this.
@@ -766,7 +757,7 @@ class Logging(commands.Cog, name="Logging"):
         try:
             since = (datetime.datetime.now(datetime.timezone.utc)
                      - datetime.timedelta(days=REMINDER_DAYS))
-            events = await asyncio.to_thread(lambda: list(
+            events = await Mongo.run_for("ping_events", lambda: list(
                 Database.get_bot_database(self.bot.MongoClient)["ping_events"].find(
                     {"guild_id": guild_id, "created_at": {"$gte": since}})))
         except Exception as e:
@@ -5,19 +5,29 @@ downloaded while the message is still alive and held in a bounded in-memory cach
 the cached copy is re-uploaded straight into the log channel, attached to the embed — one
 channel, no separate archive.
 
-The tradeoff that buys the simplicity: coverage is whatever is in the cache. A message deleted
-after a bot restart, or after the cache has rotated, still logs who/what/when if discord.py's
-own message cache remembers it, but says plainly that the file wasn't retained.
+The tradeoff that buys the simplicity: coverage is whatever is in the cache. Memory is kept
+small, and what falls out of it is written to local disk (see SpillStore) rather than dropped,
+so coverage is hours rather than minutes and survives a restart. Memory itself is copied to
+disk every few minutes as well as on the way out, so a restart that never reached cog_unload
+(a crash, a deploy that kills rather than stops) loses minutes of uploads, not all of memory.
+Nothing is read back into memory at startup; the disk tier's index comes back, and the bytes
+stay where they are until a delete asks for them. A message deleted after the
+disk copy has rotated too still logs who/what/when if discord.py's own message cache remembers
+it, but says plainly that the file wasn't retained.
 
 Scope is images, video and audio, from members and bots alike.
 """
 
 import asyncio
 import datetime
+import hashlib
 import io
+import os
 import re
+import tempfile
 import time
-from collections import OrderedDict
+import zlib
+from collections import OrderedDict, deque
 from dataclasses import dataclass, field
 from typing import Optional
 
@@ -25,23 +35,75 @@ import discord
 from discord import app_commands
 from discord.ext import commands, tasks
 
-import Database
+import AuditTail
 import GuildConfig
+import SpillStore
+import Thumbnails
 from Brand import MINT
 
 # Tuning. These bound memory: a public bot can't hold every upload from every server.
 MAX_FILE_BYTES = 8 * 1024 * 1024        # skip caching anything larger
 MAX_CACHE_BYTES = 96 * 1024 * 1024      # total across all guilds
-MAX_CACHE_ENTRIES = 400
-CACHE_TTL = 12 * 3600                   # drop entries this old
+# Entries cost a few hundred bytes of metadata each besides their files, and files are shared
+# between entries, so a server posting one picture over and over fills this rather than the
+# byte cap. It is set well above what the byte cap holds of distinct files for that reason.
+MAX_CACHE_ENTRIES = 2000
+CACHE_TTL = 12 * 3600                   # drop entries this old, from memory or disk
+# What falls out of memory goes here. The disk copy is read only when its message is deleted,
+# so it can be many times the size of the memory cache for no resident memory at all. 0 turns
+# it off. The default directory is per machine, so a restart finds what the last run left.
+SPILL_BYTES = int(os.environ.get("MEDIALOG_SPILL_BYTES") or 1024 * 1024 * 1024)
+SPILL_DIR = (os.environ.get("MEDIALOG_SPILL_DIR")
+             or os.path.join(tempfile.gettempdir(), "medialog-spill"))
+# How often memory is copied to disk. A copy is the write eviction would have made anyway, so
+# this costs little more than the eviction writes already did: an entry is only written twice
+# if it leaves memory mid-checkpoint.
+CHECKPOINT_SECONDS = int(os.environ.get("MEDIALOG_CHECKPOINT_SECONDS") or 120)
+# Downloads. Each one holds its whole file in memory until it finishes, and a raid posts
+# hundreds of files a second, so they run a few at a time from a queue that takes each guild in
+# turn. What is queued or downloading is budgeted in bytes; a file that would go over is logged
+# without its bytes rather than waited for, since by the time the queue reached it the message
+# could be long gone. One guild can hold at most GUILD_SHARE of the budget, so a raid in one
+# server doesn't stop every other server's uploads being kept.
+DOWNLOAD_WORKERS = int(os.environ.get("MEDIALOG_DOWNLOAD_WORKERS") or 6)
+DOWNLOAD_BUDGET = int(os.environ.get("MEDIALOG_DOWNLOAD_BUDGET") or 64 * 1024 * 1024)
+GUILD_SHARE = 0.5
+MIN_DOWNLOAD_COST = 1024                # what an attachment claiming 0 bytes is charged
+# Over MAX_FILE_BYTES, an image or video is kept as a small JPEG preview instead, made in worker
+# processes (see Thumbnails). 0 workers turns it off, as does having neither Pillow nor ffmpeg.
+# Past PREVIEW_QUEUE waiting, or PREVIEW_SOURCE_BYTES in size, a file gets no preview.
+PREVIEW_WORKERS = int(os.environ.get("MEDIALOG_PREVIEW_WORKERS") or 2)
+PREVIEW_QUEUE = 16
+PREVIEW_SOURCE_BYTES = 100 * 1024 * 1024
+# BMP, TIFF, WAV and AIFF are stored uncompressed and usually shrink by half or more; everything
+# else Discord sees is compressed already and is held as it came. Compression runs in a thread
+# when the file is captured, and the log decompresses it only when the message is deleted.
+# Sizes and the caps count what is actually held. tools/bench_medialog_codec.py has the numbers.
+COMPRESSIBLE_TYPES = {"image/bmp", "image/x-bmp", "image/x-ms-bmp", "image/tiff",
+                      "audio/wav", "audio/x-wav", "audio/wave", "audio/vnd.wave",
+                      "audio/aiff", "audio/x-aiff"}
+COMPRESSIBLE_EXT = re.compile(r"\.(bmp|tiff?|wav|aiff?)$", re.IGNORECASE)
+COMPRESS_LEVEL = 1
+COMPRESS_MIN_SAVING = 0.1               # kept as it came unless compressing saves this much
 MAX_FILES_PER_LOG = 10                  # Discord's per-message attachment limit
-MAX_BULK_LOGS = 8                       # individual logs before collapsing to a summary
+MAX_BULK_LOGS = 20                      # individual logs before collapsing to a summary
 # An embed holds one image. Several embeds in the same message that carry the same `url` are
 # drawn by the client as one embed with a grid of pictures, which is the only way to show more
 # than one. Four is where the grid stops.
 GALLERY_MAX = 4
 AUDIT_DELAY = 1.5
 AUDIT_WINDOW = 20
+# Logs go out through one queue per log channel. A purge or a spam wave deletes dozens of
+# messages a second, and a message each runs the channel into its rate limit inside five.
+# Whatever is queued is packed into as few messages as Discord allows, sent no faster than the
+# channel's limit, and retried rather than lost if a 429 gets through anyway. Who deleted what
+# is read from the audit log once per batch rather than once per entry.
+SEND_RATE = 5                           # messages per SEND_PER seconds, per channel
+SEND_PER = 5.0
+SEND_RETRIES = 5                        # for server errors; a 429 is waited out however long
+MAX_EMBEDS = 10                         # per message
+MAX_EMBED_CHARS = 6000                  # across every embed in one message
+UPLOAD_LIMIT = 10 * 1024 * 1024         # per message, when the guild doesn't say otherwise
 
 MEDIA_TYPES = ("image/", "video/", "audio/")
 MEDIA_EXT = re.compile(
@@ -104,6 +166,8 @@ def _not_kept(f) -> str:
     """
     if f.size > MAX_FILE_BYTES:
         return f"over {_fmt_size(MAX_FILE_BYTES)}, not kept"
+    if f.shed:
+        return "not kept, too many uploads at once"
     return "not kept, posted before a restart"
 
 
@@ -122,6 +186,69 @@ class CachedFile:
     content_type: Optional[str]
     size: int
     spoiler: bool
+    digest: Optional[bytes] = None  # the key of the Blob holding `data`, once cached
+    shed: bool = False              # not downloaded because the download budget was spent
+    preview: bool = False           # `data` is a JPEG preview, not the file itself
+    codec: Optional[str] = None     # how `data` is compressed; None when it is the file as is
+
+
+class OverBudget(Exception):
+    """The download budget couldn't take this file; it is logged without its bytes."""
+
+
+@dataclass(eq=False)
+class Blob:
+    """One copy of some bytes, however many cached messages carry them. The same meme or
+    spam image posted forty times is held, and counted against the cap, once."""
+    data: bytes
+    codec: Optional[str] = None
+    refs: int = 0
+    # The metadata it was downloaded under, so a later post matching it skips the download.
+    hints: set = field(default_factory=set)
+
+
+def _digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _disk_key(digest: bytes, codec: Optional[str]) -> int:
+    """The disk tier's key for a blob, so bytes shared in memory are shared on disk too. The
+    digest and how the bytes are held, cut to the store's 64 bits, with the top bit set: a
+    message id never has it, so the two can't meet."""
+    key = hashlib.blake2b(digest + (codec or "").encode(), digest_size=8).digest()
+    return int.from_bytes(key, "little") | 1 << 63
+
+
+def _compressible(content_type: Optional[str], filename: str) -> bool:
+    ctype = (content_type or "").split(";")[0].strip().lower()
+    return ctype in COMPRESSIBLE_TYPES or (not ctype and bool(COMPRESSIBLE_EXT.search(filename)))
+
+
+def _pack(data: bytes) -> tuple:
+    """(bytes to hold, codec). The data as it came when compressing doesn't earn its keep."""
+    packed = zlib.compress(data, COMPRESS_LEVEL)
+    if len(packed) > len(data) * (1 - COMPRESS_MIN_SAVING):
+        return data, None
+    return packed, "zlib"
+
+
+def _unpack(f) -> bytes:
+    return zlib.decompress(f.data) if f.codec == "zlib" else f.data
+
+
+def _hint(guild_id: int, att) -> Optional[tuple]:
+    """What an attachment is known to be before it is downloaded.
+
+    Discord gives no content hash for an attachment, and every upload gets its own id and url,
+    so this is as close as it gets: name, exact byte size, type and dimensions. Two different
+    files matching on all of that is rare enough to bet a download on, but not across servers,
+    where losing the bet would put one server's picture in another's log. So it never leaves
+    the guild; identical bytes are still shared everywhere once they are downloaded.
+    """
+    if not att.size:
+        return None
+    return (guild_id, att.filename, att.size, att.content_type,
+            getattr(att, "width", None), getattr(att, "height", None))
 
 
 @dataclass
@@ -137,6 +264,129 @@ class CachedMessage:
     files: list = field(default_factory=list)
     nbytes: int = 0
     cached_at: float = 0.0
+    on_disk: bool = False           # a checkpoint has already copied it to the disk tier
+
+
+@dataclass(eq=False)
+class Outgoing:
+    """One thing waiting in a log channel's queue: an entry, or a notice of its own."""
+    guild: object
+    cfg: dict
+    entry: Optional[CachedMessage] = None
+    who: Optional[str] = None
+    when: Optional[datetime.datetime] = None
+    lookup: bool = False            # ask the audit log who deleted it before sending
+    embeds: list = field(default_factory=list)      # a notice, when there is no entry
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+def _retry_after(e: discord.HTTPException) -> float:
+    try:
+        return float(e.response.headers.get("Retry-After", 5))
+    except (AttributeError, TypeError, ValueError):
+        return 5.0
+
+
+def _batches(rendered: list, max_bytes: int) -> list:
+    """Rendered entries grouped into as few messages as Discord's limits allow, in order.
+
+    Two things besides the counts keep entries apart. Attachments are referenced by name, so a
+    name already in the message is renamed, along with the embed pointing at it. And the
+    client draws adjacent embeds sharing a url as one gallery, so two galleries of the same
+    channel never share a message, or the second would be swallowed into the first.
+    """
+    groups, group = [], []
+    embeds = files = chars = size = 0
+    names, urls = set(), set()
+    for item in rendered:
+        item_embeds, item_files, count = item
+        item_chars = sum(len(e) for e in item_embeds)
+        item_size = sum(len(data) for _name, data, _spoiler in item_files)
+        item_urls = {e.url for e in item_embeds if e.url}
+        if group and (embeds + len(item_embeds) > MAX_EMBEDS
+                      or files + len(item_files) > MAX_FILES_PER_LOG
+                      or chars + item_chars > MAX_EMBED_CHARS
+                      or size + item_size > max_bytes
+                      or urls & item_urls):
+            groups.append(group)
+            group, embeds, files, chars, size = [], 0, 0, 0, 0
+            names, urls = set(), set()
+        renamed = []
+        for name, data, spoiler in item_files:
+            if name in names:
+                new = f"{len(group)}_{files + len(renamed)}_{name}"
+                for e in item_embeds:
+                    if e.image.url == f"attachment://{name}":
+                        e.set_image(url=f"attachment://{new}")
+                name = new
+            names.add(name)
+            renamed.append((name, data, spoiler))
+        group.append((item_embeds, renamed, count))
+        embeds += len(item_embeds)
+        files += len(item_files)
+        chars += item_chars
+        size += item_size
+        urls |= item_urls
+    if group:
+        groups.append(group)
+    return groups
+
+
+def _to_record(entry: CachedMessage) -> tuple:
+    """(meta, blobs, stored_at) for the disk tier. Monotonic time means nothing to the next
+    process, so the age goes to disk as wall clock time. Bytes go by their digest, so the
+    forty messages carrying one spam image write it to disk once, as they hold it once in
+    memory."""
+    meta = {
+        "guild_id": entry.guild_id, "channel_id": entry.channel_id,
+        "author_id": entry.author_id, "author_tag": entry.author_tag,
+        "author_avatar": entry.author_avatar, "author_bot": entry.author_bot,
+        "content": entry.content, "created_at": entry.created_at.isoformat(),
+        "files": [[f.filename, f.content_type, f.size, f.spoiler, f.data is not None, f.shed,
+                   f.preview, f.codec] for f in entry.files],
+    }
+    stored_at = time.time() - (time.monotonic() - entry.cached_at)
+    blobs = [f.data if f.digest is None else SpillStore.Shared(_disk_key(f.digest, f.codec),
+                                                               f.data)
+             for f in entry.files if f.data is not None]
+    return meta, blobs, stored_at
+
+
+def _from_record(meta: dict, blobs: list, stored_at: float) -> CachedMessage:
+    blobs = iter(blobs)
+    files = []
+    for name, ctype, size, spoiler, kept, *more in meta["files"]:
+        # Older records stop after `kept`, `shed` or `preview`. A kept file whose shared bytes
+        # the disk tier needed the room for comes back as None, and is logged as not kept.
+        extra = dict(zip(("shed", "preview", "codec"), more))
+        files.append(CachedFile(name, next(blobs) if kept else None, ctype, size, spoiler,
+                                **extra))
+    return CachedMessage(
+        guild_id=meta["guild_id"], channel_id=meta["channel_id"],
+        author_id=meta["author_id"], author_tag=meta["author_tag"],
+        author_avatar=meta["author_avatar"], author_bot=meta["author_bot"],
+        content=meta["content"],
+        created_at=datetime.datetime.fromisoformat(meta["created_at"]),
+        files=files,
+        nbytes=sum(len(f.data) for f in files if f.data is not None),
+        cached_at=time.monotonic() - (time.time() - stored_at),
+    )
+
+
+def _deleter(entries: list, channel_id: int, author_id: Optional[int]) -> Optional[str]:
+    """The newest audit entry that fits a deletion, named, or None."""
+    for e in entries:
+        ch = getattr(e.extra, "channel", None)
+        if ch is not None and ch.id != channel_id:
+            continue
+        if author_id is not None and e.target is not None and e.target.id != author_id:
+            continue
+        if e.user is not None:
+            return f"{e.user} (`{e.user.id}`)"
+        # An entry pushed by the gateway names a user who isn't cached by id alone.
+        user_id = getattr(e, "user_id", None)
+        return f"<@{user_id}> (`{user_id}`)" if user_id else None
+    return None
 
 
 class MediaLog(commands.Cog):
@@ -145,36 +395,100 @@ class MediaLog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self._cache: "OrderedDict[int, CachedMessage]" = OrderedDict()
+        # Bytes live in blobs keyed by content, shared by every entry that carries them.
+        # `_bytes` is what the blobs hold, which is what memory actually costs.
+        self._blobs: dict[bytes, Blob] = {}
+        self._hints: dict[tuple, bytes] = {}
+        self._fetching: dict[tuple, asyncio.Future] = {}
         self._bytes = 0
+        # The download queue: guild -> jobs, in the order guilds get their next turn, plus a
+        # lane ahead of all of them for messages another cog is about to delete.
+        self._queues: "OrderedDict[int, deque]" = OrderedDict()
+        self._urgent: deque = deque()
+        self._workers: set = set()
+        self._reserved = 0
+        self._reserved_by: dict[int, int] = {}
+        self._previewer = Thumbnails.pool(PREVIEW_WORKERS)
+        self._previewing = 0
         self._log_channels: set[int] = set()
+        # Log channel -> what is waiting to go there, the task sending it, and when its last
+        # few messages went, for pacing.
+        self._outbox: dict[int, deque] = {}
+        self._senders: dict[int, asyncio.Task] = {}
+        self._sent: dict[int, deque] = {}
         self._pending: dict[int, asyncio.Task] = {}
-        self.stats = {"cached": 0, "logged": 0, "too_big": 0, "failed": 0}
-
-    @property
-    def servers(self):
-        return Database.get_bot_database(self.bot.MongoClient)["servers"]
-
-    async def _db(self, fn, *args, **kwargs):
-        return await asyncio.to_thread(lambda: fn(*args, **kwargs))
+        # The disk tier, and what is on its way there. An entry is findable in one of the
+        # three places the whole time, so a delete arriving mid-write still gets its file.
+        self._spill: Optional[SpillStore.SpillStore] = None
+        if SPILL_BYTES > 0:
+            self._spill = SpillStore.SpillStore(self._spill_dir(), SPILL_BYTES, CACHE_TTL)
+        self._spilling: dict[int, CachedMessage] = {}
+        self._spill_tasks: set = set()
+        self.stats = {"cached": 0, "logged": 0, "too_big": 0, "failed": 0, "from_disk": 0,
+                      "reused": 0, "shared_bytes": 0, "downloaded": 0, "shed": 0,
+                      "queue_depth": 0, "queue_peak": 0, "previewed": 0, "preview_skipped": 0,
+                      "log_messages": 0, "audit_lookups": 0, "send_retries": 0,
+                      "checkpointed": 0}
+
+    def _spill_dir(self) -> str:
+        """One directory per shard range, so two processes on one machine never share one."""
+        ids = getattr(self.bot, "shard_ids", None)
+        return os.path.join(SPILL_DIR, ("shards-" + "-".join(map(str, ids))) if ids else "main")
 
     async def cog_load(self):
-        try:
-            self._log_channels = await self._db(self._warm)
-        except Exception as e:
-            print(f"[MediaLog] startup DB error: {e}")
+        # A reload after startup has missed the warm-up, but the cache it filled is still here.
+        if self.bot.is_ready():
+            self._seed_log_channels()
+        if self._spill is not None:
+            try:
+                held = await self._spill.open()
+                print(f"[MediaLog] {held} message(s) still on disk from the last run")
+            except OSError as e:
+                print(f"[MediaLog] disk cache unavailable, memory only: {e}")
+                self._spill = None
         self.prune.start()
+        if self._spill is not None and CHECKPOINT_SECONDS > 0:
+            self.checkpoint.start()
 
     async def cog_unload(self):
         self.prune.cancel()
+        self.checkpoint.cancel()
+        # Whatever is already queued for the log goes out first, within reason.
+        if self._senders:
+            _done, late = await asyncio.wait(list(self._senders.values()), timeout=10)
+            for task in late:
+                task.cancel()
+        for task in self._workers:
+            task.cancel()
+        for queue in (self._urgent, *self._queues.values()):
+            for _att, future in queue:
+                future.cancel()
+        self._urgent.clear()
+        self._queues.clear()
+        self.stats["queue_depth"] = 0
+        if self._previewer is not None:
+            self._previewer.shutdown(wait=False, cancel_futures=True)
+        # Everything in memory goes to disk on the way out, so a restart loses nothing. Closing
+        # the store saves its index, which is all the next start has to read.
+        if self._spill is not None:
+            for mid, entry in list(self._cache.items()):
+                self._demote(mid, entry)
+            await asyncio.gather(*self._spill_tasks, return_exceptions=True)
+            await self._spill.close()
         self._cache.clear()
+        self._blobs.clear()
+        self._hints.clear()
         self._bytes = 0
 
-    def _warm(self) -> set:
-        return {
-            d["medialog_channel"]
-            for d in self.servers.find({"medialog_channel": {"$ne": None}}, {"medialog_channel": 1})
-            if d.get("medialog_channel")
-        }
+    @commands.Cog.listener()
+    async def on_settings_warmed(self):
+        """Dispatched by the bot once GuildConfig holds every guild's settings, so the log
+        channels come out of that one pass rather than a query of their own."""
+        self._seed_log_channels()
+
+    def _seed_log_channels(self):
+        self._log_channels |= {d["medialog_channel"] for d in GuildConfig.cached()
+                               if d.get("medialog_channel")}
 
     # ── config ───────────────────────────────────────────────────────
     async def _get_config(self, guild_id: int) -> Optional[dict]:
@@ -202,12 +516,14 @@ class MediaLog(commands.Cog):
         cfg = await self._get_config(message.guild.id)
         if cfg is None:
             return
+        if message.id in self._pending or self._holds(message.id):
+            return                                    # another cog asked for it first
 
         task = asyncio.create_task(self._capture(message, media))
         self._pending[message.id] = task
         task.add_done_callback(lambda _t, mid=message.id: self._pending.pop(mid, None))
 
-    async def _capture(self, message: discord.Message, media: list):
+    async def _capture(self, message: discord.Message, media: list, urgent: bool = False):
         entry = CachedMessage(
             guild_id=message.guild.id,
             channel_id=message.channel.id,
@@ -219,16 +535,30 @@ class MediaLog(commands.Cog):
             created_at=message.created_at,
             cached_at=time.monotonic(),
         )
+        hints = []
 
         for att in media:
+            hints.append(_hint(message.guild.id, att))
             if att.size > MAX_FILE_BYTES:
-                # Record that it existed, but don't spend memory on it.
+                # Record that it existed, but don't spend memory on it beyond a preview.
+                preview = await self._preview(message.guild.id, att)
+                if preview is not None:
+                    data, digest = preview
+                    entry.files.append(CachedFile(att.filename, data, att.content_type,
+                                                  att.size, att.is_spoiler(), digest,
+                                                  preview=True))
+                    entry.nbytes += len(data)
+                    continue
                 entry.files.append(CachedFile(att.filename, None, att.content_type,
                                               att.size, att.is_spoiler()))
                 self.stats["too_big"] += 1
                 continue
             try:
-                data = await att.read()
+                data, digest, codec = await self._fetch(message.guild.id, att, urgent)
+            except OverBudget:
+                entry.files.append(CachedFile(att.filename, None, att.content_type,
+                                              att.size, att.is_spoiler(), shed=True))
+                continue
             except discord.NotFound:
                 entry.files.append(CachedFile(att.filename, None, att.content_type,
                                               att.size, att.is_spoiler()))
@@ -240,19 +570,210 @@ class MediaLog(commands.Cog):
                                               att.size, att.is_spoiler()))
                 continue
             entry.files.append(CachedFile(att.filename, data, att.content_type,
-                                          att.size, att.is_spoiler()))
+                                          att.size, att.is_spoiler(), digest, codec=codec))
             entry.nbytes += len(data)
 
-        self._cache[message.id] = entry
-        self._bytes += entry.nbytes
+        self._store(message.id, entry, hints)
+
+    async def _fetch(self, guild_id: int, att, urgent: bool = False) -> tuple:
+        """(data, digest, codec) for an attachment, downloading it only if nothing held
+        matches. `data` is what will be held, so compressed if the type is worth compressing;
+        the digest is of the file itself.
+
+        A raid posts the same file from twenty accounts inside a second, long before the first
+        download has finished, so one in flight counts too: the rest wait for it rather than
+        fetching the same bytes again.
+        """
+        hint = _hint(guild_id, att)
+        digest = self._hints.get(hint) if hint else None
+        if digest is not None:
+            self.stats["reused"] += 1
+            blob = self._blobs[digest]
+            return blob.data, digest, blob.codec
+        inflight = self._fetching.get(hint) if hint else None
+        if inflight is not None:
+            self.stats["reused"] += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future() if hint else None
+        if future is not None:
+            self._fetching[hint] = future
+        try:
+            data = await self._download(guild_id, att, urgent)
+            digest = _digest(data)
+            blob = self._blobs.get(digest)
+            if blob is not None:
+                result = (blob.data, digest, blob.codec)
+            elif _compressible(att.content_type, att.filename):
+                held, codec = await asyncio.to_thread(_pack, data)
+                result = (held, digest, codec)
+            else:
+                result = (data, digest, None)
+        except asyncio.CancelledError:
+            if future is not None:
+                future.cancel()
+            raise
+        except Exception as e:
+            if future is not None:
+                future.set_exception(e)
+                future.exception()          # whoever waited has it; nobody else needs to
+            raise
+        finally:
+            if hint:
+                self._fetching.pop(hint, None)
+        if future is not None:
+            future.set_result(result)
+        return result
+
+    async def _preview(self, guild_id: int, att) -> Optional[tuple]:
+        """(data, digest) of a JPEG preview of a file too large to keep, or None.
+
+        Bounded by PREVIEW_QUEUE rather than the download budget, because a worker never
+        holds more than a few MB whatever the size of the file, and past that a raid of large
+        videos would only queue up previews of messages that are long gone by the time they
+        are made. A preview already made for the same file in this guild is reused.
+        """
+        kind = _kind(att.content_type, att.filename)
+        if (self._previewer is None or not Thumbnails.can_preview(kind)
+                or att.size > PREVIEW_SOURCE_BYTES):
+            return None
+        hint = _hint(guild_id, att)
+        digest = self._hints.get(hint) if hint else None
+        if digest is not None:
+            self.stats["reused"] += 1
+            return self._blobs[digest].data, digest
+        if self._previewing >= PREVIEW_QUEUE:
+            self.stats["preview_skipped"] += 1
+            return None
+        self._previewing += 1
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(
+                self._previewer, Thumbnails.make, att.url, kind, PREVIEW_SOURCE_BYTES)
+        except Exception as e:
+            print(f"[MediaLog] preview failed for {att.filename}: {e}")
+            return None
+        finally:
+            self._previewing -= 1
+        if not data:
+            return None
+        self.stats["previewed"] += 1
+        return data, _digest(data)
+
+    async def _download(self, guild_id: int, att, urgent: bool = False) -> bytes:
+        """Queue a download and wait for a worker to do it. Raises OverBudget at once, without
+        queueing, if its bytes don't fit in what is left of the budget."""
+        cost = max(att.size, MIN_DOWNLOAD_COST)
+        mine = self._reserved_by.get(guild_id, 0)
+        if (self._reserved + cost > DOWNLOAD_BUDGET
+                or mine + cost > DOWNLOAD_BUDGET * GUILD_SHARE):
+            self.stats["shed"] += 1
+            raise OverBudget()
+        self._reserved += cost
+        self._reserved_by[guild_id] = mine + cost
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self._urgent if urgent else self._queues.get(guild_id)
+        if queue is None:
+            queue = self._queues[guild_id] = deque()
+        queue.append((att, future))
+        self.stats["queue_depth"] += 1
+        self.stats["queue_peak"] = max(self.stats["queue_peak"], self.stats["queue_depth"])
+        if len(self._workers) < DOWNLOAD_WORKERS:
+            worker = asyncio.ensure_future(self._work())
+            self._workers.add(worker)
+            worker.add_done_callback(self._workers.discard)
+        try:
+            return await future
+        finally:
+            self._reserved -= cost
+            left = self._reserved_by[guild_id] - cost
+            if left:
+                self._reserved_by[guild_id] = left
+            else:
+                del self._reserved_by[guild_id]
+
+    def _next_job(self) -> Optional[tuple]:
+        """Urgent first, then one from each guild in turn. A guild with more waiting goes to
+        the back of the line, so a server posting a hundred files delays a server posting
+        one by one download, not by a hundred."""
+        if self._urgent:
+            return self._urgent.popleft()
+        if not self._queues:
+            return None
+        guild_id, queue = next(iter(self._queues.items()))
+        job = queue.popleft()
+        if queue:
+            self._queues.move_to_end(guild_id)
+        else:
+            del self._queues[guild_id]
+        return job
+
+    async def _work(self):
+        """One worker: downloads until the queue is empty, then exits. `_download` starts
+        another whenever fewer than DOWNLOAD_WORKERS are running."""
+        while (job := self._next_job()) is not None:
+            self.stats["queue_depth"] -= 1
+            att, future = job
+            if future.done():
+                continue                        # its caller gave up waiting
+            try:
+                data = await att.read()
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            self.stats["downloaded"] += 1
+            if not future.done():
+                future.set_result(data)
+
+    def _store(self, message_id: int, entry: CachedMessage, hints=()):
+        """Put an entry in the cache, sharing any bytes already held, then evict to the caps."""
+        hints = list(hints) or [None] * len(entry.files)
+        for f, hint in zip(entry.files, hints):
+            if f.data is None:
+                continue
+            if f.digest is None:
+                f.digest = _digest(_unpack(f))
+            blob = self._blobs.get(f.digest)
+            if blob is None:
+                blob = self._blobs[f.digest] = Blob(f.data, f.codec)
+                self._bytes += len(f.data)
+            elif f.data is not blob.data:
+                # Same bytes, downloaded again; keep the copy already held.
+                entry.nbytes += len(blob.data) - len(f.data)
+                f.data, f.codec = blob.data, blob.codec
+                self.stats["shared_bytes"] += len(blob.data)
+            blob.refs += 1
+            if hint is not None:
+                blob.hints.add(hint)
+                self._hints[hint] = f.digest
+        self._cache[message_id] = entry
         self.stats["cached"] += 1
         self._evict()
 
+    def _release(self, entry: CachedMessage):
+        """Let go of an entry's blobs, freeing any nothing else is using. The entry keeps its
+        own references to the bytes, so one on its way to the log is unaffected."""
+        for f in entry.files:
+            blob = self._blobs.get(f.digest) if f.digest is not None else None
+            if blob is None:
+                continue
+            blob.refs -= 1
+            if blob.refs <= 0:
+                del self._blobs[f.digest]
+                self._bytes -= len(blob.data)
+                for hint in blob.hints:
+                    if self._hints.get(hint) == f.digest:
+                        del self._hints[hint]
+
     async def capture_now(self, message: discord.Message):
         """For cogs that are about to delete a message themselves — grabs the bytes before the
         CDN url dies. Cog listeners run concurrently with no ordering guarantee, so an
         auto-moderation delete can't rely on our on_message having run first."""
-        if message.guild is None or message.id in self._cache:
+        if message.guild is None or self._holds(message.id):
             return
         media = _media_of(message)
         if not media:
@@ -263,54 +784,127 @@ class MediaLog(commands.Cog):
         if existing is not None:
             await existing
             return
-        await self._capture(message, media)
+        await self._capture(message, media, urgent=True)
+
+    async def files_of(self, message: discord.Message) -> Optional[dict]:
+        """The bytes held for a message's attachments, by attachment id, for a cog that wants
+        to look at the files without downloading them a second time. Captures the message
+        first if that hasn't happened yet. None where this guild doesn't log media, since
+        then nothing is held and nothing will be; a file too large to hold is missing, or is
+        its preview."""
+        if message.guild is None or await self._get_config(message.guild.id) is None:
+            return None
+        media = _media_of(message)
+        if not media:
+            return {}
+        task = self._pending.get(message.id)
+        if task is None and not self._holds(message.id):
+            task = asyncio.create_task(self._capture(message, media))
+            self._pending[message.id] = task
+            task.add_done_callback(lambda _t, mid=message.id: self._pending.pop(mid, None))
+        if task is not None:
+            await asyncio.shield(task)
+        entry = self._cache.get(message.id)
+        if entry is None:
+            return {}
+        return {att.id: _unpack(f) for att, f in zip(media, entry.files) if f.data is not None}
 
     def _evict(self):
-        """Oldest-first eviction until back under the entry and byte ceilings."""
+        """Oldest-first eviction until back under the entry and byte ceilings. What leaves
+        memory is demoted to disk rather than dropped."""
         while self._cache and (
             len(self._cache) > MAX_CACHE_ENTRIES or self._bytes > MAX_CACHE_BYTES
         ):
-            _, old = self._cache.popitem(last=False)
-            self._bytes -= old.nbytes
+            mid, old = self._cache.popitem(last=False)
+            self._release(old)
+            self._demote(mid, old)
+
+    def _demote(self, message_id: int, entry: CachedMessage):
+        if self._spill is None or entry.on_disk:
+            return
+        self._spilling[message_id] = entry
+        task = asyncio.ensure_future(self._write_spill(message_id, entry))
+        self._spill_tasks.add(task)
+        task.add_done_callback(self._spill_tasks.discard)
+
+    async def _write_spill(self, message_id: int, entry: CachedMessage):
+        await self._spill.put(message_id, *_to_record(entry))
+        if self._spilling.get(message_id) is entry:
+            del self._spilling[message_id]
+        elif message_id not in self._spilling:
+            # Deleted, and logged from the copy in hand, while this was being written.
+            await self._spill.discard(message_id)
+
+    def _holds(self, message_id: int) -> bool:
+        return (message_id in self._cache or message_id in self._spilling
+                or (self._spill is not None and message_id in self._spill))
 
     def _drop(self, message_id: int) -> Optional[CachedMessage]:
         entry = self._cache.pop(message_id, None)
         if entry is not None:
-            self._bytes -= entry.nbytes
+            self._release(entry)
         return entry
 
+    async def _take(self, message_id: int) -> Optional[CachedMessage]:
+        """A deleted message's entry, from memory or else from disk. Either way it is gone
+        from the cache afterwards: it is only ever wanted once."""
+        entry = self._drop(message_id) or self._spilling.pop(message_id, None)
+        if entry is not None and entry.on_disk:
+            self._unspill(message_id)
+        if entry is None and self._spill is not None:
+            record = await self._spill.take(message_id)
+            if record is not None:
+                entry = _from_record(*record)
+                self.stats["from_disk"] += 1
+        return entry
+
+    def _unspill(self, message_id: int):
+        """Forget a checkpointed copy in the background; the delete being logged doesn't
+        need to wait behind whatever the disk thread is writing."""
+        task = asyncio.ensure_future(self._spill.discard(message_id))
+        self._spill_tasks.add(task)
+        task.add_done_callback(self._spill_tasks.discard)
+
+    @tasks.loop(seconds=max(1, CHECKPOINT_SECONDS))
+    async def checkpoint(self):
+        """Copy whatever only memory holds to disk, then save the disk tier's index."""
+        for mid, entry in [(m, e) for m, e in self._cache.items() if not e.on_disk]:
+            if self._cache.get(mid) is not entry:
+                continue                    # left memory while earlier ones were written
+            if not await self._spill.put(mid, *_to_record(entry)):
+                continue
+            if self._cache.get(mid) is entry:
+                entry.on_disk = True
+                self.stats["checkpointed"] += 1
+            elif mid not in self._spilling:
+                # Deleted, and logged from memory, while this was being written.
+                await self._spill.discard(mid)
+        await self._spill.checkpoint()
+
     @tasks.loop(minutes=10)
     async def prune(self):
         cutoff = time.monotonic() - CACHE_TTL
         for mid in [k for k, v in self._cache.items() if v.cached_at < cutoff]:
             self._drop(mid)
-        GuildConfig.prune()
+        if self._spill is not None:
+            await self._spill.prune()
 
     @prune.before_loop
     async def before_prune(self):
         await self.bot.wait_until_ready()
 
     # ── attribution ──────────────────────────────────────────────────
-    async def _who_deleted(self, guild, channel_id, author_id) -> Optional[str]:
-        """Best effort. A member deleting their own message produces no audit entry at all,
-        and Discord coalesces entries, so this is never presented as authoritative."""
-        if guild is None or guild.me is None or not guild.me.guild_permissions.view_audit_log:
-            return None
-        cutoff = discord.utils.utcnow() - datetime.timedelta(seconds=AUDIT_WINDOW)
-        try:
-            async for e in guild.audit_logs(limit=5,
-                                            action=discord.AuditLogAction.message_delete):
-                if e.created_at < cutoff:
-                    break
-                ch = getattr(e.extra, "channel", None)
-                if ch is not None and ch.id != channel_id:
-                    continue
-                if author_id is not None and e.target is not None and e.target.id != author_id:
-                    continue
-                return f"{e.user} (`{e.user.id}`)" if e.user else None
-        except (discord.Forbidden, discord.HTTPException):
-            return None
-        return None
+    async def _who_deleted(self, guild, wanted: list) -> list:
+        """Who deleted each of `wanted`, a list of (channel_id, author_id), from one look at
+        the audit log. Best effort: a member deleting their own message produces no audit
+        entry at all, and Discord coalesces entries, so this is never presented as
+        authoritative."""
+        if not wanted:
+            return []
+        self.stats["audit_lookups"] += 1
+        found = await AuditTail.recent(guild, discord.AuditLogAction.message_delete,
+                                       AUDIT_WINDOW, limit=min(100, max(5, 2 * len(wanted))))
+        return [_deleter(found, channel_id, author_id) for channel_id, author_id in wanted]
 
     # ── delete ───────────────────────────────────────────────────────
     @commands.Cog.listener()
@@ -329,16 +923,14 @@ class MediaLog(commands.Cog):
             except Exception:
                 pass
 
-        entry = self._drop(payload.message_id)
+        entry = await self._take(payload.message_id)
         if entry is None:
             entry = self._from_cached_message(payload.cached_message)
         if entry is None:
             return
 
         guild = self.bot.get_guild(payload.guild_id)
-        await asyncio.sleep(AUDIT_DELAY)
-        who = await self._who_deleted(guild, payload.channel_id, entry.author_id)
-        await self._send(guild, cfg, entry, who, discord.utils.utcnow())
+        self._enqueue(Outgoing(guild, cfg, entry, when=discord.utils.utcnow(), lookup=True))
 
     @commands.Cog.listener()
     async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
@@ -350,13 +942,13 @@ class MediaLog(commands.Cog):
 
         entries, handled = [], set()
         for mid in payload.message_ids:
-            e = self._drop(mid)
+            e = await self._take(mid)
             if e is not None:
                 entries.append(e)
                 handled.add(mid)
 
         # Fall back to discord.py's cache for anything we had no bytes for. Deduped on the
-        # message id and nothing else: _drop has already emptied our own cache of everything
+        # message id and nothing else: _take has already emptied our own cache of everything
         # above, so testing self._cache here finds nothing, and the author test that used to
         # stand in for it threw away every other message the same person had in the batch. Ten
         # images purged from one spammer logged the one we happened to hold and dropped the
@@ -373,32 +965,21 @@ class MediaLog(commands.Cog):
 
         guild = self.bot.get_guild(payload.guild_id)
         now = discord.utils.utcnow()
-        channel = self._log_channel(guild, cfg)
-        if channel is None:
-            return
-
         total_files = sum(len(e.files) for e in entries)
+        follows = ("Each one follows." if len(entries) <= MAX_BULK_LOGS else
+                   f"The first {MAX_BULK_LOGS} follow; the other "
+                   f"{len(entries) - MAX_BULK_LOGS} aren't shown individually.")
         summary = discord.Embed(
             title="Bulk delete",
             description=f"**{len(entries)}** message{'' if len(entries) == 1 else 's'} carrying "
                         f"**{total_files}** file{'' if total_files == 1 else 's'} went at once "
-                        f"in <#{payload.channel_id}>. Each one follows.",
+                        f"in <#{payload.channel_id}>. {follows}",
             color=MINT,
             timestamp=now,
         )
-        try:
-            await channel.send(embed=summary, allowed_mentions=discord.AllowedMentions.none())
-        except discord.HTTPException:
-            return
-
+        self._enqueue(Outgoing(guild, cfg, embeds=[summary]))
         for entry in entries[:MAX_BULK_LOGS]:
-            await self._send(guild, cfg, entry, "Bulk delete / purge", now)
-        if len(entries) > MAX_BULK_LOGS:
-            try:
-                await channel.send(
-                    f"-# …and {len(entries) - MAX_BULK_LOGS} more not shown individually.")
-            except discord.HTTPException:
-                pass
+            self._enqueue(Outgoing(guild, cfg, entry, "Bulk delete / purge", now))
 
     def _from_cached_message(self, message: Optional[discord.Message]) -> Optional[CachedMessage]:
         """Fall back to discord.py's own message cache: we lose the bytes but keep who/what/when."""
@@ -426,27 +1007,129 @@ class MediaLog(commands.Cog):
             return None
         return guild.get_channel(cfg["medialog_channel"])
 
-    async def _send(self, guild, cfg, entry: CachedMessage, who: Optional[str],
-                    when: datetime.datetime):
-        channel = self._log_channel(guild, cfg)
+    # ── sending ──────────────────────────────────────────────────────
+    def _enqueue(self, item: Outgoing):
+        channel_id = item.cfg["medialog_channel"]
+        self._outbox.setdefault(channel_id, deque()).append(item)
+        if channel_id not in self._senders:
+            self._senders[channel_id] = asyncio.ensure_future(self._drain(channel_id))
+
+    async def _drain(self, channel_id: int):
+        """Send one log channel's queue until it is empty. Anything queued while a batch is
+        going out is the next batch."""
+        queue = self._outbox[channel_id]
+        try:
+            while queue:
+                # The audit log lags the delete, so the oldest entry that needs it waits
+                # AUDIT_DELAY, and everything deleted meanwhile is in the same batch.
+                asks = [i.queued_at for i in queue if i.lookup]
+                if asks:
+                    await asyncio.sleep(max(0.0, min(asks) + AUDIT_DELAY - time.monotonic()))
+                batch = list(queue)
+                queue.clear()
+                try:
+                    await self._send_batch(batch)
+                except Exception as e:
+                    print(f"[MediaLog] couldn't send {len(batch)} log(s): {e}")
+        finally:
+            if not queue and self._outbox.get(channel_id) is queue:
+                del self._outbox[channel_id]
+            self._senders.pop(channel_id, None)
+
+    async def _send_batch(self, batch: list):
+        asks = [i for i in batch if i.lookup and i.entry is not None]
+        if asks:
+            names = await self._who_deleted(
+                asks[0].guild, [(i.entry.channel_id, i.entry.author_id) for i in asks])
+            for item, who in zip(asks, names):
+                item.who = who
+        last = batch[-1]
+        channel = self._log_channel(last.guild, last.cfg)
         if channel is None:
             return
-
+        rendered = []
+        for item in batch:
+            if item.entry is None:
+                rendered.append((item.embeds, [], 0))
+            else:
+                rendered.append(await self._render(item.entry, item.who, item.when))
+        limit = getattr(last.guild, "filesize_limit", None) or UPLOAD_LIMIT
+        for group in _batches(rendered, limit):
+            await self._deliver(channel, group)
+
+    async def _pace(self, channel_id: int):
+        sent = self._sent.get(channel_id)
+        if sent is None:
+            sent = self._sent[channel_id] = deque(maxlen=SEND_RATE)
+        if len(sent) == SEND_RATE:
+            wait = sent[0] + SEND_PER - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+        sent.append(time.monotonic())
+
+    async def _deliver(self, channel, group: list) -> bool:
+        """Send one packed group as one message. A 429 is waited out and tried again for as
+        long as it takes; a server error a few times. A group Discord refuses as too large is
+        sent one entry at a time instead."""
+        embeds = [e for embeds, _files, _n in group for e in embeds]
+        files = [f for _embeds, files, _n in group for f in files]
+        failures = 0
+        while True:
+            await self._pace(channel.id)
+            try:
+                await channel.send(
+                    embeds=embeds,
+                    files=[discord.File(io.BytesIO(data), filename=name, spoiler=spoiler)
+                           for name, data, spoiler in files],
+                    allowed_mentions=discord.AllowedMentions.none())
+            except discord.RateLimited as e:
+                self.stats["send_retries"] += 1
+                await asyncio.sleep(e.retry_after)
+                continue
+            except discord.Forbidden:
+                print(f"[MediaLog] missing permissions in log channel {channel.id}")
+                return False
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    self.stats["send_retries"] += 1
+                    await asyncio.sleep(_retry_after(e))
+                    continue
+                if e.status >= 500 and failures < SEND_RETRIES:
+                    failures += 1
+                    self.stats["send_retries"] += 1
+                    await asyncio.sleep(2 ** failures)
+                    continue
+                if len(group) > 1 and e.status in (400, 413):
+                    for one in group:
+                        await self._deliver(channel, [one])
+                    return True
+                print(f"[MediaLog] send failed: {e}")
+                return False
+            self.stats["log_messages"] += 1
+            self.stats["logged"] += sum(n for _embeds, _files, n in group)
+            return True
+
+    async def _render(self, entry: CachedMessage, who: Optional[str],
+                      when: datetime.datetime) -> tuple:
+        """(embeds, files, 1) for one entry, the files as (name, bytes, spoiler) so a batch
+        can be measured before any of it is sent."""
         retained = [f for f in entry.files if f.data is not None]
         files, shown, used = [], [], set()
 
         for i, f in enumerate(retained[:MAX_FILES_PER_LOG]):
-            safe = UNSAFE_NAME.sub("_", f.filename) or "file"
+            name = Thumbnails.preview_name(f.filename) if f.preview else f.filename
+            safe = UNSAFE_NAME.sub("_", name) or "file"
             # Two files can sanitise to the same name, and then attachment:// picks whichever
             # Discord decides. "IMG 1.png" and "IMG_1.png" is all it takes.
             if safe in used:
                 safe = f"{i}_{safe}"
             used.add(safe)
-            files.append(discord.File(io.BytesIO(f.data), filename=safe, spoiler=f.spoiler))
+            data = f.data if f.codec is None else await asyncio.to_thread(_unpack, f)
+            files.append((safe, data, f.spoiler))
             # Referencing an attachment draws it inside the embed rather than as a separate
             # block below it. Spoilers are left out so they stay blurred.
-            if (not f.spoiler and (f.content_type or "").lower().startswith("image/")
-                    and len(shown) < GALLERY_MAX):
+            ctype = Thumbnails.CONTENT_TYPE if f.preview else (f.content_type or "").lower()
+            if not f.spoiler and ctype.startswith("image/") and len(shown) < GALLERY_MAX:
                 shown.append(f"attachment://{safe}")
 
         # The whole entry in two lines and a picture. It used to be a grid of five fields, three
@@ -489,7 +1172,8 @@ class MediaLog(commands.Cog):
         # are visible directly underneath tells nobody anything.
         if len(shown) != len(entry.files):
             lines = [f"`{f.filename}` · {_fmt_size(f.size)}"
-                     + ("" if f.data is not None else f" · {_not_kept(f)}")
+                     + (f" · {_not_kept(f)}" if f.data is None
+                        else " · preview only" if f.preview else "")
                      for f in entry.files]
             embed.add_field(name="Files", value="\n".join(lines)[:1024], inline=False)
 
@@ -499,16 +1183,12 @@ class MediaLog(commands.Cog):
         if missing:
             shown = len(entry.files) - missing
             note.append(f"{shown} of {len(entry.files)} files kept")
+        previews = sum(f.preview for f in entry.files if f.data is not None)
+        if previews:
+            note.append(f"{previews} kept as a preview" if previews < len(entry.files)
+                        else "kept as a preview")
         embed.set_footer(text=" · ".join(note))
-
-        try:
-            await channel.send(embeds=[embed, *gallery], files=files,
-                               allowed_mentions=discord.AllowedMentions.none())
-            self.stats["logged"] += 1
-        except discord.Forbidden:
-            print(f"[MediaLog] missing permissions in log channel for guild {entry.guild_id}")
-        except discord.HTTPException as e:
-            print(f"[MediaLog] send failed: {e}")
+        return [embed, *gallery], files, 1
 
     @commands.Cog.listener()
     async def on_guild_channel_delete(self, channel):
@@ -20,8 +20,12 @@ from typing import Optional
 import discord
 from discord import app_commands
 from discord.ext import commands
+from bson import ObjectId
 
 import Database
+import GuildConfig
+import Mongo
+import WriteBehind
 from Brand import MINT
 
 # Spells are only needed for the retention window, so Mongo expires them rather than growing
@@ -68,11 +72,6 @@ class Members(commands.Cog, name="Members"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
-    async def _run(self, fn, *args, **kwargs):
-        # pymongo is synchronous. A raid means many joins at once, and doing these inline
-        # blocked the event loop long enough to risk the gateway heartbeat.
-        return await asyncio.to_thread(lambda: fn(*args, **kwargs))
-
     @property
     def _db(self):
         return Database.get_bot_database(self.bot.MongoClient)
@@ -83,7 +82,7 @@ class Members(commands.Cog, name="Members"):
 
     async def cog_load(self):
         try:
-            await self._run(self._ensure_indexes)
+            await Mongo.run(self._ensure_indexes)
         except Exception as e:
             print(f"[Members] index setup failed: {e}")
 
@@ -115,7 +114,10 @@ class Members(commands.Cog, name="Members"):
             self._tell_greetings("suppress_goodbye", member.id)
             return
 
-        cohort = str(datetime.date.today())
+        # The day it is in the server's own timezone, which is the calendar its reminder pass
+        # reads eight days from now.
+        cfg = await GuildConfig.get(self.bot, member.guild.id)
+        cohort = str(GuildConfig.local_date(cfg.get("timezone")))
         # Started first and finished last. The lookup has to begin immediately, because it
         # works by comparing invite use counts against the moment before this person arrived
         # and every further join blurs that. But it is an http call, and nothing about
@@ -187,41 +189,43 @@ class Members(commands.Cog, name="Members"):
         """Record the start of a membership. Their join date doubles as the cohort key, so it
         lines up with the cohort role and with whatever the reminder later targets.
 
-        Returns the new document's id so the invite can be filled in once it is known, or None
-        if the write failed, in which case there is nothing to fill in.
+        Written before it returns rather than queued, because the id it returns is what the
+        invite is patched onto, and that patch is queued: in an unordered batch it could
+        otherwise land before the spell it patches. A join that can't be recorded returns None
+        and gets no patch.
         """
+        spell = {
+            "_id": ObjectId(),
+            "guild_id": member.guild.id,
+            "user_id": member.id,
+            "cohort": cohort,
+            "joined_at": datetime.datetime.now(datetime.timezone.utc),
+            "left_at": None,
+            "nudged": False,
+            # Written empty and filled in a moment later. None is also the final answer
+            # whenever the invite genuinely can't be known, which the dashboard shows as
+            # its own row rather than dropping. A server that hasn't granted Manage
+            # Server has every join in there, and needs telling why.
+            "invite_code": None,
+            "inviter_id": None,
+            "inviter_name": None,
+        }
         try:
-            result = await self._run(self.spells.insert_one, {
-                "guild_id": member.guild.id,
-                "user_id": member.id,
-                "cohort": cohort,
-                "joined_at": datetime.datetime.now(datetime.timezone.utc),
-                "left_at": None,
-                "nudged": False,
-                # Written empty and filled in a moment later. None is also the final answer
-                # whenever the invite genuinely can't be known, which the dashboard shows as
-                # its own row rather than dropping. A server that hasn't granted Manage
-                # Server has every join in there, and needs telling why.
-                "invite_code": None,
-                "inviter_id": None,
-                "inviter_name": None,
-            })
+            await Mongo.run(self.spells.insert_one, spell)
         except Exception as e:
-            print(f"[Members] couldn't record the join: {e}")
+            print(f"[Members] couldn't record {member.id} joining {member.guild.id}: {e}")
             return None
-        return getattr(result, "inserted_id", None)
+        return spell["_id"]
 
     async def _attach_invite(self, spell_id, invite: tuple):
-        """Put the invite onto the membership record, once Discord has been asked."""
+        """Put the invite onto the membership record, once Discord has been asked. Queued
+        behind the insert it patches, so it lands in the same batch or a later one."""
         code, inviter_id, inviter_name = invite
         if spell_id is None or code is None:
             return
-        try:
-            await self._run(self.spells.update_one, {"_id": spell_id},
-                            {"$set": {"invite_code": code, "inviter_id": inviter_id,
-                                      "inviter_name": inviter_name}})
-        except Exception as e:
-            print(f"[Members] couldn't record which invite was used: {e}")
+        await WriteBehind.update(self.spells, {"_id": spell_id},
+                                 {"$set": {"invite_code": code, "inviter_id": inviter_id,
+                                           "inviter_name": inviter_name}})
 
     async def _assign_cohort_role(self, member: discord.Member, today: str):
         """Give the member the role for today's date, creating it if this is the day's first
@@ -234,7 +238,7 @@ class Members(commands.Cog, name="Members"):
             return
 
         try:
-            record = await self._run(
+            record = await Mongo.run(
                 roles.find_one, {"date": today, "guild_id": member.guild.id})
         except Exception as e:
             print(f"[Members] cohort lookup failed: {e}")
@@ -255,7 +259,7 @@ class Members(commands.Cog, name="Members"):
             try:
                 # $set with upsert rather than replace, so a stale record is repointed at the
                 # new role without dropping the "mentioned" flag if one is already there.
-                await self._run(
+                await Mongo.run(
                     roles.update_one,
                     {"date": today, "guild_id": member.guild.id},
                     {"$set": {"role_id": role.id}},
@@ -279,7 +283,7 @@ class Members(commands.Cog, name="Members"):
         try:
             # Close their most recent open spell. If there isn't one the bot wasn't running
             # when they joined, and inventing a join date would poison the numbers.
-            await self._run(
+            await Mongo.run(
                 self.spells.find_one_and_update,
                 {"guild_id": member.guild.id, "user_id": member.id, "left_at": None},
                 {"$set": {"left_at": datetime.datetime.now(datetime.timezone.utc)}},
@@ -400,7 +404,7 @@ class Members(commands.Cog, name="Members"):
         unit, count, fmt, heading = PERIODS[chosen]
 
         try:
-            spells = await self._run(lambda: list(
+            spells = await Mongo.run_for("memberships", lambda: list(
                 self.spells.find({"guild_id": guild.id})
                 .sort("joined_at", -1).limit(MAX_SPELLS)))
         except Exception as e:
@@ -582,7 +586,7 @@ class Members(commands.Cog, name="Members"):
         now = datetime.datetime.now(datetime.timezone.utc)
 
         try:
-            spells = await self._run(lambda: list(
+            spells = await Mongo.run_for("memberships", lambda: list(
                 self.spells.find({"guild_id": guild.id})
                 .sort("joined_at", -1).limit(MAX_SPELLS)))
         except Exception as e:
@@ -13,7 +13,6 @@ errors instead of useful messages:
   a 403 halfway through.
 """
 
-import asyncio
 import datetime
 import re
 import time
@@ -25,6 +24,7 @@ from discord.ext import commands
 
 import Database
 import GuildConfig
+import Mongo
 from Brand import MINT
 
 
@@ -43,6 +43,7 @@ ACTION_STYLE = {
     "untimeout": ("✅", "Timeout removed"),
     "warn": ("⚠️", "Warning"),
     "purge": ("🧹", "Purge"),
+    "lockdown": ("🚨", "Raid lockdown"),
 }
 
 
@@ -97,12 +98,9 @@ class Moderation(commands.Cog):
     def servers(self):
         return self._db_["servers"]
 
-    async def _run(self, fn, *args, **kwargs):
-        return await asyncio.to_thread(lambda: fn(*args, **kwargs))
-
     async def cog_load(self):
         try:
-            await self._run(self._ensure_indexes)
+            await Mongo.run(self._ensure_indexes)
         except Exception as e:
             print(f"[Moderation] index setup failed: {e}")
 
@@ -126,9 +124,12 @@ class Moderation(commands.Cog):
 
     async def _record(self, guild_id, action, user_id, user_tag, mod_id, mod_tag,
                       reason, duration=None) -> Optional[int]:
-        def write():
-            case_id = self._next_case_id(guild_id)
-            self.cases.insert_one({
+        # The number goes straight into the reply and the mod log, so the case is written
+        # before it is handed out, not queued: a queued case that failed to write would leave
+        # a numbered case that doesn't exist.
+        try:
+            case_id = await Mongo.run_for("counters", self._next_case_id, guild_id)
+            await Mongo.run(self.cases.insert_one, {
                 "guild_id": guild_id,
                 "case_id": case_id,
                 "action": action,
@@ -141,12 +142,10 @@ class Moderation(commands.Cog):
                 "created_at": datetime.datetime.now(datetime.timezone.utc),
                 "active": True,
             })
-            return case_id
-        try:
-            return await self._run(write)
         except Exception as e:
             print(f"[Moderation] failed to record case: {e}")
             return None
+        return case_id
 
     # ── mod-log channel ──────────────────────────────────────────────
     async def _log_channel_id(self, guild_id: int) -> Optional[int]:
@@ -478,27 +477,41 @@ class Moderation(commands.Cog):
             else "🐌 Slowmode is off.")
 
     # ── /lock and /unlock ────────────────────────────────────────────
-    async def _set_lock(self, interaction: discord.Interaction, locked: bool, reason):
+    async def _set_lock(self, channel, locked: bool, reason, by,
+                        unlock_to: Optional[bool] = None) -> Optional[str]:
+        """Stop @everyone sending in one channel, or let them again. Returns what went wrong,
+        or None. AutoMod's raid lockdown calls this for every channel at once, with the bot as
+        `by`, so it has no interaction to answer and the caller decides what to say.
+
+        Unlocking clears the overwrite, which is right for a channel /lock shut. A caller that
+        knows what the overwrite was before passes it as `unlock_to`: a channel open only
+        because of an explicit allow, under a category that denies, would otherwise stay shut.
+        """
         try:
-            self._need(interaction.guild, manage_channels=True)
+            self._need(channel.guild, manage_channels=True)
         except HierarchyError as e:
-            return await self._fail(interaction, str(e))
+            return str(e)
 
-        channel = interaction.channel
-        everyone = interaction.guild.default_role
+        everyone = channel.guild.default_role
         overwrite = channel.overwrites_for(everyone)
-        if overwrite.send_messages is (False if locked else None) and locked:
-            return await self._fail(interaction, "This channel is already locked.")
+        if locked and overwrite.send_messages is False:
+            return "This channel is already locked."
 
-        overwrite.send_messages = False if locked else None
+        overwrite.send_messages = False if locked else unlock_to
         try:
             await channel.set_permissions(
                 everyone, overwrite=overwrite,
-                reason=f"{interaction.user}: {reason or ('lock' if locked else 'unlock')}")
+                reason=f"{by}: {reason or ('lock' if locked else 'unlock')}")
         except discord.Forbidden:
-            return await self._fail(interaction, "I can't edit permissions in this channel.")
+            return "I can't edit permissions in this channel."
         except discord.HTTPException as e:
-            return await self._fail(interaction, f"Failed: {e}")
+            return f"Failed: {e}"
+        return None
+
+    async def _lock_here(self, interaction: discord.Interaction, locked: bool, reason):
+        problem = await self._set_lock(interaction.channel, locked, reason, interaction.user)
+        if problem:
+            return await self._fail(interaction, problem)
 
         embed = discord.Embed(
             title="🔒 Channel locked" if locked else "🔓 Channel unlocked",
@@ -515,7 +528,7 @@ class Moderation(commands.Cog):
     @app_commands.checks.has_permissions(manage_channels=True)
     @app_commands.guild_only()
     async def lock(self, interaction: discord.Interaction, reason: str = None):
-        await self._set_lock(interaction, True, reason)
+        await self._lock_here(interaction, True, reason)
 
     @app_commands.command(name="unlock", description="Let members send messages here again")
     @app_commands.describe(reason="Shown in the channel")
@@ -523,7 +536,7 @@ class Moderation(commands.Cog):
     @app_commands.checks.has_permissions(manage_channels=True)
     @app_commands.guild_only()
     async def unlock(self, interaction: discord.Interaction, reason: str = None):
-        await self._set_lock(interaction, False, reason)
+        await self._lock_here(interaction, False, reason)
 
     # ── /warn ────────────────────────────────────────────────────────
     @app_commands.command(name="warn", description="Warn a member (recorded in their history)")
@@ -545,7 +558,7 @@ class Moderation(commands.Cog):
                 interaction, "Couldn't save the warning, the database didn't respond.")
 
         try:
-            count = await self._run(self.cases.count_documents, {
+            count = await Mongo.run(self.cases.count_documents, {
                 "guild_id": interaction.guild.id, "user_id": member.id,
                 "action": "warn", "active": True})
         except Exception:
@@ -567,7 +580,7 @@ class Moderation(commands.Cog):
     async def warnings(self, interaction: discord.Interaction, member: discord.Member):
         await interaction.response.defer(ephemeral=True)
         try:
-            rows = await self._run(lambda: list(self.cases.find({
+            rows = await Mongo.run_for("mod_cases", lambda: list(self.cases.find({
                 "guild_id": interaction.guild.id, "user_id": member.id,
                 "action": "warn", "active": True}).sort("case_id", -1).limit(25)))
         except Exception as e:
@@ -604,7 +617,7 @@ class Moderation(commands.Cog):
         await interaction.response.defer(ephemeral=True)
         try:
             # Marked inactive rather than deleted, so the audit trail survives.
-            result = await self._run(self.cases.update_one, {
+            result = await Mongo.run(self.cases.update_one, {
                 "guild_id": interaction.guild.id, "case_id": case_id, "action": "warn"},
                 {"$set": {"active": False, "removed_by": str(interaction.user),
                           "removed_at": datetime.datetime.now(datetime.timezone.utc)}})
@@ -626,7 +639,7 @@ class Moderation(commands.Cog):
     async def modlogs(self, interaction: discord.Interaction, member: discord.Member):
         await interaction.response.defer(ephemeral=True)
         try:
-            rows = await self._run(lambda: list(self.cases.find({
+            rows = await Mongo.run_for("mod_cases", lambda: list(self.cases.find({
                 "guild_id": interaction.guild.id,
                 "user_id": member.id}).sort("case_id", -1).limit(25)))
         except Exception as e:
@@ -12,7 +12,6 @@ Deliberately narrow: only this bot's own reminders, only in the configured ratin
 only when the message is a lone role mention. Ordinary pings from members are not tracked.
 """
 
-import asyncio
 import datetime
 import re
 from typing import Optional
@@ -23,6 +22,8 @@ from discord.ext import commands
 
 import Database
 import GuildConfig
+import Mongo
+import WriteBehind
 from Brand import MINT
 
 EVENT_TTL_DAYS = 30
@@ -41,16 +42,13 @@ class PingTracker(commands.Cog, name="Ping Tracking"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
-    async def _run(self, fn, *args, **kwargs):
-        return await asyncio.to_thread(lambda: fn(*args, **kwargs))
-
     @property
     def _db(self):
         return Database.get_bot_database(self.bot.MongoClient)
 
     async def cog_load(self):
         try:
-            await self._run(self._ensure_indexes)
+            await Mongo.run(self._ensure_indexes)
         except Exception as e:
             print(f"[PingLog] index setup failed: {e}")
 
@@ -128,18 +126,16 @@ class PingTracker(commands.Cog, name="Ping Tracking"):
             print(f"[PingLog] send failed: {e}")
             return
 
-        try:
-            await self._run(self._db["ping_events"].insert_one, {
-                "guild_id": message.guild.id,
-                "channel_id": message.channel.id,
-                "message_id": message.id,
-                "role_id": role.id,
-                "cohort": role.name,
-                "reach": reach,
-                "created_at": datetime.datetime.now(datetime.timezone.utc),
-            })
-        except Exception as e:
-            print(f"[PingLog] couldn't record event: {e}")
+        # Queued and written in a batch with any others: nothing reads it back straight away.
+        await WriteBehind.insert(self._db["ping_events"], {
+            "guild_id": message.guild.id,
+            "channel_id": message.channel.id,
+            "message_id": message.id,
+            "role_id": role.id,
+            "cohort": role.name,
+            "reach": reach,
+            "created_at": datetime.datetime.now(datetime.timezone.utc),
+        })
 
     # Switching this on and off lives in the Logging cog, under /logging reminders,
     # with the other three logs. Recording the reminders is still this cog's job.
@@ -4,8 +4,9 @@ The loop, spread across three places:
 
 1. eventcog.on_member_join gives every joining member a role named after that day's date, so
    everyone who joined the same day shares one "cohort" role.
-2. main.mention_players (driven by the midday loop in main.py) finds the cohort that joined
-   8 days ago, pings its role once in the ratings channel, and deletes the ping 2s later.
+2. main.mention_players (run by the Scheduler at midday in each server's timezone) finds the
+   cohort that joined 8 days ago, pings its role once in the ratings channel, and deletes the
+   ping 2s later.
 3. On day 9 the same routine deletes the role and its record so cohorts don't pile up.
 
 Ratings themselves are captured by on_interaction below and stored one per member per guild,
@@ -16,6 +17,7 @@ ballot.
 import asyncio
 import datetime
 import re
+import zoneinfo
 from typing import Optional
 
 import discord
@@ -24,6 +26,7 @@ from discord.ext import commands, tasks
 
 import Database
 import GuildConfig
+import Mongo
 from Brand import MINT
 
 PING_AFTER_DAYS = 8
@@ -35,6 +38,14 @@ SCALE = 10
 RATING_ID = re.compile(r"^rating:(\d{1,2})$")
 
 
+def _known_zone(name: str) -> bool:
+    try:
+        zoneinfo.ZoneInfo(name)
+        return True
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        return False
+
+
 def bar(count: int, biggest: int, width: int = 12) -> str:
     if biggest <= 0:
         return ""
@@ -49,16 +60,13 @@ class ServerRatings(commands.Cog, name="Server Ratings"):
         self.Client = client
         self.bot = client
 
-    async def _run(self, fn, *args, **kwargs):
-        return await asyncio.to_thread(lambda: fn(*args, **kwargs))
-
     @property
     def _db(self):
         return Database.get_bot_database(self.Client.MongoClient)
 
     async def cog_load(self):
         try:
-            await self._run(self._ensure_indexes)
+            await Mongo.run(self._ensure_indexes)
         except Exception as e:
             print(f"[Ratings] index setup failed: {e}")
         self.upgrade_old_surveys.start()
@@ -111,7 +119,7 @@ class ServerRatings(commands.Cog, name="Server Ratings"):
         so clicks on them can't be decoded. Rather than making admins post a fresh survey,
         find the existing ones and edit better buttons into them."""
         try:
-            docs = await self._run(lambda: list(self._db["servers"].find(
+            docs = await Mongo.run_for("servers", lambda: list(self._db["servers"].find(
                 {"discovery_message": {"$ne": None}},
                 {"guild_id": 1, "discovery_channel": 1, "discovery_message": 1})))
         except Exception as e:
@@ -192,13 +200,13 @@ class ServerRatings(commands.Cog, name="Server Ratings"):
 
         now = datetime.datetime.now(datetime.timezone.utc)
         try:
-            existing = await self._run(self._db["ratings"].find_one, {
+            existing = await Mongo.run(self._db["ratings"].find_one, {
                 "guild_id": interaction.guild.id, "user_id": interaction.user.id})
             # Read the old score out now, as a plain int. Keeping the document around and
             # reading it after the write would depend on find_one having handed back a
             # detached copy.
             previous = existing.get("rating") if existing else None
-            await self._run(
+            await Mongo.run(
                 self._db["ratings"].update_one,
                 {"guild_id": interaction.guild.id, "user_id": interaction.user.id},
                 {"$set": {"rating": score, "updated_at": now},
@@ -224,21 +232,38 @@ class ServerRatings(commands.Cog, name="Server Ratings"):
     @app_commands.command(
         name="setchannel", description="Post the rating survey here and use this channel for reminders"
     )
+    @app_commands.describe(
+        timezone="Your server's timezone, like Europe/London, so reminders go out at midday there")
     @app_commands.default_permissions(manage_guild=True)
     @app_commands.checks.has_permissions(manage_guild=True)
     @app_commands.guild_only()
-    async def set_discovery_channel(self, interaction: discord.Interaction):
+    async def set_discovery_channel(self, interaction: discord.Interaction,
+                                    timezone: Optional[str] = None):
+        zone = (timezone or "").strip()
+        if zone and not _known_zone(zone):
+            await interaction.response.send_message(
+                f"I don't know the timezone `{zone[:60]}`. It wants a name like "
+                f"`Europe/London` or `America/New_York`.", ephemeral=True)
+            return
+
         message = await interaction.channel.send(
             embed=self._survey_embed(), view=self._survey_view())
 
         # $set rather than replacing the document, so the media log and mod log settings on
         # this same doc survive.
-        await GuildConfig.update(
-            self.bot, interaction.guild.id,
-            {"discovery_channel": interaction.channel.id, "discovery_message": message.id})
+        fields = {"discovery_channel": interaction.channel.id, "discovery_message": message.id}
+        current = (await GuildConfig.get(self.bot, interaction.guild.id)).get("timezone")
+        if zone:
+            fields["timezone"] = zone
+        await GuildConfig.update(self.bot, interaction.guild.id, fields)
+        if zone:
+            # The first server on a zone needs its midday pass booked.
+            self.bot.dispatch("timezone_set", interaction.guild.id, zone)
+        when = f"at midday {zone or current or 'UTC'} time"
         await interaction.response.send_message(
             f"Survey posted in {interaction.channel.mention}. Members who joined "
-            f"{PING_AFTER_DAYS} days ago will get a quiet reminder to come and rate the server.\n"
+            f"{PING_AFTER_DAYS} days ago will get a quiet reminder {when} to come and rate "
+            f"the server.\n"
             f"Use `/ratings` to see the scores, or `/discoveryhelp` for how the whole thing works.",
             ephemeral=True,
         )
@@ -254,7 +279,7 @@ class ServerRatings(commands.Cog, name="Server Ratings"):
         guild = interaction.guild
 
         try:
-            rows = await self._run(
+            rows = await Mongo.run_for("ratings",
                 lambda: list(self._db["ratings"].find({"guild_id": guild.id})))
             server_data = await GuildConfig.get(self.bot, guild.id)
         except Exception as e:
@@ -390,9 +415,9 @@ class ServerRatings(commands.Cog, name="Server Ratings"):
 
         try:
             server_data = await GuildConfig.get(self.bot, guild.id)
-            cohorts = await self._run(
+            cohorts = await Mongo.run_for("roles",
                 lambda: list(self._db["roles"].find({"guild_id": guild.id})))
-            rating_count = await self._run(
+            rating_count = await Mongo.run(
                 self._db["ratings"].count_documents, {"guild_id": guild.id})
         except Exception as e:
             server_data, cohorts, rating_count = {}, [], 0
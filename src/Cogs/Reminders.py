@@ -1,31 +1,33 @@
 """Reminders, delivered by direct message.
 
-The whole feature is a loop over one indexed query, so the only decisions worth writing down
-are about what happens when things go wrong.
+Each reminder is a job in the Scheduler, which wakes up when the next one is due rather than
+asking every 30 seconds. So the only decisions worth writing down are about what happens when
+things go wrong.
 
 - Delivery is a DM, falling back to the channel it was set in. Somebody with DMs closed still
   gets their reminder rather than silently never hearing about it.
-- A reminder is deleted the moment it is claimed by the loop, before it is sent, not after. A
-  restart mid-send loses one reminder; deleting after sending would resend every reminder in
-  flight on every restart, which is worse and much more annoying.
+- A reminder is deleted the moment it is claimed, before it is sent, not after. A restart
+  mid-send loses one reminder; deleting after sending would resend every reminder in flight on
+  every restart, which is worse and much more annoying.
 - They belong to the server they were set in, so removing the bot takes them with it. The
   channel they name would be gone anyway.
 """
 
-import asyncio
 import datetime
 import re
 
 import discord
 from discord import app_commands
-from discord.ext import commands, tasks
+from discord.ext import commands
 
 import Database
+import Mongo
+import Scheduler
 from Brand import MINT
 
 COLOR = MINT
 
-CHECK_SECONDS = 30
+KIND = "reminder"            # the Scheduler job kind
 MAX_PENDING = 25            # per person, so nobody can queue a thousand
 MAX_TEXT = 400
 MIN_DELAY = 30              # seconds. Anything shorter is a stopwatch, not a reminder.
@@ -60,33 +62,45 @@ class Reminders(commands.Cog, name="Reminders"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
-    async def _run(self, fn, *args, **kwargs):
-        return await asyncio.to_thread(lambda: fn(*args, **kwargs))
-
     @property
     def _db(self):
         return Database.get_bot_database(self.bot.MongoClient)
 
     @property
     def store(self):
-        return self._db["reminders"]
+        return self._db["jobs"]
 
     async def cog_load(self):
         try:
-            await self._run(self._ensure_indexes)
+            await Mongo.run(self._ensure_indexes)
+            await Mongo.run_for(self.store, self._adopt_old_queue)
         except Exception as e:
             print(f"[Reminders] index setup failed: {e}")
-        self.deliver.start()
+        Scheduler.register(KIND, self._send)
 
     async def cog_unload(self):
-        self.deliver.cancel()
+        Scheduler.unregister(KIND)
 
     def _ensure_indexes(self):
-        # The loop's only query, run twice a minute forever.
-        self.store.create_index([("due", 1)], name="due")
-        self.store.create_index([("user_id", 1), ("due", 1)], name="user_due")
+        # /reminders lists somebody's own, soonest first. Partial, so the other job kinds
+        # don't carry an index they never use.
+        self.store.create_index([("user_id", 1), ("due", 1)], name="reminder_user_due",
+                                partialFilterExpression={"kind": KIND})
         self.store.create_index([("guild_id", 1)], name="guild")
 
+    def _adopt_old_queue(self):
+        """Reminders set before they became jobs sat in their own collection. Moved across
+        once, keeping their ids, so none set before an upgrade goes unsent."""
+        old = self._db["reminders"]
+        waiting = list(old.find())
+        if not waiting:
+            return
+        for item in waiting:
+            self.store.update_one({"_id": item["_id"]},
+                                  {"$setOnInsert": dict(item, kind=KIND)}, upsert=True)
+        old.delete_many({"_id": {"$in": [item["_id"] for item in waiting]}})
+        print(f"[Reminders] moved {len(waiting)} reminder(s) onto the scheduler")
+
     # ── setting one ──────────────────────────────────────────────────
     @app_commands.command(name="remindme", description="Be told about something later")
     @app_commands.describe(when="How long from now, like 10m or 2h30m or 3d",
@@ -108,8 +122,8 @@ class Reminders(commands.Cog, name="Reminders"):
                 "Remind you about what?", ephemeral=True)
             return
 
-        pending = await self._run(self.store.count_documents,
-                                  {"user_id": interaction.user.id})
+        pending = await Mongo.run(self.store.count_documents,
+                                  {"kind": KIND, "user_id": interaction.user.id})
         if pending >= MAX_PENDING:
             await interaction.response.send_message(
                 f"You already have {pending} reminders waiting, which is the limit. "
@@ -119,14 +133,13 @@ class Reminders(commands.Cog, name="Reminders"):
         due = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
             seconds=seconds)
         try:
-            await self._run(self.store.insert_one, {
-                "user_id": interaction.user.id,
-                "guild_id": interaction.guild.id,
-                "channel_id": interaction.channel_id,
-                "text": text,
-                "due": due,
-                "set_at": datetime.datetime.now(datetime.timezone.utc),
-            })
+            await Scheduler.schedule(
+                self.bot, KIND, due,
+                user_id=interaction.user.id,
+                guild_id=interaction.guild.id,
+                channel_id=interaction.channel_id,
+                text=text,
+                set_at=datetime.datetime.now(datetime.timezone.utc))
         except Exception as e:
             print(f"[Reminders] couldn't save: {e}")
             await interaction.response.send_message(
@@ -145,8 +158,8 @@ class Reminders(commands.Cog, name="Reminders"):
     @app_commands.checks.cooldown(5, 60.0)
     @app_commands.guild_only()
     async def reminders(self, interaction: discord.Interaction, cancel: int = None):
-        mine = await self._run(
-            lambda: list(self.store.find({"user_id": interaction.user.id})
+        mine = await Mongo.run_for("jobs",
+            lambda: list(self.store.find({"kind": KIND, "user_id": interaction.user.id})
                          .sort("due", 1).limit(MAX_PENDING)))
 
         if cancel is not None:
@@ -155,7 +168,7 @@ class Reminders(commands.Cog, name="Reminders"):
                     f"There's no reminder {cancel}. You have {len(mine)}.", ephemeral=True)
                 return
             doomed = mine[cancel - 1]
-            await self._run(self.store.delete_one, {"_id": doomed["_id"]})
+            await Mongo.run(self.store.delete_one, {"_id": doomed["_id"]})
             await interaction.response.send_message(
                 f"Called off: {doomed['text'][:100]}", ephemeral=True)
             return
@@ -180,28 +193,7 @@ class Reminders(commands.Cog, name="Reminders"):
         await interaction.response.send_message(embed=embed, ephemeral=True)
 
     # ── delivering them ──────────────────────────────────────────────
-    @tasks.loop(seconds=CHECK_SECONDS)
-    async def deliver(self):
-        now = datetime.datetime.now(datetime.timezone.utc)
-        try:
-            due = await self._run(
-                lambda: list(self.store.find({"due": {"$lte": now}}).limit(100)))
-        except Exception as e:
-            print(f"[Reminders] couldn't read the queue: {e}")
-            return
-
-        for item in due:
-            # Claimed before it is sent. A crash between the two loses one reminder; deleting
-            # afterwards would resend everything in flight on the next restart instead.
-            try:
-                claimed = await self._run(self.store.find_one_and_delete, {"_id": item["_id"]})
-            except Exception as e:
-                print(f"[Reminders] couldn't claim one: {e}")
-                continue
-            if not claimed:
-                continue                    # another worker got there first
-            await self._send(claimed)
-
+    # The Scheduler claims each one as it comes due and hands it here.
     async def _send(self, item: dict):
         user = self.bot.get_user(item["user_id"])
         if user is None:
@@ -224,7 +216,14 @@ class Reminders(commands.Cog, name="Reminders"):
         except discord.HTTPException:
             pass                            # DMs closed, so try where they set it
 
+        # Whichever process claimed the job delivers it, and with the bot split across
+        # processes that need not be the one holding this channel's server.
         channel = self.bot.get_channel(item.get("channel_id"))
+        if channel is None and item.get("channel_id"):
+            try:
+                channel = await self.bot.fetch_channel(item["channel_id"])
+            except discord.HTTPException:
+                return
         if channel is None:
             return
         try:
@@ -232,12 +231,6 @@ class Reminders(commands.Cog, name="Reminders"):
         except discord.HTTPException as e:
             print(f"[Reminders] couldn't deliver to {item['user_id']}: {e}")
 
-    @deliver.before_loop
-    async def before_deliver(self):
-        # get_user and get_channel below are only worth anything once the cache exists.
-        await self.bot.wait_until_ready()
-
-
 async def setup(bot: commands.Bot):
     await bot.add_cog(Reminders(bot))
     print("✓ Reminders cog loaded")
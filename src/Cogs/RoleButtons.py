@@ -15,7 +15,6 @@ like and flags it; the bot is what actually posts. That way the same code publis
 whether it came from a slash command or from the web.
 """
 
-import asyncio
 import datetime
 import re
 from typing import Optional
@@ -27,6 +26,7 @@ from discord import app_commands
 from discord.ext import commands, tasks
 
 import Database
+import Mongo
 import RoleTools
 from Brand import MINT
 
@@ -55,17 +55,13 @@ class RoleButtons(commands.Cog, name="RoleButtons"):
         name="rolepanel", description="Messages people click to give themselves roles",
         guild_only=True, default_permissions=discord.Permissions(manage_roles=True))
 
-    async def _run(self, fn, *args, **kwargs):
-        # pymongo is synchronous, so keep it off the event loop.
-        return await asyncio.to_thread(lambda: fn(*args, **kwargs))
-
     @property
     def panels(self):
         return Database.get_bot_database(self.bot.MongoClient)["role_panels"]
 
     async def cog_load(self):
         try:
-            await self._run(self._ensure_indexes)
+            await Mongo.run(self._ensure_indexes)
         except Exception as e:
             print(f"[RoleButtons] index setup failed: {e}")
         self.publish_pending.start()
@@ -116,7 +112,7 @@ class RoleButtons(commands.Cog, name="RoleButtons"):
         down what it wants. Posting, editing and deleting the actual message happens here.
         """
         try:
-            due = await self._run(lambda: list(self.panels.find(
+            due = await Mongo.run_for("role_panels", lambda: list(self.panels.find(
                 {"$or": [{"needs_publish": True}, {"pending_delete": True}]}).limit(20)))
         except Exception as e:
             print(f"[RoleButtons] couldn't look for pending panels: {e}")
@@ -148,7 +144,7 @@ class RoleButtons(commands.Cog, name="RoleButtons"):
             except (discord.NotFound, discord.Forbidden, discord.HTTPException):
                 # Already gone, or we can't reach it. Either way the record shouldn't linger.
                 pass
-        await self._run(self.panels.delete_one, {"_id": panel["_id"]})
+        await Mongo.run(self.panels.delete_one, {"_id": panel["_id"]})
 
     @publish_pending.before_loop
     async def before_publish(self):
@@ -165,7 +161,7 @@ class RoleButtons(commands.Cog, name="RoleButtons"):
                   "published_at": datetime.datetime.now(datetime.timezone.utc)}
         if message_id is not None:
             values["message_id"] = message_id
-        await self._run(self.panels.update_one, {"_id": panel_id}, {"$set": values})
+        await Mongo.run(self.panels.update_one, {"_id": panel_id}, {"$set": values})
 
     async def _publish(self, panel: dict):
         guild = self.bot.get_guild(panel.get("guild_id", 0))
@@ -223,7 +219,7 @@ class RoleButtons(commands.Cog, name="RoleButtons"):
         await self._mark(panel["_id"], error=None, message_id=sent.id)
 
     async def _queue(self, panel_id):
-        await self._run(self.panels.update_one, {"_id": panel_id},
+        await Mongo.run(self.panels.update_one, {"_id": panel_id},
                         {"$set": {"needs_publish": True}})
 
     # ── someone clicks ───────────────────────────────────────────────
@@ -240,7 +236,7 @@ class RoleButtons(commands.Cog, name="RoleButtons"):
         await interaction.response.defer(ephemeral=True)
 
         try:
-            panel = await self._run(self.panels.find_one, {"_id": ObjectId(panel_id)})
+            panel = await Mongo.run(self.panels.find_one, {"_id": ObjectId(panel_id)})
         except Exception as e:
             print(f"[RoleButtons] panel lookup failed: {e}")
             await interaction.followup.send(
@@ -308,7 +304,7 @@ class RoleButtons(commands.Cog, name="RoleButtons"):
     # ── commands ─────────────────────────────────────────────────────
     async def _panel_options(self, interaction: discord.Interaction, current: str):
         try:
-            found = await self._run(lambda: list(
+            found = await Mongo.run_for("role_panels", lambda: list(
                 self.panels.find({"guild_id": interaction.guild.id}).limit(25)))
         except Exception:
             return []
@@ -322,7 +318,7 @@ class RoleButtons(commands.Cog, name="RoleButtons"):
     async def _get_panel(self, interaction: discord.Interaction, raw: str) -> Optional[dict]:
         """Load a panel the user named, or answer them and return None."""
         try:
-            panel = await self._run(self.panels.find_one, {"_id": ObjectId(raw)})
+            panel = await Mongo.run(self.panels.find_one, {"_id": ObjectId(raw)})
         except (InvalidId, TypeError):
             panel = None
         except Exception as e:
@@ -351,7 +347,7 @@ class RoleButtons(commands.Cog, name="RoleButtons"):
                      title: app_commands.Range[str, 1, 200],
                      description: Optional[app_commands.Range[str, 1, 1500]] = None,
                      mode: Optional[app_commands.Choice[str]] = None):
-        count = await self._run(self.panels.count_documents,
+        count = await Mongo.run(self.panels.count_documents,
                                 {"guild_id": interaction.guild.id})
         if count >= MAX_PANELS:
             await interaction.response.send_message(
@@ -359,7 +355,7 @@ class RoleButtons(commands.Cog, name="RoleButtons"):
                 f"`/rolepanel delete` first.", ephemeral=True)
             return
 
-        result = await self._run(self.panels.insert_one, {
+        result = await Mongo.run(self.panels.insert_one, {
             "guild_id": interaction.guild.id,
             "channel_id": channel.id,
             "message_id": None,
@@ -410,7 +406,7 @@ class RoleButtons(commands.Cog, name="RoleButtons"):
         roles.append({"role_id": role.id,
                       "label": RoleTools.label_for(role, label),
                       "emoji": (emoji or "").strip() or None})
-        await self._run(self.panels.update_one, {"_id": found["_id"]},
+        await Mongo.run(self.panels.update_one, {"_id": found["_id"]},
                         {"$set": {"roles": roles, "needs_publish": True}})
         await interaction.response.send_message(
             f"**{role.name}** added. The panel updates itself within a few seconds.",
@@ -432,7 +428,7 @@ class RoleButtons(commands.Cog, name="RoleButtons"):
                 f"**{role.name}** wasn't on that panel.", ephemeral=True)
             return
 
-        await self._run(self.panels.update_one, {"_id": found["_id"]},
+        await Mongo.run(self.panels.update_one, {"_id": found["_id"]},
                         {"$set": {"roles": kept, "needs_publish": bool(kept)}})
         extra = ("" if kept else
                  " That was the last button, so the message stays as it is until you add "
@@ -443,7 +439,7 @@ class RoleButtons(commands.Cog, name="RoleButtons"):
     @rolepanel.command(name="list", description="See the role panels in this server")
     @app_commands.checks.has_permissions(manage_roles=True)
     async def show(self, interaction: discord.Interaction):
-        found = await self._run(lambda: list(
+        found = await Mongo.run_for("role_panels", lambda: list(
             self.panels.find({"guild_id": interaction.guild.id}).limit(MAX_PANELS)))
 
         embed = discord.Embed(title="Role panels", color=MINT)
@@ -493,7 +489,7 @@ class RoleButtons(commands.Cog, name="RoleButtons"):
             except (discord.NotFound, discord.Forbidden, discord.HTTPException):
                 pass
 
-        await self._run(self.panels.delete_one, {"_id": found["_id"]})
+        await Mongo.run(self.panels.delete_one, {"_id": found["_id"]})
         await interaction.response.send_message(
             f"**{found.get('title') or 'That panel'}** is gone.", ephemeral=True)
 
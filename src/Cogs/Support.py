@@ -9,7 +9,6 @@ ticket and closed the tab has no reason to keep checking a page, and a support s
 notices being answered is the same as one nobody answered.
 """
 
-import asyncio
 import datetime
 import os
 from typing import Optional
@@ -19,6 +18,7 @@ from discord import app_commands
 from discord.ext import commands, tasks
 
 import Database
+import Mongo
 from Brand import MINT
 
 OWNER_GUILD_ID = os.environ.get("OWNER_GUILD_ID")
@@ -59,16 +59,13 @@ class Support(commands.GroupCog, name="Support", group_name="tickets",
         await interaction.response.send_message("Unknown command.", ephemeral=True)
         return False
 
-    async def _run(self, fn, *args, **kwargs):
-        return await asyncio.to_thread(lambda: fn(*args, **kwargs))
-
     @property
     def tickets(self):
         return Database.get_bot_database(self.bot.MongoClient)["tickets"]
 
     async def cog_load(self):
         try:
-            await self._run(self._ensure_indexes)
+            await Mongo.run(self._ensure_indexes)
         except Exception as e:
             print(f"[Support] index setup failed: {e}")
         self.announce.start()
@@ -117,7 +114,7 @@ class Support(commands.GroupCog, name="Support", group_name="tickets",
         if not SUPPORT_CHANNEL_ID:
             return
         try:
-            due = await self._run(lambda: list(
+            due = await Mongo.run_for("tickets", lambda: list(
                 self.tickets.find({"posted": False}).limit(10)))
         except Exception as e:
             print(f"[Support] couldn't look for new tickets: {e}")
@@ -137,7 +134,7 @@ class Support(commands.GroupCog, name="Support", group_name="tickets",
                 print(f"[Support] couldn't post ticket {doc.get('number')}: {e}")
                 continue
             # Cleared even if the next one fails, so one bad ticket can't replay forever.
-            await self._run(self.tickets.update_one,
+            await Mongo.run(self.tickets.update_one,
                             {"_id": doc["_id"]}, {"$set": {"posted": True}})
 
     @announce.before_loop
@@ -147,7 +144,7 @@ class Support(commands.GroupCog, name="Support", group_name="tickets",
     # ── answering ────────────────────────────────────────────────────
     async def _find(self, number: int) -> Optional[dict]:
         try:
-            return await self._run(self.tickets.find_one, {"number": int(number)})
+            return await Mongo.run(self.tickets.find_one, {"number": int(number)})
         except Exception as e:
             print(f"[Support] lookup failed: {e}")
             return None
@@ -193,7 +190,7 @@ class Support(commands.GroupCog, name="Support", group_name="tickets",
         chosen = status.value if status else "open"
         query = {} if chosen == "all" else {"status": chosen}
         try:
-            found = await self._run(lambda: list(
+            found = await Mongo.run_for("tickets", lambda: list(
                 self.tickets.find(query).sort("updated_at", -1).limit(20)))
         except Exception as e:
             await interaction.followup.send(f"Couldn't read them: {e}", ephemeral=True)
@@ -240,7 +237,7 @@ class Support(commands.GroupCog, name="Support", group_name="tickets",
             return
 
         now = datetime.datetime.now(datetime.timezone.utc)
-        await self._run(
+        await Mongo.run(
             self.tickets.update_one, {"_id": doc["_id"]},
             {"$set": {"status": "answered", "updated_at": now},
              "$push": {"messages": {"from": "staff", "author": str(interaction.user),
@@ -270,7 +267,7 @@ class Support(commands.GroupCog, name="Support", group_name="tickets",
         if message:
             update["$push"] = {"messages": {"from": "staff", "author": str(interaction.user),
                                             "body": message, "at": now}}
-        await self._run(self.tickets.update_one, {"_id": doc["_id"]}, update)
+        await Mongo.run(self.tickets.update_one, {"_id": doc["_id"]}, update)
 
         if message:
             await self._tell_them(doc, message, closed=True)
@@ -22,7 +22,8 @@ CATEGORIES = {
     "Stats": ("📊", "Server Stats",
               "Roles, activity, badges, tags and what people are playing."),
     "ImageSpamFilter": ("🛡️", "Spam Filter",
-                        "Removes batches of images posted with spam-looking filenames."),
+                        "Removes batches of images with spam-looking filenames, and the same "
+                        "picture posted over and over."),
     "Greetings": ("👋", "Greetings",
                   "Welcome and goodbye messages, written by you."),
     "Members": ("📈", "Retention & Discovery",
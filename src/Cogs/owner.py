@@ -18,6 +18,11 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 
+import AuditTail
+import GuildConfig
+import Mongo
+import Scheduler
+import WriteBehind
 from Brand import MINT
 
 OWNER_GUILD_ID = os.environ.get("OWNER_GUILD_ID")
@@ -117,14 +122,75 @@ class Owner(commands.GroupCog, name="Owner", group_name="admin",
         medialog = self.bot.get_cog("MediaLog")
         if medialog is not None:
             s = medialog.stats
+            spill = medialog._spill
+            disk = (f"{len(spill)} msg • {spill.bytes / (1024 * 1024):.1f} MB on disk • "
+                    f"{s['from_disk']} logged from there • {s['checkpointed']} checkpointed\n"
+                    if spill is not None else "")
             embed.add_field(
                 name="Media log",
                 value=f"held {len(medialog._cache)} msg • "
-                      f"{medialog._bytes / (1024 * 1024):.1f} MB in memory\n"
-                      f"cached {s['cached']} • logged {s['logged']} • "
+                      f"{medialog._bytes / (1024 * 1024):.1f} MB in memory as "
+                      f"{len(medialog._blobs)} distinct files\n"
+                      f"downloaded {s['downloaded']} • skipped {s['reused']} • "
+                      f"{s['shared_bytes'] / (1024 * 1024):.1f} MB of copies shared\n"
+                      f"queued {s['queue_depth']} (peak {s['queue_peak']}) • "
+                      f"over budget {s['shed']} • previews {s['previewed']} "
+                      f"(skipped {s['preview_skipped']})\n"
+                      + disk +
+                      f"cached {s['cached']} • logged {s['logged']} in "
+                      f"{s['log_messages']} messages • audit lookups {s['audit_lookups']} • "
+                      f"retries {s['send_retries']}\n"
+                      f"waiting to send {sum(map(len, medialog._outbox.values()))} • "
                       f"too big {s['too_big']} • failed {s['failed']}",
                 inline=False)
 
+        c = GuildConfig.stats()
+        lookups = c["hits"] + c["served_stale"] + c["misses"]
+        lines = [f"held {c['cached_guilds']:,} of {c['max_entries']:,}"
+                 + (f" • {c['hits'] / lookups:.0%} fresh hits" if lookups else ""),
+                 f"hits {c['hits']} • stale {c['served_stale']} • misses {c['misses']} • "
+                 f"evicted {c['evicted']}",
+                 f"reads {c['issued']} • coalesced {c['coalesced']}"]
+        hot = []
+        for guild_id, count in GuildConfig.hottest(5):
+            guild = self.bot.get_guild(guild_id)
+            hot.append(f"{guild.name if guild else guild_id} · {count}")
+        if hot:
+            lines.append("hottest: " + ", ".join(hot))
+        embed.add_field(name="Settings cache", value="\n".join(lines)[:1024], inline=False)
+
+        a = AuditTail.stats()
+        embed.add_field(
+            name="Audit log",
+            value=f"{a['tails']} tails held • pushed {a['pushed']:,} "
+                  f"(trusted on {a['pushed_live']} of {a['feeds']} shard(s))\n"
+                  f"reads {a['reads']} • shared {a['joined']} • hits {a['hits']} • "
+                  f"answered without a read {a['trusted_misses']}",
+            inline=False)
+
+        m = Mongo.stats()
+        w = WriteBehind.stats()
+        lines = [f"{m['running']} running • {m['queued']} queued • {m['workers']} workers",
+                 f"write-behind: {w['pending']} pending • {w['written']:,} written in "
+                 f"{w['batches']:,} batches • {w['failed']} failed"]
+        # Where the database time goes, which is rarely where anybody guesses.
+        busiest = sorted(m["collections"].items(), key=lambda kv: kv[1]["total_ms"],
+                         reverse=True)[:5]
+        for name, c in busiest:
+            lines.append(f"`{name}` {c['calls']:,} calls • avg {c['avg_ms']} ms • "
+                         f"max {c['max_ms']} ms • wait {c['wait_ms']} ms"
+                         + (f" • {c['errors']} errors" if c["errors"] else ""))
+        embed.add_field(name="Database", value="\n".join(lines)[:1024], inline=False)
+
+        j = Scheduler.status()
+        upcoming = f"<t:{int(j['next'].timestamp())}:R>" if j["next"] else "not running"
+        embed.add_field(
+            name="Scheduler",
+            value=f"next wake {upcoming} • ran {j['ran']} • failed {j['failed']} • "
+                  f"woken early {j['wakeups']}\n"
+                  f"handles: {', '.join(j['kinds']) or 'nothing'}",
+            inline=False)
+
         embed.add_field(
             name="Loaded cogs", value=", ".join(sorted(self.bot.cogs)) or "none", inline=False)
         await interaction.followup.send(embed=embed, ephemeral=True)
@@ -0,0 +1,180 @@
+"""Settings invalidation pushed from MongoDB rather than polled for.
+
+The dashboard is a separate process, so when somebody saves a setting there the bot's cached
+copy in GuildConfig has to be told. That used to be a query against `config_dirty` every ten
+seconds, all day, whether anybody had saved anything or not, and a save still took up to ten
+seconds to show up. A change stream turns it around: Mongo tells us when `servers` or
+`config_dirty` changes, within a fraction of a second, and says nothing the rest of the time.
+
+Three things shape how this is built:
+
+- **pymongo is synchronous.** Iterating a change stream blocks until the next event, so it gets
+  a thread of its own rather than a worker borrowed from the default pool for ever. Everything
+  that touches the cache is handed back to the event loop, so the cache is only ever changed
+  from one thread.
+- **Change streams need a replica set.** A standalone server refuses to open one. Then `start`
+  says so and main keeps the old poll running instead, which is slower but correct.
+- **A gap is worse than a stale read.** If the stream drops and can't pick up where it left
+  off, events may have been missed, so the whole cache is dropped rather than trusted.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Callable, Optional
+
+import Database
+import GuildConfig
+import Mongo
+
+WATCHED = ("servers", "config_dirty")
+
+# How long to wait before reopening a stream that dropped, doubling up to the ceiling. Enough
+# reopen failures in a row and the feed gives up and lets the poll take over.
+RETRY_SECONDS = 1
+RETRY_MAX_SECONDS = 60
+MAX_FAILURES = 6
+
+# Only what is needed to name the guild. A servers update has to look the document up to find
+# its guild_id, since the event itself only carries the _id, and projecting here keeps the
+# rest of the settings document off the wire. Flags being removed are ignored: that is Mongo
+# expiring old ones, not a change anybody made.
+PIPELINE = [
+    {"$match": {"$or": [
+        {"ns.coll": "servers"},
+        {"ns.coll": "config_dirty", "operationType": {"$in": ["insert", "update", "replace"]}},
+    ]}},
+    {"$project": {"ns": 1, "operationType": 1, "documentKey": 1, "fullDocument.guild_id": 1}},
+]
+
+
+def guild_of(change: dict) -> Optional[int]:
+    """Which guild a change event is about, or None if it can't be told.
+
+    A flag's _id is the guild id itself. A servers document carries guild_id, except when it
+    has been deleted, in which case only its _id survives and the cached copy is the only
+    place left to match it against. Deletes are rare enough for that scan not to matter.
+    """
+    coll = (change.get("ns") or {}).get("coll")
+    key = (change.get("documentKey") or {}).get("_id")
+    if coll == "config_dirty":
+        return key
+    doc = change.get("fullDocument") or {}
+    if doc.get("guild_id") is not None:
+        return doc["guild_id"]
+    if key is None:
+        return None
+    for guild_id, (cached, _) in list(GuildConfig._cache.items()):
+        if cached.get("_id") == key:
+            return guild_id
+    return None
+
+
+class ConfigFeed:
+    """Drops a guild's cached settings the moment Mongo reports a change to them."""
+
+    def __init__(self, bot, on_lost: Optional[Callable[[], None]] = None):
+        self.bot = bot
+        # Called on the event loop if the stream dies and stays dead, so the poll can resume.
+        self.on_lost = on_lost
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stream = None
+        self._token = None
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self.stats = {"events": 0, "invalidated": 0, "reconnects": 0, "resyncs": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _open(self, resume_after=None):
+        db = Database.get_bot_database(self.bot.MongoClient)
+        return db.watch(PIPELINE, full_document="updateLookup", resume_after=resume_after)
+
+    async def start(self) -> bool:
+        """Open the stream and start listening. False means change streams aren't available
+        here, and the caller should fall back to polling."""
+        self._loop = asyncio.get_running_loop()
+        try:
+            self._stream = await Mongo.run_for("change_stream", self._open)
+        except Exception as e:
+            print(f"[dashboard] change stream unavailable ({getattr(e, 'code', None)}): {e}")
+            return False
+        self._thread = threading.Thread(target=self._pump, name="config-feed", daemon=True)
+        self._thread.start()
+        print("[dashboard] listening for settings changes")
+        return True
+
+    def close(self):
+        self._closed = True
+        stream, self._stream = self._stream, None
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    # ── on the feed's own thread ─────────────────────────────────────
+    def _pump(self):
+        failures = 0
+        while not self._closed:
+            stream = self._stream
+            try:
+                for change in stream:
+                    failures = 0
+                    self._token = stream.resume_token
+                    self._loop.call_soon_threadsafe(self._apply, change)
+            except Exception as e:
+                if self._closed:
+                    return
+                print(f"[dashboard] change stream dropped: {e}")
+            if self._closed:
+                return
+
+            failures += 1
+            if failures > MAX_FAILURES or not self._reopen(failures):
+                if not self._closed:
+                    self._loop.call_soon_threadsafe(self._lost)
+                return
+
+    def _reopen(self, failures: int) -> bool:
+        time.sleep(min(RETRY_SECONDS * 2 ** (failures - 1), RETRY_MAX_SECONDS))
+        if self._closed:
+            return False
+        self.stats["reconnects"] += 1
+        try:
+            self._stream = self._open(resume_after=self._token)
+            return True
+        except Exception as e:
+            print(f"[dashboard] couldn't resume the change stream: {e}")
+        # The resume point is gone (the oplog rolled past it, usually), so anything could
+        # have changed in between. Start fresh and forget everything cached.
+        try:
+            self._stream = self._open()
+        except Exception as e:
+            print(f"[dashboard] couldn't reopen the change stream: {e}")
+            return False
+        self._token = None
+        self._loop.call_soon_threadsafe(self._resync)
+        return True
+
+    # ── back on the event loop ───────────────────────────────────────
+    def _apply(self, change: dict):
+        self.stats["events"] += 1
+        guild_id = guild_of(change)
+        if guild_id is None:
+            return
+        GuildConfig.invalidate(guild_id)
+        self.stats["invalidated"] += 1
+
+    def _resync(self):
+        self.stats["resyncs"] += 1
+        GuildConfig._cache.clear()
+
+    def _lost(self):
+        print("[dashboard] change stream gave up, falling back to polling")
+        # Whatever happened while it was down went unheard.
+        GuildConfig._cache.clear()
+        if self.on_lost is not None:
+            self.on_lost()
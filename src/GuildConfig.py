@@ -11,18 +11,47 @@ bot: an unconfigured server costs one read per TTL rather than one per message.
 """
 
 import asyncio
+import datetime
+import heapq
+import os
+import random
 import time
+import zoneinfo
+from collections import OrderedDict
 from typing import Optional
 
 import Database
+import Mongo
 
 TTL = 300
-_cache: dict[int, tuple[dict, float]] = {}
+# Past TTL a copy is still served, and refreshed behind the caller's back, so a busy guild
+# never waits on Mongo from the message path. Only a copy older than this makes the caller
+# wait for the read, because by then it is old enough that somebody may have noticed.
+STALE_TTL = TTL * 4
+# After a failed read the copy already held is served as fresh for this long before the next
+# try. Otherwise every message in the stale window would start a read of its own, all through
+# a database outage, each failing the same way.
+RETRY_SECONDS = 30
+# Kept in least-recently-used order and capped, so memory has a ceiling however many servers
+# the bot is in. A guild evicted here costs one read the next time it speaks, nothing more.
+MAX_ENTRIES = int(os.environ.get("GUILDCONFIG_MAX_ENTRIES") or 10_000)
+_cache: "OrderedDict[int, tuple[dict, float]]" = OrderedDict()
+# One read per guild at a time. When an entry expires under a busy guild, every listener that
+# misses it at that moment (AutoMod, MediaLog, PingLog and Logging, for every message in
+# flight) would otherwise start its own identical find_one. They wait on the first one instead.
+_inflight: dict[int, asyncio.Task] = {}
+_counts = {"hits": 0, "misses": 0, "served_stale": 0, "evicted": 0,
+           "issued": 0, "coalesced": 0}
+# Lookups per guild, halved on every prune so it says who is busy now rather than who has been
+# busy since the last deploy. Only guilds still in the cache are kept.
+_heat: dict[int, int] = {}
+# guild_id -> {build: (doc, what build made of it)}. Things a cog works out from the settings
+# once, rather than on every message: dropped with the document they were made from.
+_derived: dict[int, dict] = {}
 
-
-async def _run(fn, *args, **kwargs):
-    # pymongo is synchronous, so keep it off the event loop.
-    return await asyncio.to_thread(lambda: fn(*args, **kwargs))
+# Guild ids per query when warming the cache at startup. Well under Mongo's 16 MB command
+# limit, and small enough that one slow batch doesn't hold everything else up.
+WARM_BATCH = 500
 
 
 def _servers(bot):
@@ -32,24 +61,133 @@ def _servers(bot):
 async def get(bot, guild_id: int) -> dict:
     """The guild's settings, or an empty dict when it has none. Never returns None, so callers
     can go straight to .get() for the flag they care about."""
-    now = time.monotonic()
+    _heat[guild_id] = _heat.get(guild_id, 0) + 1
     hit = _cache.get(guild_id)
-    if hit is not None and now - hit[1] < TTL:
-        return hit[0]
+    if hit is not None:
+        _cache.move_to_end(guild_id)
+        age = time.monotonic() - hit[1]
+        if age < TTL:
+            _counts["hits"] += 1
+            return hit[0]
+        if age < STALE_TTL:
+            # Stale but recent: answer now and let the refresh land for the next message.
+            if guild_id not in _inflight:
+                _refresh(bot, guild_id, hit)
+            _counts["served_stale"] += 1
+            return hit[0]
+
+    _counts["misses"] += 1
+    task = _inflight.get(guild_id)
+    if task is not None:
+        _counts["coalesced"] += 1
+    else:
+        task = _refresh(bot, guild_id, hit)
+    # Shielded, so one caller being cancelled doesn't cancel the read everybody else is
+    # waiting on.
+    return await asyncio.shield(task)
+
 
+def _refresh(bot, guild_id: int, hit: Optional[tuple]) -> asyncio.Task:
+    task = asyncio.ensure_future(_load(bot, guild_id, hit))
+    _inflight[guild_id] = task
+    task.add_done_callback(lambda t, g=guild_id: _inflight.pop(g, None)
+                           if _inflight.get(g) is t else None)
+    return task
+
+
+async def _load(bot, guild_id: int, hit: Optional[tuple]) -> dict:
+    _counts["issued"] += 1
+    now = time.monotonic()
     try:
-        doc = await _run(_servers(bot).find_one, {"guild_id": guild_id})
+        doc = await Mongo.run(_servers(bot).find_one, {"guild_id": guild_id})
     except Exception as e:
         print(f"[GuildConfig] read failed for {guild_id}: {e}")
         # Serve the stale copy rather than pretending the guild is unconfigured, which would
-        # silently switch features off during a database blip.
-        return hit[0] if hit is not None else {}
+        # silently switch features off during a database blip. It goes back in the cache
+        # RETRY_SECONDS short of expiring, so the next read waits that long.
+        if hit is None:
+            return {}
+        if _inflight.get(guild_id) is asyncio.current_task():
+            _store(guild_id, hit[0], now - TTL + RETRY_SECONDS)
+        return hit[0]
 
     doc = doc or {}
-    _cache[guild_id] = (doc, now)
+    # An invalidation while this read was out means it may predate the change, so it is
+    # handed to whoever was already waiting but not kept.
+    if _inflight.get(guild_id) is asyncio.current_task():
+        _store(guild_id, doc, now)
     return doc
 
 
+def _store(guild_id: int, doc: dict, at: float):
+    _cache[guild_id] = (doc, at)
+    _cache.move_to_end(guild_id)
+    while len(_cache) > MAX_ENTRIES:
+        old, _ = _cache.popitem(last=False)
+        _heat.pop(old, None)
+        _derived.pop(old, None)
+        _counts["evicted"] += 1
+
+
+async def warm(bot, guild_ids) -> int:
+    """Load every listed guild's settings in a handful of `$in` queries. Returns how many
+    guilds were filled in.
+
+    Straight after a restart the cache is empty, and every guild's first message in every cog
+    would pay its own find_one: a stampede of thousands of reads just as the gateway finishes
+    connecting. Guilds with no document are cached as empty, exactly as `get` would cache them.
+
+    The timestamps are spread across the first half of the TTL rather than all set to now, so
+    the whole cache doesn't come due in the same second five minutes later.
+    """
+    # Past the cap, warming more would only evict what was warmed first.
+    room = max(MAX_ENTRIES - len(_cache), 0)
+    ids = [g for g in dict.fromkeys(guild_ids) if g not in _cache][:room]
+    servers = _servers(bot)
+    filled = 0
+    for start in range(0, len(ids), WARM_BATCH):
+        batch = ids[start:start + WARM_BATCH]
+        try:
+            docs = await Mongo.run_for(
+                servers, lambda: list(servers.find({"guild_id": {"$in": batch}})))
+        except Exception as e:
+            # Whatever is left loads one guild at a time as it is asked for, as it always did.
+            print(f"[GuildConfig] warm-up stopped after {filled} guilds: {e}")
+            break
+        found = {d.get("guild_id"): d for d in docs}
+        now = time.monotonic()
+        for guild_id in batch:
+            # A read that started while this batch was out is at least as fresh.
+            if guild_id in _cache or guild_id in _inflight:
+                continue
+            _store(guild_id, found.get(guild_id) or {}, now - random.uniform(0, TTL / 2))
+            filled += 1
+    return filled
+
+
+def derived(guild_id: int, doc: dict, build):
+    """`build(doc)`, made once per copy of the guild's settings rather than once per call.
+
+    For a cog that turns the document into something quicker to use on the message path:
+    parsed numbers, sets, compiled patterns. The result is held until the copy it was built
+    from is replaced, so a change from any command or the dashboard is picked up with the next
+    read, exactly as the document itself is. Whatever `build` returns is shared by every
+    caller, so it should be something nobody will modify.
+    """
+    held = _derived.setdefault(guild_id, {})
+    hit = held.get(build)
+    if hit is not None and hit[0] is doc:
+        return hit[1]
+    value = build(doc)
+    held[build] = (doc, value)
+    return value
+
+
+def cached() -> list:
+    """Every settings document held right now, for cogs that index something out of them."""
+    return [doc for doc, _ in _cache.values()]
+
+
 async def update(bot, guild_id: int, values: Optional[dict] = None,
                  unset: Optional[dict] = None, add_to_set: Optional[dict] = None,
                  pull: Optional[dict] = None):
@@ -64,24 +202,72 @@ async def update(bot, guild_id: int, values: Optional[dict] = None,
     if pull:
         ops["$pull"] = pull
     if ops:
-        await _run(_servers(bot).update_one, {"guild_id": guild_id}, ops, upsert=True)
+        await Mongo.run(_servers(bot).update_one, {"guild_id": guild_id}, ops, upsert=True)
     invalidate(guild_id)
 
 
 def invalidate(guild_id: int):
     _cache.pop(guild_id, None)
+    _derived.pop(guild_id, None)
+    # A read already under way may have missed the change, so the next caller starts afresh.
+    _inflight.pop(guild_id, None)
 
 
 def prune():
-    """Drop entries nobody has looked at in a while, so the dict can't grow without bound."""
+    """Drop entries too old to be served without a read anyway, and cool the access counts.
+
+    The size cap is what bounds memory; this only stops an idle guild holding a slot it would
+    have to re-read to use. Run by the bot's own maintenance loop.
+    """
     now = time.monotonic()
-    for key in [k for k, v in _cache.items() if now - v[1] > TTL * 4]:
+    for key in [k for k, v in _cache.items() if now - v[1] > STALE_TTL]:
         _cache.pop(key, None)
+    for key in [k for k in _derived if k not in _cache]:
+        del _derived[key]
+    for key in list(_heat):
+        _heat[key] //= 2
+        if not _heat[key] or key not in _cache:
+            del _heat[key]
+
+
+def hottest(n: int = 5) -> list:
+    """The n guilds asking for their settings most often lately, as (guild_id, lookups)."""
+    return heapq.nlargest(n, _heat.items(), key=lambda kv: kv[1])
 
 
 def stats() -> dict:
-    return {"cached_guilds": len(_cache)}
+    """Hits were answered fresh from memory, misses had to wait for a read, and served_stale
+    were answered from an expired copy while it was refreshed in the background. Issued is
+    reads that reached Mongo, coalesced is misses that waited on somebody else's read rather
+    than starting their own."""
+    return {"cached_guilds": len(_cache), "max_entries": MAX_ENTRIES,
+            "derived": len(_derived), "reads_in_flight": len(_inflight), **_counts}
+
+
+# ── the guild's own calendar ─────────────────────────────────────────
+# A server's "timezone" setting decides which day it is there. Cohorts are stamped with that
+# day when somebody joins and looked up by it when the reminder goes out, so both ends have to
+# read the same calendar, and never the host's, which is wherever the bot happens to run.
+DEFAULT_TIMEZONE = "UTC"
+
+
+def zone(name: Optional[str]) -> datetime.tzinfo:
+    """A timezone by IANA name. Anything unknown is UTC rather than an error mid-pass."""
+    try:
+        return zoneinfo.ZoneInfo(name or DEFAULT_TIMEZONE)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        return datetime.timezone.utc
+
+
+def local_date(name: Optional[str], days_ago: int = 0) -> datetime.date:
+    """The date it is in the zone `name`, or was `days_ago` days back."""
+    today = datetime.datetime.now(datetime.timezone.utc).astimezone(zone(name)).date()
+    return today - datetime.timedelta(days=days_ago)
+
 
+# A dashboard flag outlives every cached copy it could be about, and a poll that fell behind
+# by that much has had its copies refreshed by age anyway.
+DIRTY_FLAG_TTL = STALE_TTL * 3
 
 # Mongo error codes for "an equivalent index is already there". 85 is raised when the same
 # keys exist under a different name, which is exactly what an index created by an earlier
@@ -94,6 +280,10 @@ INDEXES = [
     # (/forcesurvey); a compound index starting with date serves both.
     ("roles", [("date", 1), ("guild_id", 1)], "date_guild"),
     ("roles", [("guild_id", 1), ("mentioned", 1)], "guild_mentioned"),
+    # The dashboard's "settings changed" flags. Every bot process polling without a change
+    # stream reads the ones newer than it has seen, so none may delete them; Mongo does, once
+    # they are older than any copy they could be about (see DIRTY_FLAG_TTL).
+    ("config_dirty", [("at", 1)], "at_ttl", {"expireAfterSeconds": DIRTY_FLAG_TTL}),
 ]
 
 
@@ -109,9 +299,9 @@ async def ensure_indexes(bot):
 
     def build():
         made, existing, failed = 0, 0, []
-        for coll, keys, name in INDEXES:
+        for coll, keys, name, *options in INDEXES:
             try:
-                db[coll].create_index(keys, name=name)
+                db[coll].create_index(keys, name=name, **(options[0] if options else {}))
                 made += 1
             except Exception as e:
                 if getattr(e, "code", None) in _INDEX_EXISTS:
@@ -121,7 +311,7 @@ async def ensure_indexes(bot):
         return made, existing, failed
 
     try:
-        made, existing, failed = await _run(build)
+        made, existing, failed = await Mongo.run_for("indexes", build)
     except Exception as e:
         print(f"[GuildConfig] index setup failed outright: {e}")
         return
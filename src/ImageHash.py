@@ -0,0 +1,177 @@
+"""Perceptual hashes of pictures, for telling that two uploads are the same image.
+
+The image spam filter used to go by filenames alone, and renaming a file is free. What a
+spammer can't cheaply change is the picture, so each image is reduced to two 64-bit hashes
+that survive re-encoding, resizing and small edits:
+
+- aHash: the image shrunk to 8x8 grey pixels, one bit per pixel for brighter than the mean
+- dHash: shrunk to 9x8, one bit per pair of neighbours for whether brightness goes up
+
+Two hashes a few bits apart (Hamming distance) are the same picture to anyone looking at it.
+Requiring both to be close cuts down on chance matches, which either alone is prone to. An
+image of one flat colour has no hash worth the name (every bit is the same), so it gets none
+rather than matching every other flat image.
+
+Decoding is the whole cost and is all CPU, so it runs in the worker processes Thumbnails'
+previews use too (see Workers), and JPEGs are decoded straight to a fraction of their size. Comparing a
+new hash against a guild's recent ones is the part that runs on the event loop; with NumPy
+that is one vectorised pass over the index, without it a loop over at most INDEX_SIZE ints.
+
+Pillow is needed to decode anything at all, and without it there are no hashes and the spam
+filter goes by filenames as it always has. NumPy is optional everywhere.
+"""
+
+import asyncio
+import io
+import time
+from array import array
+from concurrent.futures import Executor
+from typing import Optional
+
+import Workers
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAX_PIXELS = 50_000_000         # an image claiming more than this is refused unread
+FLAT = 8                        # grey levels an image must span to be worth hashing
+INDEX_SIZE = 256                # recent hashes kept per guild, oldest overwritten first
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def pool(workers: int) -> Optional[Executor]:
+    """A share of the worker processes, or None where hashes can't be made. With 0 workers
+    the caller falls back to a thread, which still keeps the decode off the event loop."""
+    if workers <= 0 or not available():
+        return None
+    return Workers.pool("hashes", workers)
+
+
+def distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def near(a: tuple, b: tuple, threshold: int) -> bool:
+    """Whether two (ahash, dhash) pairs are the same picture."""
+    return distance(a[0], b[0]) <= threshold and distance(a[1], b[1]) <= threshold
+
+
+# ── in the worker process ────────────────────────────────────────────
+def hash_all(blobs: list) -> list:
+    """(ahash, dhash) for each image in `blobs`, or None for one that can't be read. One call
+    per message, so a batch of four costs one trip to the worker rather than four."""
+    return [_hash(data) for data in blobs]
+
+
+def _hash(data: bytes) -> Optional[tuple]:
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            if img.width * img.height > MAX_PIXELS:
+                return None
+            img.draft("L", (64, 64))        # JPEG only: decode at 1/8 scale where possible
+            grey = img.convert("L")
+            low, high = grey.getextrema()
+            if high - low < FLAT:
+                return None
+            small = grey.resize((8, 8), Image.BILINEAR)
+            wide = grey.resize((9, 8), Image.BILINEAR)
+            return from_pixels(small.tobytes(), wide.tobytes())
+    except Exception:
+        # Truncated, animated oddities, formats Pillow can't open: none of them are worth a
+        # crash in the worker, and a file that can't be hashed just isn't compared.
+        return None
+
+
+def from_pixels(small: bytes, wide: bytes) -> tuple:
+    """The two hashes from 8x8 and 9x8 grey pixels, row by row."""
+    if np is not None:
+        s = np.frombuffer(small, dtype=np.uint8)
+        w = np.frombuffer(wide, dtype=np.uint8).reshape(8, 9)
+        return (_pack(s > s.mean()), _pack((w[:, 1:] > w[:, :-1]).ravel()))
+    mean = sum(small) / 64
+    ahash = 0
+    for p in small:
+        ahash = (ahash << 1) | (p > mean)
+    dhash = 0
+    for row in range(8):
+        line = wide[row * 9:row * 9 + 9]
+        for x in range(8):
+            dhash = (dhash << 1) | (line[x + 1] > line[x])
+    return ahash, dhash
+
+
+def _pack(bits) -> int:
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+# ── on the event loop ────────────────────────────────────────────────
+class HashIndex:
+    """One guild's most recent image hashes, in a fixed-size ring.
+
+    Plain arrays of machine ints rather than a list of tuples: a few KB per guild however
+    busy it is, and with NumPy they are compared in place without a copy.
+    """
+
+    __slots__ = ("ahash", "dhash", "message", "at", "pos", "size")
+
+    def __init__(self, size: int = INDEX_SIZE):
+        self.ahash = array("Q", bytes(8 * size))
+        self.dhash = array("Q", bytes(8 * size))
+        self.message = array("Q", bytes(8 * size))
+        self.at = array("d", bytes(8 * size))
+        self.pos = 0
+        self.size = 0
+
+    def add(self, pair: tuple, message_id: int, at: Optional[float] = None):
+        i = self.pos
+        self.ahash[i], self.dhash[i] = pair
+        self.message[i] = message_id
+        self.at[i] = time.monotonic() if at is None else at
+        self.pos = (i + 1) % len(self.ahash)
+        self.size = min(self.size + 1, len(self.ahash))
+
+    def forget(self, message_id: int):
+        """Take a message's pictures out of the comparison, by aging them past any window."""
+        for i in range(self.size):
+            if self.message[i] == message_id:
+                self.at[i] = float("-inf")
+
+    def matches(self, pair: tuple, threshold: int, since: float) -> set:
+        """Ids of the messages since `since` carrying a picture near `pair`."""
+        n = self.size
+        if not n:
+            return set()
+        if np is not None:
+            a = np.frombuffer(self.ahash, dtype=np.uint64)[:n]
+            d = np.frombuffer(self.dhash, dtype=np.uint64)[:n]
+            at = np.frombuffer(self.at, dtype=np.float64)[:n]
+            hit = ((_popcount(a ^ np.uint64(pair[0])) <= threshold)
+                   & (_popcount(d ^ np.uint64(pair[1])) <= threshold) & (at >= since))
+            ids = np.frombuffer(self.message, dtype=np.uint64)[:n][hit]
+            return set(int(i) for i in ids)
+        return {self.message[i] for i in range(n)
+                if self.at[i] >= since and distance(self.ahash[i], pair[0]) <= threshold
+                and distance(self.dhash[i], pair[1]) <= threshold}
+
+
+def _popcount(x):
+    if hasattr(np, "bitwise_count"):                # NumPy 2
+        return np.bitwise_count(x)
+    return np.unpackbits(x.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+
+async def run(executor: Optional[Executor], blobs: list) -> list:
+    """hash_all in the workers, or on a thread where there are none."""
+    if executor is None:
+        return await asyncio.to_thread(hash_all, blobs)
+    return await asyncio.get_running_loop().run_in_executor(executor, hash_all, blobs)
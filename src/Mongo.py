@@ -0,0 +1,125 @@
+"""Where every database call runs: one thread pool sized for it, and counted.
+
+pymongo is synchronous, so every call has to be kept off the event loop. Each cog used to do
+that with its own two-line `_run` around `asyncio.to_thread`, which hands the call to the
+event loop's default executor. That pool is small (a few more threads than there are CPUs)
+and shared with anything else that uses `to_thread`, so under load it was the real limit on
+how many database calls could be in flight, and nothing said so: a raid's worth of joins just
+got slower, queued behind each other in a pool nobody could see into.
+
+They all come through here now. The pool is sized for database work, its threads are named
+so a stack dump says what they are, and every call is timed under the collection it touched:
+how long it waited for a worker, how long it ran, how many are running and how many queued.
+/admin info shows the result.
+
+A native async driver would remove the threads altogether, but pymongo 4.4 doesn't have one
+and motor would be a second client and a second connection pool for the same database.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# pymongo's own connection pool holds 100 per server by default, so this is well inside it.
+WORKERS = int(os.environ.get("MONGO_WORKERS") or 32)
+
+_pool = None
+_lock = threading.Lock()
+_queued = 0                 # handed to the pool, not yet picked up by a worker
+_running = 0
+# collection -> counters. Only ever changed on the event loop thread, apart from the two
+# above, which the workers move between and so sit behind the lock.
+_stats: dict[str, dict] = {}
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="mongo")
+    return _pool
+
+
+def _label(fn) -> str:
+    """The collection a bound method like `coll.find_one` belongs to."""
+    return getattr(getattr(fn, "__self__", None), "name", None) or "other"
+
+
+async def run(fn, *args, **kwargs):
+    """Run one pymongo call on the database pool. A collection's own methods are counted
+    under its name; for anything else, such as a lambda building a cursor, use `run_for`."""
+    return await run_for(_label(fn), fn, *args, **kwargs)
+
+
+async def run_for(collection, fn, *args, **kwargs):
+    """Run `fn` on the pool, counted under `collection`, which is a name or a collection."""
+    global _queued
+    name = getattr(collection, "name", None) or str(collection)
+    stat = _stats.get(name)
+    if stat is None:
+        stat = _stats[name] = {"calls": 0, "errors": 0, "in_flight": 0, "run_ms": 0.0,
+                               "wait_ms": 0.0, "max_ms": 0.0}
+    timing = []
+    # Whether a worker has picked it up. A call cancelled while still queued never reaches a
+    # worker, so the queue count is settled from whichever side gets there first.
+    state = {"started": False, "abandoned": False}
+
+    def call():
+        global _queued, _running
+        started = time.perf_counter()
+        with _lock:
+            if not state["abandoned"]:
+                _queued -= 1
+            state["started"] = True
+            _running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with _lock:
+                _running -= 1
+            timing.append((started, time.perf_counter()))
+
+    submitted = time.perf_counter()
+    with _lock:
+        _queued += 1
+    stat["in_flight"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor(), call)
+    except BaseException:
+        stat["errors"] += 1
+        raise
+    finally:
+        with _lock:
+            if not state["started"]:
+                state["abandoned"] = True
+                _queued -= 1
+        stat["in_flight"] -= 1
+        stat["calls"] += 1
+        if timing:
+            started, finished = timing[0]
+            ran = (finished - started) * 1000
+            stat["run_ms"] += ran
+            stat["wait_ms"] += (started - submitted) * 1000
+            stat["max_ms"] = max(stat["max_ms"], ran)
+
+
+def stats() -> dict:
+    """The pool's state now, and per collection the call count, errors, calls in flight, and
+    average and worst run time plus average wait for a worker, in milliseconds."""
+    collections = {}
+    for name, s in _stats.items():
+        calls = s["calls"] or 1
+        collections[name] = {
+            "calls": s["calls"], "errors": s["errors"], "in_flight": s["in_flight"],
+            "avg_ms": round(s["run_ms"] / calls, 1), "max_ms": round(s["max_ms"], 1),
+            "wait_ms": round(s["wait_ms"] / calls, 1), "total_ms": s["run_ms"],
+        }
+    return {"workers": WORKERS, "running": _running, "queued": _queued,
+            "collections": collections}
+
+
+def shutdown():
+    """Let the calls already running finish and refuse new ones."""
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,168 @@
+"""Short memories of recent messages, kept small and forgotten without anybody sweeping.
+
+AutoMod's flood and repeat rules need to know what each person said lately. That used to be a
+deque of (time, the whole message lowercased) per person, which held every chatter's last
+twelve messages in full, all to compare them for equality, and a loop every ten minutes that
+walked every one of them to find the people who had gone quiet. Both grew with the busiest
+hour rather than with what the rules need. Here:
+
+- History is a fixed ring per person of when each message came and a 64-bit hash of its text,
+  in one array of machine numbers: a few hundred bytes, however long the messages were, where
+  the text itself ran to kilobytes.
+- Echoes is the same idea per channel rather than per person, with who sent each message as
+  well, for the raid check: one thing said by many accounts at once.
+- TimingWheel forgets people a fixed time after they last spoke. Everybody due in the same few
+  seconds shares a slot, a slot is emptied as its time passes, and moving somebody to a later
+  slot when they speak again is a set add and a set discard. Nothing ever scans the lot.
+
+The hashes are Python's own string hash, salted per process. They never leave memory, so that
+is all they need to be, and two different texts sharing one is not worth designing around.
+"""
+
+import math
+from array import array
+from typing import Iterator
+
+MASK = (1 << 64) - 1
+
+
+def digest(text: str) -> int:
+    """A 64-bit hash of some text, as History keeps it. Empty text is 0."""
+    return hash(text) & MASK if text else 0
+
+
+class History:
+    """One person's last `size` messages: when each came, and a hash of what it said.
+
+    Both live in one array, the time in milliseconds then the hash for each message in turn.
+    One array rather than two, since at this size the array's own header is a good part of the
+    cost."""
+
+    __slots__ = ("ring", "pos", "filled", "due")
+
+    def __init__(self, size: int):
+        self.ring = array("Q", [0]) * (2 * size)     # sized exactly, where bytes() over-allocates
+        self.pos = 0
+        self.filled = 0
+        self.due = -1               # the TimingWheel slot it will be forgotten in
+
+    @property
+    def size(self) -> int:
+        return len(self.ring) // 2
+
+    def add(self, at: float, digest: int):
+        i = self.pos
+        self.ring[2 * i] = int(at * 1000)
+        self.ring[2 * i + 1] = digest
+        self.pos = (i + 1) % self.size
+        if self.filled < self.size:
+            self.filled += 1
+
+    def nth_latest(self, n: int) -> float:
+        """When the nth most recent message came (1 is the latest), or -inf if there haven't
+        been that many."""
+        if n < 1 or n > self.filled:
+            return -math.inf
+        return self.ring[2 * ((self.pos - n) % self.size)] / 1000
+
+    def count(self, digest: int) -> int:
+        """How many of the messages held said exactly this. The empty text never counts."""
+        return self.ring[1::2].count(digest) if digest else 0
+
+
+class Echoes:
+    """One channel's last `size` messages: when each came, a hash of it, who sent it and its id.
+
+    Four parallel arrays, so a channel costs a couple of KB however hard it is being raided:
+    the newest message overwrites the oldest. `count` is done in C over the hashes alone, and
+    only once that says enough of them match does anything walk the ring in Python."""
+
+    __slots__ = ("at", "digest", "author", "message", "pos", "filled", "due")
+
+    def __init__(self, size: int):
+        self.at = array("Q", [0]) * size
+        self.digest = array("Q", [0]) * size
+        self.author = array("Q", [0]) * size
+        self.message = array("Q", [0]) * size
+        self.pos = 0
+        self.filled = 0
+        self.due = -1
+
+    def add(self, at: float, digest: int, author: int, message: int):
+        i = self.pos
+        self.at[i] = int(at * 1000)
+        self.digest[i] = digest
+        self.author[i] = author
+        self.message[i] = message
+        self.pos = (i + 1) % len(self.at)
+        if self.filled < len(self.at):
+            self.filled += 1
+
+    def count(self, digest: int) -> int:
+        """How many of the messages held hash to this, however long ago. The empty text never
+        counts."""
+        return self.digest.count(digest) if digest else 0
+
+    def senders(self, digest: int, since: float) -> dict:
+        """Who sent a message hashing to `digest` since `since`, each with the ids of what
+        they sent, oldest first."""
+        out: dict = {}
+        cutoff = since * 1000
+        for n in range(1, self.filled + 1):
+            i = (self.pos - n) % len(self.at)
+            if self.digest[i] == digest and self.at[i] >= cutoff:
+                out.setdefault(self.author[i], []).insert(0, self.message[i])
+        return out
+
+
+class TimingWheel:
+    """Forgets keys `ttl` seconds after they were last touched, give or take one `tick`.
+
+    The caller keeps each key's slot (History.due, for one) and hands it back on every touch,
+    which is what lets a key move to a later slot without the wheel keeping a second map of
+    its own. A key handed back by `expired` is only really gone if `passed` agrees about the
+    slot the caller holds for it: a record replaced under the same key starts out in a slot of
+    its own, and the old slot still names it. One that hasn't passed goes back with `keep`.
+    """
+
+    __slots__ = ("ttl", "tick", "slots", "done")
+
+    def __init__(self, ttl: float, tick: float):
+        self.ttl = ttl
+        self.tick = tick
+        self.slots = [set() for _ in range(math.ceil(ttl / tick) + 2)]
+        self.done = None            # the last slot emptied
+
+    def touch(self, key, due: int, now: float) -> int:
+        """Push `key` back to `ttl` from now. Returns its new slot, to keep for next time."""
+        slot = int((now + self.ttl) // self.tick) + 1
+        if slot != due:
+            if due >= 0:
+                self.slots[due % len(self.slots)].discard(key)
+            self.slots[slot % len(self.slots)].add(key)
+        return slot
+
+    def expired(self, now: float) -> Iterator:
+        """The keys whose time has come since the last call, each once."""
+        current = int(now // self.tick)
+        if self.done is None:
+            self.done = current
+            return
+        # Only as far back as one turn of the wheel: every slot older than that has already
+        # come round again, and emptying it once covers both.
+        start = max(self.done + 1, current - len(self.slots) + 1)
+        for slot in range(start, current + 1):
+            ring = self.slots[slot % len(self.slots)]
+            if ring:
+                self.slots[slot % len(self.slots)] = set()
+                yield from ring
+        self.done = max(self.done, current)
+
+    def passed(self, due: int, now: float) -> bool:
+        return due <= now // self.tick
+
+    def keep(self, key, due: int):
+        self.slots[due % len(self.slots)].add(key)
+
+    def __len__(self) -> int:
+        return sum(map(len, self.slots))
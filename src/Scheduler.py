@@ -0,0 +1,172 @@
+"""Things that have to happen at a particular time, kept in Mongo and run when they're due.
+
+Every timed feature used to be a loop asking Mongo "anything yet?" on a fixed beat: reminders
+every 30 seconds, the midday reminder pass every 10 minutes all day on the off chance it was
+noon. Almost every one of those questions got "no". The pass also went by the host's clock,
+so a server in Sydney had its reminders at whatever noon in the datacentre meant there.
+
+Now a job is a document in `jobs` with a `kind` and a `due` time, and one runner sleeps until
+the earliest one. A job scheduled sooner than that wakes it early. Nothing is asked of Mongo
+while nothing is due, apart from a check every MAX_SLEEP in case another process added
+something.
+
+- A job is deleted the moment it is claimed, before its handler runs. A crash mid-run loses
+  that one job rather than running it twice; reminders have always worked that way, and a
+  job that repeats schedules its next run itself.
+- Only kinds with a handler registered are claimed, so a cog that failed to load leaves its
+  jobs waiting rather than having them thrown away.
+- Handlers run as their own tasks, so a slow one doesn't hold up the next job that is due.
+"""
+
+import asyncio
+import datetime
+from typing import Awaitable, Callable, Optional
+
+import Database
+import Mongo
+
+MAX_SLEEP = 300             # seconds. Also how long a job added by another process can wait.
+RETRY_SECONDS = 30          # after the database didn't answer
+CLAIM_BATCH = 100           # jobs started per wake, so a backlog can't starve everything else
+
+_handlers: dict[str, Callable[[dict], Awaitable]] = {}
+_wake: Optional[asyncio.Event] = None
+_next: Optional[datetime.datetime] = None      # what the runner is sleeping until
+_runner: Optional[asyncio.Task] = None
+_running: set = set()
+stats = {"ran": 0, "failed": 0, "wakeups": 0}
+
+
+def _jobs(bot):
+    return Database.get_bot_database(bot.MongoClient)["jobs"]
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _aware(dt: datetime.datetime) -> datetime.datetime:
+    """pymongo hands back naive UTC; comparing that with an aware time raises."""
+    return dt.replace(tzinfo=datetime.timezone.utc) if dt.tzinfo is None else dt
+
+
+def register(kind: str, handler: Callable[[dict], Awaitable]):
+    """Run `handler(job)` for each job of this kind as it comes due."""
+    _handlers[kind] = handler
+    _nudge(None)
+
+
+def unregister(kind: str):
+    _handlers.pop(kind, None)
+
+
+def _nudge(due: Optional[datetime.datetime]):
+    """Wake the runner if this is sooner than what it's waiting for."""
+    if _wake is not None and (due is None or _next is None or _aware(due) < _next):
+        _wake.set()
+
+
+async def schedule(bot, kind: str, due: datetime.datetime, job_id=None, **fields):
+    """Add a job. With `job_id` it replaces any job already under that id, which is how a
+    repeating job moves itself on. Returns the job's id."""
+    doc = {"kind": kind, "due": due, **fields}
+    jobs = _jobs(bot)
+    if job_id is None:
+        result = await Mongo.run(jobs.insert_one, doc)
+        job_id = result.inserted_id
+    else:
+        await Mongo.run(jobs.replace_one, {"_id": job_id}, doc, upsert=True)
+    _nudge(due)
+    return job_id
+
+
+async def ensure(bot, kind: str, due: datetime.datetime, job_id, **fields) -> bool:
+    """Add a job under `job_id` unless one is already there, which keeps its own time. For
+    repeating jobs at startup. True if it was added."""
+    result = await Mongo.run(_jobs(bot).update_one, {"_id": job_id},
+                             {"$setOnInsert": {"kind": kind, "due": due, **fields}},
+                             upsert=True)
+    added = getattr(result, "upserted_id", None) is not None
+    if added:
+        _nudge(due)
+    return added
+
+
+async def run_due(bot) -> int:
+    """Claim and start every job that is due. Returns how many were started."""
+    jobs = _jobs(bot)
+    started = 0
+    while started < CLAIM_BATCH and _handlers:
+        job = await Mongo.run(jobs.find_one_and_delete,
+                              {"kind": {"$in": list(_handlers)}, "due": {"$lte": _now()}},
+                              sort=[("due", 1)])
+        if job is None:
+            break
+        handler = _handlers.get(job["kind"])
+        if handler is None:
+            continue                # unregistered while we were claiming; nothing to run it
+        task = asyncio.ensure_future(_run_one(handler, job))
+        _running.add(task)
+        task.add_done_callback(_running.discard)
+        started += 1
+    return started
+
+
+async def _run_one(handler, job: dict):
+    try:
+        await handler(job)
+        stats["ran"] += 1
+    except Exception as e:
+        stats["failed"] += 1
+        print(f"[Scheduler] {job.get('kind')} job {job.get('_id')} failed: {e}")
+
+
+async def _next_due(bot) -> Optional[datetime.datetime]:
+    if not _handlers:
+        return None
+    job = await Mongo.run(_jobs(bot).find_one, {"kind": {"$in": list(_handlers)}},
+                          {"due": 1}, sort=[("due", 1)])
+    return _aware(job["due"]) if job else None
+
+
+async def _run(bot):
+    global _next
+    while True:
+        # Cleared before looking, so a job scheduled while we look still wakes us.
+        _wake.clear()
+        try:
+            await run_due(bot)
+            due = await _next_due(bot)
+            delay = MAX_SLEEP if due is None else (due - _now()).total_seconds()
+        except Exception as e:
+            print(f"[Scheduler] couldn't read the jobs: {e}")
+            delay = RETRY_SECONDS
+        delay = max(0.0, min(delay, MAX_SLEEP))
+        _next = _now() + datetime.timedelta(seconds=delay)
+        try:
+            await asyncio.wait_for(_wake.wait(), timeout=delay)
+            stats["wakeups"] += 1
+        except asyncio.TimeoutError:
+            pass
+
+
+async def start(bot):
+    """Start the runner. Called once the bot is ready, since handlers need its cache."""
+    global _wake, _runner
+    try:
+        await Mongo.run(_jobs(bot).create_index, [("kind", 1), ("due", 1)], name="kind_due")
+    except Exception as e:
+        print(f"[Scheduler] index setup failed: {e}")
+    _wake = asyncio.Event()
+    _runner = asyncio.ensure_future(_run(bot))
+
+
+def close():
+    global _runner
+    if _runner is not None:
+        _runner.cancel()
+        _runner = None
+
+
+def status() -> dict:
+    return {"kinds": sorted(_handlers), "next": _next, "running": len(_running), **stats}
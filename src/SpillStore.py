@@ -0,0 +1,485 @@
+"""A size-capped store on local disk, for what MediaLog can no longer keep in memory.
+
+MediaLog holds attachment bytes in memory so a deleted file can be put back, and memory is
+the scarce thing: on a busy bot the cap is reached in minutes, and everything older used to be
+thrown away. Disk is cheap by comparison, so what falls out of memory is written here instead,
+and read back only if its message is deleted. That is a small fraction of everything posted,
+so this is written far more than it is read, and it is laid out for that.
+
+- Records are appended to segment files of SEGMENT_BYTES each, never rewritten. Space comes
+  back a whole segment at a time: the oldest goes once the store is over its cap, and the
+  oldest also goes as soon as every record in it has been read back or has expired.
+- A record carries its own key, time and lengths, so the index is rebuilt by reading the
+  segments through on startup. Nothing else has to be written for the store to survive a
+  restart. A record cut short by a crash is the end of its segment, and is cut off there.
+- Taking a record out appends a small marker saying so, so a restart doesn't bring it back.
+  That is why segments only ever go from the old end: a marker is always newer than what it
+  cancels, so the record is deleted before its marker can be.
+- Bytes several records carry are written once. A caller passes them as Shared, with a key
+  of their own; the first record carrying them writes them as a record under that key, and
+  every record after only names it. A shared record has no age of its own: it stays while
+  any record naming it is indexed and goes, unmarked, with the last of them. A restart
+  rebuilds who names what along with the index, so it reaches the same answer and drops a
+  shared record nothing names any more.
+- Reads go through a memory map of the segment, so a file read back costs a copy of its own
+  bytes rather than holding the segment in memory.
+- Everything touching the files runs on one thread of its own, which keeps appends in order
+  without a lock and keeps the event loop out of disk waits.
+- The index is also written out whole now and then, and on close, as a small file of fixed
+  size rows. A restart loads that and reads only what was appended after it, so starting up
+  costs a read of the index rather than a walk through every record header in gigabytes of
+  segments. The file is removed once loaded: the index it describes stops being true as soon
+  as this run writes anything, and a crash before the next one is written means a full scan,
+  which is slow but never wrong.
+"""
+
+import asyncio
+import json
+import mmap
+import os
+import re
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+SEGMENT_BYTES = 64 * 1024 * 1024
+
+# magic, key, stored_at (unix time), meta length, data length
+_HEADER = struct.Struct("<4sQdII")
+_PUT = b"SPL1"
+_GONE = b"SPLX"
+# The stored_at of a shared record, which doesn't expire by age.
+_FOREVER = float("inf")
+_SEGMENT = re.compile(r"^seg-(\d{8})\.bin$")
+# The saved index: magic, segment count, record count, name count; then (segment, bytes) per
+# segment, (key, segment, offset, meta length, data length, stored_at) per record and
+# (key, shared key) per shared record a record names.
+_INDEX_NAME = "index.bin"
+_INDEX_HEAD = struct.Struct("<4sIII")
+_INDEX_SEGMENT = struct.Struct("<IQ")
+_INDEX_RECORD = struct.Struct("<QIQIId")
+_INDEX_NAMES = struct.Struct("<QQ")
+_INDEX = b"SPI2"
+
+
+@dataclass(frozen=True)
+class Shared:
+    """Bytes that go in a record's blobs by reference: written under `key` by the first record
+    that carries them, and only named by the rest."""
+    key: int
+    data: bytes
+
+
+def _body(meta: dict, blobs: list) -> bytes:
+    """A record's meta as written. A shared blob's length is null, and its key is in
+    `_shared`, in the order they come."""
+    shared = [b.key for b in blobs if isinstance(b, Shared)]
+    if shared:
+        meta = {**meta, "_shared": shared}
+    return json.dumps({**meta, "_lengths": [None if isinstance(b, Shared) else len(b)
+                                            for b in blobs]}).encode()
+
+
+class SpillStore:
+    """Keyed records of a small JSON header plus raw bytes, kept until TTL seconds after
+    their `stored_at` or until the store needs the room, whichever comes first."""
+
+    def __init__(self, path: str, max_bytes: int, ttl: float,
+                 segment_bytes: int = SEGMENT_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.segment_bytes = segment_bytes
+        # key -> (segment, offset of the meta, meta length, data length, stored_at)
+        self._index: dict[int, tuple] = {}
+        self._sizes: dict[int, int] = {}        # segment -> bytes on disk, oldest first
+        # Their total, kept as the sizes change rather than summed when asked: the event loop
+        # asks (for /admin info) while the store's thread is adding and dropping segments, and
+        # iterating the dict then can fail with "dictionary changed size during iteration".
+        # Reading one int is safe from any thread; only the store's thread writes it.
+        self._bytes = 0
+        self._live: dict[int, int] = {}         # segment -> records still in the index
+        # Which shared records each record names, and how many indexed records name each one.
+        self._names: dict[int, tuple] = {}
+        self._named: dict[int, int] = {}
+        self._shared = 0                        # shared records in the index
+        self._maps: dict[int, mmap.mmap] = {}
+        self._segment: Optional[int] = None     # the one being appended to
+        self._file = None
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spill")
+        self._changed = False                   # since the index was last saved
+        self.stats = {"spilled": 0, "taken": 0, "expired": 0, "evicted": 0, "failed": 0,
+                      "shared": 0}
+
+    # These two are read on the event loop while the store's thread changes the index. Each
+    # is a single lookup, which the interpreter does whole, never a walk through the dict.
+    def __contains__(self, key: int) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index) - self._shared
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._io, fn, *args)
+
+    # ── the public half, for the event loop ──────────────────────────
+    async def open(self) -> int:
+        """Rebuild the index from whatever a previous run left. Returns how many records."""
+        return await self._call(self._open)
+
+    async def put(self, key: int, meta: dict, blobs: list, stored_at: float) -> bool:
+        """Append a record. A blob may be Shared, and comes back from `take` as its bytes
+        all the same, or as None if the store needed the room it was in. False if the record
+        couldn't be written, which costs nothing but the record: the caller had already let
+        go of it."""
+        return await self._call(self._put, key, meta, blobs, stored_at)
+
+    async def take(self, key: int) -> Optional[tuple]:
+        """(meta, blobs, stored_at) for a key, removed from the store, or None."""
+        if key not in self._index:
+            return None
+        return await self._call(self._take, key)
+
+    async def discard(self, key: int):
+        if key in self._index:
+            await self._call(self._forget, key)
+
+    async def prune(self) -> int:
+        """Forget everything past its TTL and give back segments nothing points into."""
+        return await self._call(self._prune)
+
+    async def checkpoint(self) -> bool:
+        """Save the index, so the next start doesn't have to rebuild it from the segments."""
+        return await self._call(self._checkpoint)
+
+    async def close(self):
+        await self._call(self._checkpoint)
+        await self._call(self._close)
+        self._io.shutdown(wait=False)
+
+    # ── the files, on the store's own thread ─────────────────────────
+    def _name(self, segment: int) -> str:
+        return os.path.join(self.path, f"seg-{segment:08d}.bin")
+
+    def _open(self) -> int:
+        if not os.path.isdir(self.path):
+            return 0
+        segments = sorted(int(m.group(1)) for m in map(_SEGMENT.match, os.listdir(self.path))
+                          if m)
+        saved = self._load_index(set(segments))
+        for segment in segments:
+            self._sizes[segment] = self._scan(segment, saved.get(segment, 0))
+            self._bytes += self._sizes[segment]
+            self._live.setdefault(segment, 0)
+        # Records only ever go in the newest segment, so after a restart that is a new one
+        # and everything already on disk stays as it was written.
+        self._segment = (segments[-1] + 1) if segments else 0
+        # Shared records whose last reader was taken, or expired, before the restart.
+        for key in [k for k, loc in self._index.items()
+                    if loc[4] == _FOREVER and k not in self._named]:
+            self._unindex(key)
+        self._collect()
+        self._trim()
+        # The saved index was removed as it was read, so the next checkpoint must write one.
+        self._changed = bool(self._sizes)
+        return len(self)
+
+    def _load_index(self, segments: set) -> dict:
+        """Whatever the saved index knows, loaded into this one. Returns segment -> how much
+        of it the saved index already covers; scanning picks up from there."""
+        name = os.path.join(self.path, _INDEX_NAME)
+        try:
+            with open(name, "rb") as f:
+                raw = f.read()
+            os.remove(name)
+        except OSError:
+            return {}
+        try:
+            magic, n_segments, n_records, n_names = _INDEX_HEAD.unpack_from(raw, 0)
+            if magic != _INDEX:
+                return {}
+            pos = _INDEX_HEAD.size
+            covered = {}
+            for segment, size in _INDEX_SEGMENT.iter_unpack(
+                    raw[pos:pos + n_segments * _INDEX_SEGMENT.size]):
+                covered[segment] = size
+            pos += n_segments * _INDEX_SEGMENT.size
+            records = list(_INDEX_RECORD.iter_unpack(
+                raw[pos:pos + n_records * _INDEX_RECORD.size]))
+            pos += n_records * _INDEX_RECORD.size
+            pairs = list(_INDEX_NAMES.iter_unpack(raw[pos:pos + n_names * _INDEX_NAMES.size]))
+        except struct.error:
+            return {}
+        if len(covered) != n_segments or len(records) != n_records or len(pairs) != n_names:
+            return {}
+        names: dict[int, list] = {}
+        for key, shared in pairs:
+            names.setdefault(key, []).append(shared)
+        # A segment shorter than the index remembers it was changed behind our back, and one
+        # that is gone took its records with it. Both are scanned or dropped instead.
+        for segment, size in list(covered.items()):
+            if segment not in segments or os.path.getsize(self._name(segment)) < size:
+                del covered[segment]
+        cutoff = time.time() - self.ttl
+        for key, segment, offset, meta_len, data_len, stored_at in records:
+            if segment in covered and stored_at >= cutoff:
+                self._add(key, (segment, offset, meta_len, data_len, stored_at),
+                          tuple(names.get(key, ())))
+        return covered
+
+    def _checkpoint(self) -> bool:
+        if not self._changed or not self._sizes:
+            return False
+        pairs = [(key, shared) for key, names in self._names.items() for shared in names]
+        rows = [_INDEX_HEAD.pack(_INDEX, len(self._sizes), len(self._index), len(pairs))]
+        rows += [_INDEX_SEGMENT.pack(segment, size) for segment, size in self._sizes.items()]
+        rows += [_INDEX_RECORD.pack(key, *loc) for key, loc in self._index.items()]
+        rows += [_INDEX_NAMES.pack(*pair) for pair in pairs]
+        name = os.path.join(self.path, _INDEX_NAME)
+        try:
+            # Written aside and moved into place, so a crash mid-write leaves the old one.
+            with open(name + ".tmp", "wb") as f:
+                f.write(b"".join(rows))
+            os.replace(name + ".tmp", name)
+        except OSError as e:
+            print(f"[SpillStore] couldn't save the index in {self.path}: {e}")
+            return False
+        self._changed = False
+        return True
+
+    def _scan(self, segment: int, pos: int = 0) -> int:
+        """Index one segment from `pos` on. Returns how much of it is whole records."""
+        name = self._name(segment)
+        size = os.path.getsize(name)
+        cutoff = time.time() - self.ttl
+        with open(name, "rb") as f:
+            while pos + _HEADER.size <= size:
+                f.seek(pos)
+                magic, key, stored_at, meta_len, data_len = _HEADER.unpack(
+                    f.read(_HEADER.size))
+                end = pos + _HEADER.size + meta_len + data_len
+                if magic not in (_PUT, _GONE) or end > size:
+                    break
+                if magic == _GONE:
+                    self._unindex(key)
+                elif stored_at >= cutoff:
+                    self._add(key, (segment, pos + _HEADER.size, meta_len, data_len, stored_at),
+                              self._names_in(f.read(meta_len)))
+                pos = end
+        if pos < size:
+            # A write the process didn't live to finish. Everything before it is sound.
+            with open(name, "r+b") as f:
+                f.truncate(pos)
+        return pos
+
+    @staticmethod
+    def _names_in(body: bytes) -> tuple:
+        """The shared records a record's meta names. Most name none, and aren't parsed."""
+        if b'"_shared"' not in body:
+            return ()
+        try:
+            return tuple(set(json.loads(body)["_shared"]))
+        except (ValueError, KeyError, TypeError):
+            return ()
+
+    def _add(self, key: int, loc: tuple, names: tuple = ()):
+        """Index a record in place of any older one under its key. What it names is counted
+        before the older one lets go, so bytes both of them name stay put."""
+        for shared in names:
+            self._named[shared] = self._named.get(shared, 0) + 1
+        self._unindex(key)
+        self._index[key] = loc
+        self._live[loc[0]] = self._live.get(loc[0], 0) + 1
+        self._shared += loc[4] == _FOREVER
+        if names:
+            self._names[key] = names
+        self._changed = True
+
+    def _unindex(self, key: int) -> Optional[tuple]:
+        loc = self._index.pop(key, None)
+        if loc is not None:
+            self._live[loc[0]] -= 1
+            self._shared -= loc[4] == _FOREVER
+            self._changed = True
+        for shared in self._names.pop(key, ()):
+            self._named[shared] -= 1
+            if self._named[shared] <= 0:
+                del self._named[shared]
+                # No marker needed: a restart finds nothing naming it either, and drops it.
+                self._unindex(shared)
+        return loc
+
+    def _append(self, magic: bytes, key: int, stored_at: float, meta: bytes, blobs: list):
+        size = _HEADER.size + len(meta) + sum(len(b) for b in blobs)
+        if self._file is None or (self._sizes[self._segment] and
+                                  self._sizes[self._segment] + size > self.segment_bytes):
+            self._roll()
+        offset = self._sizes[self._segment]
+        self._file.write(_HEADER.pack(magic, key, stored_at, len(meta),
+                                      size - _HEADER.size - len(meta)))
+        self._file.write(meta)
+        for blob in blobs:
+            self._file.write(blob)
+        self._file.flush()
+        self._sizes[self._segment] += size
+        self._bytes += size
+        return self._segment, offset + _HEADER.size
+
+    def _roll(self):
+        if self._file is not None:
+            self._file.close()
+            self._segment += 1
+        elif self._segment is None:
+            self._segment = 0
+        os.makedirs(self.path, exist_ok=True)
+        self._file = open(self._name(self._segment), "ab")
+        self._sizes[self._segment] = 0
+        self._live.setdefault(self._segment, 0)
+        self._collect()
+
+    def _put(self, key, meta, blobs, stored_at) -> bool:
+        names = [b.key for b in blobs if isinstance(b, Shared)]
+        # Shared bytes not on disk yet go first, as records of their own.
+        fresh = {b.key: [b.data] for b in blobs
+                 if isinstance(b, Shared) and b.key not in self._index}
+        writes = [(k, _FOREVER, _body({}, data), data) for k, data in fresh.items()]
+        writes.append((key, stored_at, _body(meta, blobs),
+                       [b for b in blobs if not isinstance(b, Shared)]))
+        if sum(_HEADER.size + len(body) + sum(len(b) for b in data)
+               for _k, _at, body, data in writes) > self.max_bytes:
+            return False
+        written = []
+        try:
+            for k, at, body, data in writes:
+                segment, offset = self._append(_PUT, k, at, body, data)
+                written.append((k, (segment, offset, len(body), sum(len(b) for b in data), at)))
+        except OSError as e:
+            # Shared bytes written before the failure are named by nothing, so they are left
+            # out of the index and a restart drops them too.
+            self.stats["failed"] += 1
+            print(f"[SpillStore] couldn't write to {self.path}: {e}")
+            return False
+        for k, loc in written[:-1]:
+            self._add(k, loc)
+        self._add(key, written[-1][1], tuple(set(names)))
+        self.stats["spilled"] += 1
+        self.stats["shared"] += len(names) - len(fresh)
+        self._trim()
+        return True
+
+    def _forget(self, key: int) -> Optional[tuple]:
+        """Out of the index, with a marker so a restart agrees."""
+        loc = self._unindex(key)
+        if loc is None:
+            return None
+        try:
+            self._append(_GONE, key, 0.0, b"", [])
+        except OSError:
+            pass                    # it comes back after a restart, and expires from there
+        self._collect()
+        return loc
+
+    def _take(self, key: int) -> Optional[tuple]:
+        loc = self._index.get(key)
+        if loc is None:
+            return None
+        segment, offset, meta_len, data_len, stored_at = loc
+        if stored_at < time.time() - self.ttl:
+            self._forget(key)
+            self.stats["expired"] += 1
+            return None
+        try:
+            view = self._map(segment, offset + meta_len + data_len)
+            meta = json.loads(view[offset:offset + meta_len])
+            shared = iter(meta.pop("_shared", ()))
+            blobs, pos = [], offset + meta_len
+            for n in meta.pop("_lengths"):
+                if n is None:
+                    blobs.append(self._read_shared(next(shared)))
+                    continue
+                blobs.append(view[pos:pos + n])
+                pos += n
+        except (OSError, ValueError) as e:
+            self.stats["failed"] += 1
+            print(f"[SpillStore] couldn't read {key} back: {e}")
+            self._forget(key)
+            return None
+        self._forget(key)
+        self.stats["taken"] += 1
+        return meta, blobs, stored_at
+
+    def _read_shared(self, key: int) -> Optional[bytes]:
+        """A shared record's bytes, left where they are for whoever else names them. None
+        once the cap has taken the segment they were in."""
+        loc = self._index.get(key)
+        if loc is None:
+            return None
+        segment, offset, meta_len, data_len, _stored_at = loc
+        view = self._map(segment, offset + meta_len + data_len)
+        return view[offset + meta_len:offset + meta_len + data_len]
+
+    def _map(self, segment: int, need: int) -> mmap.mmap:
+        view = self._maps.get(segment)
+        # The segment being appended to grows under an existing map, so that one is mapped
+        # again whenever a record lies past its end.
+        if view is None or len(view) < need:
+            if view is not None:
+                view.close()
+            with open(self._name(segment), "rb") as f:
+                view = self._maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return view
+
+    def _collect(self):
+        """Delete sealed segments from the old end for as long as nothing points into them."""
+        for segment in list(self._sizes):
+            if segment == self._segment or self._live.get(segment, 0) > 0:
+                return
+            self._delete(segment)
+
+    def _delete(self, segment: int):
+        view = self._maps.pop(segment, None)
+        if view is not None:
+            view.close()
+        for key in [k for k, loc in self._index.items() if loc[0] == segment]:
+            if self._unindex(key) is not None:
+                self.stats["evicted"] += 1
+        self._bytes -= self._sizes.pop(segment, 0)
+        self._live.pop(segment, None)
+        try:
+            os.remove(self._name(segment))
+        except OSError:
+            pass
+
+    def _trim(self):
+        """Oldest segment first until back under the cap. Never the one being written."""
+        while self.bytes > self.max_bytes:
+            oldest = next((s for s in self._sizes if s != self._segment), None)
+            if oldest is None:
+                break
+            self._delete(oldest)
+        # A segment going can leave shared bytes in a newer one that nothing names any more.
+        self._collect()
+
+    def _prune(self) -> int:
+        cutoff = time.time() - self.ttl
+        old = [k for k, loc in self._index.items() if loc[4] < cutoff]
+        for key in old:
+            self._unindex(key)
+        self.stats["expired"] += len(old)
+        # No markers needed: a restart applies the same TTL to what it reads.
+        self._collect()
+        return len(old)
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        for view in self._maps.values():
+            view.close()
+        self._maps.clear()
@@ -0,0 +1,132 @@
+"""Small previews of files too large for MediaLog to keep.
+
+MediaLog keeps nothing over MAX_FILE_BYTES, and those are mostly phone photos and screen
+recordings, which are exactly what a moderator wants to see once they're deleted. A picture a
+screen wide is a few hundred KB whatever the original weighed, so that is kept instead.
+
+Making one is the opposite of what the bot is built for: a large download, then a decode that
+is all CPU. So it happens in worker processes, and the event loop only waits for the result.
+A worker never holds the original in memory either:
+
+- an image is streamed to a temporary file that stays in memory only while it is small, and
+  JPEGs are decoded at a fraction of their size (Pillow's draft mode), so a 50 MB photo costs
+  a few MB of memory rather than the hundreds a full decode would
+- a video is handed to ffmpeg by url, and ffmpeg fetches only the parts it needs to reach the
+  first frame, which is usually the first few hundred KB
+
+Pillow is in requirements.txt, so image previews work wherever the bot is installed from it.
+ffmpeg is a program rather than a Python package, so pip can't provide it: install it on the
+host (the distribution's package, or an ffmpeg buildpack where the Procfile runs) for video
+previews. The bot says at startup when it is missing. Both are still optional. Without Pillow
+images go through ffmpeg too; without ffmpeg there are no video previews; with neither there
+are no previews, and MediaLog logs the file by name as it always has. Previews are always
+JPEG, which every Discord client draws inline.
+
+The workers are the pool shared with ImageHash (see Workers), which are never forked from the
+bot itself.
+"""
+
+import io
+import shutil
+import subprocess
+import tempfile
+import urllib.request
+from typing import Optional
+
+import Workers
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+FFMPEG = shutil.which("ffmpeg")
+
+EDGE = 1280                     # longest side of a preview, in pixels
+QUALITY = 80
+MAX_PIXELS = 100_000_000        # an image claiming more than this is refused unread
+CHUNK = 256 * 1024
+SPOOL_MEMORY = 2 * 1024 * 1024  # past this a streamed image goes to a temporary file
+TIMEOUT = 30                    # seconds, for the download and for ffmpeg each
+CONTENT_TYPE = "image/jpeg"
+_AGENT = {"User-Agent": "DiscordBot (MediaLog preview)"}
+
+
+def can_preview(kind: str) -> bool:
+    """Whether this machine has what it takes to preview an "image" or a "video"."""
+    if kind == "image":
+        return Image is not None or FFMPEG is not None
+    if kind == "video":
+        return FFMPEG is not None
+    return False
+
+
+def pool(workers: int) -> Optional[Workers.Share]:
+    """A share of the worker processes, or None when previews can't be made here at all."""
+    if workers <= 0:
+        return None
+    if FFMPEG is None:
+        print("[Thumbnails] no ffmpeg on PATH, so videos get no preview"
+              + ("" if Image is not None else ", and without Pillow neither do images"))
+    if not (can_preview("image") or can_preview("video")):
+        return None
+    return Workers.pool("previews", workers)
+
+
+def preview_name(filename: str) -> str:
+    stem = filename.rsplit(".", 1)[0] if "." in filename else filename
+    return f"{stem or 'file'}.preview.jpg"
+
+
+# ── in the worker process ────────────────────────────────────────────
+def make(url: str, kind: str, max_bytes: int) -> Optional[bytes]:
+    """A JPEG preview of whatever is at `url`, or None if it can't be made.
+
+    `max_bytes` caps how much of an image is read. Videos have no cap of their own, since
+    ffmpeg stops reading at the first frame.
+    """
+    if kind == "video":
+        return _ffmpeg(url) if FFMPEG else None
+    if kind != "image":
+        return None
+    if Image is None:
+        return _ffmpeg(url) if FFMPEG else None
+    return _pillow(url, max_bytes)
+
+
+def _pillow(url: str, max_bytes: int) -> Optional[bytes]:
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY) as spool:
+        request = urllib.request.Request(url, headers=_AGENT)
+        with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+            read = 0
+            while chunk := response.read(CHUNK):
+                read += len(chunk)
+                if read > max_bytes:
+                    return None
+                spool.write(chunk)
+        spool.seek(0)
+        with Image.open(spool) as img:
+            # Only the header has been read so far, so a decompression bomb stops here.
+            if img.width * img.height > MAX_PIXELS:
+                return None
+            # JPEG only: decode straight to the nearest 1/2, 1/4 or 1/8 scale at or above the
+            # target, which is where the memory saving comes from. A no-op for other formats.
+            img.draft("RGB", (EDGE, EDGE))
+            img = ImageOps.exif_transpose(img)       # phone photos are stored sideways
+            img.thumbnail((EDGE, EDGE))
+            out = io.BytesIO()
+            img.convert("RGB").save(out, "JPEG", quality=QUALITY, optimize=True)
+            return out.getvalue()
+
+
+def _ffmpeg(url: str) -> Optional[bytes]:
+    fit = (f"scale=w='min(iw,{EDGE})':h='min(ih,{EDGE})'"
+           ":force_original_aspect_ratio=decrease")
+    try:
+        done = subprocess.run(
+            [FFMPEG, "-nostdin", "-loglevel", "error", "-i", url, "-frames:v", "1", "-vf", fit,
+             "-f", "image2pipe", "-c:v", "mjpeg", "-q:v", "4", "-"],
+            capture_output=True, timeout=TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return None
+    return done.stdout if done.returncode == 0 and done.stdout else None
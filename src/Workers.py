@@ -0,0 +1,71 @@
+"""The worker processes MediaLog's previews and the image spam filter's hashes run in.
+
+Both are a decode that is all CPU, so both happen outside the bot's process, and they share one
+pool rather than each keeping its own: a guild posting a burst of large images needs hashes and
+previews at the same moment, and two pools would sit half idle the rest of the time. Each asks
+for a share with `pool(name, workers)` and the pool is sized to what all of them asked for. It
+is made on the first submit, so a bot nobody uploads a file to never starts a process.
+
+Workers are never forked from the bot. By the time the first file arrives the bot is running a
+dozen threads (pymongo's monitors, Mongo's pool, ConfigFeed and SpillStore's IO thread), and a
+fork copies whatever locks those held at that instant into a child that has none of the threads
+to release them. They come from a fork server instead, a clean process started before any of
+that and forked from, or on platforms without one are spawned. Either way a worker begins by
+importing the bot's main script, which is why main.py only starts the bot under
+`if __name__ == "__main__"`.
+"""
+
+import multiprocessing
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Optional
+
+START_METHOD = ("forkserver" if "forkserver" in multiprocessing.get_all_start_methods()
+                else "spawn")
+
+_shares: set = set()
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+class Share(Executor):
+    """One caller's part of the pool. Used like any executor; shutting it down gives the share
+    back, and cancels what it alone had waiting, without touching anybody else's work."""
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self._futures: set = set()
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        future = _executor().submit(fn, *args, **kwargs)
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+        return future
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        global _pool
+        if cancel_futures:
+            for future in list(self._futures):
+                future.cancel()
+        _shares.discard(self)
+        if not _shares and _pool is not None:
+            _pool.shutdown(wait=wait, cancel_futures=cancel_futures)
+            _pool = None
+
+
+def pool(name: str, workers: int) -> Optional[Share]:
+    """A share of `workers` processes' worth of the pool, or None for 0."""
+    if workers <= 0:
+        return None
+    share = Share(name, workers)
+    _shares.add(share)
+    return share
+
+
+def _executor() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=sum(s.workers for s in _shares) or 1,
+            mp_context=multiprocessing.get_context(START_METHOD))
+    return _pool
+
@@ -0,0 +1,192 @@
+"""Event records written in batches rather than one round trip each.
+
+A join writes a membership spell and then patches the invite onto it, a survey reminder writes
+a ping event, every moderation action writes a case, and the reminder pass marks every cohort
+it reached. Each of those used to be its own call
+to Mongo, which is fine at one a minute and is hundreds a second during a raid: every join a
+round trip for the insert and another for the invite, all queued for the same database pool.
+
+None of them has to be on disk before the handler moves on, so they are queued here and
+written together: one `bulk_write` per collection, once a batch fills or a second after the
+first write was queued, whichever comes first. The batch is unordered, so one bad write costs
+only itself and not everything queued after it. That also means nothing queued may depend on
+another queued write: a record whose id is handed out, a case number or a membership spell,
+is written with an awaited `insert_one`, and only what patches it afterwards comes through here.
+
+A batch that fails outright, because the server is unreachable or stepping down, goes back on
+the front of its queue and is tried again a little later, up to RETRIES times in a row. Writes
+the server refused one by one are counted and dropped; trying them again would get the same
+answer.
+
+The queue is bounded. Once MAX_PENDING writes are queued or on their way out, across every
+collection, the next caller waits for everything queued to be written before adding its own,
+rather than anything being dropped, which slows a raid down instead of losing it. Anything
+that reads these collections and needs its own latest writes calls `flush(collection)` first,
+and the bot flushes everything on the way out.
+
+Ids are made here rather than by the server, so `insert` can hand one back straight away.
+"""
+
+import asyncio
+import os
+
+from bson import ObjectId
+
+import Mongo
+
+BATCH = 500                 # writes per bulk_write
+FLUSH_SECONDS = 1.0         # longest a queued write waits when nothing else is pushing it out
+MAX_PENDING = int(os.environ.get("WRITE_BEHIND_MAX") or 5000)   # across every collection
+RETRIES = 3                 # failed batches in a row before a collection's queue is given up
+
+# collection key -> {"collection", "ops", "lock", "timer", "failures"}
+_queues: dict[str, dict] = {}
+_pending = 0
+_tasks: set = set()
+_stats = {"queued": 0, "written": 0, "batches": 0, "failed": 0, "waited": 0, "retried": 0}
+
+
+def _key(collection) -> str:
+    return getattr(collection, "full_name", None) or collection.name
+
+
+def _queue(collection) -> dict:
+    key = _key(collection)
+    q = _queues.get(key)
+    if q is None:
+        q = _queues[key] = {"collection": collection, "ops": [], "lock": asyncio.Lock(),
+                            "timer": None, "failures": 0}
+    return q
+
+
+async def insert(collection, doc: dict):
+    """Queue an insert and return the document's `_id`."""
+    doc.setdefault("_id", ObjectId())
+    await _add(collection, ("insert", doc))
+    return doc["_id"]
+
+
+async def update(collection, query: dict, ops: dict, upsert: bool = False):
+    """Queue an update_one. Nothing comes back: there is nothing to report yet."""
+    await _add(collection, ("update", query, ops, upsert))
+
+
+async def update_many(collection, query: dict, ops: dict):
+    """Queue an update_many."""
+    await _add(collection, ("update_many", query, ops, False))
+
+
+async def _add(collection, op: tuple):
+    global _pending
+    if _pending >= MAX_PENDING:
+        # Full. Everything is written now, not just this collection: a quiet collection
+        # holding most of the queue would otherwise never make room for a busy one.
+        _stats["waited"] += 1
+        while _pending >= MAX_PENDING:
+            await flush()
+    # Nothing is awaited between the check and the append, so however many callers were
+    # waiting, each adds its write only while there is room for it.
+    q = _queue(collection)
+    q["ops"].append(op)
+    _pending += 1
+    _stats["queued"] += 1
+    if len(q["ops"]) >= BATCH:
+        _spawn(collection)
+    elif q["timer"] is None:
+        q["timer"] = asyncio.get_running_loop().call_later(
+            FLUSH_SECONDS, _spawn, collection)
+
+
+def _spawn(collection):
+    task = asyncio.ensure_future(flush(collection))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+def _write(collection, ops: list):
+    # Imported here so importing this module doesn't need pymongo's request types.
+    import pymongo
+    requests = []
+    for kind, *args in ops:
+        if kind == "insert":
+            requests.append(pymongo.InsertOne(*args))
+        elif kind == "update":
+            requests.append(pymongo.UpdateOne(args[0], args[1], upsert=args[2]))
+        else:
+            requests.append(pymongo.UpdateMany(args[0], args[1], upsert=args[2]))
+    return collection.bulk_write(requests, ordered=False)
+
+
+async def flush(collection=None):
+    """Write what is queued, for one collection or all of them. Returns once everything that
+    was queued before the call is written, has failed, or is back in the queue for a retry."""
+    if collection is None:
+        for q in list(_queues.values()):
+            await flush(q["collection"])
+        return
+
+    global _pending
+    q = _queue(collection)
+    # Held across the write, so two flushes of one collection can't overtake each other.
+    async with q["lock"]:
+        if q["timer"] is not None:
+            q["timer"].cancel()
+            q["timer"] = None
+        ops, q["ops"] = q["ops"], []
+        if not ops:
+            return
+        settled = len(ops)
+        try:
+            await Mongo.run_for(collection, _write, collection, ops)
+            _stats["written"] += len(ops)
+            q["failures"] = 0
+        except Exception as e:
+            details = getattr(e, "details", None)
+            if details is not None:
+                # A BulkWriteError: the batch went through, and the server refused some of
+                # its writes, each for a reason of its own. The rest are written.
+                refused = len(details.get("writeErrors") or ())
+                _stats["written"] += len(ops) - refused
+                _stats["failed"] += refused
+                q["failures"] = 0
+                print(f"[WriteBehind] {refused} write(s) to {_key(collection)} refused: {e}")
+            elif q["failures"] < RETRIES:
+                # Nothing came back, so as far as we know nothing was written. Back on the
+                # front of the queue, ahead of anything queued meanwhile, and tried again
+                # once the server has had a moment.
+                q["failures"] += 1
+                q["ops"][:0] = ops
+                settled = 0
+                _stats["retried"] += len(ops)
+                if q["timer"] is None:
+                    q["timer"] = asyncio.get_running_loop().call_later(
+                        FLUSH_SECONDS * 2 ** q["failures"], _spawn, collection)
+                print(f"[WriteBehind] {len(ops)} write(s) to {_key(collection)} will be "
+                      f"retried ({q['failures']}/{RETRIES}): {e}")
+            else:
+                q["failures"] = 0
+                _stats["failed"] += len(ops)
+                print(f"[WriteBehind] gave up on {len(ops)} write(s) to {_key(collection)} "
+                      f"after {RETRIES} retries: {e}")
+        finally:
+            # Counted until written or given up, so what is in flight or waiting for a retry
+            # still holds its place under the cap.
+            _pending -= settled
+        _stats["batches"] += 1
+
+
+async def close():
+    """Write everything still queued. Called on shutdown, after the cogs have unloaded.
+    There is no later to retry in, so a failing batch is tried again at once until it is
+    written or RETRIES runs out."""
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    while _pending:
+        await flush()
+    for q in _queues.values():
+        if q["timer"] is not None:
+            q["timer"].cancel()
+            q["timer"] = None
+
+
+def stats() -> dict:
+    return {"pending": _pending, "max_pending": MAX_PENDING, **_stats}
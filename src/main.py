@@ -3,9 +3,17 @@ from discord import app_commands
 from discord.ext import commands, tasks
 import os
 from dotenv import load_dotenv
+# Before the bot's own modules, several of which read their settings as they are imported,
+# and before the shard plan below picks the client class.
+load_dotenv()
+import AuditTail
+import ConfigFeed
 import Database
 import ErrorLog
 import GuildConfig
+import Mongo
+import Scheduler
+import WriteBehind
 from Brand import MINT
 from pymongo import MongoClient
 import certifi
@@ -18,6 +26,79 @@ import traceback
 # after a few missed beats, so this also sets how quickly an outage shows up.
 HEARTBEAT_SECONDS = 60
 
+# Cohorts reminded at once. Each is a send and a delete in its own channel, and discord.py
+# already queues requests per route bucket and for the global limit; this keeps the pass well
+# under 50 requests a second so it never leans on the global one.
+REMIND_CONCURRENCY = 10
+
+# The reminder pass runs at midday in each server's own timezone, and goes again every ten
+# minutes until two o'clock while anything failed, as the old midday loop did.
+COHORT_HOUR = 12
+COHORT_UNTIL_HOUR = 14
+COHORT_RETRY_MINUTES = 10
+DEFAULT_TIMEZONE = GuildConfig.DEFAULT_TIMEZONE
+_zone = GuildConfig.zone
+
+
+def next_cohort_pass(timezone: str, after: datetime.datetime, catch_up: bool = False):
+    """The next midday in `timezone` after `after`, in UTC. With `catch_up`, inside the midday
+    window counts as now, so a bot started at half twelve still reminds today."""
+    local = after.astimezone(_zone(timezone))
+    if catch_up and COHORT_HOUR <= local.hour < COHORT_UNTIL_HOUR:
+        return after
+    noon = local.replace(hour=COHORT_HOUR, minute=0, second=0, microsecond=0)
+    if noon <= local:
+        # Wall clock arithmetic, so a DST change overnight still lands on twelve o'clock.
+        noon += datetime.timedelta(days=1)
+    return noon.astimezone(datetime.timezone.utc)
+
+
+def shard_plan(count=None, ids=None):
+    """(shard_count, shard_ids) for AutoShardedBot, from SHARD_COUNT and SHARD_IDS.
+
+    None when SHARD_COUNT is unset, which keeps the plain unsharded client the bot always ran
+    as. "auto" asks Discord how many it recommends. SHARD_IDS ("0-3" or "0,2,4") runs only
+    those shards in this process, so a big bot can be split over several processes that each
+    run one range of the same count; that needs the count spelled out, or two processes could
+    each decide differently what shard 3 is. A mistake here stops the bot rather than quietly
+    running the wrong shards, because two processes both connecting as shard 0 is worse than
+    neither.
+    """
+    raw = str(count or "").strip().lower()
+    if not raw and not str(ids or "").strip():
+        return None
+    if raw == "auto" or not raw:
+        total = None
+    elif raw.isdigit() and int(raw) > 0:
+        total = int(raw)
+    else:
+        raise ValueError(f"SHARD_COUNT must be a number or 'auto', not {count!r}")
+
+    if not str(ids or "").strip():
+        return total, None
+    if total is None:
+        raise ValueError("SHARD_IDS needs SHARD_COUNT set to a number")
+    chosen = set()
+    for part in str(ids).split(","):
+        first, dash, last = part.strip().partition("-")
+        if not first.isdigit() or (dash and not last.isdigit()):
+            raise ValueError(f"SHARD_IDS can't be read: {ids!r}")
+        chosen.update(range(int(first), int(last or first) + 1))
+    if max(chosen) >= total:
+        raise ValueError(f"SHARD_IDS {ids!r} goes past SHARD_COUNT {total}")
+    return total, sorted(chosen)
+
+
+SHARDING = shard_plan(os.environ.get("SHARD_COUNT"), os.environ.get("SHARD_IDS"))
+
+
+def _ms(latency):
+    """A gateway latency in milliseconds. None until the first heartbeat arrives, and inf
+    (also None here) if the socket is gone."""
+    if latency and latency == latency and latency != float("inf"):
+        return round(latency * 1000)
+    return None
+
 
 def _as_id(raw):
     """A snowflake from the environment, or None. A typo becomes off rather than a crash."""
@@ -56,21 +137,7 @@ def _option_text(opt) -> str:
     return f"{name}={value}"
 
 
-async def loop(bot):
-    t = 10 * 60
-
-    while True:
-        now = datetime.datetime.now()
-        # Check if current time is within 12 PM (noon) to 1:59 PM
-        if not (12 <= now.hour < 14):
-            await asyncio.sleep(t)
-            continue
-
-        await bot.mention_players()
-        await asyncio.sleep(t)
-
-
-class Bot(commands.Bot):
+class Bot(commands.AutoShardedBot if SHARDING else commands.Bot):
     def __init__(self):
         # Declared explicitly instead of Intents.all(). Everything switched on below is read
         # by something; everything left off (typing, reactions, voice states, invites,
@@ -106,7 +173,13 @@ class Bot(commands.Bot):
 
         # Larger message cache so a deleted message still carries its author/content even
         # when MediaLog no longer holds the file bytes.
-        super().__init__(command_prefix="!", intents=intents, max_messages=5000)
+        #
+        # With SHARD_COUNT set this is the sharded client instead, and the cache is per process
+        # like everything else the bot holds in memory: MediaLog's files, invite counts, the
+        # settings cache. Each is filled only by this process's own shards, and that is all
+        # that ever asks it about them, since a guild's events always arrive on its own shard.
+        sharding = {"shard_count": SHARDING[0], "shard_ids": SHARDING[1]} if SHARDING else {}
+        super().__init__(command_prefix="!", intents=intents, max_messages=5000, **sharding)
         # Permissions are declared per command rather than gated globally. A single
         # manage_guild gate over everything meant moderators (who typically hold
         # kick/ban/timeout but not Manage Server) couldn't run moderation commands, and
@@ -152,7 +225,12 @@ class Bot(commands.Bot):
         # Cogs that wouldn't load. Collected during setup and reported once the
         # gateway is up, because there is no channel to post to before that.
         self._failed_cogs = []
+        self.config_feed = None
         self.start_time = datetime.datetime.now(datetime.timezone.utc)
+        # The newest dashboard flag the edit poll has acted on, and the guilds flagged at that
+        # very moment, so one flagged in the same millisecond after the read isn't skipped.
+        # Anything older than this process was flagged before it had cached anything.
+        self._flags_seen = (self.start_time, set())
 
         # Optional: the guild that owner-only /admin commands are registered to, so they
         # stay invisible everywhere else. Unset means they register globally instead.
@@ -168,10 +246,6 @@ class Bot(commands.Bot):
             guild_id=_as_id(os.environ.get("ERROR_GUILD_ID")
                             or os.environ.get("OWNER_GUILD_ID")))
 
-    async def _db(self, fn, *args, **kwargs):
-        """pymongo is synchronous, so keep it off the event loop."""
-        return await asyncio.to_thread(lambda: fn(*args, **kwargs))
-
     async def on_interaction(self, interaction: discord.Interaction):
         """One line per command run, so the Heroku log says what the bot is being asked to do.
 
@@ -263,12 +337,19 @@ class Bot(commands.Bot):
         except Exception as e:
             print(f"[LOG ERROR] Failed to send log: {e}")
 
-    async def mention_players(self, days: int = 8, guild_id: int = None, cleanup: bool = True):
+    async def mention_players(self, days: int = 8, guild_id: int = None, cleanup: bool = True,
+                              timezone: str = None):
         """Remind the cohort that joined `days` ago.
 
         `guild_id` scopes it to one server. The scheduled midday pass leaves it None so every
         server gets its reminders, but /forcesurvey passes its own guild: without that, one admin
-        running the command would fire reminders in every server the bot is in.
+        running the command would fire reminders in every server the bot is in. `timezone`
+        scopes it to the servers whose midday it is; the scheduled pass runs once per zone.
+
+        Cohorts are reminded REMIND_CONCURRENCY at a time rather than one after another, and
+        from the gateway's cache: the guild and channel are already in memory, and fetching
+        them again was two extra REST calls per cohort, on the same rate limits as the send.
+        The marks afterwards are queued and written as one batch per collection.
 
         Returns a summary so the caller can say what actually happened instead of guessing.
         """
@@ -279,111 +360,90 @@ class Bot(commands.Bot):
         summary = {"date": None, "found": 0, "pinged": 0, "already": 0,
                    "no_channel": 0, "failed": 0, "cleaned": 0}
 
-        wantedDate = (datetime.datetime.now() - datetime.timedelta(days=days)).date()
+        # The calendar of the zone the pass is for, the same one the cohorts were stamped
+        # with. /forcesurvey has no zone of its own, so it takes its server's.
+        if timezone is None:
+            timezone_for_dates = (await self._timezone_of(guild_id) if guild_id is not None
+                                  else DEFAULT_TIMEZONE)
+        else:
+            timezone_for_dates = timezone
+        wantedDate = GuildConfig.local_date(timezone_for_dates, days)
         summary["date"] = str(wantedDate)
 
         query = {"date": str(wantedDate)}
         if guild_id is not None:
             query["guild_id"] = guild_id
 
-        objects_to_mention = await self._db(lambda: list(roles_collection.find(query)))
+        objects_to_mention = await Mongo.run_for(
+            roles_collection, lambda: list(roles_collection.find(query)))
+        if timezone is not None:
+            objects_to_mention = [obj for obj in objects_to_mention
+                                  if await self._timezone_of(obj["guild_id"]) == timezone]
         summary["found"] = len(objects_to_mention)
-        for obj in objects_to_mention:
-            if obj.get("mentioned"):
-                summary["already"] += 1
-                continue
-            print(f"Found unmentioned role for date {obj['date']} in guild {obj['guild_id']}!")
-
-            guild = await self.fetch_guild(obj["guild_id"])
-            if not guild:
-                print(f"Guild {obj['guild_id']} not found or bot isn't in it.")
-                summary["failed"] += 1
-                continue
-
-            server_data = await GuildConfig.get(self, obj["guild_id"])
-            if not server_data or "discovery_channel" not in server_data:
-                print(f'Could not find server data or discovery channel for guild {obj["guild_id"]}')
-                summary["no_channel"] += 1
-                continue
-
-            try:
-                channel = await guild.fetch_channel(server_data["discovery_channel"])
-            except discord.NotFound:
-                print(f"Discovery channel {server_data['discovery_channel']} not found.")
-                summary["no_channel"] += 1
-                continue
-            except discord.Forbidden:
-                print(f"No permission to access channel {server_data['discovery_channel']}.")
-                summary["no_channel"] += 1
-                continue
-            except Exception as e:
-                print(f"Error fetching channel: {e}")
-                summary["failed"] += 1
-                continue
-
-            if not channel:
-                summary["no_channel"] += 1
-                continue
-
-            try:
-                message = await channel.send(content=f'<@&{obj["role_id"]}>')
-                await message.delete(delay=2.0)
-                print(f"Message sent for role {obj['role_id']} in guild {obj['guild_id']}!")
-                summary["pinged"] += 1
-            except Exception as e:
-                print(f"Error sending/deleting message: {e}")
-                summary["failed"] += 1
-                continue
-
-            # Not awaited: pymongo is synchronous and an UpdateResult isn't awaitable.
-            # This used to be `await`ed inside the try above, so it raised TypeError every
-            # time, "mentioned" was never set, and the cohort got re-pinged on every pass
-            # of the 10-minute loop for the whole midday window.
-            try:
-                await self._db(roles_collection.update_one,
-                               {"_id": obj["_id"]},
-                               {"$set": {"mentioned": True}})
-            except Exception as e:
-                print(f"Error marking role as mentioned: {e}")
+        gate = asyncio.Semaphore(REMIND_CONCURRENCY)
 
+        async def remind(obj):
+            async with gate:
+                outcome = await self._remind_cohort(obj)
+            summary[outcome] += 1
+            if outcome != "pinged":
+                return
+            # Only once the ping really went out. Without the mark the cohort is pinged again
+            # on every pass of the 10-minute loop for the whole midday window.
+            await WriteBehind.update(roles_collection, {"_id": obj["_id"]},
+                                     {"$set": {"mentioned": True}})
             # Stamp the membership spells for this cohort, so /retention can show which
             # joining groups were reminded and which weren't.
-            try:
-                await self._db(
-                    database["memberships"].update_many,
-                    {"guild_id": obj["guild_id"], "cohort": obj["date"]},
-                    {"$set": {"nudged": True}})
-            except Exception as e:
-                print(f"Error marking cohort as reminded: {e}")
+            await WriteBehind.update_many(database["memberships"],
+                                          {"guild_id": obj["guild_id"], "cohort": obj["date"]},
+                                          {"$set": {"nudged": True}})
+
+        due = []
+        for obj in objects_to_mention:
+            if obj.get("mentioned"):
+                summary["already"] += 1
+            else:
+                due.append(obj)
+        await asyncio.gather(*(remind(obj) for obj in due))
+        # Written now rather than whenever the queue gets to it: the next pass, or an admin's
+        # /forcesurvey, must see these as done.
+        await WriteBehind.flush(roles_collection)
+        await WriteBehind.flush(database["memberships"])
 
         if not cleanup:
             return summary
 
         # Cleanup old roles (9 days)
-        oldDate = (datetime.datetime.now() - datetime.timedelta(days=9)).date()
+        oldDate = GuildConfig.local_date(timezone_for_dates, 9)
         print(f"Cleaning up roles for date {str(oldDate)}")
         old_query = {"date": str(oldDate)}
         if guild_id is not None:
             old_query["guild_id"] = guild_id
-        objects_to_delete = await self._db(lambda: list(roles_collection.find(old_query)))
-
-        for obj in objects_to_delete:
-            guild = await self.fetch_guild(obj["guild_id"])
-            if not guild:
-                continue
-
-            role = guild.get_role(obj["role_id"])
-            if not role:
-                continue
+        objects_to_delete = await Mongo.run_for(
+            roles_collection, lambda: list(roles_collection.find(old_query)))
+        if timezone is not None:
+            # Only this zone's servers. Another zone's cohort with the same date may be a day
+            # younger on its own calendar, and not reminded yet.
+            objects_to_delete = [obj for obj in objects_to_delete
+                                 if await self._timezone_of(obj["guild_id"]) == timezone]
+            old_query = {"_id": {"$in": [obj["_id"] for obj in objects_to_delete]}}
+
+        async def expire(obj):
+            async with gate:
+                guild = await self._cached_guild(obj["guild_id"])
+                role = guild.get_role(obj["role_id"]) if guild else None
+                if not role:
+                    return
+                try:
+                    await role.delete(reason="Date became old and was cleaned up")
+                    print(f"Deleted role {obj['role_id']} in guild {obj['guild_id']}.")
+                except Exception as e:
+                    print(f"Error deleting role: {e}")
 
-            try:
-                await role.delete(reason="Date became old and was cleaned up")
-                print(f"Deleted role {obj['role_id']} in guild {obj['guild_id']}.")
-            except Exception as e:
-                print(f"Error deleting role: {e}")
+        await asyncio.gather(*(expire(obj) for obj in objects_to_delete))
 
         try:
-            delete_result = await self._db(roles_collection.delete_many, old_query)
+            delete_result = await Mongo.run(roles_collection.delete_many, old_query)
             summary["cleaned"] = delete_result.deleted_count
             print(f"Deleted {delete_result.deleted_count} old database records.")
         except Exception as e:
@@ -391,17 +451,161 @@ class Bot(commands.Bot):
 
         return summary
 
+    async def _timezone_of(self, guild_id: int) -> str:
+        return (await GuildConfig.get(self, guild_id)).get("timezone") or DEFAULT_TIMEZONE
+
+    # ── the midday reminder pass ─────────────────────────────────────
+    async def run_cohort_pass(self, job: dict):
+        """One zone's midday pass, run by the Scheduler. It books its own next run, and books
+        it even if this one blew up, or the zone would have no pass until the next restart."""
+        zone = job.get("timezone") or DEFAULT_TIMEZONE
+        failed = 0
+        try:
+            failed = (await self.mention_players(timezone=zone))["failed"]
+        finally:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            if failed and now.astimezone(_zone(zone)).hour < COHORT_UNTIL_HOUR:
+                due = now + datetime.timedelta(minutes=COHORT_RETRY_MINUTES)
+            else:
+                due = next_cohort_pass(zone, now)
+            await Scheduler.schedule(self, "cohort_pass", due, job_id=f"cohort_pass:{zone}",
+                                     timezone=zone)
+
+    async def ensure_cohort_passes(self, zones=None):
+        """Make sure every zone a server has picked has its pass booked. One pass per zone
+        rather than per server, so a thousand servers on UTC are still one job."""
+        if zones is None:
+            try:
+                servers = Database.get_bot_database(self.MongoClient)["servers"]
+                zones = await Mongo.run(servers.distinct, "timezone")
+            except Exception as e:
+                print(f"[Scheduler] couldn't read the servers' timezones: {e}")
+                zones = []
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for zone in {DEFAULT_TIMEZONE, *(z for z in zones if z)}:
+            due = next_cohort_pass(zone, now, catch_up=True)
+            await Scheduler.ensure(self, "cohort_pass", due, job_id=f"cohort_pass:{zone}",
+                                   timezone=zone)
+
+    async def on_timezone_set(self, guild_id: int, zone: str):
+        """A server picked a zone, which may be the first one on it."""
+        try:
+            await self.ensure_cohort_passes([zone])
+        except Exception as e:
+            print(f"[Scheduler] couldn't book the pass for {zone}: {e}")
+
+    async def _cached_guild(self, guild_id: int):
+        """The guild from the gateway's cache, asking Discord only if it isn't there. None if
+        the bot isn't in it."""
+        guild = self.get_guild(guild_id)
+        if guild is not None:
+            return guild
+        try:
+            return await self.fetch_guild(guild_id)
+        except discord.HTTPException:
+            return None
+
+    async def _remind_cohort(self, obj: dict) -> str:
+        """Ping one cohort's role and delete the ping. Returns the summary key it counts under."""
+        print(f"Found unmentioned role for date {obj['date']} in guild {obj['guild_id']}!")
+
+        guild = await self._cached_guild(obj["guild_id"])
+        if not guild:
+            print(f"Guild {obj['guild_id']} not found or bot isn't in it.")
+            return "failed"
+
+        server_data = await GuildConfig.get(self, obj["guild_id"])
+        if not server_data or "discovery_channel" not in server_data:
+            print(f'Could not find server data or discovery channel for guild {obj["guild_id"]}')
+            return "no_channel"
+
+        channel = guild.get_channel(server_data["discovery_channel"])
+        if channel is None:
+            try:
+                channel = await guild.fetch_channel(server_data["discovery_channel"])
+            except discord.NotFound:
+                print(f"Discovery channel {server_data['discovery_channel']} not found.")
+                return "no_channel"
+            except discord.Forbidden:
+                print(f"No permission to access channel {server_data['discovery_channel']}.")
+                return "no_channel"
+            except Exception as e:
+                print(f"Error fetching channel: {e}")
+                return "failed"
+
+        if not channel:
+            return "no_channel"
+
+        try:
+            message = await channel.send(content=f'<@&{obj["role_id"]}>')
+            await message.delete(delay=2.0)
+            print(f"Message sent for role {obj['role_id']} in guild {obj['guild_id']}!")
+            return "pinged"
+        except Exception as e:
+            print(f"Error sending/deleting message: {e}")
+            return "failed"
+
+    async def warm_settings(self):
+        """Fill the settings cache for every guild at once, before their first messages each
+        ask for it separately. Cogs that index something out of those settings listen for
+        on_settings_warmed rather than querying for it themselves."""
+        started = asyncio.get_running_loop().time()
+        filled = await GuildConfig.warm(self, [g.id for g in self.guilds])
+        print(f"[GuildConfig] warmed {filled} of {len(self.guilds)} servers in "
+              f"{asyncio.get_running_loop().time() - started:.1f}s")
+        self.dispatch("settings_warmed")
+
     # ── talking to the dashboard ─────────────────────────────────────
+    # One runtime document per shard, "shard:<id>", each written by whichever process runs
+    # that shard. The dashboard adds them up; see store.bot_status. Nothing is written to the
+    # old single "bot" document any more, and the dashboard only falls back to it until the
+    # first shard document exists.
+    def _local_shards(self) -> dict:
+        """shard id -> latency, for every shard this process runs. Unsharded is shard 0."""
+        if SHARDING:
+            return dict(self.latencies)
+        return {0: self.latency}
+
+    def _shard_connected(self, shard_id: int) -> bool:
+        if not SHARDING:
+            return not self.is_closed()
+        shard = self.get_shard(shard_id)
+        return shard is not None and not shard.is_closed()
+
+    def _shard_count(self) -> int:
+        return self.shard_count or 1
+
+    def _shard_guilds(self, shard_id: int) -> list:
+        return [g for g in self.guilds if g.shard_id == shard_id]
+
+    async def _write_runtime(self, per_shard):
+        """Write `per_shard(shard_id)`'s fields onto each local shard's document: one bulk
+        write however many shards this process runs. Awaited rather than queued, so a failure
+        reaches the caller, which says so; the status page has nothing else to go by."""
+        # Imported here so importing this module doesn't need pymongo's request types.
+        from pymongo import UpdateOne
+        runtime = Database.get_bot_database(self.MongoClient)["runtime"]
+        requests = []
+        for shard_id in self._local_shards():
+            fields = per_shard(shard_id)
+            if fields is None:
+                continue
+            requests.append(UpdateOne(
+                {"_id": f"shard:{shard_id}"},
+                {"$set": {"shard_id": shard_id, "shard_count": self._shard_count(), **fields}},
+                upsert=True))
+        if requests:
+            await Mongo.run(runtime.bulk_write, requests, ordered=False)
+
     async def publish_guilds(self):
         """Write which guilds the bot is in, so the dashboard can show a server picker without
         asking Discord. The two processes only share MongoDB."""
+        now = datetime.datetime.now(datetime.timezone.utc)
         try:
-            await self._db(
-                Database.get_bot_database(self.MongoClient)["runtime"].update_one,
-                {"_id": "bot"},
-                {"$set": {"guild_ids": [g.id for g in self.guilds],
-                          "updated_at": datetime.datetime.now(datetime.timezone.utc)}},
-                True)
+            await self._write_runtime(lambda shard_id: {
+                "guild_ids": [g.id for g in self._shard_guilds(shard_id)],
+                "updated_at": now,
+            })
         except Exception as e:
             print(f"[dashboard] couldn't publish the guild list: {e}")
 
@@ -411,23 +615,28 @@ class Bot(commands.Bot):
 
         The dashboard is a separate process and can't see the bot at all, so "is it up" can
         only be answered by the bot leaving a mark and the web deciding whether it's recent.
-        Written into the same runtime document as the guild list, on different fields.
+        Written into the same runtime documents as the guild list, on different fields.
+
+        A shard whose connection is down gets no beat, even though this process is fine, so
+        the status page sees that one shard go quiet rather than everything looking healthy.
         """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        latencies = self._local_shards()
+
+        def beat(shard_id):
+            if not self._shard_connected(shard_id):
+                return None
+            guilds = self._shard_guilds(shard_id)
+            return {
+                "last_seen": now,
+                "started_at": self.start_time,
+                "guild_count": len(guilds),
+                "member_count": sum(g.member_count or 0 for g in guilds),
+                "latency_ms": _ms(latencies.get(shard_id)),
+            }
+
         try:
-            await self._db(
-                Database.get_bot_database(self.MongoClient)["runtime"].update_one,
-                {"_id": "bot"},
-                {"$set": {
-                    "last_seen": datetime.datetime.now(datetime.timezone.utc),
-                    "started_at": self.start_time,
-                    "guild_count": len(self.guilds),
-                    "member_count": sum(g.member_count or 0 for g in self.guilds),
-                    # None until the first heartbeat arrives, and inf if the socket is gone.
-                    "latency_ms": (round(self.latency * 1000)
-                                   if self.latency and self.latency == self.latency
-                                   and self.latency != float("inf") else None),
-                }},
-                True)
+            await self._write_runtime(beat)
         except Exception as e:
             print(f"[status] heartbeat failed: {e}")
 
@@ -435,22 +644,52 @@ class Bot(commands.Bot):
     async def before_heartbeat(self):
         await self.wait_until_ready()
 
+    @tasks.loop(minutes=10)
+    async def prune_settings(self):
+        """The settings cache's housekeeping. Its own loop rather than a line in some cog's,
+        so it can't vanish because that cog failed to load."""
+        GuildConfig.prune()
+        AuditTail.prune()
+
+    async def start_config_feed(self):
+        """Hear about dashboard saves as they happen, or poll for them if we can't.
+
+        The change stream costs nothing while nobody is saving anything. It needs a replica
+        set, though, so a standalone Mongo keeps the ten second poll below, and so does a
+        stream that dies and won't come back.
+        """
+        self.config_feed = ConfigFeed.ConfigFeed(self, on_lost=self._start_edit_poll)
+        if not await self.config_feed.start():
+            self._start_edit_poll()
+
+    def _start_edit_poll(self):
+        if not self.watch_dashboard_edits.is_running():
+            print("[dashboard] polling for settings changes every 10s")
+            self.watch_dashboard_edits.start()
+
     @tasks.loop(seconds=10)
     async def watch_dashboard_edits(self):
-        """Settings are cached for five minutes, so without this a dashboard save would look
-        like it did nothing for up to five minutes. The dashboard flags the guild it changed
-        and this drops the cached copy, which costs one small query every ten seconds however
-        many servers there are."""
+        """The fallback for when there is no change stream to listen to.
+
+        Settings are cached for five minutes, so without this a dashboard save would look
+        like it did nothing for up to five minutes. The dashboard flags the guild it changed,
+        stamped with when, and this drops the cached copy of every guild flagged since the
+        newest stamp it has seen, which costs one small query every ten seconds however many
+        servers there are. The flags are left where they are: with the shards split over
+        several processes each one reads them, and Mongo expires them (see GuildConfig)."""
         try:
             collection = Database.get_bot_database(self.MongoClient)["config_dirty"]
-            flagged = await self._db(lambda: list(collection.find({}, {"_id": 1})))
-            if not flagged:
+            since, already = self._flags_seen
+            flagged = await Mongo.run_for(collection, lambda: list(
+                collection.find({"at": {"$gte": since}}, {"_id": 1, "at": 1})))
+            fresh = [d for d in flagged if not (d["at"] == since and d["_id"] in already)]
+            if not fresh:
                 return
-            ids = [d["_id"] for d in flagged]
-            for guild_id in ids:
-                GuildConfig.invalidate(guild_id)
-            await self._db(collection.delete_many, {"_id": {"$in": ids}})
-            print(f"[dashboard] picked up changes for {len(ids)} server(s)")
+            for d in fresh:
+                GuildConfig.invalidate(d["_id"])
+            newest = max(d["at"] for d in flagged)
+            self._flags_seen = (newest, {d["_id"] for d in flagged if d["at"] == newest})
+            print(f"[dashboard] picked up changes for {len(fresh)} server(s)")
         except Exception as e:
             print(f"[dashboard] change poll failed: {e}")
 
@@ -464,6 +703,15 @@ class Bot(commands.Bot):
     async def on_guild_remove(self, guild):
         await self.publish_guilds()
 
+    async def on_shard_ready(self, shard_id: int):
+        # A shard that lost its session starts a new one on its own, without on_ready, and
+        # its guilds' entries written in between were never pushed. See AuditTail.
+        AuditTail.started(self, shard_id)
+
+    async def on_audit_log_entry_create(self, entry):
+        # Every cog asking who did something is answered from these first. See AuditTail.
+        AuditTail.feed(entry)
+
     async def on_error(self, event_method: str, *args, **kwargs):
         """Every exception raised inside an event listener lands here.
 
@@ -498,9 +746,22 @@ class Bot(commands.Bot):
                 # Reported once the gateway is up, since there is no channel to post to yet.
                 self._failed_cogs.append((ext, e))
 
+    async def close(self):
+        # Cogs unload inside super().close(), and some of them write on the way out, so the
+        # queued writes go after that and the database pool is only shut once they have.
+        if self.config_feed is not None:
+            self.config_feed.close()
+        Scheduler.close()
+        await super().close()
+        await WriteBehind.close()
+        Mongo.shutdown()
+
     async def on_ready(self):
         print("Bot is ready!")
         await self.publish_guilds()
+        # A fresh session, so whatever was written while disconnected was never pushed and
+        # the feed alone can't be trusted until it has covered a whole lookup window again.
+        AuditTail.started(self)
 
         # A cog that wouldn't load is the loudest possible failure and the easiest to miss:
         # everything else carries on, and the only sign is a line in a log nobody reads.
@@ -516,14 +777,29 @@ class Bot(commands.Bot):
         # those — the command set hasn't changed since the last sync.
         if not self._ready_once:
             self._ready_once = True
-            asyncio.ensure_future(loop(self))
-            self.watch_dashboard_edits.start()
+            await self.warm_settings()
+            Scheduler.register("cohort_pass", self.run_cohort_pass)
+            await Scheduler.start(self)
+            try:
+                await self.ensure_cohort_passes()
+            except Exception as e:
+                print(f"[Scheduler] couldn't book the midday passes: {e}")
+            await self.start_config_feed()
             self.heartbeat.start()
+            self.prune_settings.start()
 
+            shards = sorted(self._local_shards())
+            print(f"Presence intent: {'on' if self.intents.presences else 'off'} "
+                  f"({len(self.guilds)} servers on shard(s) {shards} "
+                  f"of {self._shard_count()})")
+
+            # Commands belong to the application rather than to a shard, so one process
+            # syncing them is enough and any others would only spend the rate limit. Whichever
+            # runs shard 0 does it.
+            if 0 not in shards:
+                return
             synced = await self.tree.sync()
             print(f"Loaded {len(synced)} slash commands.")
-            print(f"Presence intent: {'on' if self.intents.presences else 'off'} "
-                  f"({len(self.guilds)} servers)")
 
             # Guild-scoped commands live in a separate scope and need their own sync.
             if self.owner_guild_id:
@@ -535,10 +811,8 @@ class Bot(commands.Bot):
                 except Exception as e:
                     print(f"Failed to sync owner commands: {e}")
 
-# Load environment variables
-load_dotenv()
-
-# Create bot instance
-bot = Bot()
-# Run the bot
-bot.run(os.environ.get("BOT_TOKEN"))
+# Only when run as the script. The image worker processes start by importing this file, and
+# must not each build a bot and log in (see Workers).
+if __name__ == "__main__":
+    bot = Bot()
+    bot.run(os.environ.get("BOT_TOKEN"))
@@ -0,0 +1,182 @@
+"""The shared tail of each guild's audit log.
+
+Every cog that wants to know who did something asks here, so what matters is how few reads
+the answers cost and that none of them is wrong for being cached:
+
+- an entry already held answers without a read
+- lookups arriving together share one read, but never one that left before they asked
+- entries pushed by the gateway answer lookups, and once the feed covers the whole window a
+  miss costs nothing, after a short wait for an entry still on its way
+- a shard starting a new session is read again until its feed covers the window, and the
+  other shards' guilds are not
+- no View Audit Log means no reads and no answers
+"""
+import pathlib as _pathlib
+# Resolved from this file so the suite runs from a clone, on any machine, from any cwd.
+ROOT = _pathlib.Path(__file__).resolve().parents[1]
+SRC_DIR = str(ROOT / "src")
+import asyncio, datetime, sys, time, types
+sys.path.insert(0, SRC_DIR)
+
+import discord
+import AuditTail
+
+BAN = discord.AuditLogAction.ban
+NOW = lambda: datetime.datetime.now(datetime.timezone.utc)
+
+
+def entry(eid, target, user=7, age=0.0, guild_id=1):
+    return types.SimpleNamespace(
+        id=eid, action=BAN, guild=types.SimpleNamespace(id=guild_id),
+        created_at=NOW() - datetime.timedelta(seconds=age),
+        target=types.SimpleNamespace(id=target), user=types.SimpleNamespace(id=user))
+
+
+class Guild:
+    """A guild whose audit log is `log`, read slowly enough for lookups to overlap."""
+    def __init__(self, log=(), can_audit=True, gid=1, shard_id=0):
+        self.id = gid
+        self.shard_id = shard_id
+        self.log = list(log)
+        self.reads = 0
+        self.me = types.SimpleNamespace(
+            guild_permissions=types.SimpleNamespace(view_audit_log=can_audit))
+
+    def audit_logs(self, limit=None, action=None):
+        guild = self
+
+        async def gen():
+            guild.reads += 1
+            snapshot = sorted(guild.log, key=lambda e: e.id, reverse=True)[:limit]
+            await asyncio.sleep(0.05)
+            for e in snapshot:
+                yield e
+        return gen()
+
+
+def reset(pushed=False):
+    AuditTail._tails.clear()
+    AuditTail._inflight.clear()
+    AuditTail._started.clear()
+    AuditTail._arrivals.clear()
+    AuditTail._feed_since.clear()
+    if pushed:
+        AuditTail._feed_since.update({0: time.monotonic() - 3600, 1: time.monotonic() - 3600})
+
+
+def target(t):
+    return lambda e: e.target.id == t
+
+
+async def main():
+    print("=== a held entry answers without a read ===")
+    reset()
+    g = Guild([entry(1, 500)])
+    assert (await AuditTail.find(g, BAN, target(500))).id == 1
+    assert (await AuditTail.find(g, BAN, target(500))).id == 1
+    assert g.reads == 1, g.reads
+    print("  two lookups, one read OK")
+
+    print("\n=== lookups arriving together share a read ===")
+    reset()
+    g = Guild([entry(i, 500 + i) for i in range(20)])
+    found = await asyncio.gather(*(AuditTail.find(g, BAN, target(500 + i)) for i in range(20)))
+    assert [e.id for e in found] == list(range(20)), found
+    assert g.reads == 1, f"twenty bans at once, {g.reads} reads"
+    print(f"  20 concurrent lookups answered by {g.reads} read OK")
+
+    print("\n=== but not a read that left before they asked ===")
+    reset()
+    g = Guild([entry(1, 500)])
+    first = asyncio.ensure_future(AuditTail.find(g, BAN, target(600)))
+    await asyncio.sleep(0.01)                # that read is out, and 600 isn't banned yet
+    g.log.append(entry(2, 600))
+    late = await asyncio.gather(*(AuditTail.find(g, BAN, target(600)) for _ in range(5)))
+    await first
+    assert all(e is not None and e.id == 2 for e in late), late
+    assert g.reads == 2, f"the five latecomers share one fresh read: {g.reads}"
+    print("  latecomers wait for the next read, and share it OK")
+
+    print("\n=== entries outside the window are never the answer ===")
+    reset()
+    g = Guild([entry(1, 500, age=60)])
+    assert await AuditTail.find(g, BAN, target(500), window=15) is None
+    print("  a minute-old ban doesn't explain this one OK")
+
+    print("\n=== pushed entries ===")
+    reset(pushed=True)
+    g = Guild()
+    AuditTail.feed(entry(5, 700))
+    assert (await AuditTail.find(g, BAN, target(700))).id == 5 and g.reads == 0
+    start = time.monotonic()
+    assert await AuditTail.find(g, BAN, target(800)) is None
+    waited = time.monotonic() - start
+    assert g.reads == 0, "the feed covers the window, so a miss is trusted"
+    assert AuditTail.FEED_GRACE - 0.1 < waited < AuditTail.FEED_GRACE + 0.5, waited
+
+    async def later():
+        await asyncio.sleep(0.1)
+        AuditTail.feed(entry(6, 900))
+    asyncio.ensure_future(later())
+    start = time.monotonic()
+    assert (await AuditTail.find(g, BAN, target(900))).id == 6
+    assert time.monotonic() - start < 0.5, "answered as soon as it arrived"
+    assert g.reads == 0
+    print("  answered from the feed; a miss waits briefly and reads nothing OK")
+
+    reset()
+    AuditTail._feed_since[0] = time.monotonic()
+    g = Guild([entry(7, 950)])
+    assert (await AuditTail.find(g, BAN, target(950))).id == 7 and g.reads == 1
+    print("  a feed younger than the window still reads on a miss OK")
+
+    print("\n=== one shard's new session ===")
+    reset(pushed=True)
+    bot = types.SimpleNamespace(intents=types.SimpleNamespace(moderation=True))
+    AuditTail.started(bot, shard_id=1)
+    # Shard 1 was disconnected when this ban was written, so it was never pushed.
+    rejoined, steady = Guild([entry(8, 960)], shard_id=1), Guild(gid=2, shard_id=0)
+    assert (await AuditTail.find(rejoined, BAN, target(960))).id == 8 and rejoined.reads == 1, \
+        "a miss on the shard that just started again is read, not trusted"
+    assert await AuditTail.find(steady, BAN, target(970)) is None and steady.reads == 0, \
+        "the shard that stayed up is still trusted"
+    assert AuditTail.stats()["pushed_live"] == 1 and AuditTail.stats()["feeds"] == 2
+    AuditTail.started(bot)
+    assert list(AuditTail._feed_since) == [0], "on_ready unsharded starts shard 0 afresh"
+    bot.intents.moderation = False
+    AuditTail.started(bot, shard_id=1)
+    assert not AuditTail._feed_since, "no intent, no feed on any shard"
+    print("  read again for the restarted shard's guilds only OK")
+
+    print("\n=== recent(), for a batch of lookups at once ===")
+    reset()
+    g = Guild([entry(1, 1), entry(2, 2), entry(3, 3, age=60)])
+    assert [e.id for e in await AuditTail.recent(g, BAN)] == [2, 1]
+    reset(pushed=True)
+    g = Guild([entry(1, 1)])
+    AuditTail.feed(entry(4, 4))
+    assert [e.id for e in await AuditTail.recent(g, BAN)] == [4] and g.reads == 0
+    print("  newest first, inside the window, from the feed when it is trusted OK")
+
+    print("\n=== no View Audit Log ===")
+    reset()
+    g = Guild([entry(1, 500)], can_audit=False)
+    assert await AuditTail.find(g, BAN, target(500)) is None
+    assert await AuditTail.recent(g, BAN) == [] and g.reads == 0
+    print("  no reads, no answers OK")
+
+    print("\n=== held entries stay bounded ===")
+    reset()
+    for i in range(AuditTail.TAIL_MAX + 50):
+        AuditTail.feed(entry(i, i))
+    assert len(AuditTail._tails[(1, BAN)]) == AuditTail.TAIL_MAX
+    assert AuditTail._tails[(1, BAN)][0].id == AuditTail.TAIL_MAX + 49, "the newest kept"
+    AuditTail.feed(entry(1, 1, age=600, guild_id=2))
+    AuditTail.prune()
+    assert list(AuditTail._tails) == [(1, BAN)], "a tail with nothing recent goes"
+    print(f"  {AuditTail.TAIL_MAX} per tail, stale tails pruned OK")
+
+    print("\nALL CHECKS PASSED")
+
+
+asyncio.run(main())
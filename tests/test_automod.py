@@ -32,10 +32,16 @@ class FakeColl:
             if not upsert: return types.SimpleNamespace(matched_count=0)
             h = dict(q); self.docs.append(h)
         h.update(ops.get("$set", {}))
+        for field in ops.get("$unset", {}):
+            h.pop(field, None)
         return types.SimpleNamespace(matched_count=1)
     def insert_one(self, doc):
         self.docs.append(doc)
         return types.SimpleNamespace(inserted_id=len(self.docs))
+    def bulk_write(self, requests, ordered=True):
+        for op in requests:
+            if op[0] == "insert": self.insert_one(op[1])
+            else: self.update_one(op[1], op[2], upsert=op[3])
     def find_one_and_update(self, q, ops, upsert=False, return_document=None):
         # Backs the case counter, which is how a case gets its number.
         h = self._ref(q)
@@ -56,14 +62,20 @@ st = types.ModuleType("Database"); st.get_bot_database = lambda c: DB
 sys.modules["Database"] = st
 for n in ("pymongo", "certifi", "dotenv"):
     m = types.ModuleType(n)
-    if n == "pymongo": m.MongoClient = lambda *a, **k: object()
+    if n == "pymongo":
+        m.MongoClient = lambda *a, **k: object()
+        # What WriteBehind hands to bulk_write; FakeColl.bulk_write replays them.
+        m.InsertOne = lambda doc: ("insert", doc)
+        m.UpdateOne = lambda q, ops, upsert=False: ("update", q, ops, upsert)
     if n == "certifi": m.where = lambda: ""
     if n == "dotenv": m.load_dotenv = lambda *a, **k: None
     sys.modules[n] = m
 
 import discord
 from discord.ext import commands
+import BannedWords
 import GuildConfig
+import WriteBehind
 
 GUILD, CHAN, QUIET = 1, 10, 11
 BOT_ID, OWNER_ID = 42, 99
@@ -87,10 +99,20 @@ class FakeChannel:
     def __init__(self, cid=CHAN, staff=False):
         self.id = cid; self.name = "general"; self.mention = f"<#{cid}>"
         self.sent = []; self.staff = staff
+        self.everyone = None            # @everyone's send_messages overwrite, as /lock sets it
+        self.bulk_deleted = []
+    @property
+    def guild(self): return GUILD_OBJ
+    def __str__(self): return self.name
     def permissions_for(self, m):
         allow = getattr(m, "is_staff", False)
         return types.SimpleNamespace(manage_messages=allow, manage_guild=allow,
-                                     administrator=False)
+                                     administrator=False, send_messages=self.everyone is not False)
+    def overwrites_for(self, role): return discord.PermissionOverwrite(send_messages=self.everyone)
+    async def set_permissions(self, role, overwrite=None, reason=None):
+        self.everyone = overwrite.send_messages
+    async def delete_messages(self, messages, reason=None):
+        self.bulk_deleted.extend(m.id for m in messages)
     async def send(self, content=None, **kw):
         self.sent.append(content)
 
@@ -109,8 +131,12 @@ class FakeMember:
     async def kick(self, reason=None): self.guild.kicked.append(self.id)
 
 
+_ids = iter(range(10**6, 10**7))
+
+
 class FakeMessage:
     def __init__(self, content="hi", author=None, channel=None, mentions=(), roles=()):
+        self.id = next(_ids)
         self.guild = GUILD_OBJ
         self.author = author or FakeMember()
         self.channel = channel or CHANNELS[CHAN]
@@ -144,7 +170,9 @@ def make_guild(can_timeout=True, can_kick=True, can_ban=True):
         guild_permissions=types.SimpleNamespace(moderate_members=can_timeout,
                                                 kick_members=can_kick,
                                                 ban_members=can_ban,
-                                                manage_messages=True))
+                                                manage_messages=True,
+                                                manage_channels=True))
+    g.default_role = FakeRole(GUILD, 0)
     g.get_channel = lambda i: CHANNELS.get(i)
     g.get_role = lambda i: None
     return g
@@ -169,7 +197,6 @@ async def main():
     bot.MongoClient = object()
     await bot.load_extension("Cogs.AutoMod")
     cog = bot.get_cog("AutoMod")
-    cog.prune.cancel()
     import Cogs.AutoMod as A
     import store
 
@@ -185,6 +212,7 @@ async def main():
     async def send(content, **kw):
         m = FakeMessage(content, **kw)
         await cog.on_message(m)
+        await WriteBehind.flush()      # cases are queued and written in batches
         return m
 
     print("\n=== banned words match whole words only ===")
@@ -204,6 +232,34 @@ async def main():
         "real spaces are a different message and shouldn't be joined up"
     print("  invisible characters stripped, real spaces left alone OK")
 
+    print("\n=== disguised spellings are the same word ===")
+    automod(rules={"words": {"on": True, "action": "delete", "list": ["spam", "free nitro"]}})
+    for bad in ("$p4m", "5PAM", "spаm", "ѕpam", "frее nitr0", "sp@m!"):
+        assert (await send(bad)).deleted, bad
+    for safe in ("$p4mmy", "xspam", "5pamela", "free nitrous"):
+        assert not (await send(safe)).deleted, safe
+    m = FakeMessage("buy $p4m")
+    plan = GuildConfig.derived(GUILD, await GuildConfig.get(bot, GUILD), A.compile_plan)
+    assert cog._judge(m, plan)[1] == "used a banned word ($p4m)", "reported as written"
+    print("  digits, symbols and lookalike letters caught, still whole words only OK")
+
+    print("\n=== word lists scale, and are shared ===")
+    BannedWords._cache.clear()
+    big = [f"word{i:04d}x" for i in range(A.MAX_WORDS)]
+    assert BannedWords.matcher(big).find("a word1999x here") == "word1999x"
+    assert BannedWords.matcher(list(reversed(big)) + ["WORD0001X "]) is \
+        BannedWords.matcher(big), "the same list in any order or case is compiled once"
+    assert BannedWords.CACHE_SIZE == GuildConfig.MAX_ENTRIES, \
+        "a list for every guild whose settings are held, or refreshes recompile them"
+    size, BannedWords.CACHE_SIZE = BannedWords.CACHE_SIZE, 64
+    for i in range(BannedWords.CACHE_SIZE):
+        BannedWords.matcher([f"only{i}"])
+    assert tuple(big) not in BannedWords._cache and len(BannedWords._cache) == \
+        BannedWords.CACHE_SIZE, "least recently used dropped first, not the lot"
+    assert ("only0",) in BannedWords._cache
+    BannedWords.CACHE_SIZE = size
+    print(f"  {A.MAX_WORDS} words in one matcher, shared, evicted oldest first OK")
+
     print("\n=== invites ===")
     automod(rules={"invites": {"on": True, "action": "delete"}})
     for bad in ("join discord.gg/abc123", "https://discord.com/invite/xyz", "dsc.gg/thing"):
@@ -269,6 +325,78 @@ async def main():
     assert not any(m.deleted for m in varied)
     print("  third repeat caught, four different messages left alone OK")
 
+    print("\n=== one scan of the text serves every rule, and every cog ===")
+    import MessageScan
+    text = ("Join discord.gg/abc or https://discord.com/invite/xyz, see "
+            "https://WWW.Example.org/a and <:w:1> 🎉🎉\nGG EZ​ Wp")
+    m = FakeMessage(text)
+    scan = MessageScan.scan(m)
+    assert scan.invites == ("discord.gg/abc", "discord.com/invite/xyz"), scan.invites
+    assert scan.domains == ("discord.com", "example.org"), "an invite inside a link is both"
+    assert scan.emoji == 3 and scan.lines == 2
+    assert scan.text == text.replace("\u200b", "").lower()
+    assert (scan.letters, scan.capitals) == (sum(map(str.isalpha, text)),
+                                             sum(map(str.isupper, text)))
+    for sample in (text, "https://discord.gg/a https://dsc.gg/b", "DiScOrD.Gg/Loud <a:x:9>",
+                   "xinvite.gg/y dnvite.gg/z ☀️ 🇬🇧", "http://a.b/c?d <:no:emoji>",
+                   # A link written straight after an invite's code is still a link.
+                   "dsc.gg/https://evil.com", "discord.gg/abchttps://evil.com"):
+        got, low = MessageScan.Scan(sample), sample.replace("\u200b", "").lower()
+        assert got.invites == tuple(MessageScan.INVITE.findall(low)), sample
+        assert got.domains == tuple(d.removeprefix("www.")
+                                    for d in MessageScan.URL.findall(low)), sample
+        assert got.emoji == (len(MessageScan.CUSTOM_EMOJI.findall(low))
+                             + len(MessageScan.UNICODE_EMOJI.findall(low))), sample
+    assert MessageScan.Scan("dsc.gg/https://evil.com").domains == ("evil.com",)
+    assert MessageScan.Scan("discord.gg/abchttps://evil.com").invites == \
+        ("discord.gg/abchttps",), "the invite as it was written, the link found as well"
+    assert MessageScan.scan(m) is scan, "asked again, answered from the first scan"
+    m.content = "edited"
+    assert MessageScan.scan(m) is not scan, "an edit is scanned afresh"
+    words = BannedWords.matcher(["ez"])
+    assert scan.banned(words) == "ez" and scan._banned == {words: "ez"}
+    for i in range(MessageScan.CACHE_SIZE + 10):
+        MessageScan.scan(FakeMessage("x"))
+    assert len(MessageScan._cache) == MessageScan.CACHE_SIZE
+    print("  invites, domains, emoji, lines and capitals in one pass, kept per message OK")
+
+    print("\n=== history is small, and forgotten without a sweep ===")
+    import Recent
+    # Ahead of the real clock, which the wheels have already seen: one that went backwards
+    # would have nothing come due. Whole seconds, as History keeps milliseconds.
+    clock = [float(int(A.time.monotonic()) + 10_000)]
+    real_time = A.time
+    A.time = types.SimpleNamespace(monotonic=lambda: clock[0])
+    automod(rules={"spam": {"on": True, "action": "delete", "count": 20, "seconds": 60}})
+    cog._recent.clear()
+    talker = FakeMember(uid=901)
+    flood = []
+    for i in range(20):
+        clock[0] += 1
+        flood.append(await send(f"line {i}", author=talker))
+    assert not any(m.deleted for m in flood[:19]) and flood[19].deleted, \
+        "a count past the old 12 message history still trips"
+    held = cog._recent[(GUILD, talker.id)]
+    assert held.size == 20 and held.nth_latest(1) == clock[0]
+    assert sys.getsizeof(held) + sys.getsizeof(held.ring) <= 160 + 16 * 20, \
+        "16 bytes a message, and no message text kept"
+    quiet = FakeMember(uid=902)
+    await send("hello", author=quiet)
+    for _ in range(3):                      # the talker keeps going, the quiet one doesn't
+        clock[0] += A.HISTORY_TTL / 2
+        await send("still here", author=talker)
+    assert (GUILD, quiet.id) not in cog._recent, "forgotten once the time had passed"
+    assert (GUILD, talker.id) in cog._recent, "but not somebody still talking"
+    clock[0] += A.HISTORY_TTL + A.HISTORY_TICK + 1
+    await send("back", author=quiet)
+    assert list(cog._recent) == [(GUILD, quiet.id)]
+    assert len(cog._forget) == 1, "nothing left behind in the wheel"
+    A.time = real_time
+    wheel = Recent.TimingWheel(ttl=30, tick=10)
+    assert not list(wheel.expired(0)) and wheel.touch("k", -1, 0) == 4
+    assert not list(wheel.expired(39)) and list(wheel.expired(40)) == ["k"]
+    print("  20 in a minute caught, a few hundred bytes each, the quiet forgotten OK")
+
     print("\n=== who it never touches ===")
     automod(rules={"words": {"on": True, "action": "delete", "list": ["spam"]}})
     assert (await send("spam")).deleted, "the rule does work on an ordinary member"
@@ -310,6 +438,26 @@ async def main():
     assert not (await send("spam")).deleted
     print("  master off, rule off and unconfigured all quiet OK")
 
+    print("\n=== the settings are compiled once, not per message ===")
+    automod(exempt_channels=[QUIET],
+            rules={"words": {"on": True, "action": "delete", "list": ["spam"]},
+                   "links": {"on": True, "action": "delete", "allow": ["www.Tenor.com "]},
+                   "caps": {"on": False}})
+    await send("hello")
+    plan = GuildConfig._derived[GUILD][A.compile_plan][1]
+    await send("hello again")
+    assert GuildConfig._derived[GUILD][A.compile_plan][1] is plan, "reused, not rebuilt"
+    assert [r.key for r in plan.rules] == ["words", "links"], "only what is switched on"
+    assert plan.rules[1].allow == {"tenor.com"} and plan.exempt_channels == {QUIET}
+    assert not plan.history, "nobody's messages are kept when no rule reads them"
+    automod(rules={"words": {"on": True, "action": "delete", "list": []}})
+    await send("hello")
+    assert GuildConfig._derived[GUILD][A.compile_plan][1].rules == (), \
+        "a new copy of the settings gets a new plan, and an empty list runs nothing"
+    GuildConfig.invalidate(GUILD)
+    assert GUILD not in GuildConfig._derived
+    print("  built once per copy of the settings, rebuilt when they change OK")
+
     print("\n=== one rule per message ===")
     automod(rules={"words": {"on": True, "action": "delete", "list": ["spam"]},
                    "caps": {"on": True, "action": "delete", "percent": 50,
@@ -553,6 +701,115 @@ async def main():
     assert out["minage"]["days"] == store.MINAGE_RANGE[1], out["minage"]
     print("  remembered, defaulted and clamped OK")
 
+    print("\n=== a raid is one message from many accounts, and locks the server ===")
+    reset()
+    GUILD_OBJ.text_channels = list(CHANNELS.values())
+    # Open only because of an explicit allow, as under a category that denies everyone.
+    CHANNELS[QUIET].everyone = True
+    clock = [float(int(real_time.monotonic()) + 50_000)]
+    A.time = types.SimpleNamespace(monotonic=lambda: clock[0])
+    cog._channels.clear(); cog._raids.clear(); cog._joins.clear()
+    automod(rules={}, raid={"on": True, "accounts": 3, "seconds": 30, "lockdown": True})
+    raiders = [FakeMember(uid) for uid in range(800, 806)]
+    chatter = [await send(t, author=raiders[0]) for t in ("good morning everyone",) * 4]
+    chatter += [await send("good morning", author=r) for r in raiders]
+    assert not any(m.deleted for m in chatter) and not CHANNELS[CHAN].bulk_deleted, \
+        "one person repeating themselves, or a room saying hello, is not a raid"
+    copies = ["join my server for free nitro <@1>", "JOIN my server for freeee nitro!!! <@2>",
+              "join my server for free nitro 🎉 3"]
+    for i, (who, text) in enumerate(zip(raiders, copies)):
+        clock[0] += 5
+        await send(text, author=who)
+        assert CHANNELS[CHAN].everyone is not False or i == 2
+    ids = CHANNELS[CHAN].bulk_deleted
+    assert len(ids) == 3, "every copy in the channel goes, not just the one that tipped it"
+    assert CHANNELS[CHAN].everyone is False and CHANNELS[QUIET].everyone is False
+    cfg = await GuildConfig.get(bot, GUILD)
+    assert cfg["raid_lockdown"]["channels"] == [{"id": CHAN, "was": None},
+                                                {"id": QUIET, "was": True}], cfg
+    assert "raid" in CHANNELS[CHAN].sent[-1]
+    print("  three accounts within 30 seconds: copies deleted, both channels locked OK")
+
+    locks = len(CHANNELS[CHAN].sent)
+    late = await send("join my server for FREE nitro", author=raiders[3],
+                      channel=CHANNELS[QUIET])
+    assert late.deleted, "another copy anywhere in the server goes too"
+    assert len(CHANNELS[CHAN].sent) == locks and not CHANNELS[QUIET].sent, \
+        "without a second notice or lockdown"
+
+    class Followup:
+        def __init__(self): self.said = []
+        async def send(self, content=None, **kw): self.said.append(content)
+    async def defer(**kw): pass
+    mod_user = FakeMember(uid=850, staff=True)
+    interaction = types.SimpleNamespace(
+        guild=GUILD_OBJ, user=mod_user, followup=Followup(),
+        response=types.SimpleNamespace(defer=defer))
+    await cog.lift.callback(cog, interaction)
+    assert CHANNELS[CHAN].everyone is None and CHANNELS[QUIET].everyone is True, \
+        "each overwrite put back as it was, the explicit allow included"
+    assert "raid_lockdown" not in await GuildConfig.get(bot, GUILD)
+    assert interaction.followup.said == ["Unlocked 2 channels."], interaction.followup.said
+    print("  a late copy deleted quietly, and /automod lift puts back what it changed OK")
+
+    print("\n=== a burst of joins is a raid too ===")
+    reset()
+    GUILD_OBJ.text_channels = list(CHANNELS.values())
+    cog._raids.clear()
+    automod(rules={}, enabled=False, raid={"on": True, "accounts": 3, "seconds": 30, "joins": 2})
+    for uid in range(870, 875):
+        await cog.check_new_member(joiner(30, uid=uid))
+    assert CHANNELS[CHAN].everyone is None, "with automod off, joins are left alone like messages"
+    automod(rules={}, raid={"on": True, "accounts": 3, "seconds": 30, "joins": 4})
+    for uid in range(860, 863):
+        clock[0] += 1
+        assert await cog.check_new_member(joiner(30, uid=uid)) is False
+    assert CHANNELS[CHAN].everyone is None, "three joins is an ordinary minute"
+    clock[0] += 1
+    await cog.check_new_member(joiner(30, uid=863))
+    assert CHANNELS[CHAN].everyone is False, "the fourth inside 30 seconds locks it"
+    print("  nothing with automod off; three joins let through, the fourth in 30 seconds locks it OK")
+
+    print("\n=== and what it remembers stays the same size however long it goes on ===")
+    cog._raids.clear()
+    automod(rules={}, raid={"on": True, "accounts": 25, "seconds": 30})
+    import random
+    rng = random.Random(5)
+    for i in range(3 * A.RAID_INDEX):
+        clock[0] += 0.01
+        await send(" ".join("".join(rng.choice("abcdefgh") for _ in range(5)) for _ in range(4)),
+                   author=FakeMember(1000 + i))
+    seen = cog._channels[(GUILD, CHAN)]
+    assert seen.filled == len(seen.at) == A.RAID_INDEX and not cog._raids
+    # A raid that keeps changing its text trips again with every change, and each trip puts
+    # the cooldown back, so only the latest shapes may be held.
+    automod(rules={}, raid={"on": True, "accounts": 2, "seconds": 30, "lockdown": False})
+    for i in range(3 * A.RAID_INDEX):
+        clock[0] += 0.01
+        text = " ".join("".join(rng.choice("abcdefgh") for _ in range(5)) for _ in range(4))
+        for who in (2000 + 2 * i, 2001 + 2 * i):
+            await send(text, author=FakeMember(who))
+    shapes = cog._raids[GUILD][1]
+    assert len(shapes) == A.RAID_INDEX, len(shapes)
+    assert (await send(text, author=FakeMember(3000))).deleted, "the latest still caught"
+    cog._raids.clear()
+    clock[0] += A.HISTORY_TTL + A.HISTORY_TICK + 1
+    await send("one message, much later, in another channel", channel=CHANNELS[QUIET])
+    assert list(cog._channels) == [(GUILD, QUIET)], "the raided channel forgotten once quiet"
+    A.time = real_time
+    print(f"  {A.RAID_INDEX} messages per channel and raid shapes per server, and the quiet "
+          "ones forgotten OK")
+
+    print("\n=== the form keeps the raid numbers in range ===")
+    out = store.clean_automod(Form({"raid_on": "on", "raid_accounts": "1", "raid_joins": "999"}),
+                              set(), set(), {"raid": {"seconds": 60}})
+    assert out["raid"] == {"on": True, "lockdown": False, "accounts": 2, "seconds": 60,
+                           "joins": 50}, out["raid"]
+    plan = A.compile_plan({"automod": {"enabled": True, "raid": out["raid"]}})
+    assert (plan.raid.count, plan.raid.seconds, plan.raid.limit, plan.raid.action) == \
+        (2, 60.0, 50, "delete")
+    print("  clamped, remembered, and read the same way by the bot OK")
+
     print("\nALL CHECKS PASSED")
 
 asyncio.run(main())
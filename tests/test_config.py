@@ -1,4 +1,5 @@
-"""GuildConfig: shared caching, read-count reduction, invalidation, stale fallback, indexes."""
+"""GuildConfig: shared caching, read-count reduction, invalidation, stale fallback, indexes,
+and the change feed that invalidates on a dashboard save."""
 import pathlib as _pathlib
 # Resolved from this file so the suite runs from a clone, on any machine, from any cwd.
 ROOT = _pathlib.Path(__file__).resolve().parents[1]
@@ -10,12 +11,14 @@ sys.path.insert(0, SRC_DIR)
 
 READS = []
 INDEXES = []
+TTLS = {}
 
 
 class FakeColl:
     def __init__(self, name): self.name = name; self.docs = []
     def create_index(self, keys, **kw):
         INDEXES.append((self.name, keys, kw.get("name")))
+        TTLS[self.name] = kw.get("expireAfterSeconds", TTLS.get(self.name))
     def _ref(self, q): return next(iter(self.find(q)), None)
     def find_one(self, q, *a, **k):
         READS.append((self.name, q))
@@ -111,6 +114,144 @@ async def main():
     got = await GuildConfig.get(bot, 12345)          # never seen, and now DB works again
     assert got == {}, got
 
+    print("\n=== an expiry under load costs one read, not one per listener ===")
+    GuildConfig._cache[GUILD] = (cfg_before, 0)
+    READS.clear()
+    before = GuildConfig.stats()
+    def slow(self, q, *a, **k):
+        time.sleep(0.05)                             # long enough for everybody to pile in
+        return orig(self, q, *a, **k)
+    FakeColl.find_one = slow
+    got = await asyncio.gather(*(GuildConfig.get(bot, GUILD) for _ in range(20)))
+    FakeColl.find_one = orig
+    after = GuildConfig.stats()
+    assert len(READS) == 1, f"20 concurrent misses made {len(READS)} reads"
+    assert all(g == got[0] for g in got)
+    assert after["issued"] - before["issued"] == 1, after
+    assert after["coalesced"] - before["coalesced"] == 19, after
+    assert after["reads_in_flight"] == 0, "nothing is left waiting"
+    print(f"  20 callers, 1 read, 19 coalesced OK")
+
+    print("\n=== a cancelled caller doesn't cancel the others ===")
+    GuildConfig._cache.pop(GUILD, None)
+    FakeColl.find_one = slow
+    first = asyncio.ensure_future(GuildConfig.get(bot, GUILD))
+    second = asyncio.ensure_future(GuildConfig.get(bot, GUILD))
+    await asyncio.sleep(0.01)
+    first.cancel()
+    assert (await second)["guild_id"] == GUILD
+    FakeColl.find_one = orig
+    print("  the survivor still got its settings OK")
+
+    print("\n=== a write during a read isn't undone by it ===")
+    GuildConfig._cache.pop(GUILD, None)
+    FakeColl.find_one = slow
+    reading = asyncio.ensure_future(GuildConfig.get(bot, GUILD))
+    await asyncio.sleep(0.01)
+    GuildConfig.invalidate(GUILD)
+    await reading
+    FakeColl.find_one = orig
+    assert GUILD not in GuildConfig._cache, "a read that predates the change must not be kept"
+    print("  the in-flight read was handed out but not cached OK")
+
+    print("\n=== an expired copy is served at once and refreshed behind the caller ===")
+    GuildConfig._cache[GUILD] = ({"guild_id": GUILD, "old": True},
+                                 time.monotonic() - GuildConfig.TTL - 1)
+    READS.clear()
+    FakeColl.find_one = slow
+    started = time.monotonic()
+    got = await GuildConfig.get(bot, GUILD)
+    waited = time.monotonic() - started
+    assert got.get("old") is True, "the stale copy is the answer"
+    assert waited < 0.04, f"the caller waited {waited:.3f}s on the database"
+    again = await GuildConfig.get(bot, GUILD)
+    assert again.get("old") is True, "still stale while the refresh is out"
+    await asyncio.sleep(0.1)
+    FakeColl.find_one = orig
+    assert len(READS) == 1, "one refresh however many callers saw the stale copy"
+    fresh = await GuildConfig.get(bot, GUILD)
+    assert "old" not in fresh and fresh["guild_id"] == GUILD, fresh
+    print("  no wait, one background read, then the fresh copy OK")
+
+    print("\n=== a failed refresh backs off rather than retrying on every message ===")
+    held = {"guild_id": GUILD, "old": True}
+    GuildConfig._cache[GUILD] = (held, time.monotonic() - GuildConfig.TTL - 1)
+    def down(self, q, *a, **k):
+        READS.append((self.name, q))
+        raise RuntimeError("no primary")
+    READS.clear()
+    FakeColl.find_one = down
+    for _ in range(20):
+        assert await GuildConfig.get(bot, GUILD) is held, "the old copy, not an empty one"
+        while GUILD in GuildConfig._inflight:       # the read has failed before the next one
+            await asyncio.sleep(0.005)
+    assert len(READS) == 1, f"{len(READS)} reads during the outage, not one"
+    age = time.monotonic() - GuildConfig._cache[GUILD][1]
+    assert GuildConfig.TTL - GuildConfig.RETRY_SECONDS - 1 < age < GuildConfig.TTL, age
+    FakeColl.find_one = orig
+    print(f"  one failed read, then the old copy held {GuildConfig.RETRY_SECONDS}s "
+          f"before the next try OK")
+
+    print("\n=== only a copy past the hard limit makes the caller wait ===")
+    GuildConfig._cache[GUILD] = ({"guild_id": GUILD, "old": True},
+                                 time.monotonic() - GuildConfig.STALE_TTL - 1)
+    got = await GuildConfig.get(bot, GUILD)
+    assert "old" not in got, "far too old to hand out"
+    print("  blocked and read fresh OK")
+
+    print("\n=== startup warms every guild in a few queries ===")
+    GuildConfig._cache.clear()
+    queries = []
+    orig_find = FakeColl.find
+    def find_in(self, q=None, *a, **k):
+        wanted = (q or {}).get("guild_id")
+        if isinstance(wanted, dict) and "$in" in wanted:
+            queries.append(len(wanted["$in"]))
+            return [d for d in self.docs if d.get("guild_id") in wanted["$in"]]
+        return orig_find(self, q, *a, **k)
+    FakeColl.find = find_in
+    guilds = [GUILD] + list(range(1000, 1000 + GuildConfig.WARM_BATCH + 10))
+    filled = await GuildConfig.warm(bot, guilds)
+    FakeColl.find = orig_find
+    assert filled == len(guilds), filled
+    assert queries == [GuildConfig.WARM_BATCH, 11], queries
+    READS.clear()
+    assert (await GuildConfig.get(bot, GUILD))["guild_id"] == GUILD
+    assert await GuildConfig.get(bot, 1005) == {}, "no document is cached as empty"
+    assert not READS, f"a warmed guild still read: {READS}"
+    ages = {round(time.monotonic() - t) for _, t in GuildConfig._cache.values()}
+    assert len(ages) > 1 and max(ages) <= GuildConfig.TTL / 2, "expiries are spread out"
+    assert any(d.get("guild_id") == GUILD for d in GuildConfig.cached())
+    print(f"  {len(guilds)} guilds in {len(queries)} queries, no reads afterwards OK")
+
+    assert await GuildConfig.warm(bot, guilds) == 0, "already warm costs nothing"
+    print("  a second warm-up skips what is already held OK")
+
+    print("\n=== the cache has a ceiling, and the busiest guilds survive it ===")
+    GuildConfig._cache.clear(); GuildConfig._heat.clear()
+    cap = GuildConfig.MAX_ENTRIES
+    GuildConfig.MAX_ENTRIES = 3
+    before = GuildConfig.stats()
+    for gid in (1, 2, 3):
+        await GuildConfig.get(bot, gid)
+    for _ in range(5):
+        await GuildConfig.get(bot, 1)              # 1 is busy, so it is the most recent
+    await GuildConfig.get(bot, 4)                  # pushes out 2, the least recently used
+    after = GuildConfig.stats()
+    assert list(GuildConfig._cache) == [3, 1, 4], list(GuildConfig._cache)
+    assert after["evicted"] - before["evicted"] == 1, after
+    assert after["hits"] - before["hits"] == 5, after
+    assert after["misses"] - before["misses"] == 4, after
+    assert GuildConfig.hottest(1) == [(1, 6)], GuildConfig.hottest(3)
+    assert 2 not in GuildConfig._heat, "an evicted guild's count goes with it"
+    assert await GuildConfig.warm(bot, [7, 8, 9]) == 0, "warming never evicts"
+    GuildConfig.MAX_ENTRIES = cap
+    print(f"  capped at 3, evicted the idle one, hottest is {GuildConfig.hottest(1)} OK")
+
+    GuildConfig.prune()
+    assert GuildConfig.hottest(1) == [(1, 3)], "counts cool off on every prune"
+    print("  access counts halve on prune, so 'hottest' means lately OK")
+
     print("\n=== pruning ===")
     GuildConfig._cache.clear()
     await GuildConfig.get(bot, GUILD)
@@ -131,11 +272,72 @@ async def main():
     covered = {c for c, _, _ in INDEXES}
     # departures is gone: it was write-only and the memberships collection replaced it, with
     # its own indexes owned by the Members cog.
-    assert covered == {"servers", "roles"}, covered
+    assert covered == {"servers", "roles", "config_dirty"}, covered
+    assert TTLS["config_dirty"] == GuildConfig.DIRTY_FLAG_TTL > GuildConfig.STALE_TTL, \
+        "the dashboard's flags expire on their own, once no cached copy could predate them"
     assert any(c == "servers" and keys == [("guild_id", 1)] for c, keys, _ in INDEXES)
     assert any(c == "roles" and keys == [("date", 1), ("guild_id", 1)] for c, keys, _ in INDEXES)
     print("  all three original collections indexed OK")
 
+    print("\n=== a dashboard save is heard, not polled for ===")
+    import threading
+    import ConfigFeed
+    GuildConfig._cache.clear()
+    await GuildConfig.get(bot, GUILD)
+    await GuildConfig.get(bot, 4242)
+    GuildConfig._cache[555] = ({"_id": "doc-555", "guild_id": 555}, time.monotonic())
+    events = [
+        {"ns": {"coll": "config_dirty"}, "operationType": "update",
+         "documentKey": {"_id": GUILD}},
+        {"ns": {"coll": "servers"}, "operationType": "update",
+         "documentKey": {"_id": "x"}, "fullDocument": {"guild_id": 4242}},
+        # A deleted settings document carries only its _id.
+        {"ns": {"coll": "servers"}, "operationType": "delete",
+         "documentKey": {"_id": "doc-555"}},
+    ]
+    finished = threading.Event()
+
+    class FakeStream:
+        resume_token = {"_data": "t"}
+        def __init__(self): self.closed = threading.Event()
+        def __iter__(self):
+            yield from events
+            finished.set()
+            self.closed.wait(5)          # a live stream blocks until the next event
+            return
+        def close(self): self.closed.set()
+
+    opened = []
+    def watch(pipeline, **kw):
+        opened.append(kw)
+        return FakeStream()
+    DB.watch = watch
+    feed = ConfigFeed.ConfigFeed(bot)
+    assert await feed.start() is True
+    assert opened[0]["full_document"] == "updateLookup", "servers events need the guild_id"
+    await asyncio.to_thread(finished.wait, 5)
+    await asyncio.sleep(0.05)              # let the handed-back callbacks run
+    feed.close()
+    assert GUILD not in GuildConfig._cache, "a flagged guild is dropped"
+    assert 4242 not in GuildConfig._cache, "a servers write is dropped without a flag"
+    assert 555 not in GuildConfig._cache, "a deleted document is matched by its _id"
+    assert feed.stats["invalidated"] == 3, feed.stats
+    print("  flag, servers update and servers delete each invalidated OK")
+
+    print("\n=== no replica set means the poll stays ===")
+    def refuse(pipeline, **kw):
+        e = RuntimeError("The $changeStream stage is only supported on replica sets")
+        e.code = 40573
+        raise e
+    DB.watch = refuse
+    feed = ConfigFeed.ConfigFeed(bot)
+    assert await feed.start() is False
+    assert not feed.running
+    print("  a standalone server reports unavailable, so main keeps polling OK")
+
+    assert ConfigFeed.guild_of({"ns": {"coll": "servers"}, "documentKey": {"_id": "?"}}) is None
+    print("  an event naming no guild we know is ignored OK")
+
     print("\nALL CHECKS PASSED")
 
 asyncio.run(main())
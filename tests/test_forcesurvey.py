@@ -9,7 +9,7 @@ sys.path.insert(0, SRC_DIR)
 
 
 class FakeColl:
-    def __init__(self): self.docs = []
+    def __init__(self, name): self.name = name; self.docs = []
     def create_index(self, *a, **k): pass
     def _ref(self, q): return next(iter(self.find(q)), None)
     def find_one(self, q, *a, **k):
@@ -26,6 +26,12 @@ class FakeColl:
             h = dict(q); self.docs.append(h)
         h.update(ops.get("$set", {}))
         return types.SimpleNamespace(matched_count=1)
+    def update_many(self, q, ops, upsert=False):
+        for d in self.find(q): d.update(ops.get("$set", {}))
+    def bulk_write(self, requests, ordered=True):
+        self.batches = getattr(self, "batches", 0) + 1
+        for kind, q, *rest in requests:
+            getattr(self, kind)(q, *rest)
     def delete_many(self, q):
         gone = self.find(q)
         for d in gone: self.docs.remove(d)
@@ -34,7 +40,7 @@ class FakeColl:
 
 class FakeDB:
     def __init__(self): self.c = {}
-    def __getitem__(self, n): return self.c.setdefault(n, FakeColl())
+    def __getitem__(self, n): return self.c.setdefault(n, FakeColl(n))
 
 
 DB = FakeDB()
@@ -42,7 +48,11 @@ st = types.ModuleType("Database"); st.get_bot_database = lambda c: DB
 sys.modules["Database"] = st
 for n in ("pymongo", "certifi", "dotenv"):
     m = types.ModuleType(n)
-    if n == "pymongo": m.MongoClient = object
+    if n == "pymongo":
+        m.MongoClient = object
+        # What WriteBehind hands to bulk_write; FakeColl.bulk_write replays them.
+        m.UpdateOne = lambda q, ops, upsert=False: ("update_one", q, ops, upsert)
+        m.UpdateMany = lambda q, ops, upsert=False: ("update_many", q, ops, upsert)
     if n == "certifi": m.where = lambda: ""
     if n == "dotenv": m.load_dotenv = lambda *a, **k: None
     sys.modules[n] = m
@@ -64,16 +74,24 @@ class FakeChannel:
         SENT.append((self.id, content)); return FakeMsg()
 
 
+FETCHED = []
+
+
 class FakeGuild:
     def __init__(self, gid, cid): self.id = gid; self._cid = cid
+    def get_channel(self, i):
+        return FakeChannel(i) if i == self._cid else None
     async def fetch_channel(self, i):
+        FETCHED.append(("channel", i))
         if i == self._cid: return FakeChannel(i)
         raise discord.NotFound(types.SimpleNamespace(status=404, reason=""), "no")
     def get_role(self, rid): return None
 
 
 def d(offset):
-    return str((datetime.datetime.now() - datetime.timedelta(days=offset)).date())
+    # These servers set no timezone, so their cohorts are on UTC's calendar.
+    import GuildConfig
+    return str(GuildConfig.local_date(None, offset))
 
 
 async def main():
@@ -83,16 +101,17 @@ async def main():
         "botmain", str(ROOT / "src" / "main.py"))
     mod = importlib.util.module_from_spec(spec)
     src = open(str(ROOT / "src" / "main.py"), encoding="utf-8").read()
-    src = src.replace("bot = Bot()", "").replace(
-        'bot.run(os.environ.get("BOT_TOKEN"))', "")
     exec(compile(src, "main.py", "exec"), mod.__dict__)
     Bot = mod.Bot
 
     bot = Bot.__new__(Bot)          # skip __init__, we only need mention_players
     bot.MongoClient = object()
     guilds = {10: FakeGuild(10, 111), 20: FakeGuild(20, 222)}
+    # The gateway cache, as the bot sees it once ready. fetch_guild is only the fallback.
+    bot.get_guild = guilds.get
     bot.fetch_guild = lambda gid: _fg(gid)
-    async def _fg(gid): return guilds.get(gid)
+    async def _fg(gid):
+        FETCHED.append(("guild", gid)); return guilds.get(gid)
 
     DB["servers"].docs.extend([
         {"guild_id": 10, "discovery_channel": 111},
@@ -171,6 +190,31 @@ async def main():
     assert s["pinged"] == 2, s
     assert sorted(c for c, _ in SENT) == [111, 222], SENT
     print("  scheduled pass nudged both guilds OK")
+    assert not FETCHED, f"cached guilds and channels were fetched again: {FETCHED}"
+    print("  no REST fetches: guild and channel both came from the cache OK")
+
+    print("\n=== a big pass runs side by side, and marks in one batch ===")
+    live = {"now": 0, "peak": 0}
+    class SlowChannel(FakeChannel):
+        async def send(self, content=None, **kw):
+            live["now"] += 1; live["peak"] = max(live["peak"], live["now"])
+            await asyncio.sleep(0.01)
+            live["now"] -= 1
+            return await super().send(content, **kw)
+    class CachedGuild(FakeGuild):
+        def get_channel(self, i): return SlowChannel(i)
+    DB["roles"].docs.clear(); SENT.clear(); DB["roles"].batches = 0
+    for gid in range(1000, 1040):
+        guilds[gid] = CachedGuild(gid, 7)
+        DB["servers"].docs.append({"guild_id": gid, "discovery_channel": 7})
+        DB["roles"].docs.append({"_id": f"r{gid}", "date": d(8), "role_id": gid,
+                                 "guild_id": gid})
+    s = await bot.mention_players(days=8, cleanup=False)
+    assert s["pinged"] == 40, s
+    assert 1 < live["peak"] <= mod.REMIND_CONCURRENCY, live
+    assert all(r.get("mentioned") for r in DB["roles"].docs)
+    assert DB["roles"].batches == 1, f"{DB['roles'].batches} writes for 40 marks"
+    print(f"  40 cohorts, {live['peak']} at once, marks written in 1 batch OK")
 
     print("\nALL CHECKS PASSED")
 
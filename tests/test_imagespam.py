@@ -0,0 +1,316 @@
+"""The image spam filter: filenames, and what the pictures actually show.
+
+Renaming a file costs a spammer nothing, so the filename rules are backed by perceptual hashes
+of the images. Past the first check, "images" here are their grey pixels already shrunk, and
+decoding is the one step stood in for, so the rest runs the same with or without Pillow.
+Everything after it is the real code:
+
+- where Pillow is installed, real PNG and JPEG files decode and hash through ImageHash.run
+
+- the hashes tolerate small changes and tell different pictures apart, with or without NumPy
+- the per-guild index only matches inside its window, and holds a fixed number of hashes
+- renamed copies in one message, and the same picture reposted too often, are removed
+- MediaLog's bytes are used where it holds them, and nothing is downloaded a second time
+- each server switches it on and off for itself, and has its own counts of what it caught
+"""
+import pathlib as _pathlib
+# Resolved from this file so the suite runs from a clone, on any machine, from any cwd.
+ROOT = _pathlib.Path(__file__).resolve().parents[1]
+SRC_DIR = str(ROOT / "src")
+import asyncio, random, sys, time, types
+sys.path.insert(0, SRC_DIR)
+
+
+class FakeColl:
+    def __init__(self, name): self.name = name; self.docs = {}
+    def find_one(self, q, *a, **k):
+        key = q.get("_id", q.get("guild_id"))
+        return dict(self.docs[key]) if key in self.docs else None
+    def update_one(self, q, ops, upsert=False):
+        if "guild_id" in q:
+            self.docs.setdefault(q["guild_id"], {"guild_id": q["guild_id"]}).update(ops["$set"])
+            return
+        # The "not spam" mark: only where the message isn't marked already.
+        doc = self.docs.get(q["_id"])
+        if doc is None or q["marked"]["$ne"] in doc.get("marked", []):
+            return types.SimpleNamespace(modified_count=0)
+        for k, n in ops["$inc"].items():
+            doc[k] = doc.get(k, 0) + n
+        push = ops["$push"]["marked"]
+        doc["marked"] = (doc.get("marked", []) + push["$each"])[push["$slice"]:]
+        return types.SimpleNamespace(modified_count=1)
+    def bulk_write(self, requests, ordered=True):
+        for _kind, q, ops, _upsert in requests:
+            doc = self.docs.setdefault(q["_id"], {"_id": q["_id"]})
+            for k, n in ops["$inc"].items():
+                doc[k] = doc.get(k, 0) + n
+
+
+DB = {"servers": FakeColl("servers"), "imagespam_stats": FakeColl("imagespam_stats")}
+stub = types.ModuleType("Database"); stub.get_bot_database = lambda c: DB
+sys.modules["Database"] = stub
+pm = types.ModuleType("pymongo")
+pm.UpdateOne = lambda q, ops, upsert=False: ("update", q, ops, upsert)
+sys.modules["pymongo"] = pm
+
+import discord
+from discord.ext import commands
+import GuildConfig
+import ImageHash
+import WriteBehind
+
+
+def picture(seed: int, noise: int = 0) -> bytes:
+    """8x8 and 9x8 grey pixels of a made-up picture, `noise` levels of jitter added."""
+    rng = random.Random(seed)
+    base = [rng.randrange(256) for _ in range(72)]
+    jitter = random.Random(seed * 1000 + noise)
+    px = [max(0, min(255, p + jitter.randint(-noise, noise))) for p in base]
+    return bytes(px[:64]) + bytes(px)
+
+
+async def fake_run(_executor, blobs):
+    return [ImageHash.from_pixels(b[:64], b[64:]) if len(b) == 136 else None for b in blobs]
+
+
+class FakeChannel:
+    def __init__(self): self.id = 10; self.mention = "<#10>"; self.sent = []
+    async def send(self, text=None, **kw): self.sent.append((text, kw))
+
+
+def attachment(aid, name, data, downloads):
+    async def read():
+        downloads.append(name)
+        return data
+    return types.SimpleNamespace(id=aid, filename=name, size=len(data), read=read)
+
+
+_ids = iter(range(1000, 10**6))
+
+
+MODLOGS = {}                # guild -> its mod log channel, for the servers that have one
+
+
+def message(guild_id, *atts):
+    m = types.SimpleNamespace(
+        id=next(_ids), guild=types.SimpleNamespace(
+            id=guild_id, name="g",
+            get_channel=lambda cid: MODLOGS.get(guild_id) if cid == 77 else None),
+        author=types.SimpleNamespace(id=5, bot=False, mention="<@5>"),
+        channel=FakeChannel(), attachments=list(atts), content="", jump_url="x",
+        deleted=False)
+    async def delete(): m.deleted = True
+    m.delete = delete
+    return m
+
+
+async def main():
+    print("=== the hashes ===")
+    a, b, other = picture(1), picture(1, noise=4), picture(2)
+    ha, hb, ho = (ImageHash.from_pixels(p[:64], p[64:]) for p in (a, b, other))
+    assert ImageHash.near(ha, hb, 6), (ImageHash.distance(ha[0], hb[0]),
+                                       ImageHash.distance(ha[1], hb[1]))
+    assert not ImageHash.near(ha, ho, 6)
+    if ImageHash.np is not None:
+        saved, ImageHash.np = ImageHash.np, None
+        assert ImageHash.from_pixels(a[:64], a[64:]) == ha, "both paths hash alike"
+        ImageHash.np = saved
+    print(f"  re-encoded copy {ImageHash.distance(ha[1], hb[1])} bits off, another picture "
+          f"{ImageHash.distance(ha[1], ho[1])} OK")
+
+    if ImageHash.available():
+        import io
+        from PIL import Image, ImageFilter
+        rng = random.Random(3)
+        img = Image.frombytes("L", (32, 32), bytes(rng.randrange(256) for _ in range(1024)))
+        img = img.resize((256, 256)).filter(ImageFilter.GaussianBlur(8)).convert("RGB")
+        files = []
+        for fmt, kw in (("PNG", {}), ("JPEG", {"quality": 60})):
+            out = io.BytesIO()
+            img.save(out, fmt, **kw)
+            files.append(out.getvalue())
+        png, jpeg, junk = await ImageHash.run(None, files + [b"not an image"])
+        assert png and jpeg and junk is None, (png, jpeg, junk)
+        assert ImageHash.near(png, jpeg, 6), "the same picture, re-encoded lossily"
+        assert not ImageHash.near(png, ha, 6)
+        print(f"  a real PNG and its JPEG decoded and hashed "
+              f"{ImageHash.distance(png[1], jpeg[1])} bits apart OK")
+    else:
+        print("  no Pillow here, so real files weren't decoded")
+
+    print("\n=== hashes and previews share one pool, never forked from the bot ===")
+    import Workers
+    assert Workers.START_METHOD in ("forkserver", "spawn"), Workers.START_METHOD
+    hashes, previews = ImageHash.pool(1), Workers.pool("previews", 2)
+    if hashes is not None:
+        assert {hashes, previews} <= Workers._shares and Workers._pool is None, \
+            "nothing started before the first file"
+        assert Workers._executor()._max_workers == 3, "sized to what both asked for"
+        assert Workers._executor()._mp_context.get_start_method() == Workers.START_METHOD
+        hashes.shutdown(wait=False, cancel_futures=True)
+        assert Workers._pool is not None, "the previews still have their share"
+    previews.shutdown(wait=False, cancel_futures=True)
+    assert Workers._pool is None and not Workers._shares, "the last one out stops it"
+    print(f"  one pool of 3 by {Workers.START_METHOD}, stopped with its last user OK")
+
+    print("\n=== the rolling index ===")
+    index = ImageHash.HashIndex(size=4)
+    index.add(ha, 1, at=time.monotonic() - 3600)
+    index.add(ha, 2)
+    index.add(ho, 3)
+    assert index.matches(hb, 6, since=time.monotonic() - 60) == {2}, "the hour-old one is out"
+    for mid in range(4, 8):
+        index.add(ho, mid)
+    assert index.size == 4 and index.matches(ha, 6, since=0) == set(), "overwritten, oldest first"
+    print("  matches inside the window only; fixed size, oldest overwritten OK")
+
+    bot = commands.Bot(command_prefix="!", intents=discord.Intents.default())
+    bot.MongoClient = None
+    logged = []
+    async def send_log(**kw): logged.append(kw)
+    bot.send_log = send_log
+    await bot.load_extension("Cogs.ImageSpamFilter")
+    cog = bot.get_cog("ImageSpamFilter")
+    IS = sys.modules["Cogs.ImageSpamFilter"]
+    cog.similarity = True
+    ImageHash.run = fake_run
+
+    print("\n=== filenames alone still do it ===")
+    downloads = []
+    m = message(1, attachment(1, "1.png", other, downloads), attachment(2, "2.png", a, downloads))
+    await cog.on_message(m)
+    assert m.deleted and logged[-1]["fields"]["Why"] == "spam filenames"
+    assert not downloads, "nothing needs fetching to read a filename"
+    print("  1.png, 2.png removed without looking at them OK")
+
+    print("\n=== renamed copies in one message ===")
+    m = message(1, attachment(3, "sunset.png", a, downloads),
+                attachment(4, "holiday.png", b, downloads))
+    await cog.on_message(m)
+    assert m.deleted and "same picture 2 times" in logged[-1]["fields"]["Why"], logged[-1]
+    m = message(1, attachment(5, "cat.png", a, downloads), attachment(6, "dog.png", other,
+                                                                       downloads))
+    await cog.on_message(m)
+    assert not m.deleted, "two different pictures are just two pictures"
+    print("  same picture under two names removed, two different ones kept OK")
+
+    print("\n=== the same picture, over and over ===")
+    downloads.clear()
+    held = {}
+    class FakeMediaLog:
+        async def files_of(self, message):
+            return {att.id: held[att.id] for att in message.attachments}
+        async def capture_now(self, message): pass
+    bot.get_cog = lambda name: FakeMediaLog() if name == "MediaLog" else None
+    posts = []
+    for i in range(IS.REPOST_LIMIT + 1):
+        held[100 + i] = picture(7, noise=i)
+        posts.append(message(2, attachment(100 + i, f"meme{i}.png", held[100 + i], downloads)))
+        await cog.on_message(posts[-1])
+    assert [p.deleted for p in posts] == [False] * IS.REPOST_LIMIT + [True], \
+        [p.deleted for p in posts]
+    assert "posted 4 times" in logged[-1]["fields"]["Why"], logged[-1]
+    assert not downloads, "every byte came from the media log"
+    held[200] = picture(7)
+    elsewhere = message(3, attachment(200, "meme.png", held[200], downloads))
+    await cog.on_message(elsewhere)
+    assert not elsewhere.deleted, "another server's index is its own"
+    print(f"  copy {IS.REPOST_LIMIT + 1} removed, reposts counted per server, nothing "
+          f"downloaded OK")
+
+    print("\n=== without the media log, single images aren't fetched ===")
+    bot.get_cog = lambda name: None
+    lone = message(4, attachment(300, "pic.png", a, downloads))
+    await cog.on_message(lone)
+    assert not downloads and not lone.deleted
+    pair = message(4, attachment(301, "x.png", a, downloads), attachment(302, "y.png", b,
+                                                                          downloads))
+    await cog.on_message(pair)
+    assert sorted(downloads) == ["x.png", "y.png"] and pair.deleted
+    print("  a batch is fetched to be checked, a lone picture isn't OK")
+
+    print("\n=== each server has its own switch ===")
+    bot.get_cog = lambda name: None
+
+    class Response:
+        def __init__(self): self.sent = []; self.edited = []
+        async def send_message(self, text, **kw): self.sent.append(text)
+        async def edit_message(self, **kw): self.edited.append(kw)
+
+    def interaction(guild_id, can_manage=True, custom_id=None):
+        return types.SimpleNamespace(
+            guild=types.SimpleNamespace(id=guild_id), response=Response(),
+            user=types.SimpleNamespace(guild_permissions=types.SimpleNamespace(
+                manage_messages=can_manage)),
+            type=discord.InteractionType.component, data={"custom_id": custom_id or ""})
+
+    off = interaction(5)
+    await cog.toggleimagespam.callback(cog, off)
+    assert "disabled" in off.response.sent[0], off.response.sent
+    assert DB["servers"].docs[5]["imagespam"]["enabled"] is False, "kept in its settings"
+    quiet = message(5, attachment(400, "1.png", a, downloads), attachment(401, "2.png", b,
+                                                                          downloads))
+    await cog.on_message(quiet)
+    noisy = message(6, attachment(402, "1.png", a, downloads), attachment(403, "2.png", b,
+                                                                          downloads))
+    await cog.on_message(noisy)
+    assert not quiet.deleted and noisy.deleted, "switched off in 5 only"
+    names_only = interaction(6)
+    await cog.toggleimagespam.callback(cog, names_only, similarity=False)
+    assert GuildConfig._cache.get(6) is None, "the shared settings cache sees it at once"
+    reposts = [message(6, attachment(410 + i, f"same{i}.png", picture(9, noise=i), downloads),
+                       attachment(420 + i, f"other{i}.png", picture(9, noise=i), downloads))
+               for i in range(2)]
+    for m in reposts:
+        await cog.on_message(m)
+    assert not any(m.deleted for m in reposts), "pictures aren't compared here any more"
+    print("  off in one server, names-only in another, the rest untouched OK")
+
+    print("\n=== counts, and a moderator saying it got one wrong ===")
+    assert "delete_after" not in noisy.channel.sent[-1][1], \
+        "with no mod log the button is on the notice, and the notice stays up for it"
+    notice = noisy.channel.sent[-1][1]["view"].children[0]
+    assert notice.custom_id == f"imagespam:fp:{noisy.id}"
+    nobody = interaction(6, can_manage=False, custom_id=notice.custom_id)
+    await cog.on_interaction(nobody)
+    assert "Only people who can manage messages" in nobody.response.sent[0]
+    for _ in range(2):                      # a double click counts once
+        mod = interaction(6, custom_id=notice.custom_id)
+        await cog.on_interaction(mod)
+        assert mod.response.edited and mod.response.edited[0]["view"] is None
+    # As does pressing it again after a restart: the mark is in the database, not the cog.
+    await bot.reload_extension("Cogs.ImageSpamFilter")
+    cog = bot.cogs["ImageSpamFilter"]
+    cog.similarity = True
+    mod = interaction(6, custom_id=notice.custom_id)
+    await cog.on_interaction(mod)
+    assert DB["imagespam_stats"].docs[6]["marked"] == [noisy.id]
+    status = interaction(6)
+    await cog.imagespamstatus.callback(cog, status)
+    assert "Caught 1 • deleted 1 • marked not spam 1" in status.response.sent[0], \
+        status.response.sent
+    assert "filenames only" in status.response.sent[0]
+    assert 5 not in DB["imagespam_stats"].docs, "nothing counted where it was off"
+    print("  caught, deleted and not-spam counted per server, once per notice OK")
+
+    print("\n=== with a mod log, the button waits there ===")
+    MODLOGS[7] = FakeChannel()
+    GuildConfig._cache.pop(7, None)
+    DB["servers"].docs[7] = {"guild_id": 7, "modlog_channel": 77}
+    caught = message(7, attachment(500, "1.png", a, downloads), attachment(501, "2.png", b,
+                                                                           downloads))
+    await cog.on_message(caught)
+    assert caught.deleted and caught.channel.sent[-1][1] == {"delete_after": 20}, \
+        "the notice in the channel is brief"
+    post = MODLOGS[7].sent[-1][1]
+    assert post["view"].children[0].custom_id == f"imagespam:fp:{caught.id}"
+    assert post["embed"].fields[2].value == "spam filenames"
+    await cog.on_interaction(interaction(7, custom_id=f"imagespam:fp:{caught.id}"))
+    assert DB["imagespam_stats"].docs[7]["false_positives"] == 1
+    print("  notice gone in 20 seconds, the button kept on the mod log post OK")
+    await WriteBehind.close()
+
+    print("\nALL CHECKS PASSED")
+
+
+asyncio.run(main())
@@ -20,8 +20,8 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 
+# Run under a module name of its own, so main.py's `__main__` guard keeps the bot from starting.
 SRC = open(str(ROOT / "src" / "main.py"), encoding="utf-8").read()
-SRC = SRC.replace("bot = Bot()", "").replace('bot.run(os.environ.get("BOT_TOKEN"))', "")
 
 
 def load_module():
@@ -28,7 +28,8 @@ class FakeColl:
 
     def insert_one(self, d):
         self._ids += 1
-        doc = dict(d, _id=self._ids)
+        doc = dict(d)
+        doc.setdefault("_id", self._ids)
         self.docs.append(doc)
         return types.SimpleNamespace(inserted_id=doc["_id"])
 
@@ -39,6 +40,11 @@ class FakeColl:
                 return types.SimpleNamespace(matched_count=1)
         return types.SimpleNamespace(matched_count=0)
 
+    def bulk_write(self, requests, ordered=True):
+        for op in requests:
+            if op[0] == "insert": self.insert_one(op[1])
+            else: self.update_one(op[1], op[2], upsert=op[3])
+
 
 class FakeDB:
     def __init__(self): self.c = {}
@@ -50,13 +56,18 @@ stub = types.ModuleType("Database"); stub.get_bot_database = lambda c: DB
 sys.modules["Database"] = stub
 for name in ("pymongo", "certifi", "dotenv"):
     mod = types.ModuleType(name)
-    if name == "pymongo": mod.MongoClient = lambda *a, **k: object()
+    if name == "pymongo":
+        mod.MongoClient = lambda *a, **k: object()
+        # What WriteBehind hands to bulk_write; FakeColl.bulk_write replays them.
+        mod.InsertOne = lambda doc: ("insert", doc)
+        mod.UpdateOne = lambda q, ops, upsert=False: ("update", q, ops, upsert)
     if name == "certifi": mod.where = lambda: ""
     if name == "dotenv": mod.load_dotenv = lambda *a, **k: None
     sys.modules[name] = mod
 
 import discord
 from discord.ext import commands
+import WriteBehind
 
 
 class FakeInvite:
@@ -221,6 +232,7 @@ async def main():
 
     # Nothing stubbed: the real on_member_join asks the real cog through the real guild.
     await members.on_member_join(types.SimpleNamespace(id=555, bot=False, guild=joined))
+    await WriteBehind.flush()          # the spell and its invite are queued, then written together
 
     spell = DB["memberships"].docs[-1]
     assert spell["invite_code"] == "promo", spell
@@ -247,7 +259,7 @@ async def main():
             timeout=0.4)
     except asyncio.TimeoutError:
         pass                      # the handler is still stuck on the fetch, which is fine
-    await asyncio.sleep(0)
+    await WriteBehind.flush()
     assert len(DB["memberships"].docs) == before + 1, "the join was held up by the lookup"
     assert DB["memberships"].docs[-1]["user_id"] == 600
     assert DB["memberships"].docs[-1]["invite_code"] is None, "nothing to attribute yet"
@@ -273,6 +285,7 @@ async def main():
     await asyncio.gather(*[
         members.on_member_join(types.SimpleNamespace(id=700 + n, bot=False, guild=rush))
         for n in range(10)])
+    await WriteBehind.flush()
     assert len(DB["memberships"].docs) == before + 10, "every join still recorded"
     assert calls["n"] == 1, f"{calls['n']} invite fetches for 10 simultaneous joins"
     assert not cog.busy, "the in flight marker has to clear"
@@ -284,6 +297,7 @@ async def main():
     before = len(DB["memberships"].docs)
     joined.use("promo")          # an invite really was used, and still nothing can read it
     await members.on_member_join(types.SimpleNamespace(id=556, bot=False, guild=joined))
+    await WriteBehind.flush()
     assert len(DB["memberships"].docs) == before + 1, "the join still has to be recorded"
     assert DB["memberships"].docs[-1]["invite_code"] is None
     print("  the join is still recorded, just without a code OK")
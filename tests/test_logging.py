@@ -52,6 +52,7 @@ for n in ("pymongo", "certifi", "dotenv"):
 
 import discord
 from discord.ext import commands
+import AuditTail
 import GuildConfig
 
 GUILD, MAIN, OTHER, ROOM = 1, 900, 901, 902
@@ -77,6 +78,7 @@ CHANNELS = {}
 
 def reset_channels(main_ok=True):
     CHANNELS.clear()
+    AuditTail._tails.clear()
     CHANNELS[MAIN] = FakeChannel(MAIN, "server-log", main_ok)
     CHANNELS[OTHER] = FakeChannel(OTHER, "join-log")
     CHANNELS[ROOM] = FakeChannel(ROOM, "general")
@@ -272,7 +274,7 @@ async def main():
 
     print("\n=== bans name who did it when the audit log is readable ===")
     entry = types.SimpleNamespace(
-        created_at=datetime.datetime.now(datetime.timezone.utc),
+        id=1, created_at=datetime.datetime.now(datetime.timezone.utc),
         target=types.SimpleNamespace(id=500),
         user=FakeUser(7, "a mod"), reason="spam")
     reset_channels()
@@ -295,7 +297,7 @@ async def main():
     print("\n=== a ban placed with /ban is not logged twice ===")
     # The bot is the one calling guild.ban, so the audit log names the bot.
     by_bot = types.SimpleNamespace(
-        created_at=datetime.datetime.now(datetime.timezone.utc),
+        id=2, created_at=datetime.datetime.now(datetime.timezone.utc),
         target=types.SimpleNamespace(id=500),
         user=FakeUser(BOT_ID, "Newt"), reason="tet: spam")
 
@@ -316,7 +318,7 @@ async def main():
 
     # Somebody banning through Discord's own menu has no case, so it must always log.
     by_hand = types.SimpleNamespace(
-        created_at=datetime.datetime.now(datetime.timezone.utc),
+        id=3, created_at=datetime.datetime.now(datetime.timezone.utc),
         target=types.SimpleNamespace(id=500),
         user=FakeUser(7, "a mod"), reason=None)
     reset_channels()
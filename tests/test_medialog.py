@@ -4,9 +4,14 @@ import pathlib as _pathlib
 ROOT = _pathlib.Path(__file__).resolve().parents[1]
 SRC_DIR = str(ROOT / "src")
 WEB_DIR = str(ROOT / "web")
-import asyncio, io, sys, types, datetime, time
+import asyncio, io, os, shutil, sys, tempfile, types, datetime, time
 
 sys.path.insert(0, SRC_DIR)
+# The disk tier writes somewhere of the suite's own, not wherever the bot would.
+SPILL = tempfile.mkdtemp(prefix="medialog-test-")
+os.environ["MEDIALOG_SPILL_DIR"] = SPILL
+# Checkpoints are run by hand below, so none lands in the middle of another check.
+os.environ["MEDIALOG_CHECKPOINT_SECONDS"] = "0"
 stub = types.ModuleType("Database"); stub.get_bot_database = lambda c: None
 sys.modules["Database"] = stub
 for n in ("pymongo", "certifi", "dotenv"):
@@ -18,6 +23,30 @@ for n in ("pymongo", "certifi", "dotenv"):
 
 import discord
 from discord.ext import commands
+import SpillStore
+
+
+def round_trip(entry):
+    """An entry as it would come back from disk, without the disk: shared bytes are put back
+    where the record names them, as the store does on the way out."""
+    ML = sys.modules["Cogs.MediaLog"]
+    meta, blobs, stored_at = ML._to_record(entry)
+    blobs = [b.data if isinstance(b, SpillStore.Shared) else b for b in blobs]
+    return ML._from_record(meta, blobs, stored_at)
+
+
+async def drained(cog):
+    """Wait for every log channel's queue to go out, the way the bot's own sends do."""
+    while cog._senders:
+        await asyncio.gather(*cog._senders.values(), return_exceptions=True)
+
+
+async def log_one(cog, entry, who):
+    """One entry through the real outbox, then wait for it to be sent."""
+    ML = sys.modules["Cogs.MediaLog"]
+    cog._enqueue(ML.Outgoing(None, {"medialog_channel": 999}, entry, who,
+                             discord.utils.utcnow()))
+    await drained(cog)
 
 
 async def main():
@@ -62,41 +91,97 @@ async def main():
 
     # ---- cache + eviction ----
     print("\n=== cache eviction ===")
-    def mk(mid, nbytes):
-        e = ML.CachedMessage(
+    def body(mid, nbytes):
+        """Different bytes for every message, or they'd all share one blob."""
+        return f"{mid}:".encode().ljust(nbytes, b"0")
+
+    def entry_of(mid, nbytes, data=None):
+        data = body(mid, nbytes) if data is None else data
+        return ML.CachedMessage(
             guild_id=1, channel_id=2, author_id=3, author_tag="u#1", author_avatar=None,
             author_bot=False, content="hi", created_at=discord.utils.utcnow(),
-            files=[F("x.png", b"0" * nbytes, "image/png", nbytes, False)],
-            nbytes=nbytes, cached_at=time.monotonic())
-        cog._cache[mid] = e
-        cog._bytes += nbytes
-        cog._evict()
+            files=[F("x.png", data, "image/png", len(data), False)],
+            nbytes=len(data), cached_at=time.monotonic())
+
+    def mk(mid, nbytes, data=None):
+        cog._store(mid, entry_of(mid, nbytes, data))
+
+    def reset():
+        cog._cache.clear(); cog._blobs.clear(); cog._hints.clear(); cog._bytes = 0
+
+    def held_bytes():
+        return sum(len(b.data) for b in cog._blobs.values())
 
     for i in range(ML.MAX_CACHE_ENTRIES + 25):
         mk(i, 1024)
     assert len(cog._cache) <= ML.MAX_CACHE_ENTRIES, len(cog._cache)
     print(f"  entry cap honoured: {len(cog._cache)} <= {ML.MAX_CACHE_ENTRIES}")
     assert cog._bytes == sum(e.nbytes for e in cog._cache.values()), "byte counter drifted"
+    assert cog._bytes == held_bytes()
     print(f"  byte counter consistent: {cog._bytes}")
 
-    cog._cache.clear(); cog._bytes = 0
+    reset()
     big = ML.MAX_CACHE_BYTES // 4
     for i in range(10):
-        mk(1000 + i, big)
+        mk(5000 + i, big)
     assert cog._bytes <= ML.MAX_CACHE_BYTES, cog._bytes
     print(f"  byte cap honoured: {ML._fmt_size(cog._bytes)} <= {ML._fmt_size(ML.MAX_CACHE_BYTES)}")
     assert cog._bytes == sum(e.nbytes for e in cog._cache.values()), "byte counter drifted"
+    assert cog._bytes == held_bytes()
 
     # oldest evicted first
-    cog._cache.clear(); cog._bytes = 0
+    reset()
     for i in range(ML.MAX_CACHE_ENTRIES + 5):
         mk(i, 10)
     assert 0 not in cog._cache and 4 not in cog._cache, "oldest should have gone first"
     assert (ML.MAX_CACHE_ENTRIES + 4) in cog._cache, "newest should survive"
     print("  oldest-first order confirmed")
 
+    print("\n=== what leaves memory goes to disk, and comes back on delete ===")
+    await asyncio.gather(*cog._spill_tasks)
+    assert 0 in cog._spill and 4 in cog._spill, "evicted means demoted, not dropped"
+    assert not cog._spilling, "nothing left half written"
+    back = await cog._take(0)
+    assert back is not None and back.files[0].data == body(0, 10), back
+    assert back.author_tag == "u#1" and back.created_at.tzinfo is not None
+    assert 0 not in cog._spill, "taken once, gone"
+    assert await cog._take(0) is None
+    print(f"  {len(cog._spill)} on disk; one read back byte for byte, then gone OK")
+
+    # A delete that lands while the write is still in flight finds the entry in hand, and
+    # the copy that reaches disk afterwards is thrown away rather than left to go stale.
+    mk(90001, 10)
+    cog._cache.move_to_end(90001, last=False)
+    cog._bytes += ML.MAX_CACHE_BYTES       # forces exactly the oldest out
+    cog._evict()
+    cog._bytes -= ML.MAX_CACHE_BYTES
+    assert 90001 in cog._spilling
+    caught = await cog._take(90001)
+    assert caught is not None and caught.files[0].data == body(90001, 10)
+    await asyncio.gather(*cog._spill_tasks)
+    assert 90001 not in cog._spill, "the late disk copy is discarded"
+    print("  a delete racing the write gets the entry, and the disk copy is dropped OK")
+
+    # Bytes shared in memory stay shared on disk: one copy however many messages carry them.
+    picture = os.urandom(50_000)
+    for mid in range(90100, 90110):
+        mk(mid, 0, picture)
+    before = cog._spill.bytes
+    for mid in range(90100, 90110):
+        cog._demote(mid, cog._drop(mid))
+    await asyncio.gather(*cog._spill_tasks)
+    assert cog._spill.bytes - before < len(picture) * 2, \
+        f"ten messages, one copy of the picture: {cog._spill.bytes - before} bytes written"
+    assert cog._spill.stats["shared"] >= 9, cog._spill.stats
+    key = ML._disk_key(ML._digest(picture), None)
+    for mid in range(90100, 90110):
+        assert key in cog._spill, "kept while any message names it"
+        assert (await cog._take(mid)).files[0].data == picture, mid
+    assert key not in cog._spill, "and gone with the last of them"
+    print("  a picture in ten messages is written to disk once OK")
+
     # _drop keeps the counter straight
-    cog._cache.clear(); cog._bytes = 0
+    reset()
     mk(555, 4096)
     before = cog._bytes
     cog._drop(555)
@@ -104,6 +189,131 @@ async def main():
     assert cog._drop(999) is None, "dropping an absent id should be safe"
     print("  _drop adjusts bytes and tolerates misses")
 
+    print("\n=== the same bytes are held once, however many messages carry them ===")
+    reset()
+    meme = b"the same meme" * 100
+    for mid in (601, 602, 603):
+        mk(mid, 0, data=meme)
+    assert len(cog._blobs) == 1 and cog._bytes == len(meme), (len(cog._blobs), cog._bytes)
+    assert cog._cache[601].files[0].data is cog._cache[603].files[0].data, "one copy, shared"
+    (blob,) = cog._blobs.values()
+    assert blob.refs == 3
+    cog._drop(601); cog._drop(602)
+    assert cog._bytes == len(meme) and blob.refs == 1, "still one message using it"
+    cog._drop(603)
+    assert cog._bytes == 0 and not cog._blobs, "freed with the last message holding it"
+    print(f"  3 messages, {len(meme)} bytes held once, freed with the last OK")
+
+    def att(name, data, reads, width=64):
+        async def read():
+            reads.append(name)
+            await asyncio.sleep(0.01)
+            return data
+        return types.SimpleNamespace(filename=name, size=len(data), content_type="image/png",
+                                     width=width, height=64, is_spoiler=lambda: False,
+                                     read=read)
+
+    def posted(mid, guild_id, *atts):
+        return types.SimpleNamespace(
+            id=mid, guild=types.SimpleNamespace(id=guild_id),
+            channel=types.SimpleNamespace(id=222),
+            author=types.SimpleNamespace(id=333, bot=False,
+                                         display_avatar=types.SimpleNamespace(url=None)),
+            content="", created_at=discord.utils.utcnow(), attachments=list(atts))
+
+    reset()
+    reads = []
+    reused = cog.stats["reused"]
+    await cog._capture(posted(611, 1), [att("spam.png", meme, reads)])
+    await cog._capture(posted(612, 1), [att("spam.png", meme, reads)])
+    assert reads == ["spam.png"], f"the second post matched what was held: {reads}"
+    assert cog.stats["reused"] == reused + 1
+    digest = ML._digest(meme)
+    assert cog._cache[612].files[0].data == meme and cog._blobs[digest].refs == 2
+    print("  a repost matching name, size, type and size on screen skips the download OK")
+
+    await cog._capture(posted(613, 1), [att("spam.png", meme, reads, width=65)])
+    assert len(reads) == 2, "different dimensions, so not assumed to be the same file"
+    await cog._capture(posted(614, 2), [att("spam.png", meme, reads)])
+    assert len(reads) == 3, "another server's upload is never assumed to be this one"
+    assert len(cog._blobs) == 1 and cog._blobs[digest].refs == 4, \
+        "but once downloaded, identical bytes still share the one copy"
+    print("  no reuse on a near match or across servers, bytes shared all the same OK")
+
+    reset()
+    reads.clear()
+    raid = [posted(620 + i, 1, att("raid.png", b"raid" * 500, reads)) for i in range(20)]
+    await asyncio.gather(*(cog._capture(m, list(m.attachments)) for m in raid))
+    assert reads == ["raid.png"], f"twenty posts at once, one download: {len(reads)}"
+    assert len(cog._blobs) == 1 and cog._blobs[ML._digest(b"raid" * 500)].refs == 20
+    assert not cog._fetching, "nothing left waiting"
+    print("  20 simultaneous posts of one file wait on a single download OK")
+
+    reads.clear()
+    def failing(name):
+        async def read():
+            reads.append(name)
+            await asyncio.sleep(0.01)
+            raise RuntimeError("cdn hiccup")
+        return types.SimpleNamespace(filename=name, size=10, content_type="image/png",
+                                     width=1, height=1, is_spoiler=lambda: False, read=read)
+    await asyncio.gather(*(cog._capture(posted(650 + i, 1, failing("x.png")),
+                                        [failing("x.png")]) for i in range(3)))
+    assert reads == ["x.png"] and all(cog._cache[650 + i].files[0].data is None
+                                      for i in range(3)), "a failed download fails its waiters"
+    assert not cog._fetching
+    print("  a failed download is reported to everyone waiting on it OK")
+    reset()
+
+    print("\n=== downloads take turns by server, within a byte budget ===")
+    workers, budget = ML.DOWNLOAD_WORKERS, ML.DOWNLOAD_BUDGET
+    ML.DOWNLOAD_WORKERS = 1
+    reads.clear()
+    raiders = [posted(700 + i, 5, att(f"r{i}.png", b"r%d" % i * 100, reads)) for i in range(6)]
+    quiet = posted(710, 6, att("q.png", b"quiet" * 100, reads))
+    tasks_ = [asyncio.create_task(cog._capture(m, list(m.attachments))) for m in raiders]
+    await asyncio.sleep(0)
+    tasks_.append(asyncio.create_task(cog._capture(quiet, list(quiet.attachments))))
+    await asyncio.sleep(0)
+    assert cog.stats["queue_depth"] >= 5, cog.stats["queue_depth"]
+    await asyncio.gather(*tasks_)
+    assert reads.index("q.png") <= 2, f"the quiet server waited behind the raid: {reads}"
+    assert cog.stats["queue_depth"] == 0 and cog.stats["queue_peak"] >= 6
+    assert not cog._reserved and not cog._reserved_by, "every reservation given back"
+    print(f"  one worker, 6 raid files queued first, the other server's was download "
+          f"{reads.index('q.png') + 1} of 7 OK")
+
+    reads.clear()
+    late = [posted(720 + i, 5, att(f"l{i}.png", b"l%d" % i * 100, reads)) for i in range(3)]
+    tasks_ = [asyncio.create_task(cog._capture(m, list(m.attachments))) for m in late]
+    await asyncio.sleep(0)
+    doomed = posted(730, 5, att("doomed.png", b"doomed" * 100, reads))
+    await cog._capture(doomed, list(doomed.attachments), urgent=True)
+    assert reads.index("doomed.png") <= 1, f"about to be deleted, so it goes next: {reads}"
+    await asyncio.gather(*tasks_)
+    print("  a file another cog is about to delete jumps the queue OK")
+
+    reset()
+    reads.clear()
+    ML.DOWNLOAD_WORKERS = workers
+    ML.DOWNLOAD_BUDGET = 10_000
+    shed = cog.stats["shed"]
+    flood = [posted(740 + i, 5, att(f"f{i}.png", b"%04d" % i * 500, reads)) for i in range(5)]
+    other = posted(750, 6, att("o.png", b"other" * 400, reads))
+    await asyncio.gather(*(cog._capture(m, list(m.attachments)) for m in flood + [other]))
+    kept = [m.id for m in flood if cog._cache[m.id].files[0].data is not None]
+    assert len(kept) == 2, f"2 KB each against half of a 10 KB budget: {kept}"
+    assert cog.stats["shed"] == shed + 3
+    assert cog._cache[750].files[0].data is not None, \
+        "the flood used its own share, not the other server's"
+    dropped = cog._cache[744].files[0]
+    assert dropped.shed and "too many uploads at once" in ML._not_kept(dropped)
+    assert round_trip(cog._cache[744]).files[0].shed, "and on disk too"
+    assert len(reads) == 3, "what went over was never downloaded at all"
+    ML.DOWNLOAD_BUDGET = budget
+    print("  over its share, a server's files are logged without bytes, not queued OK")
+    reset()
+
     # ---- embed building, with a real PNG so set_image is exercised ----
     print("\n=== embed ===")
     png = (b"\x89PNG\r\n\x1a\n" + b"\x00" * 64)
@@ -125,7 +335,7 @@ async def main():
             return types.SimpleNamespace(id=1)
     cog._log_channel = lambda g, c: FakeChannel()
 
-    await cog._send(None, {"medialog_channel": 999}, entry, "Mod#1 (`77`)", discord.utils.utcnow())
+    await log_one(cog, entry, "Mod#1 (`77`)")
 
     e = sent["embeds"][0]
     print(f"  title: {e.title}")
@@ -167,7 +377,7 @@ async def main():
         content="", created_at=discord.utils.utcnow(),
         files=[F("one.png", png, "image/png", len(png), False)],
         nbytes=len(png), cached_at=time.monotonic())
-    await cog._send(None, {"medialog_channel": 999}, solo, None, discord.utils.utcnow())
+    await log_one(cog, solo, None)
     e3 = sent["embeds"][0]
     assert e3.image.url, "it is still shown"
     assert e3.fields == [], f"nothing to say twice: {[f.name for f in e3.fields]}"
@@ -182,7 +392,7 @@ async def main():
         author_bot=True, content="", created_at=discord.utils.utcnow(),
         files=[F("nsfw.png", png, "image/png", len(png), True)],
         nbytes=len(png), cached_at=time.monotonic())
-    await cog._send(None, {"medialog_channel": 999}, entry2, None, discord.utils.utcnow())
+    await log_one(cog, entry2, None)
     e2 = sent["embeds"][0]
     assert e2.image.url is None, "spoilers must stay blurred, not inlined"
     assert sent["files"][0].filename.startswith("SPOILER_")
@@ -202,7 +412,7 @@ async def main():
         created_at=discord.utils.utcnow(),
         files=[F(f"pic{i}.png", png, "image/png", len(png), False) for i in range(4)],
         nbytes=len(png) * 4, cached_at=time.monotonic())
-    await cog._send(None, {"medialog_channel": 999}, four, None, discord.utils.utcnow())
+    await log_one(cog, four, None)
     embeds = sent["embeds"]
     assert len(embeds) == 4, f"one embed per picture, got {len(embeds)}"
     # The client only draws them as one grid when every embed carries the same url.
@@ -223,7 +433,7 @@ async def main():
 
     print("\n=== a single picture is left exactly as it was ===")
     sent.clear()
-    await cog._send(None, {"medialog_channel": 999}, solo, None, discord.utils.utcnow())
+    await log_one(cog, solo, None)
     assert len(sent["embeds"]) == 1, "no gallery, no extra embeds"
     assert sent["embeds"][0].url is None, "and no link on the title where there was none before"
     print("  one embed, no url set OK")
@@ -236,7 +446,7 @@ async def main():
         created_at=discord.utils.utcnow(),
         files=[F(f"p{i}.png", png, "image/png", len(png), False) for i in range(6)],
         nbytes=len(png) * 6, cached_at=time.monotonic())
-    await cog._send(None, {"medialog_channel": 999}, six, None, discord.utils.utcnow())
+    await log_one(cog, six, None)
     assert len(sent["embeds"]) == ML.GALLERY_MAX, len(sent["embeds"])
     assert len(sent["files"]) == 6, "all six are still attached, just not all in the grid"
     listed = [f.value for f in sent["embeds"][0].fields if f.name == "Files"]
@@ -252,7 +462,7 @@ async def main():
         files=[F("IMG 1.png", png, "image/png", len(png), False),
                F("IMG_1.png", png, "image/png", len(png), False)],
         nbytes=len(png) * 2, cached_at=time.monotonic())
-    await cog._send(None, {"medialog_channel": 999}, clash, None, discord.utils.utcnow())
+    await log_one(cog, clash, None)
     names = [f.filename for f in sent["files"]]
     assert len(set(names)) == 2, f"attachment:// would pick whichever: {names}"
     assert len({e.image.url for e in sent["embeds"]}) == 2, "and each embed points at its own"
@@ -267,7 +477,7 @@ async def main():
         files=[F("safe.png", png, "image/png", len(png), False),
                F("nsfw.png", png, "image/png", len(png), True)],
         nbytes=len(png) * 2, cached_at=time.monotonic())
-    await cog._send(None, {"medialog_channel": 999}, mixed, None, discord.utils.utcnow())
+    await log_one(cog, mixed, None)
     assert len(sent["embeds"]) == 1, "the spoiler must not become a second embed"
     assert "nsfw" not in (sent["embeds"][0].image.url or "")
     assert any(f.filename.startswith("SPOILER_") for f in sent["files"])
@@ -280,6 +490,107 @@ async def main():
     assert "before a restart" in ML._not_kept(F("old.png", None, "image/png", 500, False))
     print("  too large and posted-before-a-restart read differently OK")
 
+    print("\n=== a file too large to keep is kept as a preview ===")
+    import Thumbnails
+    from concurrent.futures import ThreadPoolExecutor
+    if Thumbnails.Image is not None:
+        # The real thing, end to end, on a photo far larger than the preview.
+        from PIL import Image
+        photo = os.path.join(SPILL, "photo.jpg")
+        Image.new("RGB", (6000, 4000), (200, 30, 90)).save(photo, quality=95)
+        made = Thumbnails.make(_pathlib.Path(photo).as_uri(), "image", 100 * 1024 * 1024)
+        with Image.open(io.BytesIO(made)) as small:
+            assert max(small.size) == Thumbnails.EDGE and small.format == "JPEG", small.size
+        assert Thumbnails.make(_pathlib.Path(photo).as_uri(), "image", 1000) is None, \
+            "a file larger than it claimed is abandoned, not read to the end"
+        print(f"  6000x4000 photo -> {len(made)} byte JPEG, {Thumbnails.EDGE}px wide OK")
+    else:
+        assert not Thumbnails.can_preview("image") or Thumbnails.FFMPEG
+        print("  (no Pillow here, so the preview itself is left to the fake below)")
+
+    made_for = []
+    def fake_make(url, kind, max_bytes):
+        made_for.append((url, kind))
+        return b"\xff\xd8 preview of " + url.encode()
+    real = Thumbnails.make, Thumbnails.can_preview, cog._previewer
+    Thumbnails.make = fake_make
+    Thumbnails.can_preview = lambda kind: kind in ("image", "video")
+    cog._previewer = ThreadPoolExecutor(max_workers=1)
+
+    def huge(name, ctype):
+        return types.SimpleNamespace(filename=name, size=40 * 1024 * 1024, content_type=ctype,
+                                     width=4000, height=3000, is_spoiler=lambda: False,
+                                     url=f"https://cdn.test/{name}")
+    reset()
+    await cog._capture(posted(801, 1), [huge("phone.jpg", "image/jpeg"),
+                                        huge("clip.mp4", "video/mp4")])
+    got = cog._cache[801].files
+    assert [f.preview for f in got] == [True, True] and all(f.data for f in got)
+    assert got[1].content_type == "video/mp4" and got[1].size == 40 * 1024 * 1024, \
+        "it is still described as the file that was posted"
+    assert made_for == [("https://cdn.test/phone.jpg", "image"),
+                        ("https://cdn.test/clip.mp4", "video")]
+    assert cog._bytes < 1024, "what is held is the preview, not 80 MB"
+
+    sent.clear()
+    cog._log_channel = lambda g, c: FakeChannel()
+    await log_one(cog, cog._cache[801], None)
+    names = [f.filename for f in sent["files"]]
+    assert names == ["phone.preview.jpg", "clip.preview.jpg"], names
+    assert len(sent["embeds"]) == 2, "both previews are pictures, so both are in the grid"
+    assert "kept as a preview" in sent["embeds"][0].footer.text
+    assert "1 image, 1 video" in sent["embeds"][0].description
+    print("  a 40 MB photo and video logged as two previews, still named for what they were OK")
+
+    await cog._capture(posted(802, 1), [huge("phone.jpg", "image/jpeg")])
+    assert len(made_for) == 2 and cog._cache[802].files[0].preview, \
+        "the same file posted again reuses the preview"
+    assert round_trip(cog._cache[802]).files[0].preview
+
+    made_for.clear()
+    queue = ML.PREVIEW_QUEUE
+    ML.PREVIEW_QUEUE = 0
+    await cog._capture(posted(803, 1), [huge("other.jpg", "image/jpeg")])
+    assert not made_for and cog._cache[803].files[0].data is None
+    assert "over 8 MB" in ML._not_kept(cog._cache[803].files[0])
+    ML.PREVIEW_QUEUE = queue
+    print("  reused on a repost, and skipped rather than queued once the workers are busy OK")
+
+    cog._previewer.shutdown()
+    Thumbnails.make, Thumbnails.can_preview, cog._previewer = real
+    reset()
+
+    print("\n=== uncompressed formats are held compressed ===")
+    def att_typed(name, data, ctype):
+        return types.SimpleNamespace(filename=name, size=len(data), content_type=ctype,
+                                     width=None, height=None, is_spoiler=lambda: False,
+                                     read=lambda: asyncio.sleep(0, data))
+    tone = b"RIFF....WAVEfmt " + bytes(range(256)) * 2000
+    noise = os.urandom(64 * 1024)
+    await cog._capture(posted(901, 1), [att_typed("memo.wav", tone, "audio/wav"),
+                                        att_typed("static.wav", noise, "audio/x-wav"),
+                                        att_typed("pic.png", tone[::-1], "image/png")])
+    wav_, static, pic = cog._cache[901].files
+    assert wav_.codec == "zlib" and len(wav_.data) < len(tone) // 10, len(wav_.data)
+    assert static.codec is None and static.data == noise, "noise doesn't shrink, so kept as is"
+    assert pic.codec is None and pic.data == tone[::-1], "a PNG is never handed to the codec"
+    assert cog._bytes == len(wav_.data) + len(noise) + len(tone), "the caps count what is held"
+    assert cog._cache[901].nbytes == cog._bytes
+    print(f"  {len(tone)} byte WAV held in {len(wav_.data)}; noise and PNG left alone OK")
+
+    sent.clear()
+    await log_one(cog, cog._cache[901], None)
+    logged = {f.filename: f.fp.read() for f in sent["files"]}
+    assert logged["memo.wav"] == tone, "the log gets the file back exactly as posted"
+    back = round_trip(cog._cache[901])
+    assert back.files[0].codec == "zlib" and ML._unpack(back.files[0]) == tone
+    print("  decompressed for the log, and kept compressed on disk OK")
+
+    await cog._capture(posted(902, 1), [att_typed("again.wav", tone, "audio/wav")])
+    assert cog._cache[902].files[0].data is wav_.data and cog._blobs[wav_.digest].refs == 2, \
+        "the same file again shares the compressed copy"
+    reset()
+
     print("\n=== a bulk delete logs every message, not one per person ===")
     # The bug this covers: entries recovered from our own byte cache were deduped against
     # discord.py's cache by AUTHOR, so a purge of one person's images logged whichever one we
@@ -292,20 +603,20 @@ async def main():
             return types.SimpleNamespace(id=1)
     cog._log_channel = lambda g, c: BulkChannel()
     async def _cfg(*a, **k): return {"medialog_channel": 999, "medialog_enabled": True}
-    async def _nobody(*a, **k): return None
+    async def _nobody(guild, wanted): return [None] * len(wanted)
     cog._get_config = _cfg
     cog._who_deleted = _nobody
     ML.AUDIT_DELAY = 0
 
     # One message we hold the bytes for, two more from the same person that only discord.py
     # remembers. All three were deleted in the same sweep.
-    cog._cache.clear(); cog._bytes = 0
+    reset()
     held = ML.CachedMessage(
         guild_id=1, channel_id=222, author_id=333, author_tag="spammer#1",
         author_avatar=None, author_bot=False, content="", created_at=discord.utils.utcnow(),
         files=[F("a.png", png, "image/png", len(png), False)],
         nbytes=len(png), cached_at=time.monotonic())
-    cog._cache[1001] = held
+    cog._cache[81001] = held
     cog._bytes = len(png)
 
     def cached_msg(mid, name):
@@ -322,33 +633,180 @@ async def main():
 
     payload = types.SimpleNamespace(
         guild_id=1, channel_id=222,
-        message_ids={1001, 1002, 1003},
+        message_ids={81001, 81002, 81003},
         # discord.py hands back everything it remembers, including the one we already hold.
-        cached_messages=[cached_msg(1001, "a.png"), cached_msg(1002, "b.png"),
-                         cached_msg(1003, "c.png")])
+        cached_messages=[cached_msg(81001, "a.png"), cached_msg(81002, "b.png"),
+                         cached_msg(81003, "c.png")])
     posts.clear()
     await cog.on_raw_bulk_message_delete(payload)
+    await drained(cog)
 
-    # One summary, then one entry per message. Three messages went, so three get logged.
-    assert len(posts) == 4, f"summary plus three entries, got {len(posts)}: " \
-                            f"{[p['embeds'][0].title for p in posts]}"
-    # The summary is one embed on its own; each entry after it may be a gallery.
-    assert posts[0]["embed"].title == "Bulk delete"
-    named = [p["embeds"][0] for p in posts[1:]]
+    # One summary, then one entry per message, all in a single message since they fit.
+    assert len(posts) == 1, f"summary and three entries packed together, got {len(posts)}"
+    embeds = posts[0]["embeds"]
+    assert embeds[0].title == "Bulk delete"
+    named = embeds[1:]
     listed = " ".join(str([f.value for f in e.fields]) + (e.image.url or "") for e in named)
     for expected in ("a.png", "b.png", "c.png"):
         assert expected in listed, f"{expected} missing from the log: {listed}"
     # And the one we held bytes for is the only one with a file attached.
-    attached = [p for p in posts[1:] if p.get("files")]
-    assert len(attached) == 1, "only the cached message had bytes behind it"
+    assert [f.filename for f in posts[0]["files"]] == ["a.png"], \
+        "only the cached message had bytes behind it"
     print(f"  3 deleted, {len(named)} logged, 1 with the file itself OK")
 
     print("\n=== and never logs the same message twice ===")
-    # 1001 is in both caches. It must not produce two entries.
-    titles = [p["embeds"][0].title for p in posts[1:]]
+    # 81001 is in both caches. It must not produce two entries.
+    titles = [e.title for e in named]
     assert len(titles) == 3, titles
     print("  the one held in both caches appears once OK")
 
+    print("\n=== a burst of deletes is batched, paced and never dropped ===")
+    reads_audit = []
+    async def _one_read(guild, wanted):
+        reads_audit.append(len(wanted))
+        return [f"Mod#{i}" for i in range(len(wanted))]
+    cog._who_deleted = _one_read
+    ML.AUDIT_DELAY = 0.05
+    reset()
+    for i in range(12):
+        mk(82000 + i, 100)
+    posts.clear()
+    for i in range(12):
+        await cog.on_raw_message_delete(types.SimpleNamespace(
+            guild_id=1, channel_id=222, message_id=82000 + i, cached_message=None))
+    assert not posts, "nothing goes out before the audit log has had time to catch up"
+    await drained(cog)
+    assert reads_audit == [12], f"one audit read for the whole burst: {reads_audit}"
+    assert len(posts) == 2, f"12 entries, 10 files to a message: {len(posts)}"
+    assert sum(len(p["embeds"]) for p in posts) == 12
+    assert all(len(p["embeds"]) <= 10 and len(p["files"]) <= 10 for p in posts)
+    assert "deleted by Mod#11" in posts[1]["embeds"][-1].description
+    print(f"  12 deletes, 1 audit read, {len(posts)} messages OK")
+
+    # The same file name twice in one message would leave attachment:// pointing at either.
+    names = [f.filename for f in posts[0]["files"]]
+    assert len(set(names)) == len(names), names
+    for e in posts[0]["embeds"]:
+        assert e.image.url[len("attachment://"):] in names, e.image.url
+    print("  names made unique across the batch, each embed still on its own file OK")
+
+    # Two galleries of one channel in one message would be drawn as a single grid.
+    gallery = lambda mid: ML.CachedMessage(
+        guild_id=17, channel_id=222, author_id=333, author_tag="someone#0001",
+        author_avatar=None, author_bot=False, content="", created_at=discord.utils.utcnow(),
+        files=[F(f"{mid}-{i}.png", png, "image/png", len(png), False) for i in range(2)],
+        nbytes=len(png) * 2, cached_at=time.monotonic())
+    rendered = [await cog._render(gallery(m), None, discord.utils.utcnow()) for m in (1, 2)]
+    assert len(ML._batches(rendered, ML.UPLOAD_LIMIT)) == 2, "each gallery gets its own message"
+    print("  two grids from the same channel are kept apart OK")
+
+    pace, ML.SEND_PER = ML.SEND_PER, 0.2
+    cog._sent.clear()
+    started = time.monotonic()
+    for _ in range(ML.SEND_RATE + 1):
+        await cog._pace(999)
+    assert time.monotonic() - started >= 0.18, "the sixth send waits for the window"
+    ML.SEND_PER = pace
+    print(f"  no more than {ML.SEND_RATE} messages per window OK")
+
+    class Response:
+        status, reason = 429, "Too Many Requests"
+        headers = {"Retry-After": "0.01"}
+    tries = []
+    class Limited:
+        id = 998
+        async def send(self, **kw):
+            tries.append(kw)
+            if len(tries) < 3:
+                raise discord.HTTPException(Response(), "slow down")
+    cog._sent.clear()
+    retries = cog.stats["send_retries"]
+    assert await cog._deliver(Limited(), rendered[:1])
+    assert len(tries) == 3 and cog.stats["send_retries"] == retries + 2
+    print("  a 429 is waited out and sent, not dropped OK")
+    ML.AUDIT_DELAY = 0
+    cog._who_deleted = _nobody
+
+    print("\n=== other cogs read the held bytes instead of downloading again ===")
+    reset()
+    reads.clear()
+    shared = [att("a.png", b"first" * 50, reads), att("b.png", b"second" * 50, reads)]
+    for i, a in enumerate(shared):
+        a.id = 88000 + i
+    msg = posted(88100, 1, *shared)
+    bot._connection.user.id = 4242
+    got, _ = await asyncio.gather(cog.files_of(msg), cog.on_message(msg))
+    assert got == {88000: b"first" * 50, 88001: b"second" * 50}, got
+    assert sorted(reads) == ["a.png", "b.png"], f"captured once between the two: {reads}"
+    assert await cog.files_of(msg) == got and len(reads) == 2, "and held from then on"
+    async def _off(*a, **k): return None
+    cog._get_config = _off
+    assert await cog.files_of(msg) is None, "nothing held where the media log is off"
+    cog._get_config = _cfg
+    print("  bytes by attachment id, one download shared with the media log's own OK")
+
+    print("\n=== the disk copy survives a restart ===")
+    held = len(cog._spill)
+    reset()
+    mk(77001, 2048)
+    await cog.cog_unload()
+    fresh = ML.MediaLog(bot)
+    await fresh.cog_load()
+    fresh.prune.cancel()
+    assert len(fresh._spill) == held + 1, (len(fresh._spill), held)
+    got = await fresh._take(77001)
+    assert got is not None and got.files[0].data == body(77001, 2048), \
+        "what was in memory at shutdown went to disk on the way out"
+    assert fresh.stats["from_disk"] == 1
+    print(f"  {held + 1} entries back after a restart, read from disk OK")
+
+    print("\n=== a checkpoint covers a restart that never unloaded ===")
+    for mid in (77101, 77102, 77103):
+        fresh._store(mid, entry_of(mid, 1024))
+    await fresh.checkpoint()
+    assert all(fresh._cache[m].on_disk for m in (77101, 77102, 77103))
+    assert fresh.stats["checkpointed"] == 3
+    fresh._store(77104, entry_of(77104, 1024))      # after the checkpoint, so lost below
+    # Taken from memory after the checkpoint: the disk copy has to go too, or the crash
+    # below would bring a message back that was already logged.
+    assert (await fresh._take(77103)).files[0].data == body(77103, 1024)
+    await asyncio.gather(*fresh._spill_tasks)
+    await fresh._spill.checkpoint()
+    writes = fresh._spill.stats["spilled"]
+    oldest = fresh._cache.popitem(last=False)
+    fresh._demote(*oldest)
+    assert fresh._spill.stats["spilled"] == writes and not fresh._spilling, \
+        "evicting a checkpointed entry writes nothing: the copy is already there"
+
+    # No cog_unload: the process just stops. What the index file says, plus whatever was
+    # appended after it, is what the next start finds.
+    scanned = []
+    real_scan = SpillStore.SpillStore._scan
+    SpillStore.SpillStore._scan = lambda self, seg, pos=0: scanned.append(pos) or real_scan(
+        self, seg, pos)
+    crashed = ML.MediaLog(bot)
+    await crashed.cog_load()
+    crashed.prune.cancel()
+    SpillStore.SpillStore._scan = real_scan
+    assert any(scanned), f"the saved index is trusted, not every header re-read: {scanned}"
+    for mid in (77101, 77102):
+        got = await crashed._take(mid)
+        assert got is not None and got.files[0].data == body(mid, 1024), mid
+    assert await crashed._take(77103) is None, "already logged before the crash"
+    assert await crashed._take(77104) is None, "newer than the last checkpoint"
+    print("  checkpointed entries back after a crash, logged ones not, index reused OK")
+    await crashed.cog_unload()
+    await fresh.cog_unload()
+    shutil.rmtree(SPILL, ignore_errors=True)
+
+    print("\n=== log channels come out of the settings warm-up ===")
+    import GuildConfig
+    GuildConfig._cache[41] = ({"guild_id": 41, "medialog_channel": 4100}, time.monotonic())
+    GuildConfig._cache[42] = ({"guild_id": 42}, time.monotonic())
+    await cog.on_settings_warmed()
+    assert 4100 in cog._log_channels, cog._log_channels
+    print("  seeded from the shared cache, no query of its own OK")
+
     print("\n=== sizes read like sizes ===")
     for n, want in ((0, "0 B"), (900, "900 B"), (1024, "1 KB"), (1536, "1.5 KB"),
                     (1024 * 1024, "1 MB"), (3 * 1024 * 1024, "3 MB"),
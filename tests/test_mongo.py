@@ -0,0 +1,74 @@
+"""The database pool: calls counted under their collection, errors, and the queue settling."""
+import pathlib as _pathlib
+# Resolved from this file so the suite runs from a clone, on any machine, from any cwd.
+ROOT = _pathlib.Path(__file__).resolve().parents[1]
+SRC_DIR = str(ROOT / "src")
+import asyncio, os, sys, threading, time, types
+os.environ["MONGO_WORKERS"] = "2"
+sys.path.insert(0, SRC_DIR)
+
+import Mongo
+
+
+class FakeColl:
+    def __init__(self, name): self.name = name
+    def find_one(self, q):
+        time.sleep(0.02)
+        return {"q": q}
+    def broken(self):
+        raise RuntimeError("server selection timed out")
+
+
+async def main():
+    guilds = FakeColl("servers")
+
+    print("=== labelled by collection ===")
+    doc = await Mongo.run(guilds.find_one, {"guild_id": 1})
+    assert doc == {"q": {"guild_id": 1}}, doc
+    await Mongo.run_for(guilds, lambda: guilds.find_one({}))
+    await Mongo.run_for("roles", lambda: 1)
+    await Mongo.run(lambda: 2)
+    s = Mongo.stats()["collections"]
+    assert s["servers"]["calls"] == 2, s
+    assert s["roles"]["calls"] == 1 and s["other"]["calls"] == 1, s
+    assert s["servers"]["avg_ms"] >= 15, s["servers"]
+    print(f"  servers {s['servers']} OK")
+
+    print("\n=== errors are counted and still raised ===")
+    try:
+        await Mongo.run(guilds.broken)
+        raise AssertionError("the error was swallowed")
+    except RuntimeError:
+        pass
+    assert Mongo.stats()["collections"]["servers"]["errors"] == 1
+    print("  1 error recorded, exception reached the caller OK")
+
+    print("\n=== runs on the pool, not the loop ===")
+    names = await asyncio.gather(*[
+        Mongo.run_for("x", lambda: threading.current_thread().name) for _ in range(4)])
+    assert all(n.startswith("mongo") for n in names), names
+    print(f"  {sorted(set(names))} OK")
+
+    print("\n=== more calls than workers queue, then settle ===")
+    gate = threading.Event()
+    calls = [asyncio.ensure_future(Mongo.run_for("slow", gate.wait, 5)) for _ in range(5)]
+    await asyncio.sleep(0.1)
+    m = Mongo.stats()
+    assert m["running"] == 2 and m["queued"] == 3, m
+    assert m["collections"]["slow"]["in_flight"] == 5, m
+    print(f"  running {m['running']} queued {m['queued']} OK")
+    # One cancelled while still waiting for a worker must not leave the queue count stuck.
+    calls[-1].cancel()
+    gate.set()
+    await asyncio.gather(*calls, return_exceptions=True)
+    await asyncio.sleep(0.05)
+    m = Mongo.stats()
+    assert m["running"] == 0 and m["queued"] == 0, m
+    assert m["collections"]["slow"]["in_flight"] == 0, m
+    assert m["collections"]["slow"]["wait_ms"] > 0, m
+    print("  back to 0 running, 0 queued, including the cancelled one OK")
+
+    Mongo.shutdown()
+    print("\nALL CHECKS PASSED")
+
+asyncio.run(main())
@@ -79,6 +79,25 @@ async def main():
     assert await owner_cog.interaction_check(inter2) is True, "owner was rejected!"
     print("  -> owner allowed OK")
 
+    print("\n=== /admin info shows the settings cache ===")
+    import GuildConfig
+    GuildConfig._heat.update({4242: 17, 99: 3})
+    GuildConfig._counts["hits"] += 9
+    sent = {}
+    class Followup:
+        async def send(self, embed=None, **kw): sent["embed"] = embed
+    class Deferring:
+        async def defer(self, **kw): pass
+    inter3 = types.SimpleNamespace(user=FakeUser(), response=Deferring(), followup=Followup())
+    await owner_cog.info.callback(owner_cog, inter3)
+    field = next(f for f in sent["embed"].fields if f.name == "Settings cache")
+    assert "hottest: 4242 · 17, 99 · 3" in field.value, field.value
+    assert "hits 9" in field.value, field.value
+    print(f"  {field.value.splitlines()[-1]} OK")
+    db_field = next(f for f in sent["embed"].fields if f.name == "Database")
+    assert "workers" in db_field.value, db_field.value
+    print(f"  {db_field.value.splitlines()[0]} OK")
+
     # ---- scenario 2: env var unset ----
     del os.environ["OWNER_GUILD_ID"]
     for mod in [m for m in sys.modules if m.startswith("Cogs.")]:
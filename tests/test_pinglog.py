@@ -9,7 +9,7 @@ sys.path.insert(0, SRC_DIR)
 
 
 class FakeColl:
-    def __init__(self): self.docs = []
+    def __init__(self, name): self.name = name; self.docs = []
     def create_index(self, *a, **k): pass
     def _ref(self, q): return next(iter(self.find(q)), None)
     def find_one(self, q, *a, **k):
@@ -19,6 +19,10 @@ class FakeColl:
         return [d for d in self.docs
                 if all(d.get(k2) == v for k2, v in q.items() if not isinstance(v, dict))]
     def insert_one(self, d): self.docs.append(d)
+    def bulk_write(self, requests, ordered=True):
+        for op in requests:
+            if op[0] == "insert": self.insert_one(op[1])
+            else: self.update_one(op[1], op[2], upsert=op[3])
     def update_one(self, q, ops, upsert=False):
         h = self._ref(q)
         if h is None:
@@ -30,7 +34,7 @@ class FakeColl:
 
 class FakeDB:
     def __init__(self): self.c = {}
-    def __getitem__(self, n): return self.c.setdefault(n, FakeColl())
+    def __getitem__(self, n): return self.c.setdefault(n, FakeColl(n))
 
 
 DB = FakeDB()
@@ -38,7 +42,11 @@ st = types.ModuleType("Database"); st.get_bot_database = lambda c: DB
 sys.modules["Database"] = st
 for n in ("pymongo", "certifi", "dotenv"):
     m = types.ModuleType(n)
-    if n == "pymongo": m.MongoClient = object
+    if n == "pymongo":
+        m.MongoClient = object
+        # What WriteBehind hands to bulk_write; FakeColl.bulk_write replays them.
+        m.InsertOne = lambda doc: ("insert", doc)
+        m.UpdateOne = lambda q, ops, upsert=False: ("update", q, ops, upsert)
     if n == "certifi": m.where = lambda: ""
     if n == "dotenv": m.load_dotenv = lambda *a, **k: None
     sys.modules[n] = m
@@ -46,6 +54,7 @@ for n in ("pymongo", "certifi", "dotenv"):
 import discord
 from discord.ext import commands
 import GuildConfig
+import WriteBehind
 
 GUILD, SURVEY_CHAN, LOGCHAN, BOT_ID, HUMAN = 1, 2, 3, 42, 500
 SENT = []
@@ -126,6 +135,7 @@ async def main():
         print(f"  {'logged  ' if got else 'ignored '} {label}")
 
     print("\n=== the embed ===")
+    await WriteBehind.flush()
     SENT.clear(); DB["ping_events"].docs.clear()
     await cog.on_message(msg(content="<@&900>", roles=[cohort]))
     e = SENT[0]["embed"]
@@ -141,6 +151,7 @@ async def main():
     for f in e.fields:
         assert len(f.value) <= 1024
     assert SENT[0]["allowed_mentions"].everyone is False
+    await WriteBehind.flush()          # events are queued and written in batches
     ev = DB["ping_events"].docs[0]
     assert ev["reach"] == 12 and ev["cohort"] == "2026-07-27", ev
     print("  reach, cohort date, stored event OK")
@@ -4,8 +4,8 @@ The parser is most of the risk. "2h" and "2 hours and a bit" both look like a pe
 for the same thing, and only one of them is a request that can be honoured. Hearing the first
 half of the second one would set a reminder nobody asked for, at a time they never said.
 
-The other half is the delivery loop, where the thing that matters is that a reminder goes out
-exactly once. Claiming before sending loses one on a crash; claiming after would resend every
+The other half is delivery, by the Scheduler, where the thing that matters is that a reminder
+goes out exactly once. Claiming before sending loses one on a crash; claiming after would resend every
 reminder in flight on every restart.
 """
 import pathlib as _pathlib
@@ -37,6 +37,9 @@ class FakeColl:
             if isinstance(value, dict) and "$lte" in value:
                 if not (doc.get(key) is not None and doc[key] <= value["$lte"]):
                     return False
+            elif isinstance(value, dict) and "$in" in value:
+                if doc.get(key) not in value["$in"]:
+                    return False
             elif doc.get(key) != value:
                 return False
         return True
@@ -63,11 +66,22 @@ class FakeColl:
                 return types.SimpleNamespace(deleted_count=1)
         return types.SimpleNamespace(deleted_count=0)
 
-    def find_one_and_delete(self, query):
-        for i, doc in enumerate(self.docs):
-            if self._match(doc, query):
-                return self.docs.pop(i)
-        return None
+    def find_one_and_delete(self, query, sort=None):
+        hits = self.find(query)
+        if sort:
+            hits = hits.sort(*sort[0])
+        if not hits:
+            return None
+        self.docs.remove(hits[0])
+        return hits[0]
+
+    def update_one(self, query, ops, upsert=False):
+        if self.find_one(query) is None and upsert:
+            self.docs.append(dict(ops.get("$setOnInsert", {}), **query))
+
+    def delete_many(self, query):
+        ids = query["_id"]["$in"]
+        self.docs = [d for d in self.docs if d["_id"] not in ids]
 
 
 class FakeDB:
@@ -87,6 +101,7 @@ for name in ("pymongo", "certifi", "dotenv"):
 
 import discord
 from discord.ext import commands
+import Scheduler
 
 GUILD, CHANNEL, ME = 900, 901, 7
 
@@ -121,12 +136,28 @@ class FakeInteraction:
 async def main():
     bot = commands.Bot(command_prefix="!", intents=discord.Intents.none())
     bot.MongoClient = object()
+    # One set before reminders were scheduler jobs, still in the old collection.
+    DB["reminders"].docs.append(
+        {"_id": 50, "user_id": ME, "guild_id": GUILD, "channel_id": CHANNEL, "text": "old one",
+         "due": datetime.datetime.now(datetime.timezone.utc), "set_at": None})
     await bot.load_extension("Cogs.Reminders")
     cog = bot.get_cog("Reminders")
     R = sys.modules["Cogs.Reminders"]
-    cog.deliver.cancel()          # driven by hand below rather than on a timer
 
-    print("=== how long is that, then ===")
+    async def deliver():
+        # What the Scheduler's runner does when it wakes, driven by hand rather than by time.
+        await Scheduler.run_due(bot)
+        await asyncio.gather(*list(Scheduler._running))
+
+    print("=== reminders from before the scheduler are moved onto it ===")
+    assert not DB["reminders"].docs, DB["reminders"].docs
+    moved = DB["jobs"].docs
+    assert [(d["_id"], d["kind"], d["text"]) for d in moved] == [(50, "reminder", "old one")]
+    DB["jobs"].docs.clear()
+    print("  moved with its id, as a reminder job OK")
+
+
+    print("\n=== how long is that, then ===")
     for text, expected in (("10m", 600), ("2h", 7200), ("2h30m", 9000), ("3d", 259200),
                            ("1w", 604800), ("45s", 45), ("1d 12h", 129600),
                            ("1h 30m 15s", 5415), ("2 h", 7200), ("10M", 600)):
@@ -149,8 +180,9 @@ async def main():
     print("\n=== setting one ===")
     i = FakeInteraction()
     await cog.remindme.callback(cog, i, "2h", "water the plants")
-    assert len(DB["reminders"].docs) == 1, DB["reminders"].docs
-    saved = DB["reminders"].docs[0]
+    assert len(DB["jobs"].docs) == 1, DB["jobs"].docs
+    saved = DB["jobs"].docs[0]
+    assert saved["kind"] == "reminder", saved
     assert saved["text"] == "water the plants"
     assert saved["user_id"] == ME and saved["guild_id"] == GUILD
     assert saved["channel_id"] == CHANNEL, "so it has somewhere to fall back to"
@@ -163,28 +195,28 @@ async def main():
     print("\n=== a duration it can't read saves nothing ===")
     i = FakeInteraction()
     await cog.remindme.callback(cog, i, "whenever", "something")
-    assert len(DB["reminders"].docs) == 1, "nothing new"
+    assert len(DB["jobs"].docs) == 1, "nothing new"
     assert "couldn't read" in i.response.text, i.response.text
     assert i.response.sent[0]["ephemeral"] is True
     print("  says so, quietly, rather than guessing OK")
 
     i = FakeInteraction()
     await cog.remindme.callback(cog, i, "1h", "   ")
-    assert len(DB["reminders"].docs) == 1, "an empty reminder is not a reminder"
+    assert len(DB["jobs"].docs) == 1, "an empty reminder is not a reminder"
     print("  and neither does an empty one OK")
 
     print("\n=== the queue has a ceiling ===")
     for n in range(R.MAX_PENDING - 1):
         await cog.remindme.callback(cog, FakeInteraction(), "1h", f"thing {n}")
-    assert len(DB["reminders"].docs) == R.MAX_PENDING
+    assert len(DB["jobs"].docs) == R.MAX_PENDING
     i = FakeInteraction()
     await cog.remindme.callback(cog, i, "1h", "one too many")
-    assert len(DB["reminders"].docs) == R.MAX_PENDING, "the limit has to actually hold"
+    assert len(DB["jobs"].docs) == R.MAX_PENDING, "the limit has to actually hold"
     assert "limit" in i.response.text
     # Somebody else is unaffected: the cap is per person, not per server.
     other = FakeInteraction(user_id=ME + 1)
     await cog.remindme.callback(cog, other, "1h", "mine")
-    assert len(DB["reminders"].docs) == R.MAX_PENDING + 1
+    assert len(DB["jobs"].docs) == R.MAX_PENDING + 1
     print(f"  {R.MAX_PENDING} each, and one person filling up doesn't block anyone else OK")
 
     print("\n=== seeing and cancelling your own ===")
@@ -196,18 +228,18 @@ async def main():
     print("  numbered, and only they see the list OK")
 
     # Soonest first, so number 1 is whichever is due next, not whichever was set first.
-    mine = sorted((d for d in DB["reminders"].docs if d["user_id"] == ME),
+    mine = sorted((d for d in DB["jobs"].docs if d["user_id"] == ME),
                   key=lambda d: d["due"])
     first, last = mine[0], mine[-1]
     assert last["text"] == "water the plants", "the 2h one is furthest away, so it sorts last"
 
-    before = len(DB["reminders"].docs)
+    before = len(DB["jobs"].docs)
     i = FakeInteraction()
     await cog.reminders.callback(cog, i, 1)
-    assert len(DB["reminders"].docs) == before - 1
-    assert first["_id"] not in [d["_id"] for d in DB["reminders"].docs], \
+    assert len(DB["jobs"].docs) == before - 1
+    assert first["_id"] not in [d["_id"] for d in DB["jobs"].docs], \
         "number 1 is the one due soonest, and that is what has to go"
-    assert any(d["_id"] == last["_id"] for d in DB["reminders"].docs), \
+    assert any(d["_id"] == last["_id"] for d in DB["jobs"].docs), \
         "and nothing else moved"
     print("  cancelling by its number removes the one due soonest OK")
 
@@ -215,14 +247,14 @@ async def main():
     # Numbers are positions in your own list, so there is no number that reaches anybody
     # else's. Asking for one out of range says so rather than reaching past the end.
     stranger = FakeInteraction(user_id=ME + 99)
-    before = len(DB["reminders"].docs)
+    before = len(DB["jobs"].docs)
     await cog.reminders.callback(cog, stranger, 1)
-    assert len(DB["reminders"].docs) == before, "somebody with none must delete none"
+    assert len(DB["jobs"].docs) == before, "somebody with none must delete none"
     assert "no reminder" in stranger.response.text
     print("  a number nobody has cancels nothing OK")
 
     print("\n=== delivery, once and only once ===")
-    DB["reminders"].docs.clear()
+    DB["jobs"].docs.clear()
     sent = []
 
     class FakeUser:
@@ -234,21 +266,21 @@ async def main():
     bot.get_channel = lambda cid: None
 
     now = datetime.datetime.now(datetime.timezone.utc)
-    DB["reminders"].docs.extend([
-        {"_id": 1, "user_id": ME, "guild_id": GUILD, "channel_id": CHANNEL,
+    DB["jobs"].docs.extend([
+        {"_id": 1, "kind": "reminder", "user_id": ME, "guild_id": GUILD, "channel_id": CHANNEL,
          "text": "due now", "due": now - datetime.timedelta(seconds=5), "set_at": now},
-        {"_id": 2, "user_id": ME, "guild_id": GUILD, "channel_id": CHANNEL,
+        {"_id": 2, "kind": "reminder", "user_id": ME, "guild_id": GUILD, "channel_id": CHANNEL,
          "text": "not yet", "due": now + datetime.timedelta(hours=1), "set_at": now},
     ])
-    await cog.deliver()
+    await deliver()
     assert len(sent) == 1, sent
     assert "due now" in sent[0][1]["embed"].description
-    assert [d["text"] for d in DB["reminders"].docs] == ["not yet"], DB["reminders"].docs
+    assert [d["text"] for d in DB["jobs"].docs] == ["not yet"], DB["jobs"].docs
     print("  the due one went by DM, the future one stayed put OK")
 
     # Running again must not send it a second time, which is the whole reason it is claimed
     # out of the collection before it is sent rather than after.
-    await cog.deliver()
+    await deliver()
     assert len(sent) == 1, "a delivered reminder must not come round again"
     print("  and a second pass sends nothing OK")
 
@@ -265,24 +297,45 @@ async def main():
 
     bot.get_user = lambda uid: ClosedUser(uid)
     bot.get_channel = lambda cid: FakeChannel()
-    DB["reminders"].docs.append(
-        {"_id": 3, "user_id": ME, "guild_id": GUILD, "channel_id": CHANNEL,
+    DB["jobs"].docs.append(
+        {"_id": 3, "kind": "reminder", "user_id": ME, "guild_id": GUILD, "channel_id": CHANNEL,
          "text": "shout it then", "due": now - datetime.timedelta(seconds=1), "set_at": now})
-    await cog.deliver()
+    await deliver()
     assert len(posted) == 1, posted
     assert posted[0]["content"] == f"<@{ME}>", "it has to ping them, or they'll never see it"
     assert "shout it then" in posted[0]["embed"].description
     print("  posted in the channel with a mention OK")
 
-    print("\n=== and a channel that's gone too loses nothing else ===")
+    print("\n=== a channel this process doesn't hold is fetched ===")
+    # With the bot split across processes by shard, whichever one claims the job delivers it.
+    fetched = []
+
+    async def fetch_channel(cid):
+        fetched.append(cid)
+        return FakeChannel()
+
     bot.get_channel = lambda cid: None
-    DB["reminders"].docs.append(
-        {"_id": 4, "user_id": ME, "guild_id": GUILD, "channel_id": CHANNEL,
+    bot.fetch_channel = fetch_channel
+    DB["jobs"].docs.append(
+        {"_id": 5, "kind": "reminder", "user_id": ME, "guild_id": GUILD, "channel_id": CHANNEL,
+         "text": "from elsewhere", "due": now - datetime.timedelta(seconds=1), "set_at": now})
+    await deliver()
+    assert fetched == [CHANNEL] and len(posted) == 2, (fetched, posted)
+    print("  posted there all the same OK")
+
+    print("\n=== and a channel that's gone too loses nothing else ===")
+
+    async def gone(cid):
+        raise discord.NotFound(types.SimpleNamespace(status=404, reason=""), "unknown channel")
+
+    bot.fetch_channel = gone
+    DB["jobs"].docs.append(
+        {"_id": 4, "kind": "reminder", "user_id": ME, "guild_id": GUILD, "channel_id": CHANNEL,
          "text": "nowhere to go", "due": now - datetime.timedelta(seconds=1), "set_at": now})
-    await cog.deliver()          # must not raise
-    assert not any(d["_id"] == 4 for d in DB["reminders"].docs), \
+    await deliver()          # must not raise
+    assert not any(d["_id"] == 4 for d in DB["jobs"].docs), \
         "it is still claimed rather than retried forever"
-    assert [d["text"] for d in DB["reminders"].docs] == ["not yet"], \
+    assert [d["text"] for d in DB["jobs"].docs] == ["not yet"], \
         "and the one that isn't due yet is untouched"
     print("  dropped quietly instead of jamming the queue OK")
 
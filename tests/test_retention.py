@@ -25,6 +25,10 @@ class FakeColl:
         hits = [d for d in self.docs if self._match(d, q)]
         return dict(hits[0]) if hits else None
     def insert_one(self, d): self.docs.append(dict(d))
+    def bulk_write(self, requests, ordered=True):
+        for op in requests:
+            if op[0] == "insert": self.insert_one(op[1])
+            else: self.update_one(op[1], op[2], upsert=op[3])
     def find_one_and_update(self, q, ops, sort=None, **k):
         hits = [d for d in self.docs if self._match(d, q)]
         if sort:
@@ -67,13 +71,18 @@ st = types.ModuleType("Database"); st.get_bot_database = lambda c: DB
 sys.modules["Database"] = st
 for n in ("pymongo", "certifi", "dotenv"):
     m = types.ModuleType(n)
-    if n == "pymongo": m.MongoClient = lambda *a, **k: object()
+    if n == "pymongo":
+        m.MongoClient = lambda *a, **k: object()
+        # What WriteBehind hands to bulk_write; FakeColl.bulk_write replays them.
+        m.InsertOne = lambda doc: ("insert", doc)
+        m.UpdateOne = lambda q, ops, upsert=False: ("update", q, ops, upsert)
     if n == "certifi": m.where = lambda: ""
     if n == "dotenv": m.load_dotenv = lambda *a, **k: None
     sys.modules[n] = m
 
 import discord
 from discord.ext import commands
+import WriteBehind
 
 GUILD = 1
 NOW = datetime.datetime.now(datetime.timezone.utc)
@@ -107,10 +116,12 @@ async def main():
 
     print("=== a spell opens on join and closes on leave ===")
     await cog.on_member_join(member(100))
+    await WriteBehind.flush()          # joins are queued and written in batches
     spells = DB["memberships"].docs
     assert len(spells) == 1, spells
     assert spells[0]["left_at"] is None and spells[0]["nudged"] is False
-    assert spells[0]["cohort"] == str(datetime.date.today())
+    import GuildConfig
+    assert spells[0]["cohort"] == str(GuildConfig.local_date(None)), "UTC's day, not the host's"
     print(f"  opened: cohort {spells[0]['cohort']}, left_at None")
 
     await cog.on_member_remove(member(100))
@@ -119,11 +130,20 @@ async def main():
 
     print("\n=== a rejoin is a second spell, not an edit ===")
     await cog.on_member_join(member(100))
+    await WriteBehind.flush()
     assert len(spells) == 2, spells
     assert spells[1]["left_at"] is None
     assert spells[0]["left_at"] is not None, "the first spell must stay closed"
     print("  two spells, first still closed OK")
 
+    print("\n=== the join is on record before the handler moves on ===")
+    await cog.on_member_join(member(101))
+    assert any(d["user_id"] == 101 for d in spells), "written, not queued behind the patch"
+    await cog.on_member_remove(member(101))
+    quick = [d for d in spells if d["user_id"] == 101]
+    assert len(quick) == 1 and quick[0]["left_at"] is not None, quick
+    print("  a leave a moment later closes it OK")
+
     print("\n=== leaving with no open spell is a no-op ===")
     before = len(spells)
     await cog.on_member_remove(member(999))     # never seen joining
@@ -0,0 +1,235 @@
+"""Scheduler: jobs in Mongo, run when due, with the runner asleep in between.
+
+Also the midday reminder pass it drives: one job per timezone, booked for noon there, which
+moves itself on to the next day, or ten minutes on while something failed inside the window.
+"""
+import pathlib as _pathlib
+# Resolved from this file so the suite runs from a clone, on any machine, from any cwd.
+ROOT = _pathlib.Path(__file__).resolve().parents[1]
+SRC_DIR = str(ROOT / "src")
+import asyncio, datetime, os, sys, types
+sys.path.insert(0, SRC_DIR)
+
+UTC = datetime.timezone.utc
+
+
+def _now():
+    return datetime.datetime.now(UTC)
+
+
+class FakeJobs:
+    def __init__(self, name):
+        self.name = name; self.docs = []; self._ids = 0; self.reads = 0
+    def create_index(self, *a, **k): pass
+    def _match(self, d, q):
+        for k, v in q.items():
+            if isinstance(v, dict) and "$lte" in v:
+                if not (d.get(k) is not None and d[k] <= v["$lte"]): return False
+            elif isinstance(v, dict) and "$in" in v:
+                if d.get(k) not in v["$in"]: return False
+            elif d.get(k) != v:
+                return False
+        return True
+    def _first(self, q, sort):
+        hits = [d for d in self.docs if self._match(d, q)]
+        if hits and sort:
+            hits.sort(key=lambda d: d[sort[0][0]])
+        return hits[0] if hits else None
+    def find_one(self, q, projection=None, sort=None):
+        self.reads += 1
+        return self._first(q, sort)
+    def find_one_and_delete(self, q, sort=None):
+        self.reads += 1
+        hit = self._first(q, sort)
+        if hit is not None: self.docs.remove(hit)
+        return hit
+    def insert_one(self, d):
+        self._ids += 1
+        self.docs.append(dict(d, _id=self._ids))
+        return types.SimpleNamespace(inserted_id=self._ids)
+    def replace_one(self, q, d, upsert=False):
+        self.docs = [x for x in self.docs if x["_id"] != q["_id"]]
+        self.docs.append(dict(d, _id=q["_id"]))
+    def update_one(self, q, ops, upsert=False):
+        if any(x["_id"] == q["_id"] for x in self.docs):
+            return types.SimpleNamespace(upserted_id=None)
+        self.docs.append(dict(ops["$setOnInsert"], _id=q["_id"]))
+        return types.SimpleNamespace(upserted_id=q["_id"])
+    def delete_many(self, q):
+        gone = [d for d in self.docs if self._match(d, q)]
+        self.docs = [d for d in self.docs if d not in gone]
+        return types.SimpleNamespace(deleted_count=len(gone))
+    def distinct(self, field):
+        return sorted({d.get(field) for d in self.docs if d.get(field)})
+    find = lambda self, q=None, *a, **k: [d for d in self.docs if self._match(d, q or {})]
+
+
+class FakeDB:
+    def __init__(self): self.c = {}
+    def __getitem__(self, n): return self.c.setdefault(n, FakeJobs(n))
+
+
+DB = FakeDB()
+st = types.ModuleType("Database"); st.get_bot_database = lambda c: DB
+sys.modules["Database"] = st
+for n in ("pymongo", "certifi", "dotenv"):
+    m = types.ModuleType(n)
+    if n == "pymongo": m.MongoClient = object
+    if n == "certifi": m.where = lambda: ""
+    if n == "dotenv": m.load_dotenv = lambda *a, **k: None
+    sys.modules[n] = m
+os.environ["BOT_TOKEN"] = "x"
+
+import Scheduler
+
+
+async def main():
+    bot = types.SimpleNamespace(MongoClient=object())
+    jobs = DB["jobs"]
+    ran = []
+
+    async def note(job):
+        ran.append((job["kind"], job.get("n"), _now()))
+
+    print("=== sleeps until the job, then runs it once ===")
+    Scheduler.register("ping", note)
+    await Scheduler.start(bot)
+    await Scheduler.schedule(bot, "ping", _now() + datetime.timedelta(seconds=0.3), n=1)
+    await asyncio.sleep(0.1)
+    reads = jobs.reads
+    await asyncio.sleep(0.1)
+    assert jobs.reads == reads, "the runner asked Mongo again while nothing was due"
+    assert not ran
+    await asyncio.sleep(0.25)
+    assert [r[1] for r in ran] == [1], ran
+    assert not jobs.docs, "claimed, so gone"
+    print(f"  ran once, with {jobs.reads} reads in all and none while waiting OK")
+
+    print("\n=== something sooner wakes it early ===")
+    ran.clear()
+    await Scheduler.schedule(bot, "ping", _now() + datetime.timedelta(hours=1), n=2)
+    await asyncio.sleep(0.05)
+    await Scheduler.schedule(bot, "ping", _now() + datetime.timedelta(seconds=0.1), n=3)
+    await asyncio.sleep(0.3)
+    assert [r[1] for r in ran] == [3], ran
+    assert [d["n"] for d in jobs.docs] == [2], "the later one waits its turn"
+    print("  the 0.1s job ran without waiting out the hour-long one OK")
+
+    print("\n=== kinds nobody handles are left alone ===")
+    await Scheduler.schedule(bot, "orphan", _now() - datetime.timedelta(seconds=1))
+    await asyncio.sleep(0.1)
+    assert any(d["kind"] == "orphan" for d in jobs.docs)
+    print("  a job for a cog that isn't loaded is kept for when it is OK")
+
+    print("\n=== a failing handler is counted and doesn't stop the runner ===")
+    async def boom(job): raise RuntimeError("nope")
+    Scheduler.register("boom", boom)
+    await Scheduler.schedule(bot, "boom", _now())
+    await Scheduler.schedule(bot, "ping", _now() + datetime.timedelta(seconds=0.05), n=4)
+    await asyncio.sleep(0.3)
+    assert Scheduler.status()["failed"] == 1, Scheduler.status()
+    assert ran[-1][1] == 4
+    print(f"  {Scheduler.status()} OK")
+
+    print("\n=== ensure keeps an existing job's time ===")
+    later = _now() + datetime.timedelta(days=1)
+    assert await Scheduler.ensure(bot, "daily", later, job_id="daily:x") is True
+    assert await Scheduler.ensure(bot, "daily", _now(), job_id="daily:x") is False
+    assert next(d for d in jobs.docs if d["_id"] == "daily:x")["due"] == later
+    print("  booked once, not moved by a second ensure OK")
+    Scheduler.close()
+
+    print("\n=== midday in each server's own zone ===")
+    import importlib.util
+    spec = importlib.util.spec_from_file_location("botmain", str(ROOT / "src" / "main.py"))
+    mod = importlib.util.module_from_spec(spec)
+    src = open(str(ROOT / "src" / "main.py"), encoding="utf-8").read()
+    exec(compile(src, "main.py", "exec"), mod.__dict__)
+
+    at = datetime.datetime(2026, 3, 10, 9, 0, tzinfo=UTC)        # 9am in London, 5am in NY
+    assert mod.next_cohort_pass("Europe/London", at) == at.replace(hour=12)
+    assert mod.next_cohort_pass("America/New_York", at) == at.replace(hour=16)
+    assert mod.next_cohort_pass("Asia/Tokyo", at) == datetime.datetime(2026, 3, 11, 3, tzinfo=UTC)
+    late = at.replace(hour=12, minute=30)
+    assert mod.next_cohort_pass("UTC", late) == datetime.datetime(2026, 3, 11, 12, tzinfo=UTC)
+    assert mod.next_cohort_pass("UTC", late, catch_up=True) == late, "inside the window: now"
+    assert mod.next_cohort_pass("Not/AZone", at) == at.replace(hour=12), "unknown is UTC"
+    # New York moves its clocks on 8 March 2026; the pass still lands on its noon.
+    before = datetime.datetime(2026, 3, 7, 18, tzinfo=UTC)
+    assert mod.next_cohort_pass("America/New_York", before) == \
+        datetime.datetime(2026, 3, 8, 16, tzinfo=UTC)
+    print("  London, New York, Tokyo, unknown zones and a DST change all land on noon OK")
+
+    print("\n=== one pass per zone, which books the next ===")
+    b = mod.Bot.__new__(mod.Bot)
+    b.MongoClient = object()
+    DB["servers"].docs.extend([
+        {"_id": 1, "guild_id": 10, "timezone": "Europe/London"},
+        {"_id": 2, "guild_id": 20},
+        {"_id": 3, "guild_id": 30, "timezone": "Europe/London"},
+    ])
+    jobs.docs.clear()
+    await b.ensure_cohort_passes()
+    booked = sorted(d["_id"] for d in jobs.docs)
+    assert booked == ["cohort_pass:Europe/London", "cohort_pass:UTC"], booked
+    print(f"  {booked} OK")
+
+    scoped = []
+    async def fake_pass(days=8, guild_id=None, cleanup=True, timezone=None):
+        scoped.append(timezone)
+        return {"failed": 0}
+    b.mention_players = fake_pass
+    await b.run_cohort_pass({"kind": "cohort_pass", "timezone": "Europe/London"})
+    assert scoped == ["Europe/London"], scoped
+    job = next(d for d in jobs.docs if d["_id"] == "cohort_pass:Europe/London")
+    local = job["due"].astimezone(mod._zone("Europe/London"))
+    assert (local.hour, local.minute) == (12, 0) and job["due"] > _now(), job
+    print(f"  ran for its zone only, next one at {local:%Y-%m-%d %H:%M %Z} OK")
+
+    print("\n=== the zone filter inside mention_players ===")
+    import GuildConfig
+    # Each cohort stamped on its own server's calendar, as Members does on the join.
+    DB["roles"].docs.extend([
+        {"_id": "a", "date": str(GuildConfig.local_date("Europe/London", 8)),
+         "guild_id": 10, "role_id": 1, "mentioned": True},
+        {"_id": "b", "date": str(GuildConfig.local_date("UTC", 8)),
+         "guild_id": 20, "role_id": 2, "mentioned": True},
+    ])
+    del b.mention_players
+    s = await b.mention_players(timezone="Europe/London", cleanup=False)
+    assert s["found"] == 1, s
+    s = await b.mention_players(timezone="UTC", cleanup=False)
+    assert s["found"] == 1, s
+    s = await b.mention_players(guild_id=10, cleanup=False)
+    assert s["found"] == 1 and s["date"] == str(GuildConfig.local_date("Europe/London", 8)), \
+        "/forcesurvey reads its own server's calendar"
+    print("  each zone's pass only sees its own servers' cohorts OK")
+
+    print("\n=== and reads the calendar of its zone, not the host's ===")
+    # Fourteen hours ahead of UTC, so for most of the day it is already tomorrow there.
+    far = "Pacific/Kiritimati"
+    DB["servers"].docs.append({"_id": 4, "guild_id": 40, "timezone": far})
+    GuildConfig._cache.clear()
+    DB["roles"].docs.append({"_id": "c", "date": str(GuildConfig.local_date(far, 8)),
+                             "guild_id": 40, "role_id": 3, "mentioned": True})
+    s = await b.mention_players(timezone=far, cleanup=False)
+    assert s["found"] == 1 and s["date"] == str(GuildConfig.local_date(far, 8)), s
+    # A cleanup pass only touches its own zone's servers, even where another zone's cohort
+    # carries the same date string.
+    DB["roles"].docs.extend([
+        {"_id": "old-far", "date": str(GuildConfig.local_date(far, 9)), "guild_id": 40,
+         "role_id": 4},
+        {"_id": "old-utc", "date": str(GuildConfig.local_date(far, 9)), "guild_id": 20,
+         "role_id": 5},
+    ])
+    b.get_guild = lambda gid: None
+    async def no_guild(gid): return None
+    b.fetch_guild = no_guild
+    s = await b.mention_players(timezone=far)
+    ids = {d["_id"] for d in DB["roles"].docs}
+    assert s["cleaned"] == 1 and "old-far" not in ids and "old-utc" in ids, (s, ids)
+    print(f"  {far}'s cohort found on its own date, and only its own cleaned up OK")
+
+    print("\nALL CHECKS PASSED")
+
+asyncio.run(main())
@@ -0,0 +1,228 @@
+"""Running as several shards, possibly split over several processes.
+
+With SHARD_COUNT set the bot is the sharded client, and SHARD_IDS says which of the shards this
+process runs; unset, it is the plain client it always was. What has to hold:
+
+- a bad shard plan stops the bot, since two processes both running shard 0 is worse than none
+- each shard leaves its own runtime document, written by whoever runs it, with only its own
+  servers in it, so the dashboard can add them up and notice one going quiet
+- the invite counts are rebuilt per shard, because a shard that reconnects on its own is the
+  only one whose counts went stale
+- a dashboard save reaches every process polling for it, not just whichever polls first
+"""
+import pathlib as _pathlib
+# Resolved from this file so the suite runs from a clone, on any machine, from any cwd.
+ROOT = _pathlib.Path(__file__).resolve().parents[1]
+SRC_DIR = str(ROOT / "src")
+import asyncio, contextlib, datetime, io, os, sys, types
+sys.path.insert(0, SRC_DIR)
+
+
+class FakeColl:
+    def __init__(self, name): self.name = name; self.docs = {}; self.batches = 0; self.fail = False
+    def create_index(self, *a, **k): pass
+    def find(self, q, projection=None):
+        since = q["at"]["$gte"]
+        return [{"_id": d["_id"], "at": d["at"]} for d in self.docs.values() if d["at"] >= since]
+    def update_one(self, q, ops, upsert=False):
+        doc = self.docs.get(q["_id"])
+        if doc is None:
+            if not upsert: return
+            doc = self.docs[q["_id"]] = dict(q)
+        doc.update(ops.get("$set", {}))
+    def bulk_write(self, requests, ordered=True):
+        if self.fail:
+            raise RuntimeError("not primary")
+        self.batches += 1
+        for kind, q, *rest in requests:
+            getattr(self, kind)(q, *rest)
+
+
+class FakeDB:
+    def __init__(self): self.c = {}
+    def __getitem__(self, n): return self.c.setdefault(n, FakeColl(n))
+
+
+DB = FakeDB()
+st = types.ModuleType("Database"); st.get_bot_database = lambda c: DB
+sys.modules["Database"] = st
+for n in ("pymongo", "certifi", "dotenv"):
+    m = types.ModuleType(n)
+    if n == "pymongo":
+        m.MongoClient = lambda *a, **k: object()
+        m.UpdateOne = lambda q, ops, upsert=False: ("update_one", q, ops, upsert)
+    if n == "certifi": m.where = lambda: ""
+    if n == "dotenv": m.load_dotenv = lambda *a, **k: None
+    sys.modules[n] = m
+
+import discord
+
+# Run under a module name of its own, so main.py's `__main__` guard keeps the bot from starting.
+SRC = open(str(ROOT / "src" / "main.py"), encoding="utf-8").read()
+
+
+def load_module():
+    mod = types.ModuleType("botmain")
+    exec(compile(SRC, "main.py", "exec"), mod.__dict__)
+    return mod
+
+
+class FakeGuild:
+    def __init__(self, gid, shard_id, members=10):
+        self.id, self.shard_id, self.member_count = gid, shard_id, members
+
+
+class FakeShard:
+    def __init__(self, closed=False): self.closed = closed
+    def is_closed(self): return self.closed
+
+
+async def main():
+    print("=== the shard plan ===")
+    plan = load_module().shard_plan
+    assert plan(None, None) is None, "unset is the unsharded client it always ran as"
+    assert plan("auto", None) == (None, None), "auto asks Discord"
+    assert plan("8", None) == (8, None)
+    assert plan("8", "0-3") == (8, [0, 1, 2, 3])
+    assert plan("8", "4, 6,7") == (8, [4, 6, 7])
+    assert plan("8", "0-1,6-7") == (8, [0, 1, 6, 7])
+    for count, ids in (("eight", None), ("0", None), ("-2", None),
+                       (None, "0-3"),        # a range of nothing in particular
+                       ("auto", "0-3"),      # nor of a count nobody knows yet
+                       ("4", "2-5"),         # past the end
+                       ("4", "a-b"), ("4", "1-")):
+        try:
+            plan(count, ids)
+        except ValueError:
+            continue
+        raise AssertionError(f"{count!r}, {ids!r} should have been refused")
+    print("  counts, ranges and lists read; nonsense refused rather than guessed OK")
+
+    plain = load_module()
+    bot = plain.Bot()
+    assert not isinstance(bot, discord.AutoShardedClient)
+    await bot.close()
+    os.environ.update({"SHARD_COUNT": "4", "SHARD_IDS": "2-3"})
+    mod = load_module()
+    for key in ("SHARD_COUNT", "SHARD_IDS"):
+        os.environ.pop(key)
+    bot = mod.Bot()
+    assert isinstance(bot, discord.AutoShardedClient)
+    assert bot.shard_count == 4 and bot.shard_ids == [2, 3], (bot.shard_count, bot.shard_ids)
+    print("  unsharded by default; with the plan, shards 2 and 3 of 4 OK")
+
+    print("\n=== each shard writes its own runtime document ===")
+    Bot = mod.Bot
+
+    class TestBot(Bot):
+        guilds = [FakeGuild(1, 2, 100), FakeGuild(2, 2, 50), FakeGuild(3, 3, 7),
+                  FakeGuild(4, 0, 999)]        # shard 0 is another process's
+        latencies = [(2, 0.042), (3, float("inf"))]
+
+    bot = TestBot.__new__(TestBot)
+    bot.MongoClient = object()
+    bot.shard_count = 4
+    bot.start_time = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+    shards = {2: FakeShard(), 3: FakeShard()}
+    bot.get_shard = shards.get
+
+    await bot.publish_guilds()
+    await bot.heartbeat()
+    runtime = DB["runtime"]
+    assert set(runtime.docs) == {"shard:2", "shard:3"}, "only this process's shards"
+    two, three = runtime.docs["shard:2"], runtime.docs["shard:3"]
+    assert two["guild_ids"] == [1, 2] and three["guild_ids"] == [3]
+    assert two["guild_count"] == 2 and two["member_count"] == 150
+    assert two["shard_id"] == 2 and two["shard_count"] == 4
+    assert two["latency_ms"] == 42 and three["latency_ms"] is None, "inf is a dead socket"
+    assert runtime.batches == 2, "one bulk write each, however many shards"
+    print("  shard:2 and shard:3, each with its own servers and latency OK")
+
+    last = two["last_seen"]
+    await asyncio.sleep(0.01)
+    shards[3].closed = True
+    await bot.heartbeat()
+    assert runtime.docs["shard:2"]["last_seen"] > last
+    assert runtime.docs["shard:3"]["last_seen"] == last, \
+        "a shard whose connection is down goes quiet, so the status page sees it"
+    print("  a disconnected shard stops beating while the rest carry on OK")
+
+    class PlainBot(plain.Bot):
+        guilds = [FakeGuild(1, 0, 5), FakeGuild(2, 0, 6)]
+        latency = 0.1
+
+    DB.c.clear()
+    bot = PlainBot.__new__(PlainBot)
+    bot.MongoClient = object()
+    bot.shard_count = None
+    bot.start_time = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+    bot.is_closed = lambda: False
+    await bot.publish_guilds()
+    await bot.heartbeat()
+    doc = DB["runtime"].docs["shard:0"]
+    assert set(DB["runtime"].docs) == {"shard:0"}
+    assert doc["shard_count"] == 1 and doc["guild_ids"] == [1, 2] and doc["latency_ms"] == 100
+    print("  unsharded, it is shard 0 of 1 OK")
+
+    DB["runtime"].fail = True
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        await bot.heartbeat()
+        await bot.publish_guilds()
+    assert "[status] heartbeat failed" in out.getvalue(), out.getvalue()
+    assert "[dashboard] couldn't publish the guild list" in out.getvalue()
+    DB["runtime"].fail = False
+    print("  a runtime write that fails is reported, not swallowed OK")
+
+    print("\n=== a dashboard save reaches every process ===")
+    import GuildConfig
+    dropped = []
+    real_invalidate, GuildConfig.invalidate = GuildConfig.invalidate, dropped.append
+    start = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+    first, second = (PlainBot.__new__(PlainBot) for _ in range(2))
+    for b in (first, second):
+        b.MongoClient = object()
+        b._flags_seen = (start, set())
+    flags = DB["config_dirty"].docs
+    flags[1] = {"_id": 1, "at": start + datetime.timedelta(seconds=5)}
+    flags[2] = {"_id": 2, "at": start - datetime.timedelta(seconds=5)}   # before either began
+    await first.watch_dashboard_edits()
+    assert dropped == [1] and set(flags) == {1, 2}, "acted on, and left for the others"
+    await second.watch_dashboard_edits()
+    assert dropped == [1, 1], "the second process sees the same save"
+    await first.watch_dashboard_edits()
+    assert dropped == [1, 1], "a flag already acted on isn't acted on again"
+    flags[3] = {"_id": 3, "at": flags[1]["at"]}          # saved in the same millisecond
+    flags[1]["at"] += datetime.timedelta(seconds=1)     # and the first saved again
+    await first.watch_dashboard_edits()
+    assert sorted(dropped[2:]) == [1, 3], dropped
+    GuildConfig.invalidate = real_invalidate
+    print("  each process drops its own copy, going by the newest stamp it has seen OK")
+
+    print("\n=== invite counts are rebuilt per shard ===")
+    from Cogs.Invites import Invites
+    cog = Invites(types.SimpleNamespace(guilds=TestBot.guilds))
+    snapped = []
+
+    async def snapshot(guild):
+        snapped.append(guild.id)
+        cog.uses[guild.id] = {}
+        return True
+
+    cog._snapshot = snapshot
+    await cog.on_shard_ready(2)
+    assert sorted(snapped) == [1, 2], snapped
+    snapped.clear()
+    await cog.on_shard_ready(3)
+    assert snapped == [3], "a shard coming back doesn't refetch everybody else's invites"
+    print("  a shard that reconnects re-reads only its own servers OK")
+
+    snapped.clear()
+    await cog.on_ready()
+    assert sorted(snapped) == [1, 2, 3, 4], "unsharded, on_ready still does every server"
+    print("  and unsharded, on_ready still does the lot OK")
+
+    print("\nALL CHECKS PASSED")
+
+
+asyncio.run(main())
@@ -0,0 +1,235 @@
+"""The disk tier behind MediaLog's memory cache.
+
+Written far more than it is read, and it has to survive the process going away at any moment,
+including halfway through a write. What is checked:
+
+- a record comes back byte for byte, once, and is then gone, including after a restart
+- a torn write at the end of a segment is cut off and everything before it kept
+- the cap is held by dropping whole segments, oldest first
+- the TTL applies both while running and to what a restart finds on disk
+- the oldest segment goes as soon as nothing points into it, rather than waiting for the cap
+- a restart trusts the saved index and reads only what was appended after it, and falls back
+  to a full scan when there is no index or it can't be believed
+- shared bytes are written once however many records carry them, stay until the last of
+  those is gone, and a restart agrees about which that is
+"""
+import pathlib as _pathlib
+# Resolved from this file so the suite runs from a clone, on any machine, from any cwd.
+ROOT = _pathlib.Path(__file__).resolve().parents[1]
+SRC_DIR = str(ROOT / "src")
+import asyncio, os, shutil, sys, tempfile, time
+sys.path.insert(0, SRC_DIR)
+
+import SpillStore
+from SpillStore import SpillStore as Store
+
+MB = 1024 * 1024
+
+
+def segments(path):
+    return sorted(n for n in os.listdir(path) if n.endswith(".bin"))
+
+
+async def reopen(store, **kw):
+    await store.close()
+    fresh = Store(store.path, kw.get("max_bytes", store.max_bytes), kw.get("ttl", store.ttl),
+                  store.segment_bytes)
+    await fresh.open()
+    return fresh
+
+
+async def main():
+    root = tempfile.mkdtemp(prefix="spill-test-")
+    try:
+        await checks(root)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    print("\nALL CHECKS PASSED")
+
+
+async def checks(root):
+    print("=== in and out ===")
+    path = os.path.join(root, "basic")
+    store = Store(path, 10 * MB, ttl=3600, segment_bytes=MB)
+    assert await store.open() == 0, "a directory that isn't there yet is an empty store"
+    assert not os.path.exists(path), "and nothing is created until something is written"
+    now = time.time()
+    assert await store.put(1, {"name": "a"}, [b"first", b"", b"third"], now)
+    assert await store.put(2, {"name": "b"}, [], now)
+    assert 1 in store and 2 in store and len(store) == 2
+    meta, blobs, stored_at = await store.take(1)
+    assert meta == {"name": "a"} and blobs == [b"first", b"", b"third"], (meta, blobs)
+    assert stored_at == now
+    assert 1 not in store and await store.take(1) is None, "taken once, then gone"
+    print("  three blobs back byte for byte, including an empty one; then gone OK")
+
+    print("\n=== a restart finds what was left ===")
+    await store.put(3, {"name": "c"}, [b"x" * 1000], now)
+    store = await reopen(store)
+    assert sorted(store._index) == [2, 3], "1 was taken, and its marker says so"
+    meta, blobs, _ = await store.take(3)
+    assert blobs == [b"x" * 1000]
+    store = await reopen(store)
+    assert sorted(store._index) == [2], store._index
+    print("  records survive a restart, taken ones don't come back OK")
+
+    print("\n=== a write cut short by a crash ===")
+    await store.put(4, {"name": "d"}, [b"y" * 5000], now)
+    await store.close()
+    last = os.path.join(path, segments(path)[-1])
+    whole = os.path.getsize(last)
+    with open(last, "ab") as f:
+        f.write(SpillStore._HEADER.pack(SpillStore._PUT, 5, now, 10, 999999) + b"partial")
+    store = Store(path, 10 * MB, 3600, MB)
+    held = await store.open()
+    assert held == 2, (held, sorted(store._index))
+    assert os.path.getsize(last) == whole, "cut back to the last whole record"
+    assert (await store.take(4))[1] == [b"y" * 5000], "and everything before it is intact"
+    print("  torn tail truncated, earlier records intact OK")
+
+    print("\n=== the cap drops whole segments, oldest first ===")
+    path = os.path.join(root, "cap")
+    store = Store(path, max_bytes=3 * MB, ttl=3600, segment_bytes=MB)
+    await store.open()
+    blob = b"z" * (300 * 1024)
+    for key in range(30):
+        assert await store.put(key, {}, [blob], time.time())
+    assert store.bytes <= 3 * MB, store.bytes
+    assert len(segments(path)) <= 3, segments(path)
+    assert 0 not in store and 29 in store, "the oldest went, the newest stayed"
+    assert store.stats["evicted"] > 0
+    assert sum(os.path.getsize(os.path.join(path, n)) for n in segments(path)) == store.bytes
+    assert not await store.put(99, {}, [b"q" * (4 * MB)], time.time()), \
+        "a record bigger than the whole store is refused, not allowed to empty it"
+    print(f"  {len(store)} of 30 kept in {len(segments(path))} segments under the cap OK")
+
+    print("\n=== the oldest segment is given back once nothing points into it ===")
+    keys = [k for k in sorted(store._index) if store._index[k][0] == min(store._sizes)]
+    oldest = segments(path)[0]
+    for key in keys:
+        await store.take(key)
+    assert oldest not in segments(path), "every record in it was read back, so it goes"
+    print(f"  {oldest} deleted once its {len(keys)} records were taken OK")
+
+    print("\n=== its size can be asked for while the store's thread is busy ===")
+    writes = asyncio.gather(*(store.put(100 + k, {}, [blob], time.time()) for k in range(40)))
+    asked = 0
+    while not writes.done():
+        # What /admin info reads, from the event loop, while segments come and go.
+        assert 0 <= store.bytes and len(store) >= 0
+        asked += 1
+        await asyncio.sleep(0)
+    await writes
+    assert store.bytes == sum(store._sizes.values()) == \
+        sum(os.path.getsize(os.path.join(path, n)) for n in segments(path)) <= 3 * MB
+    store = await reopen(store)
+    assert store.bytes == sum(os.path.getsize(os.path.join(path, n)) for n in segments(path))
+    print(f"  asked {asked} times mid-write; the running total matches the disk, "
+          f"and again after a restart OK")
+    await store.close()
+
+    print("\n=== the TTL, while running and across a restart ===")
+    path = os.path.join(root, "ttl")
+    store = Store(path, 10 * MB, ttl=60, segment_bytes=MB)
+    await store.open()
+    await store.put(1, {}, [b"old"], time.time() - 120)
+    await store.put(2, {}, [b"new"], time.time())
+    assert await store.take(1) is None, "past its TTL, so not handed back"
+    await store.put(3, {}, [b"old"], time.time() - 120)
+    assert await store.prune() == 1 and 3 not in store
+    await store.put(4, {}, [b"old"], time.time() - 120)
+    store = await reopen(store)
+    assert sorted(store._index) == [2], "a restart applies the same TTL to what it reads"
+    await store.close()
+    print("  expired records are neither returned nor reloaded OK")
+
+    print("\n=== a restart reads the saved index, then only what came after it ===")
+    path = os.path.join(root, "index")
+    store = Store(path, 10 * MB, ttl=3600, segment_bytes=MB)
+    await store.open()
+    for key in range(10):
+        await store.put(key, {"k": key}, [bytes([key]) * 2000], time.time())
+    assert await store.checkpoint()
+    assert not await store.checkpoint(), "nothing changed, so nothing written"
+    await store.put(10, {"k": 10}, [b"late"], time.time())
+    await store.take(3)
+    # No close: the process dies here, after the checkpoint but with more appended.
+    scanned = []
+    real_scan = Store._scan
+    Store._scan = lambda self, seg, pos=0: scanned.append(pos) or real_scan(self, seg, pos)
+    try:
+        crashed = Store(path, 10 * MB, 3600, MB)
+        assert await crashed.open() == 10, sorted(crashed._index)
+    finally:
+        Store._scan = real_scan
+    assert scanned and scanned[0] > 0, f"picked up where the index left off: {scanned}"
+    assert 3 not in crashed and 10 in crashed, "the tail is applied on top"
+    assert (await crashed.take(7))[1] == [bytes([7]) * 2000]
+    assert not os.path.exists(os.path.join(path, SpillStore._INDEX_NAME)), \
+        "a loaded index is removed, since this run's writes make it stale"
+    await crashed.close()
+    await store.close()
+
+    # An index that can't be believed is ignored, and the segments scanned instead.
+    with open(os.path.join(path, SpillStore._INDEX_NAME), "r+b") as f:
+        f.truncate(20)
+    store = Store(path, 10 * MB, 3600, MB)
+    assert await store.open() == 9, sorted(store._index)
+    await store.close()
+    print("  index reused after a crash, tail applied, a torn index falls back to a scan OK")
+
+    print("\n=== shared bytes are written once ===")
+    path = os.path.join(root, "shared")
+    store = Store(path, 10 * MB, 3600, MB)
+    await store.open()
+    big, key = os.urandom(200_000), (1 << 63) | 7
+    now = time.time()
+    assert await store.put(1, {"k": 1}, [SpillStore.Shared(key, big), b"own"], now)
+    assert await store.put(2, {"k": 2}, [SpillStore.Shared(key, big)], now)
+    assert await store.put(3, {"k": 3}, [SpillStore.Shared(key, big)] * 2, now)
+    assert store.bytes < len(big) * 2, f"one copy on disk, not three: {store.bytes}"
+    assert store.stats["shared"] == 3, store.stats
+    assert len(store) == 3 and key in store, "the shared record isn't counted as one of them"
+    assert (await store.take(1))[1] == [big, b"own"]
+    assert (await store.take(3))[1] == [big, big]
+    assert key in store, "still named by 2"
+    store = await reopen(store)
+    assert key in store and len(store) == 1, "the saved index remembers who names what"
+    assert (await store.take(2))[1] == [big]
+    assert key not in store and len(store._index) == 0, "gone with the last record naming it"
+    print("  one copy for three records, kept until the last is taken OK")
+
+    # The same again with no saved index, so the restart has to work it out from the records.
+    assert await store.put(4, {"k": 4}, [SpillStore.Shared(key, big)], time.time())
+    assert await store.put(5, {"k": 5}, [SpillStore.Shared(key, big)], time.time())
+    await store.take(4)
+    await store.close()
+    os.remove(os.path.join(path, SpillStore._INDEX_NAME))
+    scanned = Store(path, 10 * MB, 3600, MB)
+    assert await scanned.open() == 1 and key in scanned, sorted(scanned._index)
+    assert (await scanned.take(5))[1] == [big]
+    assert key not in scanned
+    await scanned.close()
+    # Taken by the run that scanned, and the restart after it doesn't bring the bytes back.
+    again = Store(path, 10 * MB, 3600, MB)
+    await again.open()
+    assert key not in again and not again._index, sorted(again._index)
+    await again.close()
+    print("  a scan rebuilds the same, and unnamed bytes don't come back OK")
+
+    # The cap can take shared bytes from under a newer record; it comes back without them.
+    path = os.path.join(root, "shared-cap")
+    store = Store(path, 3 * 300_000, 3600, segment_bytes=300_000)
+    await store.open()
+    assert await store.put(1, {}, [SpillStore.Shared(key, big)], time.time())
+    await store.put(2, {}, [os.urandom(250_000)], time.time())
+    assert await store.put(3, {}, [SpillStore.Shared(key, big)], time.time())
+    for k in (4, 5):
+        await store.put(k, {}, [os.urandom(250_000)], time.time())
+    assert key not in store and 3 in store, sorted(store._index)
+    assert (await store.take(3))[1] == [None]
+    await store.close()
+    print("  shared bytes lost to the cap come back as None OK")
+
+
+asyncio.run(main())
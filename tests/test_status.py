@@ -24,6 +24,7 @@ os.environ.update({
 })
 
 RUNTIME = {}
+SHARDS = []          # per-shard documents; when empty the single "bot" one is read instead
 BROKEN = False
 
 
@@ -33,7 +34,10 @@ class FakeColl:
         if BROKEN:
             raise RuntimeError("no route to host")
         return dict(RUNTIME) if self.name == "runtime" and RUNTIME else None
-    def find(self, q=None, *a, **k): return []
+    def find(self, q=None, *a, **k):
+        if BROKEN:
+            raise RuntimeError("no route to host")
+        return [dict(d) for d in SHARDS] if self.name == "runtime" else []
     def update_one(self, *a, **k): return types.SimpleNamespace(matched_count=1)
 
 
@@ -44,6 +48,23 @@ class FakeDB:
 import store
 store.db = lambda: FakeDB()
 
+# One fixed "now" for the beats and for the status page reading them. With two calls to the
+# real clock, a beat exactly HEARTBEAT_GRACE old read as a fraction of a second past it, and
+# the boundary checks failed before anything after them ran.
+NOW = datetime.datetime.now(datetime.timezone.utc)
+
+
+class _Frozen(datetime.datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return NOW if tz is not None else NOW.replace(tzinfo=None)
+
+
+_clock = types.ModuleType("datetime")
+_clock.__dict__.update(vars(datetime))
+_clock.datetime = _Frozen
+store.datetime = _clock
+
 import discord_api as api
 api.manageable_guilds = lambda t, u, force=False: []
 api.guild_channels = lambda g: []
@@ -57,8 +78,7 @@ def beat(seconds_ago, **extra):
     """Pretend the bot last checked in this long ago."""
     global BROKEN
     BROKEN = False
-    now = datetime.datetime.now(datetime.timezone.utc)
-    last = now - datetime.timedelta(seconds=seconds_ago)
+    last = NOW - datetime.timedelta(seconds=seconds_ago)
     RUNTIME.clear()
     RUNTIME.update({
         "_id": "bot",
@@ -149,6 +169,57 @@ def main():
     json.dumps(data)
     print("  and stays valid json with nothing to report OK")
 
+    print("\n=== a sharded bot is added up across its shards ===")
+
+    def shard(shard_id, seconds_ago, count=3, **extra):
+        last = NOW - datetime.timedelta(seconds=seconds_ago)
+        return {"_id": f"shard:{shard_id}", "shard_id": shard_id, "shard_count": count,
+                "last_seen": last, "started_at": last - datetime.timedelta(hours=2),
+                "guild_count": 10, "member_count": 1000, "latency_ms": 40 + shard_id * 10,
+                "guild_ids": [shard_id * 100 + n for n in range(3)], **extra}
+
+    RUNTIME.clear()
+    beat(20)                   # the old document is still there, and ignored from now on
+    SHARDS[:] = [shard(0, 5), shard(1, 10), shard(2, 15)]
+    status = store.bot_status()
+    assert status["state"] == "up" and status["reason"] is None, status
+    assert status["guilds"] == 30 and status["members"] == 3000, status
+    assert status["latency_ms"] == 50, "averaged, like discord.py does"
+    assert status["seconds_quiet"] == 5, "the freshest beat"
+    assert [s["state"] for s in status["shards"]] == ["up"] * 3
+    assert store.bot_guild_ids() == {0, 1, 2, 100, 101, 102, 200, 201, 202}
+    print("  three shards: 30 servers, up, picker sees every shard's servers OK")
+
+    SHARDS[1] = shard(1, store.HEARTBEAT_DOWN + 60)
+    status = store.bot_status()
+    assert status["state"] == "wobbly", "one shard out is not the whole bot down"
+    assert "2 of 3" in status["reason"] and "shard 1" in status["reason"], status
+    assert [s["state"] for s in status["shards"]] == ["up", "down", "up"]
+    body = html.unescape(c.get("/status").data.decode())
+    assert "2 of 3 shards are up" in body and "Shard 1" in body
+    print("  one quiet shard: wobbly, and the page names it OK")
+
+    del SHARDS[2]
+    status = store.bot_status()
+    assert status["shards"][2]["state"] == "down", "a shard that never checked in is down"
+    assert status["state"] == "wobbly"
+    print("  a missing shard counts as down OK")
+
+    # Scaled down from three shards to two: shard 2's document is left behind.
+    SHARDS[:] = [shard(0, 5, count=2), shard(1, 5, count=2),
+                 shard(2, store.HEARTBEAT_DOWN * 2)]
+    status = store.bot_status()
+    assert status["state"] == "up" and len(status["shards"]) == 2, status
+    assert 200 not in store.bot_guild_ids()
+    print("  documents for shards past the current count are ignored OK")
+
+    SHARDS[:] = [shard(0, 5, count=1)]
+    status = store.bot_status()
+    assert status["state"] == "up" and status["shards"] == [], "one shard isn't listed"
+    json.dumps(c.get("/status.json").get_json())
+    SHARDS.clear()
+    print("  a single shard looks just like the unsharded bot OK")
+
     print("\n=== it needs no login ===")
     beat(10)
     for path in ("/status", "/status.json"):
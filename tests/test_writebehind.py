@@ -0,0 +1,144 @@
+"""WriteBehind: queued event writes go out as ordered bulk_writes, by size, by time, and on close."""
+import pathlib as _pathlib
+# Resolved from this file so the suite runs from a clone, on any machine, from any cwd.
+ROOT = _pathlib.Path(__file__).resolve().parents[1]
+SRC_DIR = str(ROOT / "src")
+import asyncio, sys, types
+sys.path.insert(0, SRC_DIR)
+
+pm = types.ModuleType("pymongo")
+pm.InsertOne = lambda doc: ("insert", doc)
+pm.UpdateOne = lambda q, ops, upsert=False: ("update", q, ops, upsert)
+sys.modules["pymongo"] = pm
+
+import WriteBehind
+
+WriteBehind.FLUSH_SECONDS = 0.05
+WriteBehind.BATCH = 10
+WriteBehind.MAX_PENDING = 25
+
+
+class BulkWriteError(Exception):
+    def __init__(self, details):
+        super().__init__("batch op errors occurred"); self.details = details
+
+
+class FakeColl:
+    def __init__(self, name):
+        self.name = name; self.docs = []; self.batches = []; self.fail = 0
+    def bulk_write(self, requests, ordered=True):
+        assert not ordered, "one bad write must not cost the ones queued after it"
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError("not primary")
+        self.batches.append(len(requests))
+        refused = []
+        for i, op in enumerate(requests):
+            if op[0] == "insert" and any(d["_id"] == op[1]["_id"] for d in self.docs):
+                refused.append({"index": i, "code": 11000})
+            elif op[0] == "insert":
+                self.docs.append(dict(op[1]))
+            else:
+                for d in self.docs:
+                    if all(d.get(k) == v for k, v in op[1].items()):
+                        d.update(op[2]["$set"])
+        if refused:
+            raise BulkWriteError({"writeErrors": refused,
+                                  "nInserted": len(requests) - len(refused)})
+
+
+async def main():
+    spells = FakeColl("memberships")
+
+    print("=== an insert and its patch, in one batch ===")
+    sid = await WriteBehind.insert(spells, {"user_id": 1, "invite_code": None})
+    assert sid is not None, "the id has to be known before the write"
+    await WriteBehind.update(spells, {"_id": sid}, {"$set": {"invite_code": "promo"}})
+    assert spells.docs == [], "nothing written yet"
+    await WriteBehind.flush(spells)
+    assert spells.batches == [2], spells.batches
+    assert spells.docs[0]["_id"] == sid and spells.docs[0]["invite_code"] == "promo"
+    print(f"  1 bulk_write, invite patched onto {sid} OK")
+
+    print("\n=== written on its own after a moment ===")
+    await WriteBehind.insert(spells, {"user_id": 2})
+    await asyncio.sleep(0.15)
+    assert len(spells.docs) == 2 and spells.batches[-1] == 1, spells.batches
+    print("  the timer wrote it without anybody flushing OK")
+
+    print("\n=== a full batch goes straight away ===")
+    spells.batches.clear()
+    for n in range(10):
+        await WriteBehind.insert(spells, {"user_id": 100 + n})
+    await asyncio.sleep(0.01)             # well inside FLUSH_SECONDS
+    assert spells.batches == [10], spells.batches
+    print(f"  10 writes, {len(spells.batches)} round trip OK")
+
+    print("\n=== bounded: past the limit the caller waits, nothing is dropped ===")
+    WriteBehind.BATCH = 1000              # so only the limit can push it out
+    events = FakeColl("ping_events")
+    for n in range(30):
+        await WriteBehind.insert(events, {"n": n})
+        assert WriteBehind.stats()["pending"] <= WriteBehind.MAX_PENDING
+    await WriteBehind.flush()
+    assert [d["n"] for d in events.docs] == list(range(30)), "lost or reordered"
+    assert WriteBehind.stats()["waited"] >= 1
+    print(f"  30 writes, never more than {WriteBehind.MAX_PENDING} queued, all kept in order OK")
+
+    print("\n=== the bound holds across collections, and for callers all at once ===")
+    quiet, busy = FakeColl("cohorts"), FakeColl("joins")
+    for n in range(WriteBehind.MAX_PENDING - 1):
+        await WriteBehind.insert(quiet, {"n": n})
+    highest = 0
+    async def join(n):
+        nonlocal highest
+        await WriteBehind.insert(busy, {"n": n})
+        highest = max(highest, WriteBehind.stats()["pending"])
+    await asyncio.gather(*(join(n) for n in range(40)))
+    assert highest <= WriteBehind.MAX_PENDING, f"{highest} queued past the limit"
+    assert len(quiet.docs) == WriteBehind.MAX_PENDING - 1, \
+        "the other collection is written to make room, not left holding the queue"
+    await WriteBehind.flush()
+    assert sorted(d["n"] for d in busy.docs) == list(range(40)), "nothing dropped"
+    print(f"  40 callers at once beside a full collection, at most {highest} queued OK")
+
+    print("\n=== an unreachable server: put back and tried again, not raised at the caller ===")
+    cases = FakeColl("mod_cases")
+    cases.fail = 1
+    await WriteBehind.insert(cases, {"case_id": 1})
+    await WriteBehind.flush(cases)
+    assert cases.docs == [] and WriteBehind.stats()["pending"] == 1, "kept, not dropped"
+    assert WriteBehind.stats()["retried"] == 1 and WriteBehind.stats()["failed"] == 0
+    await WriteBehind.insert(cases, {"case_id": 2})
+    await asyncio.sleep(WriteBehind.FLUSH_SECONDS * 2 + 0.1)
+    assert [d["case_id"] for d in cases.docs] == [1, 2], "retried on its own, first still first"
+    print("  1 failed batch retried once the server came back OK")
+
+    cases.fail = WriteBehind.RETRIES + 1
+    await WriteBehind.insert(cases, {"case_id": 3})
+    for _ in range(WriteBehind.RETRIES + 1):
+        await WriteBehind.flush(cases)
+    assert WriteBehind.stats()["failed"] == 1 and WriteBehind.stats()["pending"] == 0, \
+        "given up after RETRIES, so an outage can't hold the queue forever"
+    print(f"  given up after {WriteBehind.RETRIES} retries, counted OK")
+
+    print("\n=== a refused write costs only itself ===")
+    first = cases.docs[0]["_id"]
+    await WriteBehind.insert(cases, {"_id": first, "case_id": 1})      # already there
+    await WriteBehind.insert(cases, {"case_id": 4})
+    await WriteBehind.flush(cases)
+    assert [d["case_id"] for d in cases.docs] == [1, 2, 4], "the one after it still written"
+    assert WriteBehind.stats()["failed"] == 2 and WriteBehind.stats()["pending"] == 0
+    print("  duplicate refused and dropped, the rest of the batch written OK")
+
+    print("\n=== close writes what's left ===")
+    await WriteBehind.insert(cases, {"case_id": 5})
+    await WriteBehind.insert(events, {"n": 30})
+    await WriteBehind.close()
+    assert cases.docs[-1]["case_id"] == 5 and events.docs[-1]["n"] == 30
+    assert WriteBehind.stats()["pending"] == 0
+    print(f"  {WriteBehind.stats()} OK")
+
+    print("\nALL CHECKS PASSED")
+
+asyncio.run(main())
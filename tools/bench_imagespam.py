@@ -0,0 +1,93 @@
+"""How fast the image spam filter's filename rules run, on batches far bigger than Discord sends.
+
+Every message with images goes through `is_spam_batch` before anything else, so its cost is
+paid on every upload in every server. This times it on synthetic batches of each shape the
+rules care about, against the version it replaced, which looked the leading number of each
+filename up through `re.match` twice per name:
+
+    python tools/bench_imagespam.py
+
+- spam: one name repeated, numbered names in order, numbered names with gaps
+- ordinary: camera names, screenshots, a numbered batch broken by one real name at the end,
+  which is the worst case since every rule has to look at every name
+
+Discord allows 10 attachments, so 10 is the size that matters; the larger batches show how
+the cost grows. Nothing here needs anything outside the standard library and discord.py.
+"""
+
+import pathlib
+import random
+import re
+import sys
+import time
+import types
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+sys.modules.setdefault("Database", types.ModuleType("Database"))
+
+NUMERIC = re.compile(r'^\d+\.(png|jpe?g|webp|gif)$', re.IGNORECASE)
+
+
+def before(attachments) -> bool:
+    """is_spam_batch as it was."""
+    filenames = [att.filename.lower() for att in attachments]
+    if len(set(filenames)) == 1:
+        return True
+    if all(NUMERIC.match(f) for f in filenames):
+        return True
+    numeric = sorted([
+        int(re.match(r'^(\d+)\.', f).group(1))
+        for f in filenames
+        if re.match(r'^(\d+)\.', f)
+    ])
+    if len(numeric) == len(filenames):
+        gaps = [numeric[i+1] - numeric[i] for i in range(len(numeric)-1)]
+        if all(g <= 1 for g in gaps):
+            return True
+    return False
+
+
+def batch(names):
+    return [types.SimpleNamespace(filename=n) for n in names]
+
+
+def shapes(n: int, rng: random.Random) -> dict:
+    return {
+        "same name": batch(["image.png"] * n),
+        "numbered": batch([f"{i}.png" for i in range(1, n + 1)]),
+        "numbered, gaps": batch([f"{i * 3}.jpg" for i in range(n)]),
+        "camera": batch([f"IMG_{rng.randrange(10**4):04d}.jpg" for _ in range(n)]),
+        "screenshots": batch([f"Screenshot 2026-10-{rng.randrange(1, 29):02d} at "
+                              f"{rng.randrange(24)}.{rng.randrange(60):02d}.png"
+                              for _ in range(n)]),
+        "numbered, then not": batch([f"{i}.1.png" for i in range(n - 1)] + ["cat.png"]),
+    }
+
+
+def rate(fn, cases, seconds=0.3) -> float:
+    runs, start = 0, time.perf_counter()
+    while (took := time.perf_counter() - start) < seconds:
+        for case in cases:
+            fn(case)
+        runs += len(cases)
+    return runs / took
+
+
+def main():
+    import discord
+    from discord.ext import commands
+    from Cogs.ImageSpamFilter import ImageSpamFilter
+
+    cog = ImageSpamFilter(commands.Bot(command_prefix="!", intents=discord.Intents.none()))
+    rng = random.Random(1)
+    print(f"{'batch':20} {'size':>5} {'before/s':>12} {'after/s':>12} {'speedup':>8}")
+    for n in (10, 100, 1000):
+        for name, case in shapes(n, rng).items():
+            assert before(case) == cog.is_spam_batch(case), (name, n)
+            old = rate(before, [case])
+            new = rate(cog.is_spam_batch, [case])
+            print(f"{name:20} {n:5} {old:12,.0f} {new:12,.0f} {new / old:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
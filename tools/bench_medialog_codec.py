@@ -0,0 +1,157 @@
+"""How much MediaLog's in-memory compression saves, and what it costs.
+
+Only uncompressed formats are compressed (BMP, TIFF, WAV, AIFF); everything else Discord sees
+is already compressed and is stored as it came. This builds a mix of what those formats look
+like in practice and times the codec on each:
+
+    python tools/bench_medialog_codec.py
+
+- a screenshot saved as BMP: large flat areas and text, which is what BMPs in chat mostly are
+- a photo saved as BMP or TIFF: smooth gradients under sensor noise, the worst case that still
+  qualifies
+- a voice clip and a music clip as 16-bit WAV
+- a PNG and an MP4, stood in for by random bytes, to show they cost nothing: they are never
+  handed to the codec at all
+
+Nothing here needs anything outside the standard library.
+"""
+
+import math
+import pathlib
+import random
+import struct
+import sys
+import time
+import zlib
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+
+MB = 1024 * 1024
+
+
+def bmp(width: int, height: int, pixel) -> bytes:
+    row_pad = (-width * 3) % 4
+    rows = []
+    for y in range(height):
+        row = bytearray()
+        for x in range(width):
+            row += bytes(pixel(x, y))
+        rows.append(bytes(row) + b"\0" * row_pad)
+    body = b"".join(reversed(rows))
+    header = struct.pack("<2sIHHI", b"BM", 54 + len(body), 0, 0, 54)
+    info = struct.pack("<IiiHHIIiiII", 40, width, height, 1, 24, 0, len(body), 2835, 2835, 0, 0)
+    return header + info + body
+
+
+def screenshot(width=1280, height=720) -> bytes:
+    rng = random.Random(1)
+    panels = [(rng.randrange(width), rng.randrange(height), rng.randrange(60, 500),
+               rng.randrange(30, 300), tuple(rng.randrange(256) for _ in range(3)))
+              for _ in range(40)]
+
+    def pixel(x, y):
+        for px, py, w, h, colour in panels:
+            if px <= x < px + w and py <= y < py + h:
+                # Lines of "text": dark runs on every few rows inside a panel.
+                if (y - py) % 14 < 9 and (x * 7 + y) % 11 < 5 and (x - px) % 120 < 100:
+                    return (20, 20, 20)
+                return colour
+        return (54, 57, 63)
+    return bmp(width, height, pixel)
+
+
+def photo(width=1024, height=768) -> bytes:
+    rng = random.Random(2)
+
+    def pixel(x, y):
+        base = (int(120 + 80 * math.sin(x / 90)), int(100 + 60 * math.cos(y / 70)),
+                int(90 + 40 * math.sin((x + y) / 130)))
+        return tuple(max(0, min(255, c + rng.randrange(-12, 13))) for c in base)
+    return bmp(width, height, pixel)
+
+
+def wav(seconds: float, sample, rate=44100, channels=2) -> bytes:
+    frames = int(seconds * rate)
+    body = bytearray()
+    for i in range(frames):
+        v = max(-32768, min(32767, int(sample(i / rate))))
+        body += struct.pack("<h", v) * channels
+    fmt = struct.pack("<4sIHHIIHH", b"fmt ", 16, 1, channels, rate, rate * channels * 2,
+                      channels * 2, 16)
+    return (struct.pack("<4sI4s", b"RIFF", 36 + len(body), b"WAVE") + fmt
+            + struct.pack("<4sI", b"data", len(body)) + bytes(body))
+
+
+def voice() -> bytes:
+    rng = random.Random(3)
+    # Syllables of a few harmonics with pauses between them, and a little room noise.
+    def sample(t):
+        on = (t % 0.35) < 0.22 and (t % 2.0) < 1.6
+        f = 140 + 40 * math.sin(t * 3)
+        tone = sum(math.sin(2 * math.pi * f * k * t) / k for k in (1, 2, 3, 4)) if on else 0
+        return 6000 * tone + rng.gauss(0, 60)
+    return wav(8, sample)
+
+
+def music() -> bytes:
+    rng = random.Random(4)
+    notes = [220, 247, 262, 294, 330, 349, 392]
+
+    def sample(t):
+        f = notes[int(t * 4) % len(notes)]
+        chord = sum(math.sin(2 * math.pi * f * r * t) for r in (1, 1.25, 1.5))
+        return 7000 * chord + rng.gauss(0, 400)
+    return wav(8, sample)
+
+
+def main():
+    from Cogs.MediaLog import _compressible, _pack, _unpack, CachedFile
+
+    print("building samples (a few seconds)...")
+    rng = random.Random(5)
+    mix = [
+        ("screenshot.bmp", "image/bmp", screenshot()),
+        ("photo.bmp", "image/bmp", photo()),
+        ("photo.tiff", "image/tiff", photo(800, 600)),
+        ("voice.wav", "audio/wav", voice()),
+        ("music.wav", "audio/x-wav", music()),
+        ("photo.png", "image/png", rng.randbytes(2 * MB)),
+        ("clip.mp4", "video/mp4", rng.randbytes(6 * MB)),
+    ]
+
+    print(f"\n{'file':16} {'size':>9} {'held':>9} {'ratio':>6} {'pack MB/s':>10} "
+          f"{'unpack MB/s':>12}")
+    raw_total = held_total = 0
+    for name, ctype, data in mix:
+        raw_total += len(data)
+        if not _compressible(ctype, name):
+            held_total += len(data)
+            print(f"{name:16} {len(data) / MB:8.2f}M {len(data) / MB:8.2f}M {'-':>6} "
+                  f"{'not tried':>10} {'-':>12}")
+            continue
+        start = time.perf_counter()
+        stored, codec = _pack(data)
+        packed = time.perf_counter() - start
+        f = CachedFile(name, stored, ctype, len(data), False, codec=codec)
+        start = time.perf_counter()
+        assert _unpack(f) == data
+        unpacked = time.perf_counter() - start
+        held_total += len(stored)
+        print(f"{name:16} {len(data) / MB:8.2f}M {len(stored) / MB:8.2f}M "
+              f"{len(stored) / len(data):6.2f} {len(data) / MB / packed:10.0f} "
+              f"{len(data) / MB / unpacked:12.0f}")
+    print(f"\n{raw_total / MB:.1f} MB of attachments held in {held_total / MB:.1f} MB "
+          f"({held_total / raw_total:.0%})")
+
+    print("\nzlib levels on the compressible part alone:")
+    sample = [d for n, c, d in mix if _compressible(c, n)]
+    size = sum(map(len, sample))
+    for level in (1, 3, 6, 9):
+        start = time.perf_counter()
+        out = sum(len(zlib.compress(d, level)) for d in sample)
+        took = time.perf_counter() - start
+        print(f"  level {level}: {out / size:.2f} of the size at {size / MB / took:.0f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
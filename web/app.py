@@ -647,6 +647,9 @@ def guild_settings(guild_id: int):
         minage_range=store.MINAGE_RANGE,
         minage_default=store.MINAGE_DEFAULT,
         minage_actions=store.MINAGE_ACTIONS,
+        raid_defaults=store.RAID_DEFAULTS,
+        raid_ranges={"accounts": store.RAID_ACCOUNTS_RANGE, "seconds": store.RAID_SECONDS_RANGE,
+                     "joins": store.RAID_JOINS_RANGE},
     )
 
 
@@ -245,6 +245,9 @@ SECTIONS = [
             "turn a word filter off again.",
             "Invisible characters are stripped before matching, since padding a word with them "
             "is the oldest way around a filter and reads identically to everybody else.",
+            "Common disguises count as the word itself: digits and symbols standing in for "
+            "letters, like <code>sp4m</code> or <code>$pam</code>, and letters from other "
+            "alphabets that look the same. A list can hold up to 2,000 words.",
             "The link rule has an allow list. Subdomains of an allowed site count, so one "
             "entry covers the whole thing.",
             "Only one rule acts per message, so a message that trips three of them is dealt "
@@ -252,6 +255,10 @@ SECTIONS = [
             "Somebody the bot could not moderate by hand, including the server owner and "
             "anyone above it in the role list, is skipped. Acting there would half work: the "
             "message would go and the timeout would quietly fail.",
+            "The raid check looks across people rather than at one: the same message from "
+            "several accounts in one channel within a few seconds, ignoring mentions, numbers "
+            "and punctuation. Messages under 16 letters never count, so a room full of people "
+            "saying hello is not a raid.",
         ],
         "commands": [
             ("/automod on", "", "Start it, keeping the rules you already set.", MANAGE_SERVER),
@@ -263,6 +270,10 @@ SECTIONS = [
             ("/automod minage", "<days> [action]",
              "Turn away accounts younger than this many days. Zero switches it off.",
              MANAGE_SERVER),
+            ("/automod raid", "<accounts> [seconds] [joins] [lockdown]",
+             "Treat the same message from this many accounts at once as a raid, and lock "
+             "every channel when one starts. Zero switches it off.", MANAGE_SERVER),
+            ("/automod lift", "", "Unlock the channels a raid lockdown locked.", MANAGE_SERVER),
         ],
     },
     {
@@ -527,8 +538,11 @@ SECTIONS = [
             "<code>name</code> if this server already has one by that name.",
         ],
         "commands": [
-            ("/toggleimagespam", "", "Turn the image spam filter on or off.", MANAGE_SERVER),
-            ("/imagespamstatus", "", "Whether the filter is currently running.", MANAGE_SERVER),
+            ("/toggleimagespam", "[similarity]",
+             "Turn the image spam filter on or off in this server, or choose whether it "
+             "compares what pictures show as well as their names.", MANAGE_SERVER),
+            ("/imagespamstatus", "",
+             "Whether the filter is running here, and how much it has caught.", MANAGE_SERVER),
             ("/sync", "", "Force this server's command list to refresh.", MANAGE_SERVER),
             ("/emoji", "<emoji> [name]", "Copy an emoji from another server into this one.",
              "Manage Expressions"),
@@ -115,7 +115,7 @@ AUTOMOD_DEFAULTS = {
     "emoji": {"limit": 8},
     "newlines": {"limit": 15},
 }
-AUTOMOD_MAX_WORDS = 100
+AUTOMOD_MAX_WORDS = 2000
 AUTOMOD_MAX_WORD_LENGTH = 40
 AUTOMOD_MAX_DOMAINS = 50
 AUTOMOD_MAX_EXEMPT = 25
@@ -132,6 +132,12 @@ MINAGE_ACTIONS = [
     ("ban", "Ban them"),
 ]
 
+# The raid check. Mirrors Cogs/AutoMod.RAID_DEFAULTS and its MAX_RAID_* limits.
+RAID_DEFAULTS = {"accounts": 5, "seconds": 30, "joins": 0}
+RAID_ACCOUNTS_RANGE = (2, 25)
+RAID_SECONDS_RANGE = (5, 120)
+RAID_JOINS_RANGE = (0, 50)              # zero leaves joins out of it
+
 MAX_AUTOROLES = 10
 MAX_PANELS = 10
 MAX_PANEL_ROLES = 25          # Discord allows five rows of five buttons on one message
@@ -151,10 +157,41 @@ def settings(guild_id: int) -> dict:
     return db()["servers"].find_one({"guild_id": guild_id}) or {}
 
 
+def _aware(dt):
+    """pymongo hands back naive UTC; comparing that with an aware time raises."""
+    if dt is not None and dt.tzinfo is None:
+        return dt.replace(tzinfo=datetime.timezone.utc)
+    return dt
+
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _runtime_docs() -> tuple:
+    """(shard count, documents) for what the bot is running as now.
+
+    Each shard writes its own "shard:<id>" document, from whichever process runs it. Going
+    down from eight shards to four leaves the last four documents behind, so only shards under
+    the count most recently written are kept. A bot that predates sharding wrote one "bot"
+    document instead, and that stands in as the single shard until the first shard document
+    appears.
+    """
+    runtime = db()["runtime"]
+    shards = [d for d in runtime.find({"_id": {"$regex": "^shard:"}}) if "shard_id" in d]
+    if not shards:
+        doc = runtime.find_one({"_id": "bot"})
+        return (1, [doc]) if doc else (1, [])
+    newest = max(shards, key=lambda d: _aware(d.get("last_seen") or d.get("updated_at"))
+                 or _EPOCH)
+    count = newest.get("shard_count") or 1
+    return count, sorted((d for d in shards if d["shard_id"] < count),
+                         key=lambda d: d["shard_id"])
+
+
 def bot_guild_ids() -> set:
     """Published by the bot, so the picker only offers servers it is actually in."""
-    doc = db()["runtime"].find_one({"_id": "bot"}) or {}
-    return set(doc.get("guild_ids") or [])
+    _, docs = _runtime_docs()
+    return {gid for doc in docs for gid in doc.get("guild_ids") or []}
 
 
 # The bot writes a heartbeat once a minute. The dashboard is a separate process and cannot see
@@ -164,53 +201,84 @@ HEARTBEAT_GRACE = 180
 HEARTBEAT_DOWN = 600
 
 
+def _state(quiet) -> str:
+    if quiet is None or quiet > HEARTBEAT_DOWN:
+        return "down"
+    return "up" if quiet <= HEARTBEAT_GRACE else "wobbly"
+
+
 def bot_status() -> dict:
     """Whether the bot is up, and what it was doing when it last checked in.
 
     Always the same shape, including when there is nothing to report, so anything reading it
     can look at one field rather than checking which keys arrived.
+
+    With more than one shard the figures are added up across them, and `shards` has one entry
+    each. The bot is only up when every shard is. One that has gone quiet while the rest carry
+    on makes the whole thing wobbly, with the reason naming which: the servers on that shard
+    are getting nothing, and a green page would tell their owners the problem is theirs.
     """
     unknown = {"state": "unknown", "reason": None, "seconds_quiet": None, "last_seen": None,
                "started_at": None, "uptime_seconds": None, "guilds": 0, "members": None,
-               "latency_ms": None}
+               "latency_ms": None, "shards": []}
 
     try:
-        doc = db()["runtime"].find_one({"_id": "bot"}) or {}
+        count, docs = _runtime_docs()
     except Exception:
         # The database being unreachable is itself worth reporting rather than a 500.
         return {**unknown, "reason": "I can't reach the database to find out."}
 
-    last = doc.get("last_seen")
-    if last is None:
+    docs = [d for d in docs if d.get("last_seen") is not None]
+    if not docs:
         return {**unknown,
                 "reason": "The bot hasn't checked in since this page was added."}
 
-    if last.tzinfo is None:
-        last = last.replace(tzinfo=datetime.timezone.utc)
     now = datetime.datetime.now(datetime.timezone.utc)
-    quiet = max((now - last).total_seconds(), 0)
-
-    if quiet <= HEARTBEAT_GRACE:
-        state = "up"
-    elif quiet <= HEARTBEAT_DOWN:
-        state = "wobbly"
+    seen = {d.get("shard_id", 0): d for d in docs}
+    shards = []
+    for shard_id in range(count):
+        doc = seen.get(shard_id)
+        quiet = (max((now - _aware(doc["last_seen"])).total_seconds(), 0)
+                 if doc else None)
+        shards.append({
+            "shard_id": shard_id,
+            "state": _state(quiet),
+            "seconds_quiet": int(quiet) if quiet is not None else None,
+            "guilds": (doc.get("guild_count") or len(doc.get("guild_ids") or [])) if doc else 0,
+            "latency_ms": doc.get("latency_ms") if doc else None,
+        })
+
+    states = {s["state"] for s in shards}
+    if len(states) == 1:
+        state, reason = states.pop(), None
     else:
-        state = "down"
-
-    started = doc.get("started_at")
-    if started is not None and started.tzinfo is None:
-        started = started.replace(tzinfo=datetime.timezone.utc)
+        state = "wobbly"
+        quiet_ones = [str(s["shard_id"]) for s in shards if s["state"] != "up"]
+        reason = (f"{len(shards) - len(quiet_ones)} of {len(shards)} shards are up. "
+                  f"Servers on shard {', '.join(quiet_ones)} may not get an answer "
+                  f"until it's back.")
+
+    # The freshest beat is when the bot last said anything at all, and the latest start is
+    # the most recent restart of any part of it.
+    last = max(_aware(d["last_seen"]) for d in docs)
+    starts = [_aware(d["started_at"]) for d in docs if d.get("started_at") is not None]
+    started = max(starts) if starts else None
+    members = [d["member_count"] for d in docs if d.get("member_count") is not None]
+    latencies = [d["latency_ms"] for d in docs if d.get("latency_ms") is not None]
 
     return {
         "state": state,
-        "reason": None,
-        "seconds_quiet": int(quiet),
+        "reason": reason,
+        "seconds_quiet": int(max((now - last).total_seconds(), 0)),
         "last_seen": last,
         "started_at": started,
         "uptime_seconds": int((last - started).total_seconds()) if started else None,
-        "guilds": doc.get("guild_count") or len(doc.get("guild_ids") or []),
-        "members": doc.get("member_count"),
-        "latency_ms": doc.get("latency_ms"),
+        "guilds": sum(s["guilds"] for s in shards),
+        "members": sum(members) if members else None,
+        # Averaged, the way discord.py reports a sharded bot's latency.
+        "latency_ms": round(sum(latencies) / len(latencies)) if latencies else None,
+        # Only worth listing when there is more than the one.
+        "shards": shards if count > 1 else [],
     }
 
 
@@ -278,12 +346,12 @@ def _clamp(raw, low, high, fallback):
 
 def _word_list(raw, limit, length) -> list:
     """A textarea or comma separated box into a clean list, deduplicated and capped."""
-    out = []
+    out = {}                    # a dict for its order, since lists run to thousands
     for piece in re.split(r"[,\n]", raw or ""):
         piece = piece.strip().lower()
-        if piece and piece not in out:
-            out.append(piece[:length])
-    return out[:limit]
+        if piece:
+            out.setdefault(piece[:length])
+    return list(out)[:limit]
 
 
 def clean_automod(form, valid_channels: set, valid_roles: set, existing: dict) -> dict:
@@ -338,8 +406,16 @@ def clean_automod(form, valid_channels: set, valid_roles: set, existing: dict) -
         "tell": "minage_tell" in form,
     }
 
+    was_raid = (existing.get("raid") or {})
+    raid = {"on": "raid_on" in form, "lockdown": "raid_lockdown" in form}
+    for name, (rlo, rhi) in (("accounts", RAID_ACCOUNTS_RANGE), ("seconds", RAID_SECONDS_RANGE),
+                             ("joins", RAID_JOINS_RANGE)):
+        raid[name] = _clamp(form.get(f"raid_{name}"), rlo, rhi,
+                            was_raid.get(name, RAID_DEFAULTS[name]))
+
     return {
         "minage": minage,
+        "raid": raid,
         "enabled": "automod_enabled" in form,
         "notify": "automod_notify" in form,
         "exempt_staff": "automod_exempt_staff" in form,